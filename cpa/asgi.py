@@ -2,6 +2,9 @@
 ASGI config for cpa project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Tracking links and postbacks are answered by offers.asgi.TrackingApplication
+without going through Django's middleware; every other request is passed on
+to the regular Django application.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +16,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cpa.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after Django is set up, since it loads the offers models
+from offers.asgi import TrackingApplication  # noqa: E402
+
+application = TrackingApplication(django_application)
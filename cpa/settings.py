@@ -10,8 +10,12 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
+import sys
 from pathlib import Path
 
+import django
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -45,6 +49,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'offers.middleware.QueryProfilerMiddleware',  # Opt-in, see QUERY_PROFILER_ENABLED
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -83,9 +88,43 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'timeout': 20,
+        },
     }
 }
 
+# SQLite has no SELECT ... FOR UPDATE; starting atomic blocks with
+# BEGIN IMMEDIATE makes them take the write lock up front, so concurrent
+# postbacks queue up instead of failing with "database is locked" when a
+# read turns into a write. The option only exists from Django 5.1; older
+# versions keep deferred transactions and rely on the busy timeout.
+if django.VERSION >= (5, 1):
+    DATABASES['default']['OPTIONS']['transaction_mode'] = 'IMMEDIATE'
+
+
+# Caches
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Shared by every worker process so that invalidations reach all of them.
+    # Point this at Redis (django.core.cache.backends.redis.RedisCache) when
+    # running on more than one host.
+    'tracking': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'tracking',
+    },
+}
+
+# Cache alias used for click/postback hot-path data (redirect plans, ...)
+OFFERS_CACHE_ALIAS = 'tracking'
+
+# Seconds a track_click redirect plan may live in the shared cache
+REDIRECT_PLAN_TIMEOUT = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -152,6 +191,232 @@ DEFAULT_TRACKING_DOMAIN = 'https://aim4jobs.com'
 # Main domain for redirects when accessing restricted content on tracking domains
 MAIN_DOMAIN = 'https://affilomint.com'
 
+# Click Geo Enrichment
+# ====================
+
+# Clicks are redirected immediately and their geo data is filled in by the
+# process_click_enrichment command. Jobs per batch it processes:
+CLICK_ENRICHMENT_BATCH_SIZE = 100
+
+# Stop queueing new lookups once this many jobs are waiting (backpressure)
+CLICK_ENRICHMENT_MAX_PENDING = 50000
+
+# Give up on a lookup after this many failed attempts
+CLICK_ENRICHMENT_MAX_ATTEMPTS = 3
+
+# Seconds after which a batch claimed by a drainer that never finished it
+# is handed out again
+CLICK_ENRICHMENT_CLAIM_TIMEOUT = 300
+
+# Geo lookup backend: 'ipinfo' (HTTP, via the enrichment queue) or 'local'
+# (range database built with the build_geoip_database command, resolved
+# inline in track_click)
+GEOIP_BACKEND = 'ipinfo'
+GEOIP_DATABASE_PATH = BASE_DIR / 'geoip' / 'ranges.db'
+
+# In-process lookup cache: entries, seconds to live, and whether to cache
+# per /24 (IPv4) and /48 (IPv6) prefix instead of per address
+GEOIP_CACHE_SIZE = 10000
+GEOIP_CACHE_TTL = 3600
+GEOIP_CACHE_BY_PREFIX = False
+
+# Click Ingest
+# ============
+
+# 'direct' inserts every click as it happens; 'batched' appends clicks to a
+# per-process spool file and writes them with bulk_create every
+# CLICK_INGEST_BATCH_SIZE clicks or CLICK_INGEST_FLUSH_MS milliseconds
+CLICK_INGEST_MODE = 'direct'
+CLICK_INGEST_BATCH_SIZE = 200
+CLICK_INGEST_FLUSH_MS = 500
+
+# Spool segments not yet written to the database (replayed after a crash)
+CLICK_INGEST_SPOOL_DIR = BASE_DIR / 'spool' / 'clicks'
+
+# fsync the spool after every click; survives power loss, costs throughput
+CLICK_INGEST_FSYNC = False
+
+# Worker id (0-1023) embedded in click IDs. Leave as None to lease a free one
+# from the database per process; set it only when every process gets its own value.
+CLICK_ID_WORKER_ID = None
+
+# Seconds a leased click ID worker id outlives a process that stopped renewing it
+CLICK_ID_WORKER_LEASE_SECONDS = 300
+
+# Threads the ASGI tracking/postback endpoint (offers.asgi) uses for
+# database work; bounds the connections it holds open at once
+TRACKING_ASGI_DB_WORKERS = 16
+
+# Click Filtering
+# ===============
+
+# Hits from bots, blocked networks, repeat clicks and floods are redirected
+# without a ClickTracking row and counted in ClickFilterStat instead
+CLICK_FILTERS_ENABLED = True
+
+# Only count and log what the filters would drop, still recording every
+# click; turn off once ClickFilterStat shows the rules match what they should
+CLICK_FILTERS_LOG_ONLY = True
+
+# Case-insensitive words of bot user agents, matched as a whole word or as
+# the end of a product name ('bot' matches "Googlebot/2.1" but not "Cubot")
+CLICK_BOT_USER_AGENTS = [
+    'bot', 'crawler', 'spider', 'slurp', 'facebookexternalhit', 'headlesschrome',
+    'phantomjs', 'python-requests', 'python-urllib', 'curl', 'wget', 'libwww',
+    'scrapy', 'httpclient', 'go-http-client', 'lighthouse', 'pingdom',
+]
+
+# AS numbers whose traffic is never counted (needs GEOIP_BACKEND = 'local')
+CLICK_BLOCKED_ASNS = []
+
+# Same visitor, user and offer within this many seconds reuses the click ID
+CLICK_DEDUP_WINDOW = 10
+
+# More than CLICK_FLOOD_LIMIT hits per visitor/user/offer in
+# CLICK_FLOOD_WINDOW seconds are treated as a flood
+CLICK_FLOOD_WINDOW = 60
+CLICK_FLOOD_LIMIT = 20
+
+# Visitor/user/offer keys kept in memory per process
+CLICK_FILTER_MAX_KEYS = 100000
+
+# Seconds between writes of the filter counters to ClickFilterStat
+CLICK_FILTER_STATS_FLUSH_INTERVAL = 30
+
+# Query Profiler
+# ==============
+
+# Records per-view query counts, SQL time, repeated queries (N+1) and wall
+# time in memory; shown to staff at /admin-dashboard/queries/
+QUERY_PROFILER_ENABLED = False
+
+# Share of requests profiled (1.0 = all)
+QUERY_PROFILER_SAMPLE_RATE = 1.0
+
+# Minutes of history kept, in one-minute buckets
+QUERY_PROFILER_WINDOW_MINUTES = 60
+
+# Postback Queue
+# ==============
+
+# 'sync' processes each postback before answering; 'queue' stores it as a
+# RawPostback in one insert, answers at once and leaves the conversion to
+# the process_postback_queue command
+POSTBACK_INGEST_MODE = 'sync'
+
+# Postbacks claimed per batch and threads processing them (grouped by user)
+POSTBACK_QUEUE_BATCH_SIZE = 200
+POSTBACK_QUEUE_WORKERS = 4
+
+# Retry a postback that failed with a server error up to this many times
+POSTBACK_QUEUE_MAX_ATTEMPTS = 5
+
+# Seconds after which a claimed batch is considered abandoned and re-claimed
+POSTBACK_QUEUE_CLAIM_TIMEOUT = 300
+
+# Days processed postbacks are kept as a log
+POSTBACK_QUEUE_RETENTION_DAYS = 7
+
+# Bulk Conversion Status Changes
+# ==============================
+
+# Admin selections up to this size are approved/rejected during the request;
+# larger ones become a ConversionStatusJob run by process_conversion_status_jobs
+CONVERSION_BULK_SYNC_LIMIT = 500
+
+# Conversions changed per transaction
+CONVERSION_BULK_CHUNK_SIZE = 1000
+
+# Daily Stats Rollup
+# ==================
+
+# Keep DailyStat current from click tracking and conversion changes; the
+# affiliate reports and dashboard read from it
+DAILY_STATS_ENABLED = True
+
+# Seconds between writes of each process's buffered counts to DailyStat
+DAILY_STATS_FLUSH_INTERVAL = 30
+
+# Seconds an affiliate's dashboard totals and chart series may be cached;
+# new clicks or conversions for the affiliate invalidate them sooner
+DASHBOARD_METRICS_TIMEOUT = 300
+
+# Outbound Affiliate Postbacks
+# ============================
+
+# Postbacks claimed per batch by deliver_outbound_postbacks
+OUTBOUND_POSTBACK_BATCH_SIZE = 200
+
+# Requests in flight at once, and the size of the shared connection pool
+OUTBOUND_POSTBACK_CONCURRENCY = 20
+
+# Most requests per second sent to any one host (0 = no limit)
+OUTBOUND_POSTBACK_HOST_RATE = 10
+
+# Seconds to wait for an affiliate's tracker to answer
+OUTBOUND_POSTBACK_TIMEOUT = 10
+
+# Attempts before a postback is moved to the dead letters
+OUTBOUND_POSTBACK_MAX_ATTEMPTS = 6
+
+# Delay before the first retry, doubled for each further one, and its cap
+OUTBOUND_POSTBACK_BACKOFF_SECONDS = 30
+OUTBOUND_POSTBACK_BACKOFF_MAX_SECONDS = 3600
+
+# Seconds after which a claimed batch is considered abandoned and re-claimed
+OUTBOUND_POSTBACK_CLAIM_TIMEOUT = 300
+
+# Days sent postbacks are kept as a log
+OUTBOUND_POSTBACK_RETENTION_DAYS = 14
+
+# Logging
+# =======
+
+# Level for everything under the offers app, from the OFFERS_LOG_LEVEL
+# environment variable (INFO adds the balance and accounting audit trail,
+# DEBUG per-click detail); only errors are logged while the tests run
+if sys.argv[1:2] == ['test']:
+    OFFERS_LOG_LEVEL = 'ERROR'
+else:
+    OFFERS_LOG_LEVEL = os.environ.get('OFFERS_LOG_LEVEL', 'WARNING').upper()
+
+# Share of INFO/DEBUG records kept from the click tracking hot path;
+# warnings and errors are always kept
+OFFERS_TRACKING_LOG_SAMPLE_RATE = 0.01
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {
+            '()': 'offers.structured_logging.JsonFormatter',
+        },
+    },
+    'filters': {
+        'tracking_sampling': {
+            '()': 'offers.structured_logging.SamplingFilter',
+            'rate': OFFERS_TRACKING_LOG_SAMPLE_RATE,
+        },
+    },
+    'handlers': {
+        'offers_queue': {
+            # Writes from a background thread so requests never block on output
+            'class': 'offers.structured_logging.QueueingHandler',
+            'formatter': 'json',
+        },
+    },
+    'loggers': {
+        'offers': {
+            'handlers': ['offers_queue'],
+            'level': OFFERS_LOG_LEVEL,
+            'propagate': False,
+        },
+        'offers.tracking': {
+            'filters': ['tracking_sampling'],
+        },
+    },
+}
+
 # Django Crontab Configuration
 # ============================
 
@@ -160,6 +425,18 @@ CRONJOBS = [
     ('0 6 * * *', 'django.core.management.call_command', ['process_payments'], {}, '>> /var/log/cpa_cron.log 2>&1'),
     # Check user activation status every minute
     ('*/1 * * * *', 'user.cron.check_user_activation_status', '>> /tmp/user_activation_check.log 2>&1'),
+    # Drain the click geo enrichment queue every minute
+    ('*/1 * * * *', 'django.core.management.call_command', ['process_click_enrichment'], {}, '>> /tmp/click_enrichment.log 2>&1'),
+    # Check every balance against its ledger total once an hour
+    ('15 * * * *', 'django.core.management.call_command', ['reconcile_balances'], {}, '>> /tmp/balance_reconciliation.log 2>&1'),
+    # Drain the postback queue every minute (POSTBACK_INGEST_MODE = 'queue')
+    ('*/1 * * * *', 'django.core.management.call_command', ['process_postback_queue'], {}, '>> /tmp/postback_queue.log 2>&1'),
+    # Run queued bulk conversion approvals/rejections from the admin
+    ('*/1 * * * *', 'django.core.management.call_command', ['process_conversion_status_jobs'], {}, '>> /tmp/conversion_status_jobs.log 2>&1'),
+    # Recompute the last two closed days of the daily stats rollup
+    ('10 0 * * *', 'django.core.management.call_command', ['rebuild_daily_stats'], {}, '>> /tmp/daily_stats.log 2>&1'),
+    # Send queued postbacks to affiliates' trackers every minute
+    ('*/1 * * * *', 'django.core.management.call_command', ['deliver_outbound_postbacks'], {}, '>> /tmp/outbound_postbacks.log 2>&1'),
 ]
 
 # CRONTAB_LOCK_JOBS - Prevent overlapping jobs
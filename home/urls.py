@@ -5,4 +5,5 @@ urlpatterns = [
     path('',views.index,name='index'),
     path('terms-and-conditions/', views.terms_and_conditions, name='terms_and_conditions'),
     path('admin-dashboard/', views.admin_dashboard, name='admin_dashboard'),
+    path('admin-dashboard/queries/', views.query_profile, name='query_profile'),
 ]
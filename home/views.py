@@ -4,6 +4,9 @@ from django.utils import timezone
 from django.db.models import Sum, Count
 from datetime import datetime, time, timedelta
 from offers.models import Conversion
+from offers.query_profiler import get_query_profile, LATENCY_BOUNDS_MS
+from django.conf import settings
+from django.shortcuts import redirect
 
 def index(request):
     return render(request, 'home/index.html')
@@ -42,4 +45,18 @@ def admin_dashboard(request):
         'start_date': start_date,
         'end_date': end_date,
     })
-    
+
+@staff_member_required
+def query_profile(request):
+    """Per-view query and latency profile collected by QueryProfilerMiddleware"""
+    profile = get_query_profile()
+    if request.method == 'POST' and request.POST.get('action') == 'reset':
+        profile.reset()
+        return redirect('query_profile')
+
+    return render(request, 'home/query_profile.html', {
+        'enabled': getattr(settings, 'QUERY_PROFILER_ENABLED', False),
+        'window_minutes': profile.window_minutes,
+        'rows': profile.report(),
+        'latency_bounds': LATENCY_BOUNDS_MS,
+    })
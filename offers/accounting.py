@@ -0,0 +1,463 @@
+"""
+Conversion accounting
+
+A conversion's status decides whether its payout sits on the affiliate's
+balance: entering 'approved' credits the offer payout (and the referrer's
+share, as a ReferralEarning), leaving it - to 'rejected' or 'pending' -
+reverses both. Conversion.save runs every change through this module:
+
+1. prepare_transition() reads everything the transition needs - the old
+   status, the affiliate, the offer payout and name, the active referral
+   and whether a referral earning already exists - in one joined query.
+2. The conversion row is written.
+3. apply_transition() writes the effects with a fixed number of queries:
+   the referral earning insert or delete, one UPDATE for all balance
+   credits (debits get one guarded UPDATE per user), one bulk INSERT of
+   ledger entries and, for a rejection, the notification. An approval of
+   a conversion whose affiliate has postback URLs also queues the outbound
+   postback (offers.outbound_postbacks); whether there are any is part of
+   the lookup in step 1.
+
+Every status change is also counted in the daily stats rollup
+(offers.daily_stats) once the transaction commits; that costs no query.
+
+All of it happens in a single transaction, and the referral percentage
+comes from the network registry (offers.network_registry), so a transition
+costs the same handful of queries whatever its history.
+
+Bulk approvals and rejections from the admin use change_conversion_statuses
+instead, which handles a whole set of conversions with set-based queries;
+large selections run as a ConversionStatusJob (see run_status_job).
+"""
+import logging
+from collections import OrderedDict, namedtuple
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, DecimalField, Exists, F, OuterRef, Subquery, Sum, Value, When
+from django.utils import timezone
+
+from user.models import User
+
+from .daily_stats import count_conversion_changes
+from .models import (
+    AffiliatePostback, BalanceLedger, ClickTracking, Conversion, ConversionStatusJob, Notification, Referral,
+    ReferralEarning,
+)
+from .network_registry import get_site_settings
+from .outbound_postbacks import queue_outbound_postbacks
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal('0.01')
+
+# Credits are combined into UPDATE statements of at most this many users
+CREDIT_BATCH_SIZE = 500
+
+Transition = namedtuple('Transition', [
+    'old_status', 'new_status', 'user_id', 'offer_payout', 'offer_name',
+    'referral_id', 'referrer_id', 'has_referral_earning', 'has_affiliate_postback',
+    'offer_id', 'subids', 'old_conversion_date', 'old_payout',
+])
+
+_CLICK_SUBIDS = ('click_tracking__subid1', 'click_tracking__subid2', 'click_tracking__subid3')
+
+BalanceChange = namedtuple('BalanceChange', ['user_id', 'amount', 'entry_type', 'conversion_id', 'description'])
+
+
+def transition_effect(old_status, new_status):
+    """Return 'credit', 'debit' or None for a status change (old_status None = new conversion)"""
+    was_approved = old_status == 'approved'
+    is_approved = new_status == 'approved'
+    if is_approved and not was_approved:
+        return 'credit'
+    if was_approved and not is_approved:
+        return 'debit'
+    return None
+
+
+def _referral_subquery(user_ref, field):
+    return Subquery(
+        Referral.objects.filter(referred_user=OuterRef(user_ref), is_active=True)
+        .order_by('id').values(field)[:1]
+    )
+
+
+def _affiliate_postback_exists(user_ref):
+    return Exists(AffiliatePostback.objects.filter(user=OuterRef(user_ref), is_active=True))
+
+
+def prepare_transition(conversion):
+    """Load what a save of this conversion needs to account for it, in one query"""
+    if conversion.pk:
+        row = Conversion.objects.filter(pk=conversion.pk).values(
+            'status', 'conversion_date', 'payout', *_CLICK_SUBIDS,
+            user_id=F('click_tracking__user_id'),
+            offer_id=F('click_tracking__offer_id'),
+            offer_payout=F('click_tracking__offer__payout'),
+            offer_name=F('click_tracking__offer__offer_name'),
+            referral_id=_referral_subquery('click_tracking__user_id', 'id'),
+            referrer_id=_referral_subquery('click_tracking__user_id', 'referrer_id'),
+            has_referral_earning=Exists(ReferralEarning.objects.filter(conversion=OuterRef('pk'))),
+            has_affiliate_postback=_affiliate_postback_exists('click_tracking__user_id'),
+        ).first()
+        if row is not None:
+            return Transition(
+                old_status=row.pop('status'),
+                new_status=conversion.status,
+                subids=tuple(row.pop(field) for field in _CLICK_SUBIDS),
+                old_conversion_date=row.pop('conversion_date'),
+                old_payout=row.pop('payout'),
+                **row
+            )
+
+    row = ClickTracking.objects.filter(pk=conversion.click_tracking_id).values(
+        'user_id', 'offer_id', 'subid1', 'subid2', 'subid3',
+        offer_payout=F('offer__payout'),
+        offer_name=F('offer__offer_name'),
+        referral_id=_referral_subquery('user_id', 'id'),
+        referrer_id=_referral_subquery('user_id', 'referrer_id'),
+        has_affiliate_postback=_affiliate_postback_exists('user_id'),
+    ).get()
+    return Transition(
+        old_status=None,
+        new_status=conversion.status,
+        has_referral_earning=False,
+        subids=(row.pop('subid1'), row.pop('subid2'), row.pop('subid3')),
+        old_conversion_date=None,
+        old_payout=None,
+        **row
+    )
+
+
+def apply_transition(conversion, transition):
+    """Write the balance, referral and notification effects of a saved conversion"""
+    effect = transition_effect(transition.old_status, transition.new_status)
+    payout = transition.offer_payout
+
+    old = None
+    if transition.old_status is not None:
+        old = (transition.old_status, transition.old_conversion_date, transition.old_payout)
+    count_conversion_changes([(
+        transition.user_id, transition.offer_id, transition.subids,
+        old, (conversion.status, conversion.conversion_date, conversion.payout),
+    )])
+
+    if effect == 'credit' and transition.has_affiliate_postback:
+        queue_outbound_postbacks([conversion.id])
+
+    if effect is None or (effect == 'credit' and payout <= 0):
+        logger.info(
+            f"Conversion {conversion.id} saved: User {transition.user_id} balance unchanged "
+            f"(status: {transition.old_status} -> {transition.new_status}, offer payout: {payout})"
+        )
+        return
+
+    if effect == 'credit':
+        description = 'Conversion re-approved' if transition.old_status else ''
+        changes = [BalanceChange(transition.user_id, payout, 'conversion_credit', conversion.id, description)]
+        earning = _create_referral_earning(conversion, transition)
+        if earning is not None:
+            changes.append(BalanceChange(
+                transition.referrer_id, earning.amount, 'referral_credit', conversion.id,
+                f'Referral {transition.referral_id}',
+            ))
+        apply_balance_changes(changes)
+        logger.info(f"Conversion approved: User {transition.user_id} balance increased by {payout} (offer payout)")
+        return
+
+    changes = [BalanceChange(transition.user_id, -payout, 'reversal', conversion.id, f'Conversion {transition.new_status}')]
+    if transition.has_referral_earning:
+        earnings = list(
+            ReferralEarning.objects.filter(conversion=conversion)
+            .values_list('id', 'amount', 'referral_id', 'referral__referrer_id')
+        )
+        for earning_id, amount, referral_id, referrer_id in earnings:
+            changes.append(BalanceChange(
+                referrer_id, -amount, 'reversal', conversion.id, f'Referral {referral_id} earning reversed',
+            ))
+        ReferralEarning.objects.filter(pk__in=[earning[0] for earning in earnings]).delete()
+    apply_balance_changes(changes)
+    logger.info(f"Conversion {transition.new_status}: User {transition.user_id} balance decreased by {payout} (offer payout)")
+
+    if transition.new_status == 'rejected':
+        rejection_notification(conversion.id, transition.user_id, transition.offer_name, payout).save()
+
+
+def _create_referral_earning(conversion, transition):
+    """Create the referrer's earning for an approved conversion, or return None"""
+    if transition.referral_id is None or transition.has_referral_earning:
+        return None
+    site_settings = get_site_settings()
+    if not site_settings or site_settings.referral_percentage <= 0:
+        return None
+    amount = (transition.offer_payout * site_settings.referral_percentage / 100).quantize(CENT)
+    if amount <= 0:
+        return None
+    return ReferralEarning.objects.create(
+        referral_id=transition.referral_id,
+        conversion=conversion,
+        amount=amount,
+        percentage_used=site_settings.referral_percentage,
+    )
+
+
+def rejection_notification(conversion_id, user_id, offer_name, payout):
+    """Build (unsaved) the notification telling an affiliate a lead was rejected"""
+    return Notification(
+        user_id=user_id,
+        notification_type='lead_rejected',
+        title='Lead Rejected ❌',
+        message=f'Your conversion for "{offer_name}" has been rejected. The payout of ${payout} has been deducted from your balance. Please ensure you follow the offer requirements to avoid rejections.',
+        related_object_id=conversion_id,
+        related_object_type='Conversion',
+    )
+
+
+def apply_balance_changes(changes):
+    """
+    Apply BalanceChanges to user balances and record them in the ledger
+
+    Changes are netted per user. Users with a net credit are updated
+    together, CREDIT_BATCH_SIZE per UPDATE; each net debit is one UPDATE
+    guarded by balance >= amount. A debit that would take a balance below
+    zero clears it instead, like User.add_to_balance, and an 'adjustment'
+    entry records the part that could not be taken. Returns {user_id: net
+    amount applied}.
+    """
+    if not changes:
+        return {}
+
+    net = OrderedDict()
+    for change in changes:
+        net[change.user_id] = net.get(change.user_id, Decimal('0.00')) + Decimal(change.amount).quantize(CENT)
+
+    credits = [(user_id, amount) for user_id, amount in net.items() if amount > 0]
+    for start in range(0, len(credits), CREDIT_BATCH_SIZE):
+        batch = credits[start:start + CREDIT_BATCH_SIZE]
+        if len(batch) == 1:
+            delta = Value(batch[0][1])
+        else:
+            delta = Case(
+                *[When(pk=user_id, then=Value(amount)) for user_id, amount in batch],
+                output_field=DecimalField(max_digits=10, decimal_places=2),
+            )
+        User.objects.filter(pk__in=[user_id for user_id, _ in batch]).update(balance=F('balance') + delta)
+
+    entries = [
+        BalanceLedger(
+            user_id=change.user_id,
+            entry_type=change.entry_type,
+            amount=Decimal(change.amount).quantize(CENT),
+            conversion_id=change.conversion_id,
+            description=change.description,
+        )
+        for change in changes
+        if change.amount
+    ]
+
+    applied = dict(net)
+    for user_id, amount in net.items():
+        if amount >= 0:
+            continue
+        users = User.objects.filter(pk=user_id)
+        if users.filter(balance__gte=-amount).update(balance=F('balance') + amount):
+            continue
+        # Not enough balance: take what is there, like add_to_balance does
+        current = users.select_for_update().values_list('balance', flat=True).get()
+        users.update(balance=Decimal('0.00'))
+        applied[user_id] = -current
+        entries.append(BalanceLedger(
+            user_id=user_id,
+            entry_type='adjustment',
+            amount=-current - amount,
+            description='Debit limited to the available balance',
+        ))
+        logger.warning(f"User {user_id} balance would have gone negative. Set to 0.00")
+
+    BalanceLedger.objects.bulk_create(entries)
+    return applied
+
+
+# Bulk status changes
+# ===================
+#
+# change_conversion_statuses() applies one status to a set of conversions
+# without going through Conversion.save row by row: balance credits and
+# reversals are summed per user (and per referrer) with aggregate queries,
+# applied with one UPDATE per affected user, and the referral earnings and
+# notifications are written with bulk inserts. Ledger entries are booked per
+# user and chunk rather than per conversion.
+
+def get_bulk_chunk_size():
+    return getattr(settings, 'CONVERSION_BULK_CHUNK_SIZE', 1000)
+
+
+def _totals(queryset, key, amount):
+    """Sum amount per key value with one aggregate query"""
+    return dict(queryset.order_by().values(key).annotate(total=Sum(amount)).values_list(key, 'total'))
+
+
+def change_conversion_statuses(conversion_ids, new_status):
+    """
+    Set the status of the given conversions and apply the balance effects
+
+    Conversions already in new_status are left alone. Returns the number of
+    conversions changed. Run it on chunks of get_bulk_chunk_size() IDs; the
+    whole chunk is one transaction.
+    """
+    with transaction.atomic():
+        rows = list(
+            Conversion.objects.select_for_update(of=('self',))
+            .filter(pk__in=list(conversion_ids))
+            .exclude(status=new_status)
+            .values_list(
+                'id', 'status', 'click_tracking__user_id', 'click_tracking__offer__payout', 'click_tracking__offer__offer_name',
+                'conversion_date', 'payout', 'click_tracking__offer_id', *_CLICK_SUBIDS,
+            )
+        )
+        if not rows:
+            return 0
+
+        effect_ids = {'credit': [], 'debit': []}
+        for conversion_id, old_status, *_ in rows:
+            effect = transition_effect(old_status, new_status)
+            if effect:
+                effect_ids[effect].append(conversion_id)
+
+        Conversion.objects.filter(pk__in=[row[0] for row in rows]).update(status=new_status)
+
+        changes = []
+        if effect_ids['credit']:
+            changes += _bulk_credit(effect_ids['credit'])
+        if effect_ids['debit']:
+            changes += _bulk_debit(effect_ids['debit'], new_status)
+        apply_balance_changes(changes)
+        if effect_ids['credit']:
+            queue_outbound_postbacks(effect_ids['credit'])
+        count_conversion_changes([
+            (user_id, offer_id, subids, (old_status, conversion_date, payout), (new_status, conversion_date, payout))
+            for _, old_status, user_id, _, _, conversion_date, payout, offer_id, *subids in rows
+        ])
+
+        if new_status == 'rejected':
+            debited = set(effect_ids['debit'])
+            Notification.objects.bulk_create([
+                rejection_notification(conversion_id, user_id, offer_name, payout)
+                for conversion_id, _, user_id, payout, offer_name, *_ in rows
+                if conversion_id in debited
+            ])
+
+    logger.info(
+        f"Bulk status change to {new_status}: {len(rows)} conversion(s) changed, "
+        f"{len(effect_ids['credit'])} credited, {len(effect_ids['debit'])} reversed"
+    )
+    return len(rows)
+
+
+def _bulk_credit(conversion_ids):
+    """Referral earnings and BalanceChanges for conversions entering 'approved'"""
+    conversions = Conversion.objects.filter(pk__in=conversion_ids)
+    user_totals = _totals(conversions, 'click_tracking__user_id', 'click_tracking__offer__payout')
+    changes = [
+        BalanceChange(user_id, total, 'conversion_credit', None, f'Bulk approval of {len(conversion_ids)} conversion(s)')
+        for user_id, total in user_totals.items()
+        if total and total > 0
+    ]
+
+    site_settings = get_site_settings()
+    if not site_settings or site_settings.referral_percentage <= 0:
+        return changes
+
+    candidates = (
+        conversions.filter(click_tracking__offer__payout__gt=0)
+        .exclude(Exists(ReferralEarning.objects.filter(conversion=OuterRef('pk'))))
+        .annotate(
+            referral_id=_referral_subquery('click_tracking__user_id', 'id'),
+            referrer_id=_referral_subquery('click_tracking__user_id', 'referrer_id'),
+        )
+        .filter(referral_id__isnull=False)
+        .values_list('id', 'referral_id', 'referrer_id', 'click_tracking__offer__payout')
+    )
+    earnings = []
+    referrer_totals = {}
+    for conversion_id, referral_id, referrer_id, payout in candidates:
+        amount = (payout * site_settings.referral_percentage / 100).quantize(CENT)
+        if amount <= 0:
+            continue
+        earnings.append(ReferralEarning(
+            referral_id=referral_id,
+            conversion_id=conversion_id,
+            amount=amount,
+            percentage_used=site_settings.referral_percentage,
+        ))
+        referrer_totals[referrer_id] = referrer_totals.get(referrer_id, Decimal('0.00')) + amount
+    ReferralEarning.objects.bulk_create(earnings)
+
+    changes += [
+        BalanceChange(referrer_id, total, 'referral_credit', None, f'Referral earnings from {len(conversion_ids)} bulk-approved conversion(s)')
+        for referrer_id, total in referrer_totals.items()
+    ]
+    return changes
+
+
+def _bulk_debit(conversion_ids, new_status):
+    """Delete referral earnings and return BalanceChanges for conversions leaving 'approved'"""
+    user_totals = _totals(
+        Conversion.objects.filter(pk__in=conversion_ids), 'click_tracking__user_id', 'click_tracking__offer__payout'
+    )
+    earnings = ReferralEarning.objects.filter(conversion_id__in=conversion_ids)
+    referrer_totals = _totals(earnings, 'referral__referrer_id', 'amount')
+    earnings.delete()
+
+    description = f'Bulk {new_status}: {len(conversion_ids)} conversion(s)'
+    changes = [
+        BalanceChange(user_id, -total, 'reversal', None, description)
+        for user_id, total in user_totals.items()
+        if total and total > 0
+    ]
+    changes += [
+        BalanceChange(referrer_id, -total, 'reversal', None, f'{description}, referral earnings reversed')
+        for referrer_id, total in referrer_totals.items()
+        if total
+    ]
+    return changes
+
+
+def run_status_job(job, chunk_size=None, progress=None):
+    """
+    Work through a ConversionStatusJob chunk by chunk
+
+    Resumes from job.processed. Each chunk's progress is saved in the same
+    transaction as its changes; progress(job) is called after every chunk.
+    Returns the job.
+    """
+    chunk_size = chunk_size or get_bulk_chunk_size()
+
+    job.status = 'running'
+    job.started_at = job.started_at or timezone.now()
+    ConversionStatusJob.objects.filter(pk=job.pk).update(status=job.status, started_at=job.started_at)
+
+    try:
+        while job.processed < job.total:
+            chunk = job.conversion_ids[job.processed:job.processed + chunk_size]
+            with transaction.atomic():
+                changed = change_conversion_statuses(chunk, job.new_status)
+                job.processed += len(chunk)
+                job.changed += changed
+                ConversionStatusJob.objects.filter(pk=job.pk).update(processed=job.processed, changed=job.changed)
+            if progress:
+                progress(job)
+    except Exception as e:
+        job.status = 'failed'
+        job.last_error = str(e)
+        ConversionStatusJob.objects.filter(pk=job.pk).update(status=job.status, last_error=job.last_error)
+        logger.error(f"Conversion status job {job.pk} failed after {job.processed} of {job.total}: {str(e)}", exc_info=True)
+        return job
+
+    job.status = 'done'
+    job.finished_at = timezone.now()
+    ConversionStatusJob.objects.filter(pk=job.pk).update(status=job.status, finished_at=job.finished_at)
+    logger.info(f"Conversion status job {job.pk} done: {job.changed} of {job.total} conversion(s) marked {job.new_status}")
+    return job
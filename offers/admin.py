@@ -1,10 +1,16 @@
+from django.conf import settings
 from django.contrib import admin
-from django.urls import path
+from django.urls import path, reverse
 from django.shortcuts import render
 from django.http import JsonResponse
 from django.utils.html import format_html
 from django.utils import timezone
-from .models import Offer, OfferAdminForm, UserOfferRequest, ClickTracking, Conversion, SiteSettings, CPANetwork, Manager, PaymentMethod, Invoice, ReferralLink, Referral, ReferralEarning, Noticeboard, Notification
+from django.db.models import Q
+from .accounting import change_conversion_statuses, get_bulk_chunk_size
+from .click_lookup import click_id_variants, resolve_click_id
+from .network_registry import get_site_settings
+from .outbound_postbacks import requeue_dead_letters
+from .models import AffiliatePostback, DailyStat, SubId, OutboundPostback, OutboundPostbackDeadLetter, Offer, OfferAdminForm, UserOfferRequest, ClickTracking, ClickEnrichmentJob, ClickFilterStat, Conversion, ConversionStatusJob, PostbackReceipt, RawPostback, SamplingDecision, SamplingRule, SiteSettings, CPANetwork, Manager, PaymentMethod, Invoice, BalanceLedger, ReferralLink, Referral, ReferralEarning, Noticeboard, Notification
 
 @admin.register(CPANetwork)
 class CPANetworkAdmin(admin.ModelAdmin):
@@ -44,7 +50,8 @@ class CPANetworkAdmin(admin.ModelAdmin):
     
     def get_postback_url_display(self, obj):
         """Display postback URL with copy button"""
-        site_settings = SiteSettings.get_settings()
+        # From the network registry, so the changelist does not query it per row
+        site_settings = get_site_settings()
         if not site_settings:
             return "Site settings not configured"
         
@@ -274,8 +281,35 @@ class UserOfferRequestAdmin(admin.ModelAdmin):
         super().save_model(request, obj, form, change)
 
 
+class ClickIdSearchMixin:
+    """
+    Answer searches for a single click ID from the indexes
+
+    A search term that looks like an ID (one token of 12+ characters) and
+    resolves to a click, including the wrapped, truncated and re-cased
+    forms offers.click_lookup resolves, is matched exactly against the
+    indexed click ID columns instead of a LIKE '%term%' scan over every
+    search field. Any other term goes to the normal search.
+    """
+    # Lookup from the admin's model to the primary key of its click
+    click_pk_lookup = 'click_tracking_id'
+
+    def get_click_id_filter(self, term, click_pk):
+        return Q(**{self.click_pk_lookup: click_pk})
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if len(term) < 12 or any(char.isspace() for char in term) or '@' in term:
+            return super().get_search_results(request, queryset, search_term)
+        resolved = resolve_click_id(term)
+        click_pk = ClickTracking.objects.filter(click_id=resolved).values_list('pk', flat=True).first() if resolved else None
+        if click_pk is None:
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(self.get_click_id_filter(term, click_pk)), False
+
+
 @admin.register(ClickTracking)
-class ClickTrackingAdmin(admin.ModelAdmin):
+class ClickTrackingAdmin(ClickIdSearchMixin, admin.ModelAdmin):
     list_display = [
         'user',
         'offer',
@@ -310,6 +344,8 @@ class ClickTrackingAdmin(admin.ModelAdmin):
     
     readonly_fields = ['click_id', 'click_date', 'ip_address', 'user_agent', 'referrer']
     
+    click_pk_lookup = 'pk'
+    
     fieldsets = (
         ('Click Information', {
             'fields': ('user', 'offer', 'click_id', 'click_date')
@@ -341,8 +377,165 @@ class ClickTrackingAdmin(admin.ModelAdmin):
         return False
 
 
+@admin.register(ClickEnrichmentJob)
+class ClickEnrichmentJobAdmin(admin.ModelAdmin):
+    list_display = ['click_tracking', 'ip_address', 'status', 'attempts', 'created_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['click_tracking__click_id', 'ip_address', 'last_error']
+    readonly_fields = ['click_tracking', 'ip_address', 'attempts', 'last_error', 'created_at']
+    actions = ['retry_jobs']
+
+    def retry_jobs(self, request, queryset):
+        updated = queryset.update(status='pending', attempts=0)
+        self.message_user(request, f'{updated} job(s) queued for another attempt.')
+    retry_jobs.short_description = "Retry selected jobs"
+
+
+@admin.register(RawPostback)
+class RawPostbackAdmin(admin.ModelAdmin):
+    list_display = ['id', 'received_at', 'status', 'attempts', 'status_code', 'processed_at']
+    list_filter = ['status', 'received_at']
+    search_fields = ['last_error']
+    readonly_fields = ['params', 'status_code', 'response', 'attempts', 'last_error', 'received_at', 'claimed_at', 'processed_at']
+    date_hierarchy = 'received_at'
+    actions = ['retry_postbacks']
+
+    def has_add_permission(self, request):
+        return False
+
+    def retry_postbacks(self, request, queryset):
+        updated = queryset.exclude(status='done').update(status='pending', attempts=0)
+        self.message_user(request, f'{updated} postback(s) queued for another attempt.')
+    retry_postbacks.short_description = "Retry selected postbacks"
+
+
+@admin.register(SamplingRule)
+class SamplingRuleAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'user', 'offer', 'cpa_network', 'method', 'skip_count', 'window', 'is_active', 'updated_at']
+    list_filter = ['method', 'is_active', 'cpa_network']
+    list_editable = ['is_active']
+    search_fields = ['user__email', 'offer__offer_name', 'cpa_network__network_key']
+    raw_id_fields = ['user', 'offer']
+    readonly_fields = ['created_at', 'updated_at']
+
+
+@admin.register(SamplingDecision)
+class SamplingDecisionAdmin(admin.ModelAdmin):
+    list_display = ['click_tracking', 'rule', 'sequence', 'kept', 'decided_at']
+    list_filter = ['kept', 'rule', 'decided_at']
+    search_fields = ['click_tracking__click_id']
+    list_select_related = ['click_tracking', 'rule']
+    date_hierarchy = 'decided_at'
+
+    def has_add_permission(self, request):
+        """Decisions are only written by postback processing"""
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(AffiliatePostback)
+class AffiliatePostbackAdmin(admin.ModelAdmin):
+    list_display = ['user', 'offer', 'url', 'is_active', 'updated_at']
+    list_filter = ['is_active']
+    list_editable = ['is_active']
+    search_fields = ['user__email', 'offer__offer_name', 'url']
+    raw_id_fields = ['user', 'offer']
+    readonly_fields = ['created_at', 'updated_at']
+
+
+@admin.register(OutboundPostback)
+class OutboundPostbackAdmin(admin.ModelAdmin):
+    list_display = ['id', 'conversion', 'url', 'status', 'attempts', 'status_code', 'next_attempt_at', 'sent_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['url', 'last_error']
+    raw_id_fields = ['conversion', 'affiliate_postback']
+    readonly_fields = ['url', 'attempts', 'status_code', 'last_error', 'created_at', 'claimed_at', 'sent_at']
+    date_hierarchy = 'created_at'
+    actions = ['send_now']
+
+    def has_add_permission(self, request):
+        return False
+
+    def send_now(self, request, queryset):
+        updated = queryset.filter(status='pending').update(next_attempt_at=timezone.now())
+        self.message_user(request, f'{updated} postback(s) will be sent on the next run.')
+    send_now.short_description = "Send selected postbacks on the next run"
+
+
+@admin.register(OutboundPostbackDeadLetter)
+class OutboundPostbackDeadLetterAdmin(admin.ModelAdmin):
+    list_display = ['id', 'conversion', 'url', 'attempts', 'status_code', 'last_error', 'failed_at']
+    list_filter = ['status_code', 'failed_at']
+    search_fields = ['url', 'last_error']
+    raw_id_fields = ['conversion', 'affiliate_postback']
+    readonly_fields = ['url', 'attempts', 'status_code', 'last_error', 'created_at', 'failed_at']
+    date_hierarchy = 'failed_at'
+    actions = ['requeue']
+
+    def has_add_permission(self, request):
+        return False
+
+    def requeue(self, request, queryset):
+        requeued = requeue_dead_letters(queryset)
+        self.message_user(request, f'{requeued} postback(s) queued for another attempt.')
+    requeue.short_description = "Send selected postbacks again"
+
+
+@admin.register(ClickFilterStat)
+class ClickFilterStatAdmin(admin.ModelAdmin):
+    list_display = ['date', 'user', 'offer', 'reason', 'count']
+    list_filter = ['reason', 'date']
+    search_fields = ['user__email', 'offer__offer_name']
+    list_select_related = ['user', 'offer']
+    date_hierarchy = 'date'
+
+    def has_add_permission(self, request):
+        """Counters are only written by click tracking"""
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(DailyStat)
+class DailyStatAdmin(admin.ModelAdmin):
+    list_display = ['date', 'user', 'offer', 'subid1', 'subid2', 'subid3', 'clicks', 'conversions', 'rejected', 'earnings']
+    list_filter = ['date']
+    search_fields = ['user__email', 'offer__offer_name', 'subid1', 'subid2', 'subid3']
+    list_select_related = ['user', 'offer']
+    date_hierarchy = 'date'
+
+    def has_add_permission(self, request):
+        """Rows are written by offers.daily_stats (see rebuild_daily_stats)"""
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(SubId)
+class SubIdAdmin(admin.ModelAdmin):
+    list_display = ['value', 'slot', 'user', 'first_seen', 'last_seen']
+    list_filter = ['slot']
+    search_fields = ['value', 'user__email']
+    list_select_related = ['user']
+
+    def has_add_permission(self, request):
+        """Rows are written by click tracking (see offers.subids)"""
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        """Worker processes cache SubId ids; a deleted row would break their click inserts"""
+        return False
+
+
 @admin.register(Conversion)
-class ConversionAdmin(admin.ModelAdmin):
+class ConversionAdmin(ClickIdSearchMixin, admin.ModelAdmin):
     list_display = [
         'click_tracking',
         'conversion_date',
@@ -360,7 +553,7 @@ class ConversionAdmin(admin.ModelAdmin):
     search_fields = [
         'click_tracking__user__full_name',
         'click_tracking__offer__offer_name',
-        'network_click_id',
+        '=network_click_id',
         'network_payout'
     ]
     
@@ -378,12 +571,82 @@ class ConversionAdmin(admin.ModelAdmin):
         }),
     )
     
+    actions = ['mark_as_approved', 'mark_as_rejected']
+    
+    def get_click_id_filter(self, term, click_pk):
+        """The conversion of the click the term resolves to, or network transaction IDs exactly"""
+        return super().get_click_id_filter(term, click_pk) | Q(network_click_id__in=[term] + click_id_variants(term))
+    
     def get_queryset(self, request):
         """Custom queryset to include related data"""
         return super().get_queryset(request).select_related(
             'click_tracking__user', 
             'click_tracking__offer'
         )
+    
+    def _change_status(self, request, queryset, new_status):
+        """Change the selection at once, or queue a ConversionStatusJob when it is large"""
+        conversion_ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+        if len(conversion_ids) > getattr(settings, 'CONVERSION_BULK_SYNC_LIMIT', 500):
+            job = ConversionStatusJob.objects.create(
+                new_status=new_status,
+                conversion_ids=conversion_ids,
+                total=len(conversion_ids),
+                requested_by=request.user,
+            )
+            url = reverse('admin:offers_conversionstatusjob_change', args=[job.pk])
+            self.message_user(
+                request,
+                format_html(
+                    '{} conversion(s) queued to be marked {}. <a href="{}">Follow the progress</a>.',
+                    len(conversion_ids), new_status, url
+                ),
+                level='SUCCESS'
+            )
+            return
+        
+        chunk_size = get_bulk_chunk_size()
+        changed = sum(
+            change_conversion_statuses(conversion_ids[start:start + chunk_size], new_status)
+            for start in range(0, len(conversion_ids), chunk_size)
+        )
+        self.message_user(
+            request,
+            f"Successfully marked {changed} conversion(s) as {new_status} ({len(conversion_ids) - changed} already were).",
+            level='SUCCESS'
+        )
+    
+    def mark_as_approved(self, request, queryset):
+        """Admin action to approve selected conversions and credit their payouts"""
+        self._change_status(request, queryset, 'approved')
+    mark_as_approved.short_description = "Approve selected conversions"
+    
+    def mark_as_rejected(self, request, queryset):
+        """Admin action to reject selected conversions and reverse their payouts"""
+        self._change_status(request, queryset, 'rejected')
+    mark_as_rejected.short_description = "Reject selected conversions"
+
+
+@admin.register(ConversionStatusJob)
+class ConversionStatusJobAdmin(admin.ModelAdmin):
+    list_display = ['created_at', 'new_status', 'total', 'get_progress_display', 'changed', 'status', 'requested_by', 'finished_at']
+    list_filter = ['status', 'new_status', 'created_at']
+    readonly_fields = ['new_status', 'status', 'total', 'processed', 'changed', 'get_progress_display', 'requested_by', 'last_error', 'created_at', 'started_at', 'finished_at']
+    exclude = ['conversion_ids']
+    actions = ['retry_jobs']
+
+    def has_add_permission(self, request):
+        """Jobs are created by the bulk actions on conversions"""
+        return False
+
+    def get_progress_display(self, obj):
+        return f'{obj.progress}% ({obj.processed} of {obj.total})'
+    get_progress_display.short_description = 'Progress'
+
+    def retry_jobs(self, request, queryset):
+        updated = queryset.filter(status='failed').update(status='pending', last_error=None)
+        self.message_user(request, f'{updated} job(s) queued to resume.')
+    retry_jobs.short_description = "Resume selected failed jobs"
 
 @admin.register(Manager)
 class ManagerAdmin(admin.ModelAdmin):
@@ -481,6 +744,39 @@ class InvoiceAdmin(admin.ModelAdmin):
         )
     mark_as_rejected.short_description = "Mark selected invoices as rejected"
 
+
+@admin.register(BalanceLedger)
+class BalanceLedgerAdmin(admin.ModelAdmin):
+    list_display = ['created_at', 'user', 'entry_type', 'amount', 'conversion', 'invoice', 'description']
+    list_filter = ['entry_type', 'created_at']
+    search_fields = ['user__email', 'description']
+    list_select_related = ['user', 'invoice__user', 'conversion__click_tracking__offer']
+    raw_id_fields = ['user', 'conversion', 'invoice']
+    date_hierarchy = 'created_at'
+
+    def has_add_permission(self, request):
+        """Entries are only written by User.add_to_balance and reconcile_balances"""
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(PostbackReceipt)
+class PostbackReceiptAdmin(admin.ModelAdmin):
+    list_display = ['created_at', 'network_key', 'click_id', 'status_code', 'hits', 'conversion_id', 'updated_at']
+    list_filter = ['network_key', 'status_code', 'created_at']
+    search_fields = ['click_id', 'key']
+    readonly_fields = ['key', 'network_key', 'click_id', 'conversion', 'response', 'status_code', 'hits', 'created_at', 'updated_at']
+    date_hierarchy = 'created_at'
+
+    def has_add_permission(self, request):
+        """Receipts are only written by postback processing"""
+        return False
+
 @admin.register(ReferralLink)
 class ReferralLinkAdmin(admin.ModelAdmin):
     list_display = [
@@ -0,0 +1,150 @@
+"""
+Lightweight ASGI endpoint for tracking links and postbacks
+
+TrackingApplication sits in front of Django's ASGI handler (see
+cpa/asgi.py). Tracking-link and postback requests are answered directly:
+no middleware (sessions, CSRF, auth, messages, referral and tracking-domain
+checks), no URL resolver and no HttpRequest. Everything else, including
+postbacks with a multipart body, goes to Django unchanged.
+
+The database work runs in a small thread pool (TRACKING_ASGI_DB_WORKERS).
+Django's async ORM methods would push every query through the single
+thread_sensitive executor, which serialises them; a pool gives real
+concurrency. Each call closes stale connections before and after running,
+as Django does around a request.
+"""
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections
+
+from .postback_queue import receive_postback
+from .postbacks import merge_params
+from .tracking import process_click
+
+logger = logging.getLogger(__name__)
+
+CLICK_PATHS = ('/offer/', '/offers/offer/')
+POSTBACK_PATH = '/offers/postback/'
+
+FORM_CONTENT_TYPE = 'application/x-www-form-urlencoded'
+
+# Same headers handle_postback sends
+POSTBACK_HEADERS = [
+    (b'content-type', b'application/json'),
+    (b'cache-control', b'no-cache, no-store, must-revalidate'),
+    (b'pragma', b'no-cache'),
+    (b'expires', b'0'),
+]
+
+
+def _parse_query(raw):
+    # Last value wins for repeated keys, like QueryDict.get()
+    return dict(parse_qsl(raw.decode('latin-1'), keep_blank_values=True))
+
+
+def _scope_meta(scope):
+    """Build the subset of Django's request.META the tracking code reads"""
+    meta = {}
+    for name, value in scope.get('headers', []):
+        key = 'HTTP_' + name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        meta[key] = f"{meta[key]},{value}" if key in meta else value
+    client = scope.get('client')
+    if client:
+        meta['REMOTE_ADDR'] = client[0]
+    return meta
+
+
+def _run_db(function, *args):
+    close_old_connections()
+    try:
+        return function(*args)
+    finally:
+        close_old_connections()
+
+
+class TrackingApplication:
+    """ASGI app serving click and postback routes, delegating the rest"""
+
+    def __init__(self, fallback, max_workers=None):
+        self.fallback = fallback
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or getattr(settings, 'TRACKING_ASGI_DB_WORKERS', 16),
+            thread_name_prefix='tracking-db',
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            path = scope['path']
+            if path in CLICK_PATHS and scope['method'] in ('GET', 'HEAD'):
+                return await self.handle_click(scope, send)
+            if path == POSTBACK_PATH and self._is_simple_postback(scope):
+                return await self.handle_postback(scope, receive, send)
+        return await self.fallback(scope, receive, send)
+
+    def _is_simple_postback(self, scope):
+        if scope['method'] == 'GET':
+            return True
+        if scope['method'] != 'POST':
+            return False
+        content_type = dict(scope.get('headers', [])).get(b'content-type', b'')
+        return content_type.split(b';')[0].strip().decode('latin-1').lower() == FORM_CONTENT_TYPE
+
+    async def _in_pool(self, function, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, _run_db, function, *args)
+
+    async def handle_click(self, scope, send):
+        params = _parse_query(scope.get('query_string', b''))
+        status, value = await self._in_pool(process_click, params, _scope_meta(scope))
+
+        if status == 302:
+            headers = [(b'location', value.encode('utf-8')), (b'content-type', b'text/html; charset=utf-8')]
+            body = b''
+        else:
+            headers = [(b'content-type', b'text/html; charset=utf-8')]
+            body = value.encode('utf-8')
+        await self._respond(send, status, headers, body, head=scope['method'] == 'HEAD')
+
+    async def handle_postback(self, scope, receive, send):
+        form = {}
+        if scope['method'] == 'POST':
+            body = await self._read_body(receive)
+            if body is None:
+                data = {'success': False, 'message': 'Request body too large', 'error_code': 'BODY_TOO_LARGE'}
+                return await self._respond(send, 413, POSTBACK_HEADERS, json.dumps(data, cls=DjangoJSONEncoder).encode('utf-8'))
+            form = _parse_query(body)
+        query = _parse_query(scope.get('query_string', b''))
+
+        logger.info(f"Postback received: Method={scope['method']}, GET={query}, POST={form}")
+        data, status = await self._in_pool(receive_postback, merge_params(query, form))
+        await self._respond(send, status, POSTBACK_HEADERS, json.dumps(data, cls=DjangoJSONEncoder).encode('utf-8'))
+
+    async def _read_body(self, receive):
+        """Return the request body, or None when it exceeds DATA_UPLOAD_MAX_MEMORY_SIZE"""
+        chunks = []
+        limit = settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if limit is not None and size > limit:
+                return None
+            chunks.append(chunk)
+            if not message.get('more_body', False):
+                break
+        return b''.join(chunks)
+
+    async def _respond(self, send, status, headers, body, head=False):
+        headers = headers + [(b'content-length', str(len(body)).encode('ascii'))]
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': b'' if head else body})
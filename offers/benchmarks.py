@@ -0,0 +1,364 @@
+"""
+Shared helpers for the bench_* management commands
+
+Benchmarks run against a throwaway copy of the schema (created with the
+same machinery as the Django test runner) so they never touch real data.
+
+Postback logs (read_postback_log / write_postback_log) hold one postback
+per line, either as JSON - {"t": seconds since the first postback,
+"params": {...}} or just the parameters - or as the request URL or query
+string. replay_postbacks() sends such a log at a target rate and records
+the latency, status and query count of every request.
+
+stub_http_server() runs a local HTTP server that records the requests it
+gets, standing in for an affiliate's tracker in the outbound postback
+tests and bench.
+"""
+import json
+import math
+import os
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from django.db import close_old_connections, connection, connections
+
+
+@contextmanager
+def isolated_database(alias='default'):
+    """
+    Create a fresh, migrated test database for the duration of the block
+
+    SQLite test databases are placed in a temporary file rather than in
+    memory so that benchmark threads all see the same data.
+    """
+    from .click_ids import reset_click_id_generator
+    from .daily_stats import reset_daily_stat_buffer
+    from .subids import reset_subid_cache
+
+    connection = connections[alias]
+    old_name = connection.settings_dict['NAME']
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    old_test_name = test_settings.get('NAME')
+
+    temp_dir = None
+    if connection.vendor == 'sqlite' and not old_test_name:
+        temp_dir = tempfile.mkdtemp(prefix='cpa-bench-')
+        test_settings['NAME'] = os.path.join(temp_dir, 'bench.sqlite3')
+
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield connection
+    finally:
+        # Per-process state that refers to rows of the throwaway database:
+        # buffered rollup counts are written now rather than at exit, cached
+        # SubId ids are dropped and the click ID worker lease is given back
+        reset_daily_stat_buffer()
+        reset_subid_cache()
+        reset_click_id_generator()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        test_settings['NAME'] = old_test_name
+        if temp_dir:
+            for name in os.listdir(temp_dir):
+                os.remove(os.path.join(temp_dir, name))
+            os.rmdir(temp_dir)
+
+
+def percentile(samples, pct):
+    """Return the pct-th percentile (0-100) of a list of numbers"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = math.ceil(pct / 100.0 * len(ordered))
+    return ordered[min(len(ordered), max(rank, 1)) - 1]
+
+
+def latency_summary(samples):
+    """Summarise latencies given in seconds as milliseconds"""
+    if not samples:
+        return {'count': 0, 'mean': 0.0, 'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'max': 0.0}
+    return {
+        'count': len(samples),
+        'mean': sum(samples) / len(samples) * 1000,
+        'p50': percentile(samples, 50) * 1000,
+        'p95': percentile(samples, 95) * 1000,
+        'p99': percentile(samples, 99) * 1000,
+        'max': max(samples) * 1000,
+    }
+
+
+def format_latency(label, samples):
+    """Return a one-line latency report for command output"""
+    summary = latency_summary(samples)
+    return (
+        f'{label}: n={summary["count"]} mean={summary["mean"]:.2f}ms '
+        f'p50={summary["p50"]:.2f}ms p95={summary["p95"]:.2f}ms '
+        f'p99={summary["p99"]:.2f}ms max={summary["max"]:.2f}ms'
+    )
+
+
+def create_fixture(users=1, offers=1, payout='10.00', need_approval=False):
+    """
+    Seed a CPA network with the given number of affiliates and offers
+
+    Returns (network, users, offers).
+    """
+    from user.models import User
+    from .models import CPANetwork, Offer
+
+    network = CPANetwork.objects.create(
+        network_key='BenchNetwork',
+        name='Bench Network',
+        description='Local stand-in network for benchmarks',
+        click_id_parameter='subid',
+        postback_click_id_parameter='subid',
+    )
+    user_objs = [
+        User.objects.create_user(
+            email=f'bench{i}@example.com',
+            password=None,
+            full_name=f'Bench Affiliate {i}',
+        )
+        for i in range(users)
+    ]
+    offer_objs = [
+        Offer.objects.create(
+            offer_name=f'Bench Offer {i}',
+            cpa_network=network,
+            offer_url=f'https://offers.example.com/lp/{i}?src=bench',
+            need_approval=need_approval,
+            payout=Decimal(payout),
+        )
+        for i in range(offers)
+    ]
+    return network, user_objs, offer_objs
+
+
+def latency_stats(samples):
+    """min/max/mean/stddev/median/ops of latencies in seconds, as pytest-benchmark reports them"""
+    if not samples:
+        return {'min': 0.0, 'max': 0.0, 'mean': 0.0, 'stddev': 0.0, 'median': 0.0, 'ops': 0.0}
+    mean = statistics.fmean(samples)
+    return {
+        'min': min(samples),
+        'max': max(samples),
+        'mean': mean,
+        'stddev': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        'median': statistics.median(samples),
+        'ops': 1.0 / mean if mean else 0.0,
+    }
+
+
+def read_postback_log(path):
+    """Return [(offset_seconds or None, params)] from a postback log file"""
+    entries = []
+    with open(path, encoding='utf-8') as log:
+        for line in log:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('{'):
+                record = json.loads(line)
+                if 'params' in record:
+                    entries.append((record.get('t'), dict(record['params'])))
+                else:
+                    entries.append((None, record))
+            else:
+                query = urlsplit(line).query if '?' in line else line
+                entries.append((None, dict(parse_qsl(query, keep_blank_values=True))))
+    return entries
+
+
+def write_postback_log(path, entries):
+    """Write [(offset_seconds or None, params)] as a JSON-lines postback log"""
+    with open(path, 'w', encoding='utf-8') as log:
+        for offset, params in entries:
+            record = {'params': params}
+            if offset is not None:
+                record['t'] = round(offset, 6)
+            log.write(json.dumps(record) + '\n')
+
+
+def remap_postback_log(entries, network, click_ids, click_param=None):
+    """
+    Point a recorded log at the benchmark network and clicks
+
+    Each distinct click ID in the log is replaced by the next seeded click
+    (so retries of one postback stay retries of one click) and the network
+    by the benchmark network. click_param names the click ID parameter in
+    the log; by default it is the first parameter other than network and
+    payout. Postbacks beyond the seeded clicks are dropped.
+    """
+    mapping = {}
+    remapped = []
+    for offset, params in entries:
+        param = click_param or next((key for key in params if key not in ('network', 'payout')), None)
+        recorded_id = params.get(param) if param else None
+        if recorded_id is None:
+            continue
+        key = recorded_id.lower()
+        if key not in mapping:
+            if len(mapping) >= len(click_ids):
+                continue
+            mapping[key] = click_ids[len(mapping)]
+        click_id = mapping[key]
+        # Keep the upper-casing some networks do when echoing the ID back
+        if recorded_id.isupper():
+            click_id = click_id.upper()
+        new_params = {k: v for k, v in params.items() if k != param}
+        new_params.update({'network': network.network_key, network.postback_click_id_parameter: click_id})
+        remapped.append((offset, new_params))
+    return remapped
+
+
+def _steady(network, click_ids, rng):
+    return [(None, {'network': network.network_key, network.postback_click_id_parameter: click_id, 'payout': '10.00'})
+            for click_id in click_ids]
+
+
+def _retry_storm(network, click_ids, rng, copies=5):
+    """Every postback arrives several times, some copies upper-cased, in shuffled bursts"""
+    entries = []
+    for click_id in click_ids:
+        for copy in range(rng.randint(2, copies)):
+            sent_id = click_id.upper() if copy % 2 else click_id
+            entries.append((None, {'network': network.network_key, network.postback_click_id_parameter: sent_id, 'payout': '10.00'}))
+    burst = 50
+    chunks = [entries[i:i + burst] for i in range(0, len(entries), burst)]
+    for chunk in chunks:
+        rng.shuffle(chunk)
+    return [entry for chunk in chunks for entry in chunk]
+
+
+def _mixed(network, click_ids, rng):
+    """Mostly single postbacks with some retries, unknown clicks and unknown networks"""
+    entries = []
+    for click_id in click_ids:
+        params = {'network': network.network_key, network.postback_click_id_parameter: click_id, 'payout': '10.00'}
+        entries.append((None, params))
+        roll = rng.random()
+        if roll < 0.2:
+            entries.append((None, dict(params)))
+        elif roll < 0.25:
+            entries.append((None, dict(params, **{network.postback_click_id_parameter: f'unknown-{click_id}'})))
+        elif roll < 0.27:
+            entries.append((None, dict(params, network='UnknownNetwork')))
+    rng.shuffle(entries)
+    return entries
+
+
+# Named postback load shapes for bench_postbacks: scenario(network, click_ids, rng) -> entries
+POSTBACK_SCENARIOS = {
+    'steady': _steady,
+    'retry_storm': _retry_storm,
+    'mixed': _mixed,
+}
+
+
+def replay_postbacks(entries, send, rate=None, concurrency=8):
+    """
+    Send postbacks with send(params) -> status_code and time each one
+
+    Postbacks go out at their recorded offsets, or rate per second when
+    rate is given, or as fast as concurrency allows. Returns a list of
+    (latency_seconds, status_code, queries) in log order and the elapsed time.
+    """
+    started = time.perf_counter()
+    if rate:
+        schedule = [i / rate for i in range(len(entries))]
+    elif any(offset is not None for offset, _ in entries):
+        schedule = [offset or 0.0 for offset, _ in entries]
+    else:
+        schedule = [0.0] * len(entries)
+
+    def run(index):
+        delay = started + schedule[index] - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        queries = [0]
+
+        def count_query(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        sent = time.perf_counter()
+        try:
+            with connection.execute_wrapper(count_query):
+                status = send(entries[index][1])
+        finally:
+            close_old_connections()
+        return time.perf_counter() - sent, status, queries[0]
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(run, range(len(entries))))
+    return results, time.perf_counter() - started
+
+
+_clients = threading.local()
+
+
+def postback_client():
+    """Django test client for the current thread"""
+    from django.test import Client
+
+    if not hasattr(_clients, 'client'):
+        _clients.client = Client()
+    return _clients.client
+
+
+class StubServer:
+    """What stub_http_server() yields: its base URL and the requests received"""
+
+    def __init__(self, url):
+        self.url = url
+        self.lock = threading.Lock()
+        # (perf_counter time, path with query string) per request
+        self.requests = []
+
+    def paths(self):
+        with self.lock:
+            return [path for _, path in self.requests]
+
+
+@contextmanager
+def stub_http_server(respond=None, delay=0.0):
+    """
+    Serve GET requests on a free localhost port while the block runs
+
+    respond(path) returns the status code to answer with (200 by default);
+    delay is slept before answering. Connections are kept alive, like a real
+    tracker would.
+    """
+    stub = None
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            with stub.lock:
+                stub.requests.append((time.perf_counter(), self.path))
+            if delay:
+                time.sleep(delay)
+            self.send_response(respond(self.path) if respond else 200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    stub = StubServer(f'http://127.0.0.1:{server.server_address[1]}')
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield stub
+    finally:
+        server.shutdown()
+        server.server_close()
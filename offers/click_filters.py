@@ -0,0 +1,300 @@
+"""
+Click filtering ahead of ClickTracking creation
+
+Before a tracking-link hit is written, process_click asks the ClickFilter
+whether it should count as a click:
+
+- bot: the user agent contains one of CLICK_BOT_USER_AGENTS as a whole
+  word, or as the end of a product name ("bot" matches "Googlebot/2.1" and
+  "bot", not "Cubot"). The words are compiled into a single trie-shaped
+  regular expression, so matching costs one pass over the user agent
+  whatever the number of words.
+- blocked_asn: the visitor's network (the AS number at the start of the
+  geo 'organization' field) is in CLICK_BLOCKED_ASNS. This needs the geo
+  data inline, i.e. GEOIP_BACKEND = 'local'; with the HTTP backend the
+  check is skipped.
+- duplicate: the same (ip, user, offer) clicked less than CLICK_DEDUP_WINDOW
+  seconds ago. The visitor is redirected with the previous click ID.
+- flood: more than CLICK_FLOOD_LIMIT hits for the key within
+  CLICK_FLOOD_WINDOW seconds; also answered with the previous click ID.
+
+Duplicate/flood state lives in a bounded in-memory store per process, with
+entries evicted once idle for longer than both windows or when the store
+is full. Filtered hits create no row and no geo lookup; they are counted in
+memory and added to ClickFilterStat every CLICK_FILTER_STATS_FLUSH_INTERVAL
+seconds by a flusher thread, and once more when the process exits.
+
+With CLICK_FILTERS_LOG_ONLY (the default) the decisions are counted and
+logged but every hit is still recorded as a click, so the rules can be
+checked against real traffic before they start dropping clicks.
+"""
+import atexit
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ClickFilterStat
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BOT_USER_AGENTS = [
+    'bot', 'crawler', 'spider', 'slurp', 'facebookexternalhit', 'headlesschrome',
+    'phantomjs', 'python-requests', 'python-urllib', 'curl', 'wget', 'libwww',
+    'scrapy', 'httpclient', 'go-http-client', 'lighthouse', 'pingdom',
+]
+
+ASN_PATTERN = re.compile(r'^AS(\d+)\b', re.IGNORECASE)
+
+
+def compile_trie_pattern(words):
+    """
+    Compile literal words into one case-insensitive regex shaped like a trie
+
+    ['bot', 'bing', 'crawl'] becomes b(?:ing|ot)|crawl, so the regex engine
+    follows shared prefixes once instead of trying every word in turn. The
+    words only match as a whole word or right before a '/', i.e. the trie
+    is wrapped as \\b(?:trie)\\b|(?:trie)/. Returns None when there are no words.
+    """
+    trie = {}
+    for word in words:
+        word = word.lower()
+        if not word:
+            continue
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        # A word may end here or go on (bot, bots), since matches are anchored
+        optional = '?' if '' in node else ''
+        if len(branches) == 1 and not optional:
+            return branches[0]
+        return '(?:' + '|'.join(branches) + ')' + optional
+
+    if not trie:
+        return None
+    pattern = build(trie)
+    return re.compile(rf'\b(?:{pattern})\b|(?:{pattern})/', re.IGNORECASE)
+
+
+def parse_asn(organization):
+    """Return the AS number from an 'AS15169 Google LLC' style value, or None"""
+    if not organization:
+        return None
+    match = ASN_PATTERN.match(organization)
+    return int(match.group(1)) if match else None
+
+
+class SlidingWindowStore:
+    """Bounded, TTL-evicted per-key hit history"""
+
+    def __init__(self, dedup_window, flood_window, flood_limit, max_keys):
+        self.dedup_window = dedup_window
+        self.flood_window = flood_window
+        self.flood_limit = flood_limit
+        self.max_keys = max_keys
+        self.ttl = max(dedup_window, flood_window)
+        # key -> [last hit, deque of hit times, last click ID, last click time]
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, key, now):
+        """
+        Register a hit; return (reason, previous click ID) for a repeat hit
+        or (None, None) when it should become a new click
+        """
+        with self._lock:
+            self._evict(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = [now, deque(maxlen=self.flood_limit + 1), None, 0.0]
+                self._entries[key] = entry
+            else:
+                self._entries.move_to_end(key)
+                entry[0] = now
+
+            hits = entry[1]
+            hits.append(now)
+            while hits and hits[0] <= now - self.flood_window:
+                hits.popleft()
+
+            if entry[2] is None:
+                return None, None
+            if len(hits) > self.flood_limit:
+                return 'flood', entry[2]
+            if now - entry[3] < self.dedup_window:
+                return 'duplicate', entry[2]
+            return None, None
+
+    def remember(self, key, click_id, now):
+        """Record the click ID issued for a key"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry[2] = click_id
+                entry[3] = now
+
+    def _evict(self, now):
+        entries = self._entries
+        while entries:
+            key, entry = next(iter(entries.items()))
+            if len(entries) <= self.max_keys and entry[0] > now - self.ttl:
+                break
+            entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ClickFilter:
+    """Process-wide filter state and decision counters"""
+
+    def __init__(self, bot_user_agents, blocked_asns, dedup_window, flood_window,
+                 flood_limit, max_keys, flush_interval, log_only=False):
+        self.log_only = log_only
+        self.bot_pattern = compile_trie_pattern(bot_user_agents)
+        self.blocked_asns = frozenset(int(asn) for asn in blocked_asns)
+        self.store = SlidingWindowStore(dedup_window, flood_window, flood_limit, max_keys)
+        self.flush_interval = flush_interval
+        self.pid = os.getpid()
+        self._counts = {}
+        self._counts_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='click-filter-flusher', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def match_bot(self, user_agent):
+        """Return the matched pattern when the user agent looks automated"""
+        if self.bot_pattern is None or not user_agent:
+            return None
+        match = self.bot_pattern.search(user_agent)
+        return match.group(0).rstrip('/') if match else None
+
+    def is_blocked_network(self, geo_fields):
+        if not self.blocked_asns or not geo_fields:
+            return False
+        return parse_asn(geo_fields.get('organization')) in self.blocked_asns
+
+    def check_visitor(self, user_agent, geo_fields):
+        """Return 'bot' or 'blocked_asn' for traffic that is never a click"""
+        if self.match_bot(user_agent):
+            return 'bot'
+        if self.is_blocked_network(geo_fields):
+            return 'blocked_asn'
+        return None
+
+    def check_repeat(self, ip_address, user_id, offer_id):
+        """Return (reason, previous click ID) for duplicates and floods"""
+        return self.store.check((ip_address, user_id, offer_id), time.monotonic())
+
+    def remember(self, ip_address, user_id, offer_id, click_id):
+        self.store.remember((ip_address, user_id, offer_id), click_id, time.monotonic())
+
+    def count(self, user_id, offer_id, reason):
+        """Count a filtered hit; the flusher thread writes it within flush_interval"""
+        key = (timezone.localdate(), user_id, offer_id, reason)
+        with self._counts_lock:
+            self._counts[key] = self._counts.get(key, 0) + 1
+
+    def flush(self):
+        """Add the counted decisions to ClickFilterStat; returns the rows touched"""
+        # Only one thread flushes; the others keep counting
+        if not self._flush_lock.acquire(blocking=False):
+            return 0
+        try:
+            with self._counts_lock:
+                counts, self._counts = self._counts, {}
+
+            for (date, user_id, offer_id, reason), amount in counts.items():
+                try:
+                    _add_to_stat(date, user_id, offer_id, reason, amount)
+                except IntegrityError as e:
+                    # The user or offer was deleted in the meantime
+                    logger.warning(f"Dropping click filter count for {user_id}/{offer_id}: {str(e)}")
+            return len(counts)
+        finally:
+            self._flush_lock.release()
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Click filter stats flush failed: {str(e)}", exc_info=True)
+            finally:
+                close_old_connections()
+
+    def close(self):
+        """Stop the flusher thread and write what is left"""
+        if self._stopped.is_set() or self.pid != os.getpid():
+            return
+        self._stopped.set()
+        self.flush()
+
+    def pending_counts(self):
+        with self._counts_lock:
+            return dict(self._counts)
+
+
+def _add_to_stat(date, user_id, offer_id, reason, amount):
+    lookup = {'date': date, 'user_id': user_id, 'offer_id': offer_id, 'reason': reason}
+    if ClickFilterStat.objects.filter(**lookup).update(count=F('count') + amount):
+        return
+    try:
+        with transaction.atomic():
+            ClickFilterStat.objects.create(count=amount, **lookup)
+    except IntegrityError:
+        # Another process created the row first (or the FK is gone, which
+        # makes this update a no-op and is reported by the caller)
+        if not ClickFilterStat.objects.filter(**lookup).update(count=F('count') + amount):
+            raise
+
+
+_filter = None
+_filter_lock = threading.Lock()
+
+
+def get_click_filter():
+    """Return the process-wide ClickFilter, or None when filtering is off"""
+    global _filter
+    if not getattr(settings, 'CLICK_FILTERS_ENABLED', True):
+        return None
+    # A forked child gets the parent's counts (the parent writes them) but
+    # not its flusher thread, so it starts a filter of its own
+    if _filter is None or _filter.pid != os.getpid():
+        with _filter_lock:
+            if _filter is None or _filter.pid != os.getpid():
+                _filter = ClickFilter(
+                    bot_user_agents=getattr(settings, 'CLICK_BOT_USER_AGENTS', DEFAULT_BOT_USER_AGENTS),
+                    blocked_asns=getattr(settings, 'CLICK_BLOCKED_ASNS', []),
+                    dedup_window=getattr(settings, 'CLICK_DEDUP_WINDOW', 10),
+                    flood_window=getattr(settings, 'CLICK_FLOOD_WINDOW', 60),
+                    flood_limit=getattr(settings, 'CLICK_FLOOD_LIMIT', 20),
+                    max_keys=getattr(settings, 'CLICK_FILTER_MAX_KEYS', 100000),
+                    flush_interval=getattr(settings, 'CLICK_FILTER_STATS_FLUSH_INTERVAL', 30),
+                    log_only=getattr(settings, 'CLICK_FILTERS_LOG_ONLY', True),
+                )
+    return _filter
+
+
+def reset_click_filter():
+    """Drop the process-wide filter, flushing its counters first"""
+    global _filter
+    with _filter_lock:
+        if _filter is not None:
+            _filter.close()
+        _filter = None
@@ -0,0 +1,380 @@
+"""
+Click ID generation
+
+A click ID is a 128-bit integer written as 26 Crockford base32 characters:
+
+    48 bits  milliseconds since the Unix epoch
+    10 bits  worker (process) id
+    12 bits  per-worker sequence within the millisecond
+    32 bits  affiliate (user) id
+    26 bits  offer id
+
+IDs sort by creation time, never repeat within a worker (the sequence
+waits for the next millisecond once 4096 IDs have been issued in one), and
+carry the user and offer so a postback can be routed without a lookup.
+Decoding is case-insensitive and accepts the usual Crockford substitutions
+(I/L for 1, O for 0), since some networks mangle the case of echoed IDs.
+
+The worker id comes from CLICK_ID_WORKER_ID when set; that value must then
+be unique per process across every host issuing IDs. Otherwise each process
+leases a free worker id from the ClickIdWorkerLease table at its first ID,
+keeps the lease alive from a background thread and gives it back at exit.
+A lease not renewed for CLICK_ID_WORKER_LEASE_SECONDS (a crashed process)
+may be taken over; the holder stops issuing IDs under it well before then,
+renewing it or moving to another worker id first.
+"""
+import atexit
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, close_old_connections, transaction
+from django.db.models import CharField, Func
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+ENCODED_LENGTH = 26
+
+TIMESTAMP_BITS = 48
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+USER_BITS = 32
+OFFER_BITS = 26
+
+MAX_WORKER = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+MAX_USER = (1 << USER_BITS) - 1
+MAX_OFFER = (1 << OFFER_BITS) - 1
+
+OFFER_SHIFT = 0
+USER_SHIFT = OFFER_BITS
+SEQUENCE_SHIFT = USER_SHIFT + USER_BITS
+WORKER_SHIFT = SEQUENCE_SHIFT + SEQUENCE_BITS
+TIMESTAMP_SHIFT = WORKER_SHIFT + WORKER_BITS
+
+# Two base32 characters per 10-bit chunk, so encoding is 13 table lookups
+_PAIRS = [ALPHABET[i >> 5] + ALPHABET[i & 31] for i in range(1024)]
+
+_DECODE = {}
+for _index, _char in enumerate(ALPHABET):
+    _DECODE[_char] = _index
+    _DECODE[_char.lower()] = _index
+for _char, _index in (('O', 0), ('o', 0), ('I', 1), ('i', 1), ('L', 1), ('l', 1)):
+    _DECODE[_char] = _index
+
+# Share of the lease period a process trusts its lease for without renewing
+# it, leaving the rest as headroom for clock differences between hosts
+LEASE_TRUST = 0.8
+
+# Seconds a released worker id stays unclaimable, so the next holder cannot
+# issue IDs in a millisecond the last one may still have used
+LEASE_REUSE_DELAY = 5
+
+# Characters of a click ID covered by the case-insensitive lookup index on
+# ClickTracking (see offers.click_lookup); a truncated ID needs at least this many
+CLICK_KEY_LENGTH = 16
+
+
+class ClickKey(Func):
+    """
+    LOWER(SUBSTR(click_id, 1, CLICK_KEY_LENGTH)), the expression the click key
+    index is built on
+
+    The bounds are written into the SQL rather than passed as parameters so
+    that queries repeat the index expression exactly and the database uses it.
+    """
+    template = f'LOWER(SUBSTR(%(expressions)s, 1, {CLICK_KEY_LENGTH}))'
+    output_field = CharField()
+
+ClickIdInfo = namedtuple('ClickIdInfo', ['timestamp', 'worker_id', 'sequence', 'user_id', 'offer_id'])
+
+
+def encode(value):
+    """Encode a 128-bit integer as 26 Crockford base32 characters"""
+    # 130 bits of output; the top two are always zero
+    return ''.join([_PAIRS[(value >> shift) & 1023] for shift in range(120, -10, -10)])
+
+
+def decode(text):
+    """Decode 26 Crockford base32 characters; raises ValueError on bad input"""
+    if len(text) != ENCODED_LENGTH:
+        raise ValueError(f"Click ID must be {ENCODED_LENGTH} characters")
+    value = 0
+    try:
+        for char in text:
+            value = (value << 5) | _DECODE[char]
+    except KeyError:
+        raise ValueError(f"Invalid character in click ID {text!r}")
+    if value >> 128:
+        raise ValueError(f"Click ID {text!r} is out of range")
+    return value
+
+
+class WorkerLease:
+    """A worker id held in ClickIdWorkerLease by this process"""
+
+    def __init__(self, duration):
+        self.duration = duration
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}'
+        self.worker_id = None
+        # time.monotonic() after which the lease must be renewed before use
+        self.valid_until = 0.0
+
+    def acquire(self):
+        """Claim a free or expired worker id; raises RuntimeError when none is left"""
+        from .models import ClickIdWorkerLease
+
+        now = timezone.now()
+        held = set(ClickIdWorkerLease.objects.filter(expires_at__gte=now).values_list('worker_id', flat=True))
+        # Start from the process id so processes of one host rarely race for a slot
+        first = os.getpid() % (MAX_WORKER + 1)
+        for offset in range(MAX_WORKER + 1):
+            worker_id = (first + offset) % (MAX_WORKER + 1)
+            if worker_id in held:
+                continue
+            checked = time.monotonic()
+            now = timezone.now()
+            expires_at = now + timedelta(seconds=self.duration)
+            taken = ClickIdWorkerLease.objects.filter(worker_id=worker_id, expires_at__lt=now).update(
+                owner=self.owner, expires_at=expires_at,
+            )
+            if not taken:
+                try:
+                    with transaction.atomic():
+                        ClickIdWorkerLease.objects.create(worker_id=worker_id, owner=self.owner, expires_at=expires_at)
+                except IntegrityError:
+                    # Claimed by another process since the read above
+                    continue
+            self.worker_id = worker_id
+            self.valid_until = checked + self.duration * LEASE_TRUST
+            return worker_id
+        raise RuntimeError(
+            f"All {MAX_WORKER + 1} click ID worker ids are leased; "
+            "set CLICK_ID_WORKER_ID for each process instead"
+        )
+
+    def renew(self):
+        """Extend the lease; returns False when it has been taken over"""
+        from .models import ClickIdWorkerLease
+
+        checked = time.monotonic()
+        renewed = ClickIdWorkerLease.objects.filter(worker_id=self.worker_id, owner=self.owner).update(
+            expires_at=timezone.now() + timedelta(seconds=self.duration),
+        )
+        if renewed:
+            self.valid_until = checked + self.duration * LEASE_TRUST
+        return bool(renewed)
+
+    def release(self):
+        """Give the worker id back (claimable again after LEASE_REUSE_DELAY)"""
+        from .models import ClickIdWorkerLease
+
+        ClickIdWorkerLease.objects.filter(worker_id=self.worker_id, owner=self.owner).update(
+            expires_at=timezone.now() + timedelta(seconds=LEASE_REUSE_DELAY),
+        )
+        self.worker_id = None
+        self.valid_until = 0.0
+
+
+class ClickIdGenerator:
+    """
+    Thread-safe click ID source for one process
+
+    Without a configured worker_id the worker id is leased (see WorkerLease)
+    when the first ID is issued, and renewed every lease_seconds / 3.
+    """
+
+    def __init__(self, worker_id=None, lease_seconds=300):
+        self._configured_worker = worker_id
+        self._lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._reset()
+
+    def _reset(self):
+        if self._configured_worker is not None:
+            worker_id = int(self._configured_worker)
+            if not 0 <= worker_id <= MAX_WORKER:
+                raise ValueError(f"Click ID worker id must be between 0 and {MAX_WORKER}")
+        else:
+            worker_id = None
+        self.worker_id = worker_id
+        self._lease = None
+        self._last_ms = 0
+        self._sequence = 0
+
+    def _after_fork(self):
+        # Forked children must not continue the parent's worker/sequence, nor
+        # renew or release the parent's lease; they lease their own
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._reset()
+
+    def _hold_worker_id(self):
+        """Make sure worker_id is leased and usable; called with the lock held"""
+        if self._configured_worker is not None:
+            return
+        if self._lease is None:
+            lease = WorkerLease(self._lease_seconds)
+            lease.acquire()
+            self._lease = lease
+            threading.Thread(
+                target=self._renew_lease, args=(self._stopped,), name='click-id-lease', daemon=True,
+            ).start()
+        elif time.monotonic() >= self._lease.valid_until and not self._lease.renew():
+            # Renewal came too late and the worker id has been taken over
+            logger.warning(f"Click ID worker id {self._lease.worker_id} was taken over; leasing another")
+            self._lease.acquire()
+        self.worker_id = self._lease.worker_id
+
+    def _renew_lease(self, stopped):
+        while not stopped.wait(self._lease_seconds / 3):
+            try:
+                with self._lock:
+                    if self._lease is None:
+                        break
+                    self._lease.valid_until = 0.0
+                    self._hold_worker_id()
+            except Exception as e:
+                # next_value retries (and fails) before the lease runs out
+                logger.error(f"Click ID worker lease renewal failed: {str(e)}", exc_info=True)
+            finally:
+                close_old_connections()
+
+    def release(self):
+        """Stop renewing and give the leased worker id back"""
+        self._stopped.set()
+        with self._lock:
+            lease, self._lease = self._lease, None
+            if lease is not None:
+                self.worker_id = None
+                lease.release()
+
+    def next_value(self, user_id, offer_id):
+        """Return the next click ID as an integer"""
+        if not 0 <= user_id <= MAX_USER or not 0 <= offer_id <= MAX_OFFER:
+            raise ValueError(f"User {user_id} / offer {offer_id} do not fit in a click ID")
+
+        with self._lock:
+            self._hold_worker_id()
+            worker_id = self.worker_id
+            now = time.time_ns() // 1_000_000
+            if now <= self._last_ms:
+                # Same millisecond, or the clock stepped back: keep counting on
+                # the last timestamp so IDs stay unique and ordered
+                self._sequence += 1
+                if self._sequence > MAX_SEQUENCE:
+                    while now <= self._last_ms:
+                        now = time.time_ns() // 1_000_000
+                    self._last_ms = now
+                    self._sequence = 0
+            else:
+                self._last_ms = now
+                self._sequence = 0
+            timestamp = self._last_ms
+            sequence = self._sequence
+
+        return (
+            (timestamp << TIMESTAMP_SHIFT)
+            | (worker_id << WORKER_SHIFT)
+            | (sequence << SEQUENCE_SHIFT)
+            | (user_id << USER_SHIFT)
+            | offer_id
+        )
+
+    def next_id(self, user_id, offer_id):
+        """Return the next click ID as a string"""
+        return encode(self.next_value(user_id, offer_id))
+
+
+def decode_click_id(click_id):
+    """
+    Return a ClickIdInfo for a click ID, or None when it is not one of ours
+    (e.g. an ID issued before this scheme, or a value mangled by a network)
+    """
+    if not click_id:
+        return None
+    try:
+        value = decode(click_id.strip())
+    except ValueError:
+        return None
+
+    milliseconds = value >> TIMESTAMP_SHIFT
+    return ClickIdInfo(
+        timestamp=datetime.fromtimestamp(milliseconds / 1000.0, tz=dt_timezone.utc),
+        worker_id=(value >> WORKER_SHIFT) & MAX_WORKER,
+        sequence=(value >> SEQUENCE_SHIFT) & MAX_SEQUENCE,
+        user_id=(value >> USER_SHIFT) & MAX_USER,
+        offer_id=value & MAX_OFFER,
+    )
+
+
+def normalize_click_id(click_id):
+    """
+    Return the canonical spelling of a click ID
+
+    IDs in this scheme come back upper-case with Crockford substitutions
+    undone; anything else is returned stripped but otherwise unchanged.
+    """
+    if not click_id:
+        return click_id
+    click_id = click_id.strip()
+    try:
+        return encode(decode(click_id))
+    except ValueError:
+        return click_id
+
+
+_generator = None
+_generator_lock = threading.Lock()
+
+
+def get_click_id_generator():
+    """Return the process-wide generator, creating it on first use"""
+    global _generator
+    if _generator is None:
+        with _generator_lock:
+            if _generator is None:
+                _generator = ClickIdGenerator(
+                    getattr(settings, 'CLICK_ID_WORKER_ID', None),
+                    lease_seconds=getattr(settings, 'CLICK_ID_WORKER_LEASE_SECONDS', 300),
+                )
+    return _generator
+
+
+def reset_click_id_generator():
+    """Release the process-wide generator's lease; the next ID creates a new generator"""
+    global _generator
+    with _generator_lock:
+        generator, _generator = _generator, None
+    if generator is not None:
+        generator.release()
+
+
+def _release_at_exit():
+    try:
+        reset_click_id_generator()
+    except DatabaseError:
+        # The lease simply expires
+        pass
+
+
+def _reset_after_fork():
+    global _generator_lock
+    _generator_lock = threading.Lock()
+    if _generator is not None:
+        _generator._after_fork()
+
+
+atexit.register(_release_at_exit)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,291 @@
+"""
+Write-behind ingest for ClickTracking rows
+
+In the default 'direct' mode every click is a single INSERT made by
+track_click. With CLICK_INGEST_MODE = 'batched', clicks are appended to a
+per-process spool file and an in-memory buffer instead, and written with
+bulk_create once CLICK_INGEST_BATCH_SIZE rows are waiting or
+CLICK_INGEST_FLUSH_MS milliseconds have passed, whichever comes first.
+
+The spool makes the buffer crash-safe. Each process appends to its own
+segment file; a flush rotates the segment, inserts the rows and only then
+deletes the rotated file. Segments left behind by a process that died are
+replayed by the next writer that starts (or by the replay_click_spool
+command). Replays skip click IDs that are already in the table, so a
+segment whose rows were committed just before a crash is harmless.
+
+Clicks are only visible to reports and postbacks after their flush, i.e.
+at most CLICK_INGEST_FLUSH_MS later than in direct mode.
+"""
+import atexit
+import datetime
+import glob
+import json
+import logging
+import os
+import threading
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections
+from django.utils.dateparse import parse_datetime
+
+from .daily_stats import count_clicks
+from .enrichment import enqueue_click_enrichment
+from .geo import get_geo_resolver
+from .models import ClickTracking
+from .subids import resolve_subids
+
+logger = logging.getLogger(__name__)
+
+SPOOL_SUFFIX = '.spool'
+
+
+def _serialize(click):
+    """Return a JSON-safe dict of a ClickTracking's column values"""
+    data = {}
+    for field in ClickTracking._meta.concrete_fields:
+        if field.primary_key:
+            continue
+        value = getattr(click, field.attname)
+        if isinstance(value, datetime.datetime):
+            value = value.isoformat()
+        elif isinstance(value, Decimal):
+            value = str(value)
+        data[field.attname] = value
+    return data
+
+
+def _deserialize(data):
+    data = dict(data)
+    if data.get('click_date'):
+        data['click_date'] = parse_datetime(data['click_date'])
+    return ClickTracking(**data)
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _segment_pid(path):
+    """Return the pid encoded in a segment file name (clicks-<pid>-...)"""
+    try:
+        return int(os.path.basename(path).split('-')[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def write_clicks(clicks):
+    """
+    Insert clicks with bulk_create, count them in the daily stats and queue
+    their geo lookups (their subid references are resolved first)
+
+    Falls back to row-by-row inserts when the batch violates a constraint
+    (e.g. the affiliate was deleted while the click sat in the buffer), so
+    one bad row never loses the rest of the batch. Returns the clicks that
+    were written.
+    """
+    if not clicks:
+        return []
+
+    resolve_subids(clicks)
+    try:
+        written = ClickTracking.objects.bulk_create(clicks)
+    except IntegrityError:
+        written = []
+        for click in clicks:
+            click.pk = None
+            try:
+                click.save(force_insert=True)
+                written.append(click)
+            except IntegrityError as e:
+                logger.error(f"Dropping click {click.click_id} from ingest batch: {str(e)}")
+
+    count_clicks(written)
+    if not get_geo_resolver().is_local:
+        enqueue_click_enrichment([click for click in written if click.country is None])
+    return written
+
+
+def replay_segment(path):
+    """Write every click in a spool segment and delete it; returns the row count"""
+    clicks = []
+    with open(path, 'r', encoding='utf-8') as handle:
+        for line in handle:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                clicks.append(_deserialize(json.loads(line)))
+            except ValueError:
+                # A torn final line from a crash mid-write
+                logger.warning(f"Skipping unreadable line in click spool {path}")
+
+    if clicks:
+        click_ids = [click.click_id for click in clicks]
+        already_written = set(
+            ClickTracking.objects.filter(click_id__in=click_ids).values_list('click_id', flat=True)
+        )
+        write_clicks([click for click in clicks if click.click_id not in already_written])
+
+    os.remove(path)
+    return len(clicks)
+
+
+def replay_orphaned_segments(spool_dir, include_live=False):
+    """
+    Replay segments whose owning process is gone
+
+    With include_live=True every segment is replayed; only do that when no
+    writer is running (e.g. from the replay_click_spool command at deploy).
+    Returns the number of clicks replayed.
+    """
+    replayed = 0
+    for path in sorted(glob.glob(os.path.join(str(spool_dir), f'clicks-*{SPOOL_SUFFIX}*'))):
+        pid = _segment_pid(path)
+        if not include_live and pid is not None and (pid == os.getpid() or _process_alive(pid)):
+            continue
+        try:
+            count = replay_segment(path)
+        except FileNotFoundError:
+            # Another process replayed it first
+            continue
+        replayed += count
+        logger.info(f"Replayed {count} click(s) from {path}")
+    return replayed
+
+
+class ClickIngestWriter:
+    """Buffered, spooled ClickTracking writer for one process"""
+
+    def __init__(self, spool_dir, batch_size=200, flush_ms=500, fsync=False):
+        self.spool_dir = str(spool_dir)
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000.0
+        self.fsync = fsync
+        self.pid = os.getpid()
+
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._segment_number = 0
+        self._segment = None
+        self._segment_path = None
+        self._stopped = threading.Event()
+
+        os.makedirs(self.spool_dir, exist_ok=True)
+        replay_orphaned_segments(self.spool_dir)
+
+        self._open_segment()
+        self._thread = threading.Thread(target=self._run, name='click-ingest-flusher', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _open_segment(self):
+        self._segment_number += 1
+        self._segment_path = os.path.join(
+            self.spool_dir,
+            f'clicks-{self.pid}-{self._segment_number}{SPOOL_SUFFIX}'
+        )
+        self._segment = open(self._segment_path, 'a', encoding='utf-8')
+
+    def submit(self, click):
+        """Spool and buffer an unsaved ClickTracking; flushes when the batch is full"""
+        line = json.dumps(_serialize(click), separators=(',', ':'))
+        with self._lock:
+            self._segment.write(line + '\n')
+            self._segment.flush()
+            if self.fsync:
+                os.fsync(self._segment.fileno())
+            self._buffer.append(click)
+            full = len(self._buffer) >= self.batch_size
+
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Write everything buffered so far; returns the number of rows written"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._buffer:
+                    return 0
+                batch, self._buffer = self._buffer, []
+                self._segment.close()
+                flushing_path = self._segment_path + '.flushing'
+                os.replace(self._segment_path, flushing_path)
+                self._open_segment()
+
+            written = write_clicks(batch)
+            os.remove(flushing_path)
+            return len(written)
+
+    def pending(self):
+        with self._lock:
+            return len(self._buffer)
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                # The rotated segment stays on disk and is replayed later
+                logger.error(f"Click ingest flush failed: {str(e)}", exc_info=True)
+            finally:
+                close_old_connections()
+
+    def close(self):
+        """Stop the flusher thread and write what is left"""
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        try:
+            self.flush()
+        finally:
+            with self._lock:
+                self._segment.close()
+                if os.path.exists(self._segment_path) and not os.path.getsize(self._segment_path):
+                    os.remove(self._segment_path)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_click_writer():
+    """Return this process's ClickIngestWriter, creating it on first use"""
+    global _writer
+    if _writer is None or _writer.pid != os.getpid():
+        with _writer_lock:
+            if _writer is None or _writer.pid != os.getpid():
+                _writer = ClickIngestWriter(
+                    settings.CLICK_INGEST_SPOOL_DIR,
+                    batch_size=getattr(settings, 'CLICK_INGEST_BATCH_SIZE', 200),
+                    flush_ms=getattr(settings, 'CLICK_INGEST_FLUSH_MS', 500),
+                    fsync=getattr(settings, 'CLICK_INGEST_FSYNC', False),
+                )
+    return _writer
+
+
+def record_click(click, queue_enrichment=True):
+    """
+    Persist a new ClickTracking according to CLICK_INGEST_MODE
+
+    In direct mode the click is inserted immediately (and has a pk when this
+    returns); in batched mode it is handed to the write-behind writer.
+    """
+    if getattr(settings, 'CLICK_INGEST_MODE', 'direct') == 'batched':
+        get_click_writer().submit(click)
+        return click
+
+    resolve_subids([click])
+    click.save(force_insert=True)
+    count_clicks([click])
+    if queue_enrichment:
+        enqueue_click_enrichment(click)
+    return click
@@ -0,0 +1,116 @@
+"""
+Click lookup for postbacks with altered click IDs
+
+Networks do not always echo a click ID back the way it was sent: some wrap
+it in their macro characters ({ID}, #ID#, [ID] - see
+CPANetwork.click_id_wrapper), some cut it short, some change its case.
+process_postback first tries the canonical ID against the unique click_id
+index; when that misses, resolve_click_id() tries the variants:
+
+1. The value with the network's wrapper (and stray quotes or spaces)
+   removed, normalized as usual, against the same unique index.
+2. The first CLICK_KEY_LENGTH characters, lower-cased, against the
+   expression index offers_click_key_idx on ClickTracking (ClickKey). That is one
+   index seek whatever the table size; the rows it returns are then checked
+   against the whole received value, so a click is only matched when the
+   value is a case-insensitive prefix of exactly one click ID.
+
+IDs in the Crockford scheme are also tried with the usual O/I/L
+substitutions undone, since normalize_click_id cannot decode a truncated ID.
+"""
+import logging
+
+from .click_ids import CLICK_KEY_LENGTH, ClickKey, normalize_click_id
+from .models import ClickTracking
+
+logger = logging.getLogger(__name__)
+
+# Characters networks commonly leave around an echoed ID besides their wrapper
+_STRAY = ' \t\r\n"\''
+
+# Wrappers tried after the network's own (the choices CPANetwork offers)
+_COMMON_WRAPPERS = ['{}', '[]', '#', '*', '%']
+
+_CROCKFORD_FOLD = str.maketrans({'o': '0', 'i': '1', 'l': '1'})
+
+
+def _wrapper_pair(wrapper):
+    if len(wrapper) == 2:
+        return wrapper[0], wrapper[1]
+    if len(wrapper) == 1:
+        return wrapper, wrapper
+    return None
+
+
+def unwrap_click_id(value, wrapper=''):
+    """Strip a network's macro wrapper (or a common one) and stray quoting from a received click ID"""
+    value = (value or '').strip(_STRAY)
+    pairs = [pair for pair in map(_wrapper_pair, [wrapper] + _COMMON_WRAPPERS) if pair]
+    unwrapped = True
+    while unwrapped and len(value) > 2:
+        unwrapped = False
+        for opening, closing in pairs:
+            if value[0] == opening and value[-1] == closing:
+                value = value[1:-1].strip(_STRAY)
+                unwrapped = True
+                break
+    return value
+
+
+def click_id_variants(value, wrapper=''):
+    """Canonical click IDs a received value may stand for, most likely first"""
+    variants = []
+    for candidate in (value, unwrap_click_id(value, wrapper)):
+        normalized = normalize_click_id((candidate or '').strip())
+        if normalized and normalized not in variants:
+            variants.append(normalized)
+    return variants
+
+
+def _key_candidates(value):
+    lowered = value.lower()
+    return list(dict.fromkeys([lowered, lowered.translate(_CROCKFORD_FOLD)]))
+
+
+def resolve_click_id(value, network=None):
+    """
+    Return the stored click_id a received value refers to, or None
+
+    Checks the exact variants first, then the prefix index. Returns None
+    when nothing matches or when a prefix matches more than one click.
+    """
+    wrapper = network.click_id_wrapper if network is not None else ''
+    variants = click_id_variants(value, wrapper)
+    if not variants:
+        return None
+
+    found = list(ClickTracking.objects.filter(click_id__in=variants).values_list('click_id', flat=True))
+    if found:
+        return min(found, key=variants.index)
+
+    received = unwrap_click_id(value, wrapper)
+    if not received:
+        return None
+    # A value shorter than the key can only match a click ID of that length
+    candidates = _key_candidates(received)
+    keys = [candidate[:CLICK_KEY_LENGTH] for candidate in candidates]
+    matches = {
+        click_id
+        for click_id in (
+            ClickTracking.objects.alias(click_key=ClickKey('click_id'))
+            .filter(click_key__in=keys)
+            .order_by()
+            .values_list('click_id', flat=True)[:50]
+        )
+        if any(
+            click_id.lower().startswith(candidate) and (len(candidate) >= CLICK_KEY_LENGTH or len(click_id) == len(candidate))
+            for candidate in candidates
+        )
+    }
+    if len(matches) == 1:
+        click_id = matches.pop()
+        logger.info(f"Resolved received click ID {value!r} to {click_id}")
+        return click_id
+    if matches:
+        logger.warning(f"Received click ID {value!r} matches {len(matches)} clicks; not resolving it")
+    return None
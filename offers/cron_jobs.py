@@ -119,9 +119,10 @@ def process_user_payments():
                     notes=f"Auto-generated invoice for balance transfer on {timezone.now().strftime('%Y-%m-%d')} ({payment_date_type})"
                 )
                 
-                # Reset user balance to 0
-                user.balance = Decimal('0.00')
-                user.save()
+                # Move the invoiced amount off the balance; credits that arrived
+                # since the balance was read stay on it
+                user.add_to_balance(-invoice.amount, entry_type='invoice_debit', invoice=invoice,
+                                    description=f'Invoice {invoice.invoice_number}')
                 
                 processed_count += 1
                 total_amount += invoice.amount
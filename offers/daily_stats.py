@@ -0,0 +1,384 @@
+"""
+Daily stats rollup
+
+DailyStat holds, per day, affiliate, offer and subid combination, the
+clicks, approved conversions, rejected conversions and earnings the
+reports show, so a report reads days x offers rows whatever the click
+volume. The rows are kept current without adding queries to the click or
+postback path:
+
+- record_click (offers.click_ingest) counts each click it writes, and the
+  accounting code (offers.accounting) counts each conversion status change
+  once its transaction commits. The counts are added up in memory per
+  process and written to DailyStat by a background thread every
+  DAILY_STATS_FLUSH_INTERVAL seconds (and at exit), one UPDATE per row
+  touched.
+- rebuild_daily_stats() recomputes a date range from ClickTracking and
+  Conversion with two grouped queries per chunk of days. The
+  rebuild_daily_stats command runs it for the last closed days every night,
+  which also repairs counts lost with a process that died, and can backfill
+  the whole history.
+
+Counts still buffered in other processes when a day is rebuilt are added
+on top of it, so the command only rebuilds days that ended at least
+SETTLE_INTERVALS flush intervals ago (see last_settled_date()).
+
+Views that cache figures derived from the stats (offers.dashboard_metrics)
+key them on stats_versions(user_id): a per-affiliate stamp bumped whenever
+new counts for that affiliate are written, plus a global one bumped by a
+rebuild. With the rollup disabled the stamp is bumped as the clicks and
+conversions themselves are written.
+"""
+import atexit
+import datetime
+import logging
+import os
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Count, F, Min, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import ClickTracking, Conversion, DailyStat
+
+logger = logging.getLogger(__name__)
+
+MEASURES = ('clicks', 'conversions', 'rejected', 'earnings')
+
+# Days recomputed per pair of grouped queries by rebuild_daily_stats
+REBUILD_CHUNK_DAYS = 7
+
+# Flush intervals after which no count for a closed day can still be
+# buffered: one for the wait until the next flush, one for the flush itself
+SETTLE_INTERVALS = 2
+
+VERSION_KEY = 'offers:daily_stats:version'
+USER_VERSION_KEY = 'offers:daily_stats:version:{}'
+
+
+def _subids(subid1, subid2, subid3):
+    return (subid1 or '', subid2 or '', subid3 or '')
+
+
+def _date(value):
+    return timezone.localdate(value) if timezone.is_aware(value) else value.date()
+
+
+def _cache():
+    return caches[getattr(settings, 'OFFERS_CACHE_ALIAS', 'default')]
+
+
+def stats_versions(user_id):
+    """Return the (global, per-affiliate) stamps of the stats behind user_id's figures"""
+    cache = _cache()
+    keys = [VERSION_KEY, USER_VERSION_KEY.format(user_id)]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return tuple(versions[key] for key in keys)
+
+
+def bump_stats_versions(user_ids=None):
+    """Mark the stats of user_ids (every affiliate when None) as changed"""
+    # Timestamps rather than incr() for the same reason as the redirect plan
+    # version: a cache restart must not bring an old stamp back
+    stamp = time.time_ns()
+    if user_ids is None:
+        _cache().set(VERSION_KEY, stamp, None)
+    elif user_ids:
+        _cache().set_many({USER_VERSION_KEY.format(user_id): stamp for user_id in user_ids}, None)
+
+
+def conversion_measures(status, payout, sign=1):
+    """DailyStat measures a conversion in this status contributes (sign=-1 takes them back)"""
+    if status == 'approved':
+        return {'conversions': sign, 'earnings': sign * Decimal(payout or 0)}
+    if status == 'rejected':
+        return {'rejected': sign}
+    return {}
+
+
+class DailyStatBuffer:
+    """Per-process DailyStat increments, written every flush_interval seconds"""
+
+    def __init__(self, flush_interval):
+        self.flush_interval = flush_interval
+        self.pid = os.getpid()
+        self._counts = {}
+        self._counts_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='daily-stats-flusher', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def add(self, increments):
+        """Add (key, {measure: amount}) pairs; key is (date, user_id, offer_id, subids)"""
+        with self._counts_lock:
+            for key, measures in increments:
+                totals = self._counts.setdefault(key, dict.fromkeys(MEASURES, 0))
+                for measure, amount in measures.items():
+                    totals[measure] += amount
+
+    def flush(self):
+        """Write the buffered increments to DailyStat; returns the rows touched"""
+        # Only one thread flushes; the others keep counting
+        if not self._flush_lock.acquire(blocking=False):
+            return 0
+        try:
+            with self._counts_lock:
+                counts, self._counts = self._counts, {}
+
+            user_ids = set()
+            for key, measures in counts.items():
+                if not any(measures.values()):
+                    continue
+                try:
+                    _add_to_stat(key, measures)
+                    user_ids.add(key[1])
+                except IntegrityError as e:
+                    # The user or offer was deleted in the meantime
+                    logger.warning(f"Dropping daily stat counts for {key}: {str(e)}")
+            bump_stats_versions(user_ids)
+            return len(counts)
+        finally:
+            self._flush_lock.release()
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                # Counts of a failed flush are lost until the nightly rebuild
+                logger.error(f"Daily stats flush failed: {str(e)}", exc_info=True)
+            finally:
+                close_old_connections()
+
+    def close(self):
+        """Stop the flusher thread and write what is left"""
+        if self._stopped.is_set() or self.pid != os.getpid():
+            return
+        self._stopped.set()
+        self.flush()
+
+    def pending_counts(self):
+        with self._counts_lock:
+            return {key: dict(measures) for key, measures in self._counts.items()}
+
+
+def _add_to_stat(key, measures):
+    date, user_id, offer_id, (subid1, subid2, subid3) = key
+    lookup = {
+        'date': date, 'user_id': user_id, 'offer_id': offer_id,
+        'subid1': subid1, 'subid2': subid2, 'subid3': subid3,
+    }
+    increments = {measure: F(measure) + amount for measure, amount in measures.items() if amount}
+    if DailyStat.objects.filter(**lookup).update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            DailyStat.objects.create(**lookup, **measures)
+    except IntegrityError:
+        # Another process created the row first (or the FK is gone, which
+        # makes this update a no-op and is reported by the caller)
+        if not DailyStat.objects.filter(**lookup).update(**increments):
+            raise
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_daily_stat_buffer():
+    """Return the process-wide buffer, or None when the rollup is not maintained"""
+    global _buffer
+    if not getattr(settings, 'DAILY_STATS_ENABLED', True):
+        return None
+    # A forked child gets a copy of the parent's counts (the parent writes
+    # them) but not its flusher thread, so it starts a buffer of its own
+    if _buffer is None or _buffer.pid != os.getpid():
+        with _buffer_lock:
+            if _buffer is None or _buffer.pid != os.getpid():
+                _buffer = DailyStatBuffer(getattr(settings, 'DAILY_STATS_FLUSH_INTERVAL', 30))
+    return _buffer
+
+
+def reset_daily_stat_buffer():
+    """Drop the process-wide buffer, flushing its counts first"""
+    global _buffer
+    with _buffer_lock:
+        if _buffer is not None:
+            _buffer.close()
+        _buffer = None
+
+
+def flush_daily_stats():
+    buffer = _buffer
+    return buffer.flush() if buffer is not None else 0
+
+
+def count_clicks(clicks):
+    """Count clicks that were just written"""
+    if not clicks:
+        return
+    buffer = get_daily_stat_buffer()
+    if buffer is None:
+        # Reports read the raw tables, which already hold these clicks
+        bump_stats_versions({click.user_id for click in clicks})
+        return
+    buffer.add(
+        ((_date(click.click_date), click.user_id, click.offer_id, _subids(click.subid1, click.subid2, click.subid3)), {'clicks': 1})
+        for click in clicks
+    )
+
+
+def count_conversion_changes(changes):
+    """
+    Count conversion status changes once the current transaction commits
+
+    changes holds (user_id, offer_id, subids, old, new) where old and new
+    are (status, conversion_date, payout), old None for a new conversion.
+    """
+    buffer = get_daily_stat_buffer()
+    if buffer is None:
+        user_ids = {user_id for user_id, offer_id, subids, old, new in changes if old != new}
+        if user_ids:
+            transaction.on_commit(lambda: bump_stats_versions(user_ids))
+        return
+    increments = []
+    for user_id, offer_id, subids, old, new in changes:
+        if old == new:
+            continue
+        for state, sign in ((old, -1), (new, 1)):
+            if state is None:
+                continue
+            status, conversion_date, payout = state
+            measures = conversion_measures(status, payout, sign)
+            if measures:
+                increments.append(((_date(conversion_date), user_id, offer_id, _subids(*subids)), measures))
+    if increments:
+        transaction.on_commit(lambda: buffer.add(increments))
+
+
+def rebuild_daily_stats(start_date, end_date):
+    """
+    Recompute DailyStat for start_date..end_date (inclusive) from the raw tables
+
+    Works in chunks of REBUILD_CHUNK_DAYS days, each replaced in one
+    transaction. Returns the number of rows written.
+    """
+    flush_daily_stats()
+    written = 0
+    chunk_start = start_date
+    while chunk_start <= end_date:
+        chunk_end = min(chunk_start + datetime.timedelta(days=REBUILD_CHUNK_DAYS - 1), end_date)
+        written += _rebuild_chunk(chunk_start, chunk_end)
+        chunk_start = chunk_end + datetime.timedelta(days=1)
+    bump_stats_versions()
+    return written
+
+
+def last_settled_date():
+    """
+    Latest day no process can still hold buffered counts for
+
+    A count reaches DailyStat within SETTLE_INTERVALS flush intervals, so a
+    day is settled once it ended that long ago.
+    """
+    window = datetime.timedelta(seconds=getattr(settings, 'DAILY_STATS_FLUSH_INTERVAL', 30) * SETTLE_INTERVALS)
+    return timezone.localdate(timezone.now() - window) - datetime.timedelta(days=1)
+
+
+def day_bounds(start_date, end_date):
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.datetime.combine(start_date, datetime.time.min), tz)
+    end = timezone.make_aware(datetime.datetime.combine(end_date + datetime.timedelta(days=1), datetime.time.min), tz)
+    return start, end
+
+
+def _rebuild_chunk(start_date, end_date):
+    start, end = day_bounds(start_date, end_date)
+    rows = {}
+
+    def row(date, user_id, offer_id, subid1, subid2, subid3):
+        key = (date, user_id, offer_id, _subids(subid1, subid2, subid3))
+        if key not in rows:
+            rows[key] = dict.fromkeys(MEASURES, 0)
+        return rows[key]
+
+    clicks = (
+        ClickTracking.objects.filter(click_date__gte=start, click_date__lt=end)
+        .annotate(day=TruncDate('click_date'))
+        .order_by()
+        .values_list('day', 'user_id', 'offer_id', 'subid1', 'subid2', 'subid3')
+        .annotate(total=Count('id'))
+    )
+    for day, user_id, offer_id, subid1, subid2, subid3, total in clicks:
+        row(day, user_id, offer_id, subid1, subid2, subid3)['clicks'] = total
+
+    conversions = (
+        Conversion.objects.filter(conversion_date__gte=start, conversion_date__lt=end)
+        .annotate(day=TruncDate('conversion_date'))
+        .order_by()
+        .values_list(
+            'day', 'click_tracking__user_id', 'click_tracking__offer_id',
+            'click_tracking__subid1', 'click_tracking__subid2', 'click_tracking__subid3',
+        )
+        .annotate(
+            approved=Count('id', filter=Q(status='approved')),
+            rejected=Count('id', filter=Q(status='rejected')),
+            earnings=Sum('payout', filter=Q(status='approved')),
+        )
+    )
+    for day, user_id, offer_id, subid1, subid2, subid3, approved, rejected, earnings in conversions:
+        measures = row(day, user_id, offer_id, subid1, subid2, subid3)
+        measures['conversions'] = approved
+        measures['rejected'] = rejected
+        measures['earnings'] = earnings or Decimal('0.00')
+
+    stats = [
+        DailyStat(
+            date=date, user_id=user_id, offer_id=offer_id,
+            subid1=subid1, subid2=subid2, subid3=subid3,
+            **measures
+        )
+        for (date, user_id, offer_id, (subid1, subid2, subid3)), measures in rows.items()
+        if any(measures.values())
+    ]
+    with transaction.atomic():
+        DailyStat.objects.filter(date__gte=start_date, date__lte=end_date).delete()
+        DailyStat.objects.bulk_create(stats, batch_size=1000)
+    return len(stats)
+
+
+def first_activity_date():
+    """Date of the earliest click or conversion, or None when there are none"""
+    dates = [
+        value for value in (
+            ClickTracking.objects.aggregate(first=Min('click_date'))['first'],
+            Conversion.objects.aggregate(first=Min('conversion_date'))['first'],
+        )
+        if value is not None
+    ]
+    return _date(min(dates)) if dates else None
+
+
+def stats_for(user, start_date=None, end_date=None, offer_id=None, subid=None):
+    """DailyStat rows of an affiliate, narrowed by the usual report filters"""
+    stats = DailyStat.objects.filter(user=user)
+    if start_date:
+        stats = stats.filter(date__gte=start_date)
+    if end_date:
+        stats = stats.filter(date__lte=end_date)
+    if offer_id:
+        stats = stats.filter(offer_id=offer_id)
+    if subid:
+        stats = stats.filter(Q(subid1=subid) | Q(subid2=subid) | Q(subid3=subid))
+    return stats.order_by()
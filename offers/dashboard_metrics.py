@@ -0,0 +1,134 @@
+"""
+Dashboard metrics
+
+dashboard_metrics() returns an affiliate's totals and the day-by-day chart
+series for a date range, every day present (days without activity are
+zero-filled). The figures come from the DailyStat rollup in one grouped
+query, or, with DAILY_STATS_ENABLED = False, from one grouped clicks query
+and one grouped conversions query, so the cost does not depend on the
+length of the range.
+
+Results are cached in the OFFERS_CACHE_ALIAS cache per (user, range) for
+DASHBOARD_METRICS_TIMEOUT seconds. The key carries the affiliate's stats
+version (see offers.daily_stats.stats_versions), which moves when new
+clicks or conversions for that affiliate are counted, so a cached result
+is never served once the affiliate has new activity.
+"""
+import datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+
+from .daily_stats import day_bounds, stats_for, stats_versions
+from .models import ClickTracking, Conversion
+from .reports import use_rollup
+
+# Part of the cache key so results cached in an older shape are never read
+METRICS_FORMAT = 1
+
+
+def _cache():
+    return caches[getattr(settings, 'OFFERS_CACHE_ALIAS', 'default')]
+
+
+def _daily_rows(user, start_date, end_date):
+    """{date: {'clicks', 'conversions', 'earnings'}} for the days with any activity"""
+    if use_rollup():
+        rows = stats_for(user, start_date, end_date).values('date').annotate(
+            day_clicks=Sum('clicks'), day_conversions=Sum('conversions'), day_earnings=Sum('earnings'),
+        )
+        return {
+            row['date']: {
+                'clicks': row['day_clicks'] or 0,
+                'conversions': row['day_conversions'] or 0,
+                'earnings': row['day_earnings'] or Decimal('0.00'),
+            }
+            for row in rows
+        }
+
+    start, end = day_bounds(start_date, end_date)
+    days = {}
+
+    def day(date):
+        return days.setdefault(date, {'clicks': 0, 'conversions': 0, 'earnings': Decimal('0.00')})
+
+    clicks = (
+        ClickTracking.objects.filter(user=user, click_date__gte=start, click_date__lt=end)
+        .annotate(day=TruncDate('click_date'))
+        .order_by()
+        .values_list('day')
+        .annotate(total=Count('id'))
+    )
+    for date, total in clicks:
+        day(date)['clicks'] = total
+
+    conversions = (
+        Conversion.objects.filter(
+            click_tracking__user=user, conversion_date__gte=start, conversion_date__lt=end,
+        )
+        .annotate(day=TruncDate('conversion_date'))
+        .order_by()
+        .values_list('day')
+        .annotate(
+            approved=Count('id', filter=Q(status='approved')),
+            earnings=Sum('payout', filter=Q(status='approved')),
+        )
+    )
+    for date, approved, earnings in conversions:
+        measures = day(date)
+        measures['conversions'] = approved
+        measures['earnings'] = earnings or Decimal('0.00')
+    return days
+
+
+def build_dashboard_metrics(user, start_date, end_date):
+    """Compute dashboard_metrics() straight from the database"""
+    days = _daily_rows(user, start_date, end_date)
+    series = []
+    current_date = start_date
+    while current_date <= end_date:
+        measures = days.get(current_date, {})
+        series.append({
+            'date': current_date,
+            'clicks': measures.get('clicks', 0),
+            'conversions': measures.get('conversions', 0),
+            'earnings': measures.get('earnings', Decimal('0.00')),
+        })
+        current_date += datetime.timedelta(days=1)
+
+    clicks = sum(day['clicks'] for day in series)
+    conversions = sum(day['conversions'] for day in series)
+    earnings = sum((day['earnings'] for day in series), Decimal('0.00'))
+    return {
+        'clicks': clicks,
+        'conversions': conversions,
+        'earnings': earnings,
+        'conversion_rate': conversions * 100 / clicks if clicks else 0.0,
+        'epc': earnings / clicks if clicks else Decimal('0.00'),
+        'series': series,
+    }
+
+
+def dashboard_metrics(user, start_date, end_date):
+    """
+    Totals and per-day series of an affiliate for start_date..end_date (inclusive)
+
+    Returns clicks, conversions, earnings, conversion_rate, epc and series,
+    a list of {'date', 'clicks', 'conversions', 'earnings'} per day, oldest
+    first.
+    """
+    global_version, user_version = stats_versions(user.pk)
+    source = 'rollup' if use_rollup() else 'raw'
+    cache_key = (
+        f'offers:dashboard_metrics:{METRICS_FORMAT}:{source}:{global_version}:{user_version}:'
+        f'{user.pk}:{start_date.isoformat()}:{end_date.isoformat()}'
+    )
+    cache = _cache()
+    metrics = cache.get(cache_key)
+    if metrics is None:
+        metrics = build_dashboard_metrics(user, start_date, end_date)
+        cache.set(cache_key, metrics, getattr(settings, 'DASHBOARD_METRICS_TIMEOUT', 300))
+    return metrics
@@ -0,0 +1,228 @@
+"""
+Background geo enrichment for click tracking
+
+track_click writes the ClickTracking row, queues a ClickEnrichmentJob and
+redirects straight away. The process_click_enrichment management command
+drains the queue, looks the visitor IP up and fills in the location fields.
+When the configured geo resolver is local (see offers.geo) the lookup is
+cheap enough to do inline and no job is queued at all.
+
+The queue is bounded: once more than CLICK_ENRICHMENT_MAX_PENDING jobs are
+waiting, new clicks are not queued (they keep empty geo fields) so a slow or
+unreachable geo provider can never grow the table without limit.
+
+Each batch is claimed (status 'running') before its lookups start, so
+drainers running at the same time never process the same job. Jobs of a
+drainer that died mid-batch are claimed again once
+CLICK_ENRICHMENT_CLAIM_TIMEOUT seconds have passed.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .geo import get_geo_resolver
+from .models import ClickTracking, ClickEnrichmentJob
+
+logger = logging.getLogger(__name__)
+
+# Location values used for clicks coming from the local development server
+DEVELOPMENT_GEO = {
+    'country': 'Development',
+    'city': 'Localhost',
+    'region': 'Development Environment',
+    'timezone': 'UTC',
+    'organization': 'Development Server',
+}
+
+# How long a pending-count reading is reused before the queue is counted again
+BACKLOG_CHECK_INTERVAL = 5.0
+
+_metrics_lock = threading.Lock()
+_metrics = {
+    'enqueued': 0,
+    'dropped': 0,
+    'processed': 0,
+    'failed': 0,
+}
+_backlog = {'pending': 0, 'checked_at': 0.0}
+
+
+def _increment(name, amount=1):
+    with _metrics_lock:
+        _metrics[name] += amount
+
+
+def get_max_pending():
+    return getattr(settings, 'CLICK_ENRICHMENT_MAX_PENDING', 50000)
+
+
+def get_max_attempts():
+    return getattr(settings, 'CLICK_ENRICHMENT_MAX_ATTEMPTS', 3)
+
+
+def is_development_ip(ip_address):
+    """Return True for the loopback address used by the dev server"""
+    return ip_address == '127.0.0.1'
+
+
+def _pending_backlog():
+    """Return the pending job count, re-counting at most every few seconds"""
+    now = time.monotonic()
+    if now - _backlog['checked_at'] >= BACKLOG_CHECK_INTERVAL:
+        _backlog['pending'] = ClickEnrichmentJob.objects.filter(status__in=['pending', 'running']).count()
+        _backlog['checked_at'] = now
+    return _backlog['pending']
+
+
+def enqueue_click_enrichment(clicks):
+    """
+    Queue geo lookups for freshly created clicks
+
+    Accepts a single ClickTracking or an iterable of them. Clicks without an
+    IP, or from the dev server, are skipped. Returns the number of jobs queued.
+    """
+    if isinstance(clicks, ClickTracking):
+        clicks = [clicks]
+
+    jobs = [
+        ClickEnrichmentJob(click_tracking_id=click.pk, ip_address=click.ip_address)
+        for click in clicks
+        if click.ip_address and not is_development_ip(click.ip_address)
+    ]
+    if not jobs:
+        return 0
+
+    if _pending_backlog() >= get_max_pending():
+        _increment('dropped', len(jobs))
+        logger.warning(f"Click enrichment backlog full, dropping {len(jobs)} job(s)")
+        return 0
+
+    ClickEnrichmentJob.objects.bulk_create(jobs)
+    _backlog['pending'] += len(jobs)
+    _increment('enqueued', len(jobs))
+    return len(jobs)
+
+
+def resolve_inline(ip_address):
+    """
+    Return location fields to store with a new click, or None
+
+    Returns development values for the dev server and the resolved fields
+    when the geo resolver is local. None means the click has to go through
+    the enrichment queue.
+    """
+    if is_development_ip(ip_address):
+        return dict(DEVELOPMENT_GEO)
+    resolver = get_geo_resolver()
+    if ip_address and resolver.is_local:
+        return resolver.resolve(ip_address) or {}
+    return None
+
+
+def claim_enrichment_jobs(batch_size):
+    """Mark up to batch_size waiting jobs as running and return them"""
+    now = timezone.now()
+    stale = now - timedelta(seconds=getattr(settings, 'CLICK_ENRICHMENT_CLAIM_TIMEOUT', 300))
+    claimable = Q(status='pending') | Q(status='running', claimed_at__lt=stale)
+    with transaction.atomic():
+        ids = list(
+            ClickEnrichmentJob.objects
+            .filter(claimable)
+            .order_by('created_at')
+            .select_for_update(skip_locked=True)
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return []
+        # Re-checked in the UPDATE for databases without row locks
+        ClickEnrichmentJob.objects.filter(claimable, pk__in=ids).update(status='running', claimed_at=now)
+    return list(
+        ClickEnrichmentJob.objects.filter(pk__in=ids, status='running', claimed_at=now).order_by('created_at')
+    )
+
+
+def _lookup(job):
+    """Resolve one job's IP; runs in a worker thread and never touches the DB"""
+    try:
+        return job, get_geo_resolver().resolve(job.ip_address), None
+    except Exception as e:
+        return job, None, str(e)
+
+
+def process_enrichment_jobs(batch_size=None, workers=4):
+    """
+    Process one batch of pending enrichment jobs
+
+    The batch is claimed first, then its lookups run concurrently in a
+    thread pool; the database writes happen on the calling thread. Returns a
+    dict with the processed, retried and failed counts for the batch.
+    """
+    if batch_size is None:
+        batch_size = getattr(settings, 'CLICK_ENRICHMENT_BATCH_SIZE', 100)
+
+    jobs = claim_enrichment_jobs(batch_size)
+    result = {'processed': 0, 'retried': 0, 'failed': 0}
+    if not jobs:
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        lookups = list(executor.map(_lookup, jobs))
+
+    done_ids = []
+    for job, fields, error in lookups:
+        if error is None:
+            if fields:
+                ClickTracking.objects.filter(pk=job.click_tracking_id).update(**fields)
+            done_ids.append(job.pk)
+            result['processed'] += 1
+            continue
+
+        job.attempts += 1
+        job.last_error = error
+        job.claimed_at = None
+        if job.attempts >= get_max_attempts():
+            job.status = 'failed'
+            result['failed'] += 1
+            logger.error(f"Giving up on geo lookup for click {job.click_tracking_id}: {error}")
+        else:
+            job.status = 'pending'
+            result['retried'] += 1
+        job.save(update_fields=['attempts', 'last_error', 'status', 'claimed_at'])
+
+    if done_ids:
+        ClickEnrichmentJob.objects.filter(pk__in=done_ids).delete()
+
+    _increment('processed', result['processed'])
+    _increment('failed', result['failed'])
+    return result
+
+
+def get_enrichment_metrics():
+    """
+    Return queue depth and throughput counters for the enrichment pipeline
+
+    pending and oldest_pending_seconds describe the shared queue; the other
+    counters are local to this process.
+    """
+    pending = ClickEnrichmentJob.objects.filter(status='pending')
+    oldest = pending.order_by('created_at').values_list('created_at', flat=True).first()
+
+    with _metrics_lock:
+        metrics = dict(_metrics)
+
+    metrics.update({
+        'resolver': get_geo_resolver().stats(),
+        'pending': pending.count(),
+        'running': ClickEnrichmentJob.objects.filter(status='running').count(),
+        'failed_jobs': ClickEnrichmentJob.objects.filter(status='failed').count(),
+        'oldest_pending_seconds': (timezone.now() - oldest).total_seconds() if oldest else 0.0,
+        'max_pending': get_max_pending(),
+    })
+    return metrics
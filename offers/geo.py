@@ -0,0 +1,309 @@
+"""
+IP geolocation for click tracking
+
+Every backend implements GeoResolver.resolve(), which returns a dict of
+ClickTracking location fields (country, city, region, ...) or None.
+
+- IPInfoResolver asks ipinfo.io over HTTP (one round trip per lookup).
+- RangeDatabaseResolver reads a local range database built with the
+  build_geoip_database command. The file is memory-mapped and searched with
+  a binary search, so a lookup costs microseconds and no network.
+- CachedGeoResolver wraps either one with a bounded LRU/TTL cache keyed by
+  IP (or by /24 and /48 prefix) and keeps hit/miss counters.
+
+get_geo_resolver() returns the process-wide resolver configured in settings.
+"""
+import ipaddress
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Range database layout:
+#   header  - magic, record count, offset of the location table
+#   records - (start, end, location index) sorted by start; addresses are
+#             16-byte big-endian integers, IPv4 stored as ::ffff:a.b.c.d
+#   table   - JSON list of location dicts referenced by index
+DATABASE_MAGIC = b'CPAGEO01'
+HEADER = struct.Struct('>8sIQ')
+RECORD = struct.Struct('>16s16sI')
+
+
+def _address_key(ip_address):
+    """Return the 16-byte sort key of an IPv4 or IPv6 address"""
+    address = ipaddress.ip_address(ip_address)
+    if address.version == 4:
+        return b'\x00' * 10 + b'\xff\xff' + address.packed
+    return address.packed
+
+
+class GeoResolver:
+    """Base class for geo backends"""
+
+    # True when resolve() never leaves the process, so it is cheap enough to
+    # call on the redirect path
+    is_local = False
+
+    def resolve(self, ip_address):
+        """Return a dict of ClickTracking location fields, or None"""
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+
+class IPInfoResolver(GeoResolver):
+    """Look IPs up on ipinfo.io"""
+
+    def __init__(self, timeout=5):
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def resolve(self, ip_address):
+        """
+        Network errors are raised so the enrichment queue can retry later;
+        a non-200 answer is treated as "no data".
+        """
+        response = self.session.get(f'https://ipinfo.io/{ip_address}/json', timeout=self.timeout)
+        if response.status_code != 200:
+            logger.warning(f"Failed to fetch IP info for {ip_address}: HTTP {response.status_code}")
+            return None
+
+        data = response.json()
+        fields = {
+            'country': data.get('country', ''),
+            'city': data.get('city', ''),
+            'region': data.get('region', ''),
+            'timezone': data.get('timezone', ''),
+            'postal_code': data.get('postal', ''),
+            'organization': data.get('org', ''),
+        }
+
+        # Parse location coordinates
+        if data.get('loc'):
+            try:
+                lat, lon = data['loc'].split(',')
+                fields['latitude'] = round(float(lat.strip()), 6)
+                fields['longitude'] = round(float(lon.strip()), 6)
+            except (ValueError, AttributeError):
+                pass
+
+        return fields
+
+
+class RangeDatabaseResolver(GeoResolver):
+    """Binary search over a memory-mapped range database"""
+
+    is_local = True
+
+    def __init__(self, path):
+        self.path = str(path)
+        with open(self.path, 'rb') as handle:
+            self._mmap = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.record_count, table_offset = HEADER.unpack_from(self._mmap, 0)
+        if magic != DATABASE_MAGIC:
+            raise ValueError(f"{self.path} is not a geo range database")
+
+        self._locations = json.loads(self._mmap[table_offset:].decode('utf-8'))
+
+    def _record(self, index):
+        return RECORD.unpack_from(self._mmap, HEADER.size + index * RECORD.size)
+
+    def resolve(self, ip_address):
+        try:
+            key = _address_key(ip_address)
+        except ValueError:
+            return None
+
+        # Find the last range starting at or before the address
+        low, high = 0, self.record_count
+        while low < high:
+            middle = (low + high) // 2
+            start = self._mmap[HEADER.size + middle * RECORD.size:HEADER.size + middle * RECORD.size + 16]
+            if start <= key:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low == 0:
+            return None
+        start, end, location = self._record(low - 1)
+        if key > end:
+            return None
+        return dict(self._locations[location])
+
+    def stats(self):
+        return {'ranges': self.record_count, 'locations': len(self._locations)}
+
+
+class CachedGeoResolver(GeoResolver):
+    """
+    Bounded LRU/TTL cache in front of another resolver
+
+    With by_prefix=True, IPv4 addresses are cached per /24 and IPv6 per /48,
+    which is plenty for country/city data and makes the cache far more
+    effective for visitors behind carrier NAT. Misses (None) are cached too.
+    """
+
+    def __init__(self, backend, max_entries=10000, ttl=3600, by_prefix=False):
+        self.backend = backend
+        self.is_local = backend.is_local
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.by_prefix = by_prefix
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cache_key(self, ip_address):
+        if not self.by_prefix:
+            return ip_address
+        if ':' not in ip_address:
+            # Cheap /24 key for dotted IPv4 without building network objects
+            return ip_address.rpartition('.')[0] + '.0/24'
+        try:
+            address = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return ip_address
+        prefix = 24 if address.version == 4 else 48
+        return str(ipaddress.ip_network(f'{address}/{prefix}', strict=False))
+
+    def resolve(self, ip_address):
+        key = self._cache_key(ip_address)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return dict(entry[1]) if entry[1] is not None else None
+            self.misses += 1
+
+        # Resolve outside the lock so a slow backend does not serialise lookups
+        fields = self.backend.resolve(ip_address)
+
+        with self._lock:
+            self._entries[key] = (now + self.ttl, fields)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        return dict(fields) if fields is not None else None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits / lookups * 100) if lookups else 0.0,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+            }
+        stats.update(self.backend.stats())
+        return stats
+
+
+def build_range_database(rows, path):
+    """
+    Write a range database from (start_ip, end_ip, location_dict) rows
+
+    Rows may be in any order and may mix IPv4 and IPv6. Identical location
+    dicts are stored once. The file is written to a temporary name and moved
+    into place so running resolvers never see a half-written file.
+    Returns the number of ranges written.
+    """
+    locations = []
+    location_index = {}
+    records = []
+
+    for start_ip, end_ip, location in rows:
+        start_key = _address_key(start_ip)
+        end_key = _address_key(end_ip)
+        if end_key < start_key:
+            raise ValueError(f"Range {start_ip} - {end_ip} ends before it starts")
+
+        marker = json.dumps(location, sort_keys=True)
+        if marker not in location_index:
+            location_index[marker] = len(locations)
+            locations.append(location)
+        records.append((start_key, end_key, location_index[marker]))
+
+    records.sort()
+    for previous, current in zip(records, records[1:]):
+        if current[0] <= previous[1]:
+            raise ValueError("Ranges in a geo database must not overlap")
+
+    table = json.dumps(locations, separators=(',', ':')).encode('utf-8')
+    table_offset = HEADER.size + len(records) * RECORD.size
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.geoip-')
+    try:
+        with os.fdopen(fd, 'wb') as handle:
+            handle.write(HEADER.pack(DATABASE_MAGIC, len(records), table_offset))
+            for record in records:
+                handle.write(RECORD.pack(*record))
+            handle.write(table)
+        os.replace(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+    return len(records)
+
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+
+def get_geo_resolver():
+    """
+    Return the configured resolver, creating it on first use
+
+    GEOIP_BACKEND selects 'ipinfo' (default) or 'local'; the local backend
+    reads GEOIP_DATABASE_PATH. Both are wrapped in a CachedGeoResolver sized
+    by GEOIP_CACHE_SIZE / GEOIP_CACHE_TTL / GEOIP_CACHE_BY_PREFIX.
+    """
+    global _resolver
+    if _resolver is None:
+        with _resolver_lock:
+            if _resolver is None:
+                backend_name = getattr(settings, 'GEOIP_BACKEND', 'ipinfo')
+                if backend_name == 'local':
+                    backend = RangeDatabaseResolver(settings.GEOIP_DATABASE_PATH)
+                else:
+                    backend = IPInfoResolver()
+                _resolver = CachedGeoResolver(
+                    backend,
+                    max_entries=getattr(settings, 'GEOIP_CACHE_SIZE', 10000),
+                    ttl=getattr(settings, 'GEOIP_CACHE_TTL', 3600),
+                    by_prefix=getattr(settings, 'GEOIP_CACHE_BY_PREFIX', False),
+                )
+    return _resolver
+
+
+def reset_geo_resolver():
+    """Drop the process-wide resolver (e.g. after rebuilding the database)"""
+    global _resolver
+    with _resolver_lock:
+        _resolver = None
@@ -0,0 +1,72 @@
+"""
+Balance ledger reconciliation
+
+Every change made through User.add_to_balance() writes a BalanceLedger
+entry in the same transaction as the balance UPDATE, so for each user
+balance == SUM(ledger amounts). Anything that writes User.balance some
+other way (an edit in the admin, a raw SQL fix, a full save of a stale
+User instance) breaks that equality; reconcile_balances() finds those users
+and, when asked to, books the difference as an 'adjustment' entry so the
+ledger explains the balance again.
+"""
+import logging
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Sum
+
+from user.models import User
+
+from .models import BalanceLedger
+
+logger = logging.getLogger(__name__)
+
+Mismatch = namedtuple('Mismatch', ['user_id', 'email', 'balance', 'ledger_total'])
+
+
+def find_mismatches():
+    """Return a Mismatch for every user whose balance differs from their ledger total"""
+    totals = dict(
+        BalanceLedger.objects.order_by().values_list('user_id').annotate(total=Sum('amount'))
+    )
+    mismatches = []
+    for user_id, email, balance in User.objects.values_list('id', 'email', 'balance').iterator():
+        ledger_total = totals.get(user_id) or Decimal('0.00')
+        if balance != ledger_total:
+            mismatches.append(Mismatch(user_id, email, balance, ledger_total))
+    return mismatches
+
+
+def reconcile_balances(fix=False):
+    """
+    Compare every balance with its ledger total
+
+    With fix=True each difference is recorded as an 'adjustment' entry,
+    taking the current balance as correct. Returns the mismatches found.
+    """
+    mismatches = find_mismatches()
+    for mismatch in mismatches:
+        logger.error(
+            f"Balance mismatch for user {mismatch.user_id}: balance {mismatch.balance}, "
+            f"ledger total {mismatch.ledger_total}"
+        )
+        if fix:
+            _book_difference(mismatch.user_id)
+    return mismatches
+
+
+def _book_difference(user_id):
+    # Re-read under a row lock so a credit landing meanwhile is not booked twice
+    with transaction.atomic():
+        balance = User.objects.select_for_update().values_list('balance', flat=True).get(pk=user_id)
+        ledger_total = BalanceLedger.objects.filter(user_id=user_id).aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
+        difference = balance - ledger_total
+        if difference:
+            BalanceLedger.objects.create(
+                user_id=user_id,
+                entry_type='adjustment',
+                amount=difference,
+                description='Reconciliation adjustment',
+            )
+            logger.warning(f"Booked reconciliation adjustment of {difference} for user {user_id}")
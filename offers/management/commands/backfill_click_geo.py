@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand, CommandError
+import time
+from offers.geo import get_geo_resolver
+from offers.models import ClickTracking
+
+# Location fields written by the backfill
+GEO_FIELDS = [
+    'country', 'city', 'region', 'timezone', 'postal_code', 'organization', 'latitude', 'longitude'
+]
+
+class Command(BaseCommand):
+    help = 'Fill in missing click geo data from the local geo database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Clicks updated per bulk_update',
+        )
+
+    def handle(self, *args, **options):
+        resolver = get_geo_resolver()
+        if not resolver.is_local:
+            raise CommandError('Backfill needs GEOIP_BACKEND = "local"; the HTTP backend would make one request per click')
+
+        started = time.monotonic()
+        batch_size = options['batch_size']
+        updated = 0
+        last_id = 0
+
+        while True:
+            clicks = list(
+                ClickTracking.objects.filter(
+                    id__gt=last_id,
+                    country__isnull=True,
+                    ip_address__isnull=False,
+                ).order_by('id').only('id', 'ip_address')[:batch_size]
+            )
+            if not clicks:
+                break
+            last_id = clicks[-1].id
+
+            changed = []
+            for click in clicks:
+                fields = resolver.resolve(click.ip_address)
+                if not fields:
+                    continue
+                # Set every field so bulk_update never loads a deferred one
+                for name in GEO_FIELDS:
+                    setattr(click, name, fields.get(name))
+                changed.append(click)
+
+            if changed:
+                ClickTracking.objects.bulk_update(changed, GEO_FIELDS)
+                updated += len(changed)
+
+        stats = resolver.stats()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Backfilled {updated} click(s) in {time.monotonic() - started:.1f}s '
+                f'(cache hit rate {stats.get("hit_rate", 0.0):.1f}%)'
+            )
+        )
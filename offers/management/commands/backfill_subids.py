@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+import time
+from offers.models import ClickTracking
+from offers.subids import SLOTS, resolve_subids
+
+# Reference fields written by the backfill
+REF_FIELDS = [f'subid{slot}_ref' for slot in SLOTS]
+
+class Command(BaseCommand):
+    help = 'Create SubId rows for clicks recorded before the subid dimension and link the clicks to them'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Clicks updated per bulk_update',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        batch_size = options['batch_size']
+        unlinked = Q()
+        for slot in SLOTS:
+            unlinked |= Q(**{f'subid{slot}__gt': '', f'subid{slot}_ref__isnull': True})
+        updated = 0
+        last_id = 0
+
+        while True:
+            # Oldest first, so first_seen is the subid's first click
+            clicks = list(
+                ClickTracking.objects.filter(unlinked, id__gt=last_id)
+                .order_by('id')
+                .only('id', 'user_id', 'click_date', 'subid1', 'subid2', 'subid3', *REF_FIELDS)[:batch_size]
+            )
+            if not clicks:
+                break
+            last_id = clicks[-1].id
+
+            resolve_subids(clicks, use_cache=False)
+            ClickTracking.objects.bulk_update(clicks, REF_FIELDS)
+            updated += len(clicks)
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Linked {updated} click(s) to their subids in {time.monotonic() - started:.1f}s')
+        )
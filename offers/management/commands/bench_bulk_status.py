@@ -0,0 +1,115 @@
+from django.core.management.base import BaseCommand
+from decimal import Decimal
+from django.db import connection
+import time
+from offers.accounting import run_status_job
+from offers.benchmarks import isolated_database, create_fixture
+from offers.ledger import find_mismatches
+from offers.models import (
+    ClickTracking, Conversion, ConversionStatusJob, Notification, Referral, ReferralEarning, ReferralLink,
+    SiteSettings, generate_click_id,
+)
+from user.models import User
+
+class Command(BaseCommand):
+    help = 'Compare rejecting conversions one save() at a time with the bulk status engine'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--conversions',
+            type=int,
+            default=2000,
+            help='Approved conversions rejected per method',
+        )
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=20,
+            help='Affiliates the conversions are spread over; all were referred by one extra user',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Conversions per transaction for the bulk engine',
+        )
+
+    def handle(self, *args, **options):
+        count = options['conversions']
+
+        with isolated_database():
+            SiteSettings.objects.create(referral_percentage=Decimal('10.00'))
+            network, users, offers = create_fixture(users=options['users'])
+            offer = offers[0]
+            referrer = User.objects.create_user(email='referrer@example.com', password=None, full_name='Referrer')
+            link = ReferralLink.objects.create(user=referrer, referral_code='BENCHREF')
+            for user in users:
+                Referral.objects.create(referrer=referrer, referred_user=user, referral_link=link)
+
+            def make_conversions():
+                clicks = ClickTracking.objects.bulk_create([
+                    ClickTracking(
+                        user=users[i % len(users)],
+                        offer=offer,
+                        click_id=generate_click_id(users[i % len(users)].id, offer.id),
+                    )
+                    for i in range(count)
+                ])
+                conversions = []
+                for click in clicks:
+                    conversion = Conversion(click_tracking=click, payout=Decimal('1.00'), status='approved')
+                    conversion.save()
+                    conversions.append(conversion)
+                return conversions
+
+            conversions = make_conversions()
+            queries = [0]
+            started = time.perf_counter()
+            with connection.execute_wrapper(self._counter(queries)):
+                for conversion in conversions:
+                    conversion.status = 'rejected'
+                    conversion.save()
+            self._report('save() per row', count, time.perf_counter() - started, queries[0])
+
+            conversions = make_conversions()
+            job = ConversionStatusJob.objects.create(
+                new_status='rejected',
+                conversion_ids=[conversion.pk for conversion in conversions],
+                total=len(conversions),
+            )
+            queries = [0]
+            started = time.perf_counter()
+            with connection.execute_wrapper(self._counter(queries)):
+                job = run_status_job(
+                    job,
+                    chunk_size=options['chunk_size'],
+                    progress=lambda job: self.stdout.write(f'  {job.progress}% ({job.processed}/{job.total})'),
+                )
+            self._report('bulk engine', count, time.perf_counter() - started, queries[0])
+
+            approved = Conversion.objects.filter(status='approved').count()
+            notifications = Notification.objects.filter(notification_type='lead_rejected').count()
+            self.stdout.write(
+                f'Job {job.status}: {job.changed} changed; {approved} still approved, '
+                f'{ReferralEarning.objects.count()} referral earnings left, {notifications} rejection notices'
+            )
+            balances = sum(User.objects.values_list('balance', flat=True))
+            mismatches = find_mismatches()
+            self.stdout.write(f'Total balance ${balances}, {len(mismatches)} user(s) out of balance with the ledger')
+
+            if job.status != 'done' or approved or balances or mismatches:
+                self.stdout.write(self.style.ERROR('Bulk rejection left balances inconsistent'))
+            else:
+                self.stdout.write(self.style.SUCCESS('Balances and ledger agree'))
+
+    def _counter(self, queries):
+        def count_query(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+        return count_query
+
+    def _report(self, label, count, elapsed, queries):
+        self.stdout.write(
+            f'{label}: {count} rejections in {elapsed:.2f}s ({count / elapsed:.0f}/s), '
+            f'{queries} queries ({queries / count:.2f} per conversion)'
+        )
@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand
+from django.db import connections
+import multiprocessing
+import time
+from offers.benchmarks import isolated_database
+from offers.click_ids import get_click_id_generator, decode_click_id
+
+def _generate(args):
+    """Worker process: issue IDs for one tracking link as fast as possible"""
+    count, user_id, offer_id = args
+    generator = get_click_id_generator()
+    started = time.perf_counter()
+    ids = [generator.next_id(user_id, offer_id) for _ in range(count)]
+    return ids, time.perf_counter() - started
+
+class Command(BaseCommand):
+    help = 'Measure click ID generation rate and check for collisions across processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=8,
+            help='Concurrent generator processes',
+        )
+        parser.add_argument(
+            '--ids',
+            type=int,
+            default=100000,
+            help='IDs generated per process',
+        )
+
+    def handle(self, *args, **options):
+        processes = options['processes']
+        count = options['ids']
+        # Every process uses the same link: the worst case for collisions
+        user_id, offer_id = 123, 456
+
+        context = multiprocessing.get_context('fork')
+        # Worker ids are leased from the database, so the processes need one
+        with isolated_database():
+            # Children open their own connections rather than sharing ours
+            connections.close_all()
+            started = time.perf_counter()
+            with context.Pool(processes) as pool:
+                results = pool.map(_generate, [(count, user_id, offer_id)] * processes)
+            wall_seconds = time.perf_counter() - started
+
+        all_ids = []
+        per_process = []
+        for ids, seconds in results:
+            all_ids.extend(ids)
+            per_process.append(len(ids) / seconds)
+
+        collisions = len(all_ids) - len(set(all_ids))
+        workers = {decode_click_id(ids[0]).worker_id for ids, seconds in results}
+        wrong_route = sum(
+            1 for click_id in all_ids[::max(1, count // 100)]
+            if decode_click_id(click_id)[3:] != (user_id, offer_id)
+        )
+
+        self.stdout.write(f'{len(all_ids)} IDs from {processes} process(es) (worker ids: {len(workers)} distinct)')
+        self.stdout.write(f'Per process: {min(per_process):,.0f} - {max(per_process):,.0f} IDs/sec')
+        self.stdout.write(f'Aggregate:   {len(all_ids) / wall_seconds:,.0f} IDs/sec (including process start-up)')
+        if collisions or wrong_route:
+            self.stdout.write(self.style.ERROR(f'{collisions} collision(s), {wrong_route} ID(s) decoded to the wrong link'))
+        else:
+            self.stdout.write(self.style.SUCCESS('No collisions; sampled IDs decode to the right user/offer'))
@@ -0,0 +1,96 @@
+from django.core.management.base import BaseCommand
+from concurrent.futures import ThreadPoolExecutor
+from django.db import close_old_connections
+import shutil
+import tempfile
+import time
+from offers.benchmarks import isolated_database, create_fixture
+from offers.click_ingest import ClickIngestWriter
+from offers.models import ClickTracking
+
+class Command(BaseCommand):
+    help = 'Measure click inserts per second for direct and batched ingest'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--clicks',
+            type=int,
+            default=5000,
+            help='Clicks written per mode',
+        )
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=4,
+            help='Concurrent writer threads',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='Rows per bulk_create in batched mode',
+        )
+        parser.add_argument(
+            '--flush-ms',
+            type=int,
+            default=500,
+            help='Flush interval in batched mode',
+        )
+
+    def handle(self, *args, **options):
+        count = options['clicks']
+        threads = options['threads']
+
+        with isolated_database():
+            network, users, offers = create_fixture()
+
+            def make_click(prefix, i):
+                # Resolved geo fields so no enrichment job is queued
+                return ClickTracking(
+                    user=users[i % len(users)],
+                    offer=offers[i % len(offers)],
+                    click_id=f'{prefix}-{i}',
+                    ip_address=f'203.0.113.{i % 250 + 1}',
+                    user_agent='bench',
+                    country='US',
+                )
+
+            def run(write):
+                def worker(indexes):
+                    for i in indexes:
+                        write(i)
+                    close_old_connections()
+
+                chunks = [range(start, count, threads) for start in range(threads)]
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=threads) as pool:
+                    list(pool.map(worker, chunks))
+                return started
+
+            started = run(lambda i: make_click('direct', i).save(force_insert=True))
+            direct_seconds = time.perf_counter() - started
+
+            spool_dir = tempfile.mkdtemp(prefix='cpa-spool-')
+            try:
+                writer = ClickIngestWriter(
+                    spool_dir,
+                    batch_size=options['batch_size'],
+                    flush_ms=options['flush_ms'],
+                )
+                started = run(lambda i: writer.submit(make_click('batched', i)))
+                accepted_seconds = time.perf_counter() - started
+                writer.close()
+                batched_seconds = time.perf_counter() - started
+            finally:
+                shutil.rmtree(spool_dir, ignore_errors=True)
+
+            written = ClickTracking.objects.filter(click_id__startswith='batched-').count()
+
+        self.stdout.write(f'{count} clicks, {threads} thread(s)')
+        self.stdout.write(f'Direct:  {count / direct_seconds:10.0f} clicks/sec')
+        self.stdout.write(
+            f'Batched: {count / batched_seconds:10.0f} clicks/sec written '
+            f'({count / accepted_seconds:.0f} clicks/sec accepted)'
+        )
+        if written != count:
+            self.stdout.write(self.style.ERROR(f'Batched mode wrote {written} of {count} clicks'))
@@ -0,0 +1,160 @@
+from django.core.management.base import BaseCommand
+from collections import Counter
+from contextlib import ExitStack
+from decimal import Decimal
+from django.test.utils import override_settings
+import random
+import time
+from offers.accounting import change_conversion_statuses
+from offers.benchmarks import isolated_database, create_fixture, stub_http_server
+from offers.models import AffiliatePostback, ClickTracking, Conversion, OutboundPostback, OutboundPostbackDeadLetter, generate_click_id
+from offers.outbound_postbacks import OutboundPostbackSender, deliver_outbound_batch
+
+class Command(BaseCommand):
+    help = "Approve conversions and relay their postbacks to local stub trackers, checking retries and per-host rates"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--conversions',
+            type=int,
+            default=1000,
+            help='Conversions approved',
+        )
+        parser.add_argument(
+            '--hosts',
+            type=int,
+            default=4,
+            help='Stub trackers, each on its own port (one per affiliate, round robin)',
+        )
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=8,
+            help='Affiliates with a postback URL',
+        )
+        parser.add_argument(
+            '--latency-ms',
+            type=float,
+            default=20.0,
+            help='Time each stub tracker takes to answer',
+        )
+        parser.add_argument(
+            '--failure-rate',
+            type=float,
+            default=0.1,
+            help='Share of requests the stub trackers answer with 503',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=20,
+            help='Requests in flight (OUTBOUND_POSTBACK_CONCURRENCY)',
+        )
+        parser.add_argument(
+            '--host-rate',
+            type=float,
+            default=0.0,
+            help='Requests per second per host (OUTBOUND_POSTBACK_HOST_RATE, 0 = no limit)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='Postbacks per batch',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=1,
+            help='Random seed for the stub failures',
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        failure_rate = options['failure_rate']
+
+        def respond(path):
+            return 503 if rng.random() < failure_rate else 200
+
+        settings = override_settings(OUTBOUND_POSTBACK_BACKOFF_SECONDS=0, OUTBOUND_POSTBACK_MAX_ATTEMPTS=6)
+        with isolated_database(), settings, ExitStack() as stack:
+            trackers = [
+                stack.enter_context(stub_http_server(respond, delay=options['latency_ms'] / 1000))
+                for _ in range(options['hosts'])
+            ]
+            network, users, offers = create_fixture(users=options['users'])
+            for i, user in enumerate(users):
+                AffiliatePostback.objects.create(
+                    user=user,
+                    url=trackers[i % len(trackers)].url + '/postback?click={subid1}&payout={payout}&conversion={conversion_id}',
+                )
+
+            clicks = ClickTracking.objects.bulk_create([
+                ClickTracking(
+                    user=users[i % len(users)],
+                    offer=offers[0],
+                    click_id=generate_click_id(users[i % len(users)].id, offers[0].id),
+                    subid1=f'aff-{i}',
+                )
+                for i in range(options['conversions'])
+            ])
+            conversions = Conversion.objects.bulk_create([
+                Conversion(click_tracking=click, payout=Decimal('1.00'), status='pending') for click in clicks
+            ])
+
+            started = time.perf_counter()
+            ids = [conversion.id for conversion in conversions]
+            for start in range(0, len(ids), 1000):
+                change_conversion_statuses(ids[start:start + 1000], 'approved')
+            queued = OutboundPostback.objects.count()
+            self.stdout.write(f'Approved {len(ids)} conversions and queued {queued} postbacks in {time.perf_counter() - started:.2f}s')
+
+            sender = OutboundPostbackSender(concurrency=options['concurrency'], host_rate=options['host_rate'])
+            totals = Counter()
+            started = time.perf_counter()
+            try:
+                while True:
+                    result = deliver_outbound_batch(batch_size=options['batch_size'], sender=sender)
+                    totals.update(result)
+                    if not sum(result.values()):
+                        break
+            finally:
+                sender.close()
+            elapsed = time.perf_counter() - started
+
+            failures = self._report(trackers, totals, elapsed, queued, options)
+
+        if failures:
+            self.stdout.write(self.style.ERROR('; '.join(failures)))
+        else:
+            self.stdout.write(self.style.SUCCESS('Every postback sent once; per-host rates within the limit'))
+
+    def _report(self, trackers, totals, elapsed, queued, options):
+        requests_made = sum(len(tracker.requests) for tracker in trackers)
+        self.stdout.write(
+            f'Delivered in {elapsed:.2f}s: {totals["sent"]} sent, {totals["retried"]} retried, {totals["dead"]} dead '
+            f'({requests_made} requests, {requests_made / elapsed if elapsed else 0:.0f}/s with {options["concurrency"]} in flight)'
+        )
+
+        failures = []
+        for tracker in trackers:
+            times = sorted(sent for sent, _ in tracker.requests)
+            # Most requests seen in any one-second window
+            peak, first = 0, 0
+            for last, sent in enumerate(times):
+                while sent - times[first] >= 1.0:
+                    first += 1
+                peak = max(peak, last - first + 1)
+            self.stdout.write(f'{tracker.url}: {len(times)} requests, peak {peak} in one second')
+            if options['host_rate'] and peak > options['host_rate'] + 1:
+                failures.append(f'{tracker.url} got {peak} requests in one second (limit {options["host_rate"]:g})')
+
+        # A retried request may have been answered 503 first; count distinct successes
+        sent = OutboundPostback.objects.filter(status='sent').count()
+        dead = OutboundPostbackDeadLetter.objects.count()
+        if sent + dead != queued:
+            failures.append(f'{queued - sent - dead} postback(s) neither sent nor dead-lettered')
+        waiting = OutboundPostback.objects.exclude(status='sent').count()
+        if waiting:
+            failures.append(f'{waiting} postback(s) still waiting')
+        return failures
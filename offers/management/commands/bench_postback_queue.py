@@ -0,0 +1,93 @@
+from django.core.management.base import BaseCommand
+from concurrent.futures import ThreadPoolExecutor
+from django.db import close_old_connections
+from django.test.utils import override_settings
+import time
+from offers.benchmarks import isolated_database, create_fixture, format_latency
+from offers.models import ClickTracking, Conversion, generate_click_id
+from offers.postback_queue import receive_postback, process_postback_batch, get_postback_queue_metrics
+
+class Command(BaseCommand):
+    help = 'Compare postback response times when processed inline and when queued'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--postbacks',
+            type=int,
+            default=400,
+            help='Postbacks sent per mode',
+        )
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=8,
+            help='Concurrent senders',
+        )
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=10,
+            help='Affiliates the postbacks are spread over',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Queue worker threads',
+        )
+
+    def handle(self, *args, **options):
+        count = options['postbacks']
+        threads = options['threads']
+
+        with isolated_database():
+            network, users, offers = create_fixture(users=options['users'])
+            offer = offers[0]
+
+            def make_clicks():
+                clicks = [
+                    ClickTracking(
+                        user=users[i % len(users)],
+                        offer=offer,
+                        click_id=generate_click_id(users[i % len(users)].id, offer.id),
+                        ip_address='203.0.113.1',
+                        country='US',
+                    )
+                    for i in range(count)
+                ]
+                ClickTracking.objects.bulk_create(clicks)
+                return clicks
+
+            def send(click):
+                started = time.perf_counter()
+                try:
+                    receive_postback({'network': network.network_key, 'subid': click.click_id, 'payout': '1'})
+                finally:
+                    close_old_connections()
+                return time.perf_counter() - started
+
+            for mode in ('sync', 'queue'):
+                clicks = make_clicks()
+                before = Conversion.objects.count()
+                with override_settings(POSTBACK_INGEST_MODE=mode):
+                    started = time.perf_counter()
+                    with ThreadPoolExecutor(max_workers=threads) as pool:
+                        samples = list(pool.map(send, clicks))
+                    elapsed = time.perf_counter() - started
+                self.stdout.write(format_latency(f'{mode} response', samples))
+                self.stdout.write(f'  {count} postbacks answered in {elapsed:.2f}s ({count / elapsed:.0f}/s)')
+
+                if mode == 'queue':
+                    started = time.perf_counter()
+                    while sum(process_postback_batch(workers=options['workers']).values()):
+                        pass
+                    drained = time.perf_counter() - started
+                    metrics = get_postback_queue_metrics()
+                    self.stdout.write(
+                        f'  queue drained in {drained:.2f}s ({count / drained:.0f}/s), '
+                        f'last batch lag mean {metrics["last_batch_mean_lag_seconds"]:.2f}s, '
+                        f'{metrics["pending"]} pending, {metrics["failed_postbacks"]} failed'
+                    )
+                self.stdout.write(f'  {Conversion.objects.count() - before} conversions created')
+
+        self.stdout.write(self.style.SUCCESS('Done'))
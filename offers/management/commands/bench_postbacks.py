@@ -0,0 +1,244 @@
+from django.core.management.base import BaseCommand, CommandError
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+from django.db.models import Count, Sum
+from django.test.utils import override_settings
+from django.utils import timezone
+import random
+import statistics
+from offers.benchmarks import (
+    POSTBACK_SCENARIOS, isolated_database, create_fixture, format_latency, latency_stats, postback_client,
+    read_postback_log, remap_postback_log, replay_postbacks, write_postback_log,
+)
+from offers.ledger import find_mismatches
+from offers.models import BalanceLedger, ClickTracking, Conversion, RawPostback, generate_click_id
+from offers.postback_queue import process_postback_batch, receive_postback
+from user.models import User
+
+class Command(BaseCommand):
+    help = 'Load-test /offers/postback/ with generated scenarios or replayed postback logs and check the accounting'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scenario',
+            choices=sorted(POSTBACK_SCENARIOS),
+            default='retry_storm',
+            help='Generated load shape (ignored with --log)',
+        )
+        parser.add_argument(
+            '--log',
+            default=None,
+            help='Replay this postback log (JSON lines or URLs) instead of a scenario',
+        )
+        parser.add_argument(
+            '--click-param',
+            default=None,
+            help='Click ID parameter in the --log file (default: first parameter besides network and payout)',
+        )
+        parser.add_argument(
+            '--write-log',
+            default=None,
+            help='Also save the postbacks of the first round as a replayable log',
+        )
+        parser.add_argument(
+            '--export-log',
+            default=None,
+            help='Write the queued postbacks (RawPostback) of the real database to this file and exit',
+        )
+        parser.add_argument(
+            '--since-hours',
+            type=float,
+            default=24.0,
+            help='Age of the oldest postback written by --export-log',
+        )
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=10,
+            help='Affiliates seeded',
+        )
+        parser.add_argument(
+            '--offers',
+            type=int,
+            default=3,
+            help='Offers seeded',
+        )
+        parser.add_argument(
+            '--clicks',
+            type=int,
+            default=300,
+            help='Clicks seeded per round',
+        )
+        parser.add_argument(
+            '--rounds',
+            type=int,
+            default=3,
+            help='Rounds run, each with fresh clicks',
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=None,
+            help='Target postbacks per second (default: recorded timing, or as fast as possible)',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=8,
+            help='Concurrent senders',
+        )
+        parser.add_argument(
+            '--target',
+            choices=['view', 'core'],
+            default='view',
+            help="'view' requests /offers/postback/ through the Django stack, 'core' calls the postback code directly",
+        )
+        parser.add_argument(
+            '--ingest-mode',
+            choices=['sync', 'queue'],
+            default='sync',
+            help='POSTBACK_INGEST_MODE during the run; queued postbacks are drained after each round',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=1,
+            help='Random seed for the generated scenarios',
+        )
+
+    def handle(self, *args, **options):
+        if options['export_log']:
+            self._export(options['export_log'], options['since_hours'])
+            return
+
+        recorded = read_postback_log(options['log']) if options['log'] else None
+        if recorded is not None and not recorded:
+            raise CommandError(f'No postbacks found in {options["log"]}')
+        rng = random.Random(options['seed'])
+        name = f'replay:{options["log"]}' if recorded else options['scenario']
+
+        if options['target'] == 'view':
+            def send(params):
+                return postback_client().get('/offers/postback/', params).status_code
+        else:
+            def send(params):
+                return receive_postback(params)[1]
+
+        with isolated_database(), override_settings(POSTBACK_INGEST_MODE=options['ingest_mode']):
+            network, users, offers = create_fixture(users=options['users'], offers=options['offers'])
+            samples, statuses, queries, round_ops = [], Counter(), [], []
+
+            for round_number in range(1, options['rounds'] + 1):
+                click_ids = self._seed_clicks(users, offers, options['clicks'])
+                if recorded:
+                    entries = remap_postback_log(recorded, network, click_ids, options['click_param'])
+                else:
+                    entries = POSTBACK_SCENARIOS[options['scenario']](network, click_ids, rng)
+                if round_number == 1 and options['write_log']:
+                    write_postback_log(options['write_log'], entries)
+                    self.stdout.write(f'Wrote {len(entries)} postbacks to {options["write_log"]}')
+
+                results, elapsed = replay_postbacks(entries, send, rate=options['rate'], concurrency=options['concurrency'])
+                if options['ingest_mode'] == 'queue':
+                    while sum(process_postback_batch().values()):
+                        pass
+
+                samples += [latency for latency, _, _ in results]
+                statuses.update(status for _, status, _ in results)
+                queries += [count for _, _, count in results]
+                round_ops.append(len(results) / elapsed if elapsed else 0.0)
+                self.stdout.write(
+                    f'Round {round_number}: {len(results)} postbacks for {len(click_ids)} clicks '
+                    f'in {elapsed:.2f}s ({round_ops[-1]:.0f}/s)'
+                )
+
+            self._report(name, samples, statuses, queries, round_ops, options)
+            failures = self._check_accounting()
+
+        if failures:
+            self.stdout.write(self.style.ERROR('; '.join(failures)))
+        else:
+            self.stdout.write(self.style.SUCCESS('No double credits; every balance matches its ledger'))
+
+    def _seed_clicks(self, users, offers, count):
+        clicks = [
+            ClickTracking(
+                user=users[i % len(users)],
+                offer=offers[i % len(offers)],
+                click_id=generate_click_id(users[i % len(users)].id, offers[i % len(offers)].id),
+                ip_address='203.0.113.1',
+                country='US',
+            )
+            for i in range(count)
+        ]
+        ClickTracking.objects.bulk_create(clicks)
+        return [click.click_id for click in clicks]
+
+    def _report(self, name, samples, statuses, queries, round_ops, options):
+        stats = latency_stats(samples)
+        self.stdout.write(
+            f'\n{"Name":<24}{"Min":>10}{"Max":>10}{"Mean":>10}{"StdDev":>10}{"Median":>10}{"OPS":>10}  (ms, OPS per sender)'
+        )
+        self.stdout.write(
+            f'{name[:23]:<24}{stats["min"] * 1000:>10.2f}{stats["max"] * 1000:>10.2f}{stats["mean"] * 1000:>10.2f}'
+            f'{stats["stddev"] * 1000:>10.2f}{stats["median"] * 1000:>10.2f}{stats["ops"]:>10.1f}'
+        )
+        self.stdout.write(format_latency(f'{options["target"]} ({options["ingest_mode"]})', samples))
+        self.stdout.write(
+            f'Throughput: {statistics.fmean(round_ops):.0f}/s mean over {len(round_ops)} round(s) '
+            f'with {options["concurrency"]} senders'
+        )
+        self.stdout.write(
+            f'Queries per postback: mean {statistics.fmean(queries):.1f}, max {max(queries)}, total {sum(queries)}'
+            if queries else 'Queries per postback: none sent'
+        )
+        self.stdout.write('Responses: ' + ', '.join(f'{count} x {status}' for status, count in sorted(statuses.items())))
+
+    def _check_accounting(self):
+        failures = []
+        doubled = (
+            Conversion.objects.order_by().values('click_tracking_id')
+            .annotate(total=Count('id')).filter(total__gt=1).count()
+        )
+        if doubled:
+            failures.append(f'{doubled} click(s) converted more than once')
+
+        double_credits = (
+            BalanceLedger.objects.filter(entry_type='conversion_credit').order_by().values('conversion_id')
+            .annotate(total=Count('id')).filter(total__gt=1).count()
+        )
+        if double_credits:
+            failures.append(f'{double_credits} conversion(s) credited more than once')
+
+        expected = dict(
+            Conversion.objects.filter(status='approved').order_by()
+            .values('click_tracking__user_id')
+            .annotate(total=Sum('click_tracking__offer__payout'))
+            .values_list('click_tracking__user_id', 'total')
+        )
+        wrong = [
+            email for user_id, email, balance in User.objects.values_list('id', 'email', 'balance')
+            if balance != expected.get(user_id, Decimal('0.00'))
+        ]
+        if wrong:
+            failures.append(f'balance differs from approved payouts for {", ".join(wrong)}')
+
+        mismatches = find_mismatches()
+        if mismatches:
+            failures.append(f'{len(mismatches)} user(s) out of balance with the ledger')
+
+        self.stdout.write(
+            f'{Conversion.objects.count()} conversions, {sum(expected.values(), Decimal("0.00"))} credited, '
+            f'{double_credits} double credits, {len(mismatches)} ledger mismatches'
+        )
+        return failures
+
+    def _export(self, path, since_hours):
+        since = timezone.now() - timedelta(hours=since_hours)
+        rows = list(RawPostback.objects.filter(received_at__gte=since).order_by('received_at').values_list('received_at', 'params'))
+        if not rows:
+            raise CommandError('No queued postbacks in that period (RawPostback rows only exist in queue mode)')
+        first = rows[0][0]
+        write_postback_log(path, [((received_at - first).total_seconds(), params) for received_at, params in rows])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {len(rows)} postbacks to {path}'))
@@ -0,0 +1,115 @@
+from django.core.management.base import BaseCommand
+from contextlib import redirect_stdout
+from urllib.parse import urlsplit, parse_qs
+import io
+import random
+import time
+from offers.redirect_templates import compile_redirect_template, format_click_id_macro, render_redirect_url
+
+# (name, URL builder) - the builder gets the offer number and the network's macro
+URL_SHAPES = [
+    ('plain', lambda i, macro: f'https://offers{i % 50}.example.com/lp/{i}'),
+    ('query', lambda i, macro: f'https://offers{i % 50}.example.com/lp?o={i}&aff=7'),
+    ('fragment', lambda i, macro: f'https://offers{i % 50}.example.com/lp/{i}#signup'),
+    ('query+fragment', lambda i, macro: f'https://offers{i % 50}.example.com/lp?o={i}#/step?x=1'),
+    ('trailing ?', lambda i, macro: f'https://offers{i % 50}.example.com/lp/{i}?'),
+    ('trailing &', lambda i, macro: f'https://offers{i % 50}.example.com/lp?o={i}&'),
+    ('network macro', lambda i, macro: f'https://offers{i % 50}.example.com/lp?o={i}&s2={macro}'),
+    ('generic macro', lambda i, macro: f'https://offers{i % 50}.example.com/c/{{clickid}}/{i}'),
+]
+
+NETWORKS = [('s2', '{}'), ('subid', '#'), ('aff_sub', '[]'), ('', '{}')]
+
+
+def legacy_redirect_url(offer_url, click_id_parameter, click_id, debug=False):
+    """Per-click work of the old Offer.build_redirect_url"""
+    if debug:
+        print(f"Original URL: {offer_url}")
+        print(f"Click ID Parameter: '{click_id_parameter}'")
+    click_param_name = click_id_parameter or 'subid'
+    if debug:
+        print(f"Using network parameter: {click_param_name}")
+    separator = '&' if '?' in offer_url else '?'
+    final_url = f"{offer_url}{separator}{click_param_name}={click_id}"
+    if debug:
+        print(f"Final URL: {final_url}")
+        print(f"URL length: {len(final_url)}")
+        print(f"Contains click ID: {'click_id' in final_url}")
+    return final_url
+
+
+class Command(BaseCommand):
+    help = 'Micro-benchmark precompiled offer redirect templates against per-click URL building'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--offers',
+            type=int,
+            default=5000,
+            help='Offers generated (spread over every URL shape)',
+        )
+        parser.add_argument(
+            '--clicks',
+            type=int,
+            default=200000,
+            help='Redirect URLs built per approach',
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        offers = []
+        for i in range(options['offers']):
+            shape, build = URL_SHAPES[i % len(URL_SHAPES)]
+            parameter, wrapper = NETWORKS[i % len(NETWORKS)]
+            macro = format_click_id_macro(parameter or 'subid', wrapper)
+            offers.append((shape, build(i, macro), parameter, wrapper))
+
+        started = time.perf_counter()
+        templates = [compile_redirect_template(url, parameter, wrapper) for shape, url, parameter, wrapper in offers]
+        compile_seconds = time.perf_counter() - started
+
+        click_id = '01M53R7A11J600000000A00007'
+        picks = [rng.randrange(len(offers)) for _ in range(options['clicks'])]
+
+        # The old method printed its debug output on every click; it goes to
+        # an in-memory buffer here, so real terminals/log files cost more
+        started = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            for index in picks:
+                shape, url, parameter, wrapper = offers[index]
+                legacy_redirect_url(url, parameter, click_id, debug=True)
+        legacy_debug_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for index in picks:
+            shape, url, parameter, wrapper = offers[index]
+            legacy_redirect_url(url, parameter, click_id)
+        legacy_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for index in picks:
+            render_redirect_url(templates[index], click_id)
+        template_seconds = time.perf_counter() - started
+
+        # Every shape must carry the click ID exactly once, in the query
+        # string or in place of the macro, with the fragment left at the end
+        errors = {}
+        for (shape, url, parameter, wrapper), template in zip(offers, templates):
+            final = render_redirect_url(template, click_id)
+            parts = urlsplit(final)
+            in_query = [value for values in parse_qs(parts.query).values() for value in values].count(click_id)
+            in_path = parts.path.count(click_id)
+            fragment_kept = '#' not in url or final.endswith(url[url.index('#'):])
+            if in_query + in_path != 1 or not fragment_kept:
+                errors[shape] = final
+
+        self.stdout.write(f'{len(offers)} offers, {len(URL_SHAPES)} URL shapes, {len(picks)} clicks')
+        self.stdout.write(f'Compile:  {compile_seconds / len(offers) * 1e6:8.2f}us per offer')
+        self.stdout.write(f'Legacy:   {legacy_debug_seconds / len(picks) * 1e9:8.0f}ns per click with debug prints')
+        self.stdout.write(f'Legacy:   {legacy_seconds / len(picks) * 1e9:8.0f}ns per click without prints')
+        self.stdout.write(f'Template: {template_seconds / len(picks) * 1e9:8.0f}ns per click')
+        if errors:
+            for shape, final in errors.items():
+                self.stdout.write(self.style.ERROR(f'Bad URL for {shape}: {final}'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Every URL shape renders the click ID once with its fragment intact'))
@@ -0,0 +1,138 @@
+from django.core.management.base import BaseCommand
+from datetime import timedelta
+from decimal import Decimal
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+import random
+import time
+from offers.benchmarks import isolated_database, create_fixture
+from offers.daily_stats import rebuild_daily_stats
+from offers.models import ClickTracking, Conversion, generate_click_id
+
+class Command(BaseCommand):
+    help = "Seed growing click volumes and time the report pages, checking their query count stays constant"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            default='1000,10000,50000',
+            help='Comma separated click totals to measure at',
+        )
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=30,
+            help='Days the clicks are spread over',
+        )
+        parser.add_argument(
+            '--offers',
+            type=int,
+            default=10,
+            help='Offers the clicks are spread over',
+        )
+        parser.add_argument(
+            '--conversion-rate',
+            type=float,
+            default=0.05,
+            help='Share of clicks that convert',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Requests per page and size (the median is reported)',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=1,
+            help='Random seed for the click spread',
+        )
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        rng = random.Random(options['seed'])
+
+        with isolated_database(), override_settings(ALLOWED_HOSTS=['*']):
+            network, users, offers = create_fixture(users=1, offers=options['offers'])
+            user = users[0]
+            client = Client()
+            client.force_login(user)
+            today = timezone.localdate()
+            urls = {
+                'daily reports': reverse('daily_reports'),
+                'daily details': reverse('get_daily_details') + f'?date={today}',
+            }
+
+            queries = {}
+            seeded = 0
+            for size in sizes:
+                started = time.perf_counter()
+                self._seed(user, offers, size - seeded, seeded, rng, options)
+                seeded = size
+                rebuild_daily_stats(today - timedelta(days=options['days']), today)
+                self.stdout.write(f'{size} clicks seeded and rolled up in {time.perf_counter() - started:.1f}s')
+
+                for source, enabled in (('rollup', True), ('raw', False)):
+                    with override_settings(DAILY_STATS_ENABLED=enabled):
+                        for name, url in urls.items():
+                            elapsed, count = self._measure(client, url, options['repeat'])
+                            queries.setdefault((source, name), set()).add(count)
+                            self.stdout.write(f'  {source:6} {name:14} {elapsed * 1000:8.1f}ms  {count} queries')
+
+        varying = {key: counts for key, counts in queries.items() if len(counts) > 1}
+        if varying:
+            for (source, name), counts in varying.items():
+                self.stdout.write(self.style.ERROR(
+                    f'{source} {name}: query count changed with the click volume ({sorted(counts)})'
+                ))
+        else:
+            self.stdout.write(self.style.SUCCESS('Query counts constant across click volumes'))
+
+    def _seed(self, user, offers, count, offset, rng, options):
+        now = timezone.now()
+        batch = []
+        for i in range(offset, offset + count):
+            offer = offers[i % len(offers)]
+            batch.append(ClickTracking(
+                user=user,
+                offer=offer,
+                click_id=generate_click_id(user.id, offer.id),
+                subid1=f'source-{rng.randrange(20)}',
+                click_date=now - timedelta(days=rng.randrange(options['days']), seconds=rng.randrange(3600)),
+            ))
+            if len(batch) == 5000:
+                self._write(batch, rng, options)
+                batch = []
+        if batch:
+            self._write(batch, rng, options)
+
+    def _write(self, batch, rng, options):
+        clicks = ClickTracking.objects.bulk_create(batch)
+        Conversion.objects.bulk_create([
+            Conversion(
+                click_tracking=click,
+                payout=Decimal('2.50'),
+                status=rng.choice(('approved', 'approved', 'rejected')),
+                conversion_date=click.click_date,
+            )
+            for click in clicks
+            if rng.random() < options['conversion_rate']
+        ])
+
+    def _measure(self, client, url, repeat):
+        timings = []
+        count = 0
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                response = client.get(url)
+                timings.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                raise RuntimeError(f'{url} answered {response.status_code}')
+            count = len(context.captured_queries)
+        timings.sort()
+        return timings[len(timings) // 2], count
@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import override_settings
+from unittest import mock
+import time
+from offers import enrichment
+from offers.geo import GeoResolver
+from offers.benchmarks import isolated_database, create_fixture, format_latency
+
+class Command(BaseCommand):
+    help = 'Measure track_click redirect latency with a stubbed slow geo provider'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=200,
+            help='Number of redirects to measure per mode',
+        )
+        parser.add_argument(
+            '--geo-delay-ms',
+            type=float,
+            default=250.0,
+            help='Simulated latency of the geo provider',
+        )
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        delay = options['geo_delay_ms'] / 1000.0
+
+        class SlowResolver(GeoResolver):
+            def resolve(self, ip_address):
+                time.sleep(delay)
+                return {'country': 'US', 'city': 'Bench City', 'region': 'Bench Region'}
+
+        slow_resolver = SlowResolver()
+
+        with isolated_database():
+            network, users, offers = create_fixture()
+            url = f'/offers/offer/?userid={users[0].id}&offerid={offers[0].id}'
+            client = Client()
+
+            # Click filtering would treat the repeated visitors as duplicates
+            with mock.patch.object(enrichment, 'get_geo_resolver', lambda: slow_resolver), \
+                    override_settings(CLICK_FILTERS_ENABLED=False):
+                # Blocking path: the lookup finishes before the response is sent,
+                # which is how track_click behaved before the queue existed
+                inline = self._measure(client, url, count, drain_inline=True)
+                queued = self._measure(client, url, count, drain_inline=False)
+
+                started = time.monotonic()
+                while enrichment.process_enrichment_jobs(batch_size=100, workers=16)['processed']:
+                    pass
+                drain_seconds = time.monotonic() - started
+
+        self.stdout.write(f'Geo provider delay: {options["geo_delay_ms"]:.0f}ms')
+        self.stdout.write(format_latency('Inline geo lookup', inline))
+        self.stdout.write(format_latency('Queued geo lookup', queued))
+        self.stdout.write(f'Background drain of {count} queued jobs: {drain_seconds:.2f}s')
+
+    def _measure(self, client, url, count, drain_inline):
+        samples = []
+        for i in range(count):
+            started = time.perf_counter()
+            response = client.get(url, REMOTE_ADDR=f'203.0.113.{i % 250 + 1}')
+            if drain_inline:
+                enrichment.process_enrichment_jobs(batch_size=1, workers=1)
+            samples.append(time.perf_counter() - started)
+            if response.status_code != 302:
+                self.stdout.write(self.style.ERROR(f'Unexpected status {response.status_code}'))
+        return samples
@@ -0,0 +1,165 @@
+from django.core.management.base import BaseCommand
+from django.core.asgi import get_asgi_application
+from django.core.handlers.wsgi import WSGIHandler
+from django.test.utils import override_settings
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import io
+import time
+from offers.asgi import TrackingApplication
+from offers.benchmarks import isolated_database, create_fixture, format_latency
+from offers.models import ClickTracking, generate_click_id
+
+class Command(BaseCommand):
+    help = 'Load-test click and postback routes through WSGI, Django ASGI and the lightweight ASGI endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=500,
+            help='Requests per route and server path',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=8,
+            help='Requests in flight at once',
+        )
+        parser.add_argument(
+            '--route',
+            choices=['click', 'postback', 'both'],
+            default='both',
+            help='Which route to load',
+        )
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        concurrency = options['concurrency']
+        routes = ['click', 'postback'] if options['route'] == 'both' else [options['route']]
+
+        wsgi = WSGIHandler()
+        django_asgi = get_asgi_application()
+        tracking_asgi = TrackingApplication(django_asgi, max_workers=concurrency)
+
+        # Every request comes from the same visitor, which click filtering
+        # would answer as a duplicate without touching the database
+        with isolated_database(), override_settings(CLICK_FILTERS_ENABLED=False):
+            network, users, offers = create_fixture()
+            user, offer = users[0], offers[0]
+
+            # Every postback needs its own click; make enough for all three paths
+            click_ids = [generate_click_id(user.id, offer.id) for _ in range(count * 3)]
+            ClickTracking.objects.bulk_create([
+                ClickTracking(user=user, offer=offer, click_id=click_id, country='US')
+                for click_id in click_ids
+            ])
+            postback_ids = iter(click_ids)
+
+            def request_for(route):
+                if route == 'click':
+                    return '/offers/offer/', f'userid={user.id}&offerid={offer.id}', 302
+                return (
+                    '/offers/postback/',
+                    f'network={network.network_key}&{network.postback_click_id_parameter}={next(postback_ids)}&payout=1',
+                    200,
+                )
+
+            for route in routes:
+                self.stdout.write(f'--- {route} ({count} requests, concurrency {concurrency})')
+                for label, runner in (
+                    ('WSGI', lambda: self._run_wsgi(wsgi, route, request_for, count, concurrency)),
+                    ('Django ASGI', lambda: self._run_asgi(django_asgi, route, request_for, count, concurrency)),
+                    ('Tracking ASGI', lambda: self._run_asgi(tracking_asgi, route, request_for, count, concurrency)),
+                ):
+                    samples, seconds, failures = runner()
+                    self.stdout.write(format_latency(f'{label:13s} {count / seconds:7.0f} req/s', samples))
+                    if failures:
+                        self.stdout.write(self.style.ERROR(f'{label}: {failures} unexpected response(s)'))
+
+        tracking_asgi.executor.shutdown()
+
+    def _run_wsgi(self, handler, route, request_for, count, concurrency):
+        requests = [request_for(route) for _ in range(count)]
+
+        def one(request):
+            path, query, expected = request
+            environ = {
+                'REQUEST_METHOD': 'GET',
+                'PATH_INFO': path,
+                'QUERY_STRING': query,
+                'SCRIPT_NAME': '',
+                'SERVER_NAME': 'testserver',
+                'SERVER_PORT': '80',
+                'SERVER_PROTOCOL': 'HTTP/1.1',
+                'HTTP_HOST': 'testserver',
+                'HTTP_USER_AGENT': 'bench',
+                'REMOTE_ADDR': '203.0.113.10',
+                'wsgi.input': io.BytesIO(b''),
+                'wsgi.errors': io.StringIO(),
+                'wsgi.url_scheme': 'http',
+            }
+            status = []
+            started = time.perf_counter()
+            response = handler(environ, lambda code, headers: status.append(code))
+            b''.join(response)
+            response.close()
+            return time.perf_counter() - started, int(status[0].split()[0]) == expected
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(one, requests))
+        seconds = time.perf_counter() - started
+        return [r[0] for r in results], seconds, sum(1 for r in results if not r[1])
+
+    def _run_asgi(self, application, route, request_for, count, concurrency):
+        requests = [request_for(route) for _ in range(count)]
+
+        async def one(request, semaphore):
+            path, query, expected = request
+            scope = {
+                'type': 'http',
+                'asgi': {'version': '3.0'},
+                'http_version': '1.1',
+                'method': 'GET',
+                'scheme': 'http',
+                'path': path,
+                'raw_path': path.encode(),
+                'query_string': query.encode(),
+                'root_path': '',
+                'headers': [(b'host', b'testserver'), (b'user-agent', b'bench')],
+                'client': ('203.0.113.10', 50000),
+                'server': ('testserver', 80),
+            }
+            status = []
+            body_sent = False
+            finished = asyncio.Event()
+
+            async def receive():
+                # Like a real server: the body once, then wait for the end
+                nonlocal body_sent
+                if not body_sent:
+                    body_sent = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                await finished.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+                elif not message.get('more_body', False):
+                    finished.set()
+
+            async with semaphore:
+                started = time.perf_counter()
+                await application(scope, receive, send)
+                return time.perf_counter() - started, status[0] == expected
+
+        async def run_all():
+            semaphore = asyncio.Semaphore(concurrency)
+            return await asyncio.gather(*(one(request, semaphore) for request in requests))
+
+        started = time.perf_counter()
+        results = asyncio.run(run_all())
+        seconds = time.perf_counter() - started
+        return [r[0] for r in results], seconds, sum(1 for r in results if not r[1])
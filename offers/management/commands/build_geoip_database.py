@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+import csv
+import os
+from offers.geo import build_range_database, RangeDatabaseResolver
+
+# CSV columns after start_ip,end_ip that are copied into the location data
+LOCATION_COLUMNS = [
+    'country', 'region', 'city', 'timezone', 'postal_code', 'organization', 'latitude', 'longitude'
+]
+
+class Command(BaseCommand):
+    help = 'Build the local geo range database used by GEOIP_BACKEND = "local"'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'csv_file',
+            help='CSV with a header row: start_ip,end_ip and any of ' + ','.join(LOCATION_COLUMNS),
+        )
+        parser.add_argument(
+            '--output',
+            default=None,
+            help='Database file to write (defaults to GEOIP_DATABASE_PATH)',
+        )
+
+    def handle(self, *args, **options):
+        output = options['output'] or str(settings.GEOIP_DATABASE_PATH)
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+        try:
+            with open(options['csv_file'], newline='', encoding='utf-8') as handle:
+                count = build_range_database(self._rows(csv.DictReader(handle)), output)
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f'Could not build geo database: {str(e)}')
+
+        stats = RangeDatabaseResolver(output).stats()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Wrote {count} ranges ({stats["locations"]} distinct locations) to {output}'
+            )
+        )
+
+    def _rows(self, reader):
+        for row in reader:
+            location = {}
+            for column in LOCATION_COLUMNS:
+                value = (row.get(column) or '').strip()
+                if not value:
+                    continue
+                if column in ('latitude', 'longitude'):
+                    value = round(float(value), 6)
+                location[column] = value
+            yield row['start_ip'].strip(), row['end_ip'].strip(), location
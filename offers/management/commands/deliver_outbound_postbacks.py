@@ -0,0 +1,75 @@
+from django.core.management.base import BaseCommand
+import logging
+import time
+from offers.models import OutboundPostback, OutboundPostbackDeadLetter
+from offers.outbound_postbacks import deliver_outbound_batch, purge_sent_postbacks
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = "Send queued postbacks (OutboundPostback) to affiliates' trackers"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Postbacks per batch (defaults to OUTBOUND_POSTBACK_BATCH_SIZE)',
+        )
+        parser.add_argument(
+            '--max-seconds',
+            type=float,
+            default=55.0,
+            help='Stop sending after this many seconds (fits a once-a-minute cron)',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep running and poll for due postbacks instead of exiting when none are left',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1.0,
+            help='Seconds to sleep between polls in --loop mode',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        totals = {'sent': 0, 'retried': 0, 'dead': 0}
+
+        try:
+            while True:
+                result = deliver_outbound_batch(batch_size=options['batch_size'])
+                for key in totals:
+                    totals[key] += result[key]
+
+                if not sum(result.values()):
+                    if not options['loop']:
+                        break
+                    time.sleep(options['poll_interval'])
+                elif not options['loop'] and time.monotonic() - started >= options['max_seconds']:
+                    break
+            purged = purge_sent_postbacks()
+        except KeyboardInterrupt:
+            purged = 0
+        except Exception as e:
+            self.stdout.write(
+                self.style.ERROR(f'Error during outbound postback delivery: {str(e)}')
+            )
+            logger.error(f'Outbound postback command failed: {str(e)}', exc_info=True)
+            return
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Outbound postbacks sent in {time.monotonic() - started:.1f}s\n'
+                f'Sent: {totals["sent"]}\n'
+                f'Retried: {totals["retried"]}\n'
+                f'Dead: {totals["dead"]}\n'
+                f'Purged: {purged}'
+            )
+        )
+        self.stdout.write(
+            f'Waiting: {OutboundPostback.objects.filter(status="pending").count()}\n'
+            f'Dead letters: {OutboundPostbackDeadLetter.objects.count()}'
+        )
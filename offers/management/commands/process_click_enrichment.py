@@ -0,0 +1,103 @@
+from django.core.management.base import BaseCommand
+import logging
+import time
+from offers.enrichment import process_enrichment_jobs, get_enrichment_metrics
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Fill in geo data for queued clicks (ClickEnrichmentJob queue)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Jobs per batch (defaults to CLICK_ENRICHMENT_BATCH_SIZE)',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Concurrent geo lookups per batch',
+        )
+        parser.add_argument(
+            '--max-seconds',
+            type=float,
+            default=55.0,
+            help='Stop draining after this many seconds (fits a once-a-minute cron)',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep running and poll for new jobs instead of exiting when the queue is empty',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1.0,
+            help='Seconds to sleep between polls in --loop mode',
+        )
+        parser.add_argument(
+            '--stats',
+            action='store_true',
+            help='Print queue metrics and exit',
+        )
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self._print_metrics()
+            return
+
+        started = time.monotonic()
+        totals = {'processed': 0, 'retried': 0, 'failed': 0}
+
+        try:
+            while True:
+                result = process_enrichment_jobs(
+                    batch_size=options['batch_size'],
+                    workers=options['workers'],
+                )
+                for key in totals:
+                    totals[key] += result[key]
+
+                batch_size = sum(result.values())
+                if not batch_size:
+                    if not options['loop']:
+                        break
+                    time.sleep(options['poll_interval'])
+                elif not options['loop'] and time.monotonic() - started >= options['max_seconds']:
+                    break
+        except KeyboardInterrupt:
+            pass
+        except Exception as e:
+            self.stdout.write(
+                self.style.ERROR(f'Error during click enrichment: {str(e)}')
+            )
+            logger.error(f'Click enrichment command failed: {str(e)}', exc_info=True)
+            return
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Click enrichment finished in {time.monotonic() - started:.1f}s\n'
+                f'Processed: {totals["processed"]}\n'
+                f'Retried: {totals["retried"]}\n'
+                f'Failed: {totals["failed"]}'
+            )
+        )
+        self._print_metrics()
+
+    def _print_metrics(self):
+        metrics = get_enrichment_metrics()
+        self.stdout.write(
+            f'Pending: {metrics["pending"]} / {metrics["max_pending"]}\n'
+            f'Running: {metrics["running"]}\n'
+            f'Failed jobs: {metrics["failed_jobs"]}\n'
+            f'Oldest pending: {metrics["oldest_pending_seconds"]:.1f}s'
+        )
+        resolver = metrics['resolver']
+        if 'hits' in resolver:
+            self.stdout.write(
+                f'Geo cache: {resolver["hits"]} hits / {resolver["misses"]} misses '
+                f'({resolver["hit_rate"]:.1f}%), {resolver["entries"]} entries'
+            )
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+import logging
+from offers.accounting import run_status_job
+from offers.models import ConversionStatusJob
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Run queued bulk conversion approvals and rejections (ConversionStatusJob)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=None,
+            help='Conversions changed per transaction (defaults to CONVERSION_BULK_CHUNK_SIZE)',
+        )
+        parser.add_argument(
+            '--job',
+            type=int,
+            default=None,
+            help='Only run the job with this ID',
+        )
+
+    def handle(self, *args, **options):
+        # 'running' jobs were interrupted (cron runs are locked against overlap)
+        jobs = ConversionStatusJob.objects.filter(status__in=['pending', 'running']).order_by('created_at')
+        if options['job']:
+            jobs = jobs.filter(pk=options['job'])
+
+        def report(job):
+            self.stdout.write(
+                f'Job {job.pk}: {job.processed}/{job.total} processed ({job.progress}%), {job.changed} changed'
+            )
+
+        count = 0
+        for job in jobs:
+            self.stdout.write(f'Marking {job.total} conversion(s) {job.new_status} (job {job.pk})')
+            job = run_status_job(job, chunk_size=options['chunk_size'], progress=report)
+            count += 1
+            if job.status == 'failed':
+                self.stdout.write(self.style.ERROR(f'Job {job.pk} failed: {job.last_error}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'Job {job.pk} done: {job.changed} conversion(s) changed'))
+
+        if not count:
+            self.stdout.write('No conversion status jobs waiting')
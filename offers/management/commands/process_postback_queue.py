@@ -0,0 +1,100 @@
+from django.core.management.base import BaseCommand
+import logging
+import time
+from offers.postback_queue import process_postback_batch, purge_processed_postbacks, get_postback_queue_metrics
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Turn queued postbacks (RawPostback) into conversions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Postbacks per batch (defaults to POSTBACK_QUEUE_BATCH_SIZE)',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help='Threads per batch, each handling whole users (defaults to POSTBACK_QUEUE_WORKERS)',
+        )
+        parser.add_argument(
+            '--max-seconds',
+            type=float,
+            default=55.0,
+            help='Stop draining after this many seconds (fits a once-a-minute cron)',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep running and poll for new postbacks instead of exiting when the queue is empty',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=0.5,
+            help='Seconds to sleep between polls in --loop mode',
+        )
+        parser.add_argument(
+            '--stats',
+            action='store_true',
+            help='Print queue metrics and exit',
+        )
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self._print_metrics()
+            return
+
+        started = time.monotonic()
+        totals = {'processed': 0, 'retried': 0, 'failed': 0}
+
+        try:
+            while True:
+                result = process_postback_batch(
+                    batch_size=options['batch_size'],
+                    workers=options['workers'],
+                )
+                for key in totals:
+                    totals[key] += result[key]
+
+                if not sum(result.values()):
+                    if not options['loop']:
+                        break
+                    time.sleep(options['poll_interval'])
+                elif not options['loop'] and time.monotonic() - started >= options['max_seconds']:
+                    break
+            purged = purge_processed_postbacks()
+        except KeyboardInterrupt:
+            purged = 0
+        except Exception as e:
+            self.stdout.write(
+                self.style.ERROR(f'Error during postback processing: {str(e)}')
+            )
+            logger.error(f'Postback queue command failed: {str(e)}', exc_info=True)
+            return
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Postback queue drained in {time.monotonic() - started:.1f}s\n'
+                f'Processed: {totals["processed"]}\n'
+                f'Retried: {totals["retried"]}\n'
+                f'Failed: {totals["failed"]}\n'
+                f'Purged: {purged}'
+            )
+        )
+        self._print_metrics()
+
+    def _print_metrics(self):
+        metrics = get_postback_queue_metrics()
+        self.stdout.write(
+            f'Mode: {metrics["mode"]}\n'
+            f'Pending: {metrics["pending"]} (processing: {metrics["processing"]})\n'
+            f'Failed postbacks: {metrics["failed_postbacks"]}\n'
+            f'Lag (oldest pending): {metrics["oldest_pending_seconds"]:.1f}s\n'
+            f'Last batch lag: mean {metrics["last_batch_mean_lag_seconds"]:.2f}s, '
+            f'max {metrics["last_batch_max_lag_seconds"]:.2f}s'
+        )
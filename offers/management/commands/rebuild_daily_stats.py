@@ -0,0 +1,74 @@
+from django.core.management.base import BaseCommand, CommandError
+from datetime import datetime, timedelta
+import logging
+import time
+from offers.daily_stats import first_activity_date, last_settled_date, rebuild_daily_stats
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Recompute the DailyStat rollup from clicks and conversions (the last closed days by default)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=2,
+            help='Closed days to recompute, ending with the last settled day (ignored with --start or --all)',
+        )
+        parser.add_argument(
+            '--start',
+            default=None,
+            help='First day to recompute (YYYY-MM-DD)',
+        )
+        parser.add_argument(
+            '--end',
+            default=None,
+            help='Last day to recompute (YYYY-MM-DD, default the last settled day)',
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Backfill the whole history up to the last settled day',
+        )
+
+    def _parse(self, value):
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError(f'Invalid date {value!r}; use YYYY-MM-DD')
+
+    def handle(self, *args, **options):
+        # Days other processes may still hold buffered counts for are left
+        # alone: the rebuild would count those twice once they are written
+        settled = last_settled_date()
+        if options['all']:
+            start_date, end_date = first_activity_date(), settled
+            if start_date is None:
+                self.stdout.write('No clicks or conversions to roll up')
+                return
+        else:
+            end_date = self._parse(options['end']) if options['end'] else settled
+            start_date = self._parse(options['start']) if options['start'] else end_date - timedelta(days=options['days'] - 1)
+        if start_date > end_date:
+            raise CommandError('The start date is after the end date')
+        if end_date > settled:
+            self.stdout.write(self.style.WARNING(
+                f"Skipping {max(start_date, settled + timedelta(days=1))} to {end_date}: "
+                "other processes may still hold counts for these days"
+            ))
+            end_date = settled
+            if start_date > end_date:
+                return
+
+        started = time.monotonic()
+        try:
+            written = rebuild_daily_stats(start_date, end_date)
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Error rebuilding daily stats: {str(e)}'))
+            logger.error(f'Daily stats rebuild failed: {str(e)}', exc_info=True)
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt daily stats for {start_date} to {end_date}: {written} row(s) in {time.monotonic() - started:.1f}s'
+        ))
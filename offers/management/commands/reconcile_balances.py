@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+import logging
+from offers.ledger import reconcile_balances
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Check that every user balance equals the sum of their balance ledger entries'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            help='Record each difference as an adjustment entry, taking the balance as correct',
+        )
+
+    def handle(self, *args, **options):
+        mismatches = reconcile_balances(fix=options['fix'])
+
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS('All balances match their ledger'))
+            return
+
+        for mismatch in mismatches:
+            self.stdout.write(
+                self.style.ERROR(
+                    f'{mismatch.email} (user {mismatch.user_id}): balance ${mismatch.balance}, '
+                    f'ledger ${mismatch.ledger_total}, difference ${mismatch.balance - mismatch.ledger_total}'
+                )
+            )
+        if options['fix']:
+            self.stdout.write(self.style.WARNING(f'Booked adjustments for {len(mismatches)} user(s)'))
+        else:
+            self.stdout.write(self.style.ERROR(f'{len(mismatches)} balance(s) do not match their ledger'))
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from offers.click_ingest import replay_orphaned_segments
+
+class Command(BaseCommand):
+    help = 'Write clicks left in the batched-ingest spool to the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Also replay segments of processes that still look alive (only when no web worker is running)',
+        )
+
+    def handle(self, *args, **options):
+        replayed = replay_orphaned_segments(settings.CLICK_INGEST_SPOOL_DIR, include_live=options['all'])
+        self.stdout.write(self.style.SUCCESS(f'Replayed {replayed} spooled click(s)'))
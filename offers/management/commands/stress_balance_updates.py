@@ -0,0 +1,139 @@
+from django.core.management.base import BaseCommand
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from django.db import close_old_connections
+from django.db.models import Sum
+import time
+from offers.benchmarks import isolated_database, create_fixture
+from offers.ledger import find_mismatches
+from offers.models import (
+    BalanceLedger, ClickTracking, Conversion, Referral, ReferralLink, SamplingDecision, SiteSettings,
+    generate_click_id,
+)
+from offers.postbacks import process_postback
+from user.models import User
+
+class Command(BaseCommand):
+    help = 'Send parallel postbacks and check that no balance update is lost'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--postbacks',
+            type=int,
+            default=300,
+            help='Postbacks sent (one per click)',
+        )
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=8,
+            help='Concurrent postback threads',
+        )
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=2,
+            help='Affiliates receiving conversions; all were referred by one extra user',
+        )
+
+    def handle(self, *args, **options):
+        threads = options['threads']
+
+        with isolated_database():
+            network, users, offers = create_fixture(users=options['users'], payout='10.00')
+            offer = offers[0]
+
+            # Every conversion also credits the same referrer, the most
+            # contended row in the run
+            SiteSettings.objects.create(referral_percentage=Decimal('5.00'))
+            referrer = User.objects.create_user(email='referrer@example.com', password=None, full_name='Bench Referrer')
+            link = ReferralLink.objects.create(user=referrer)
+            for user in users:
+                Referral.objects.create(referrer=referrer, referred_user=user, referral_link=link)
+
+            lost = self._read_modify_write(users[0], threads)
+            self.stdout.write(
+                f'Read-modify-save baseline: {lost} of {threads * 50} increments lost'
+            )
+            User.objects.filter(pk=users[0].pk).update(balance=0)
+
+            clicks = [
+                ClickTracking(
+                    user=users[i % len(users)],
+                    offer=offer,
+                    click_id=generate_click_id(users[i % len(users)].id, offer.id),
+                    ip_address='203.0.113.1',
+                    country='US',
+                )
+                for i in range(options['postbacks'])
+            ]
+            ClickTracking.objects.bulk_create(clicks)
+
+            def send(click):
+                try:
+                    return process_postback({'network': network.network_key, 'subid': click.click_id, 'payout': '10'})[1]
+                finally:
+                    close_old_connections()
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                statuses = list(pool.map(send, clicks))
+            elapsed = time.perf_counter() - started
+
+            errors = sum(1 for status in statuses if status != 200)
+            self.stdout.write(
+                f'{len(clicks)} postbacks in {elapsed:.2f}s with {threads} threads '
+                f'({len(clicks) / elapsed:.0f}/s), {errors} failed'
+            )
+
+            failures = []
+            for user in users:
+                user.refresh_from_db()
+                approved = Conversion.objects.filter(click_tracking__user=user, status='approved').count()
+                counted = SamplingDecision.objects.filter(click_tracking__user=user).count()
+                expected = offer.payout * approved
+                self.stdout.write(
+                    f'{user.email}: {counted} postbacks counted, {approved} conversions, '
+                    f'balance ${user.balance} (expected ${expected})'
+                )
+                if user.balance != expected:
+                    failures.append(user.email)
+
+            referrer.refresh_from_db()
+            conversions = Conversion.objects.filter(status='approved').count()
+            expected = (offer.payout * Decimal('0.05')).quantize(Decimal('0.01')) * conversions
+            self.stdout.write(f'{referrer.email}: balance ${referrer.balance} (expected ${expected})')
+            if referrer.balance != expected:
+                failures.append(referrer.email)
+
+            counted = SamplingDecision.objects.count()
+            if counted != len(clicks) - errors:
+                failures.append(f'sampling decisions ({counted} of {len(clicks) - errors})')
+
+            ledger_total = BalanceLedger.objects.aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
+            mismatches = find_mismatches()
+            self.stdout.write(f'Ledger total ${ledger_total:.2f}, {len(mismatches)} user(s) out of balance with the ledger')
+            failures.extend(mismatch.email for mismatch in mismatches)
+
+        if failures or errors:
+            self.stdout.write(self.style.ERROR(f'Lost updates or failures: {", ".join(failures) or f"{errors} failed postbacks"}'))
+        else:
+            self.stdout.write(self.style.SUCCESS('No lost updates'))
+
+    def _read_modify_write(self, user, threads, per_thread=50):
+        """Add $1 per_thread times per thread the way add_to_balance used to; return increments lost"""
+        User.objects.filter(pk=user.pk).update(balance=0)
+
+        def worker(_):
+            try:
+                for _ in range(per_thread):
+                    current = User.objects.get(pk=user.pk)
+                    current.balance += Decimal('1.00')
+                    current.save(update_fields=['balance'])
+            finally:
+                close_old_connections()
+
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(worker, range(threads)))
+        final = User.objects.values_list('balance', flat=True).get(pk=user.pk)
+        return threads * per_thread - int(final)
@@ -0,0 +1,98 @@
+from django.core.management.base import BaseCommand
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+from django.db import close_old_connections
+from django.db.models import Count, Sum
+import threading
+from offers.benchmarks import isolated_database, create_fixture
+from offers.ledger import find_mismatches
+from offers.models import ClickTracking, Conversion, PostbackReceipt, SamplingDecision, generate_click_id
+from offers.postbacks import process_postback
+
+class Command(BaseCommand):
+    help = 'Fire every postback several times at once and check it is only counted once'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--clicks',
+            type=int,
+            default=30,
+            help='Distinct postbacks (one per click)',
+        )
+        parser.add_argument(
+            '--retries',
+            type=int,
+            default=8,
+            help='Concurrent copies of each postback',
+        )
+
+    def handle(self, *args, **options):
+        retries = options['retries']
+
+        with isolated_database():
+            network, users, offers = create_fixture(payout='10.00')
+            user, offer = users[0], offers[0]
+            clicks = [
+                ClickTracking(
+                    user=user,
+                    offer=offer,
+                    click_id=generate_click_id(user.id, offer.id),
+                    ip_address='203.0.113.1',
+                    country='US',
+                )
+                for _ in range(options['clicks'])
+            ]
+            ClickTracking.objects.bulk_create(clicks)
+
+            def send(args):
+                click, barrier = args
+                barrier.wait()
+                try:
+                    # Some networks upper-case the ID they echo back
+                    click_id = click.click_id if threading.get_ident() % 2 else click.click_id.upper()
+                    return process_postback({'network': network.network_key, 'subid': click_id, 'payout': '10'})
+                finally:
+                    close_old_connections()
+
+            outcomes = Counter()
+            with ThreadPoolExecutor(max_workers=retries) as pool:
+                for click in clicks:
+                    # All copies of one postback are released together
+                    barrier = threading.Barrier(retries)
+                    for data, status in pool.map(send, [(click, barrier)] * retries):
+                        outcomes[(status, data.get('message'))] += 1
+
+            for (status, message), count in sorted(outcomes.items()):
+                self.stdout.write(f'{count:5d} x {status} {message}')
+
+            failures = []
+            user.refresh_from_db()
+            doubled = (
+                Conversion.objects.order_by().values('click_tracking_id')
+                .annotate(total=Count('id')).filter(total__gt=1).count()
+            )
+            conversions = Conversion.objects.count()
+            counted = SamplingDecision.objects.count()
+            hits = PostbackReceipt.objects.aggregate(total=Sum('hits'))['total'] or 0
+
+            self.stdout.write(
+                f'{len(clicks)} clicks, {conversions} conversions, {counted} sampling decisions, '
+                f'balance ${user.balance}, {PostbackReceipt.objects.count()} receipts covering {hits} postbacks'
+            )
+            if doubled:
+                failures.append(f'{doubled} click(s) converted twice')
+            if counted != len(clicks):
+                failures.append(f'{counted} sampling decisions for {len(clicks)} clicks')
+            if user.balance != offer.payout * conversions:
+                failures.append(f'balance ${user.balance} != ${offer.payout * conversions}')
+            if hits != len(clicks) * retries:
+                failures.append(f'receipts cover {hits} of {len(clicks) * retries} postbacks')
+            if find_mismatches():
+                failures.append('balance does not match the ledger')
+            if any(status != 200 for status, _ in outcomes):
+                failures.append('some postbacks failed')
+
+        if failures:
+            self.stdout.write(self.style.ERROR('; '.join(failures)))
+        else:
+            self.stdout.write(self.style.SUCCESS('Every postback was counted exactly once'))
@@ -0,0 +1,113 @@
+from django.core.management.base import BaseCommand
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+from django.db import close_old_connections
+import time
+from offers.benchmarks import isolated_database, create_fixture
+from offers.models import ClickTracking, Conversion, SamplingDecision, SamplingRule, generate_click_id
+from offers.postbacks import process_postback
+from offers.sampling import sample_by_hash
+
+class Command(BaseCommand):
+    help = 'Send parallel postbacks under several sampling rules and check each ratio holds exactly'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--postbacks',
+            type=int,
+            default=600,
+            help='Postbacks sent (one per click)',
+        )
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=8,
+            help='Concurrent postback threads',
+        )
+
+    def handle(self, *args, **options):
+        count = options['postbacks']
+
+        with isolated_database():
+            network, users, offers = create_fixture(users=3, offers=2)
+            # The migration's default rule (skip 1 of 3 by counter) covers
+            # everything the rules below do not
+            default_rule = SamplingRule.objects.get(user=None, offer=None, cpa_network=None)
+            user_rule = SamplingRule.objects.create(user=users[0], method='counter', skip_count=2, window=5)
+            offer_rule = SamplingRule.objects.create(offer=offers[1], method='hash', skip_count=1, window=4)
+
+            clicks = [
+                ClickTracking(
+                    user=users[i % len(users)],
+                    offer=offers[(i // len(users)) % len(offers)],
+                    click_id=generate_click_id(users[i % len(users)].id, offers[(i // len(users)) % len(offers)].id),
+                    ip_address='203.0.113.1',
+                    country='US',
+                )
+                for i in range(count)
+            ]
+            ClickTracking.objects.bulk_create(clicks)
+
+            def send(click):
+                try:
+                    return process_postback({'network': network.network_key, 'subid': click.click_id, 'payout': '10'})[1]
+                finally:
+                    close_old_connections()
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+                statuses = Counter(pool.map(send, clicks))
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f'{count} postbacks in {elapsed:.2f}s ({count / elapsed:.0f}/s): '
+                + ', '.join(f'{total} x {status}' for status, total in sorted(statuses.items()))
+            )
+
+            failures = []
+            if set(statuses) != {200}:
+                failures.append('some postbacks failed')
+
+            decisions = list(SamplingDecision.objects.select_related('click_tracking'))
+            if len(decisions) != count:
+                failures.append(f'{len(decisions)} decisions for {count} clicks')
+            kept = sum(1 for decision in decisions if decision.kept)
+            conversions = Conversion.objects.count()
+            if conversions != kept:
+                failures.append(f'{conversions} conversions for {kept} kept decisions')
+
+            for rule in (default_rule, user_rule, offer_rule):
+                ruled = [decision for decision in decisions if decision.rule_id == rule.id]
+                filtered = sum(1 for decision in ruled if not decision.kept)
+                self.stdout.write(f'{rule}: {filtered} of {len(ruled)} filtered')
+                if rule.method == 'counter':
+                    failures.extend(self._check_counter(rule, ruled))
+                else:
+                    wrong = sum(
+                        1 for decision in ruled
+                        if sample_by_hash(rule, decision.click_tracking)[0] != decision.kept
+                    )
+                    if wrong:
+                        failures.append(f'{wrong} hash decisions differ on recomputation')
+
+        if failures:
+            self.stdout.write(self.style.ERROR('; '.join(failures)))
+        else:
+            self.stdout.write(self.style.SUCCESS('Every counter rule filtered exactly its configured share'))
+
+    def _check_counter(self, rule, decisions):
+        """Per affiliate, counter values must run 1..n and drop exactly skip_count per window"""
+        failures = []
+        by_user = {}
+        for decision in decisions:
+            by_user.setdefault(decision.click_tracking.user_id, []).append(decision)
+        for user_id, user_decisions in by_user.items():
+            n = len(user_decisions)
+            sequences = sorted(decision.sequence for decision in user_decisions)
+            if sequences != list(range(1, n + 1)):
+                failures.append(f'rule {rule.id}, user {user_id}: counter values are not 1..{n}')
+            expected = sum(1 for position in range(n) if position % rule.window >= rule.window - rule.skip_count)
+            filtered = sum(1 for decision in user_decisions if not decision.kept)
+            self.stdout.write(f'  user {user_id}: {filtered} of {n} filtered (expected {expected})')
+            if filtered != expected:
+                failures.append(f'rule {rule.id}, user {user_id}: {filtered} filtered, expected {expected}')
+        return failures
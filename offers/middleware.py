@@ -5,7 +5,12 @@ from .models import ReferralLink
 from django.http import HttpResponseForbidden
 from django.conf import settings
 from django.urls import reverse
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from contextlib import ExitStack
+from .query_profiler import QueryRecorder, get_query_profile
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -173,4 +178,41 @@ class TrackingDomainAccessMiddleware(MiddlewareMixin):
             raise Http404(f"Page not found on tracking domain {host}")
         
         # Access allowed, continue normally
-        return None 
\ No newline at end of file
+        return None
+
+
+class QueryProfilerMiddleware:
+    """
+    Record query count, SQL time, repeated queries and wall time per view
+
+    Opt-in with QUERY_PROFILER_ENABLED; when it is off Django drops the
+    middleware at startup, so it costs nothing. QUERY_PROFILER_SAMPLE_RATE
+    profiles only a share of requests. Results are shown on the staff page
+    at /admin-dashboard/queries/ (see offers.query_profiler).
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_PROFILER_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        rate = getattr(settings, 'QUERY_PROFILER_SAMPLE_RATE', 1.0)
+        self.every = max(1, round(1 / rate)) if rate > 0 else 0
+        self.seen = 0
+
+    def __call__(self, request):
+        self.seen += 1
+        if not self.every or self.seen % self.every:
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        wall_seconds = time.perf_counter() - started
+
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else f'unresolved {request.method}'
+        get_query_profile().record(view_name, recorder, wall_seconds)
+        return response
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:33
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('offers', '0022_cpanetwork_click_id_wrapper'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClickEnrichmentJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ip_address', models.GenericIPAddressField(verbose_name='Visitor IP Address')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('failed', 'Failed')], default='pending', max_length=20, verbose_name='Status')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Attempts')),
+                ('last_error', models.TextField(blank=True, null=True, verbose_name='Last Error')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Created At')),
+                ('click_tracking', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='enrichment_job', to='offers.clicktracking', verbose_name='Click Tracking')),
+            ],
+            options={
+                'verbose_name': 'Click Enrichment Job',
+                'verbose_name_plural': 'Click Enrichment Jobs',
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='offers_clic_status_39e36e_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:40
+
+from django.db import migrations, models
+from offers.redirect_templates import compile_redirect_template
+
+
+def compile_templates(apps, schema_editor):
+    Offer = apps.get_model('offers', 'Offer')
+    offers = list(Offer.objects.select_related('cpa_network'))
+    for offer in offers:
+        offer.redirect_template = compile_redirect_template(
+            offer.offer_url,
+            offer.cpa_network.click_id_parameter,
+            offer.cpa_network.click_id_wrapper,
+        )
+    Offer.objects.bulk_update(offers, ['redirect_template'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('offers', '0023_clickenrichmentjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='offer',
+            name='redirect_template',
+            field=models.TextField(blank=True, default='', editable=False, help_text='Offer URL with the click ID position marked; rebuilt on save', verbose_name='Redirect Template'),
+        ),
+        migrations.RunPython(compile_templates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('offers', '0024_offer_redirect_template'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClickFilterStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Date')),
+                ('reason', models.CharField(choices=[('bot', 'Bot User Agent'), ('blocked_asn', 'Blocked ASN'), ('duplicate', 'Duplicate Click'), ('flood', 'Click Flood')], max_length=20, verbose_name='Reason')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Count')),
+                ('offer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='offers.offer', verbose_name='Offer')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Click Filter Stat',
+                'verbose_name_plural': 'Click Filter Stats',
+                'ordering': ['-date', 'reason'],
+                'unique_together': {('date', 'user', 'offer', 'reason')},
+            },
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def record_opening_balances(apps, schema_editor):
+    """Start each user's ledger at their current balance"""
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    BalanceLedger = apps.get_model('offers', 'BalanceLedger')
+    entries = [
+        BalanceLedger(
+            user_id=user_id,
+            entry_type='opening_balance',
+            amount=balance,
+            description='Balance when the ledger was introduced',
+        )
+        for user_id, balance in User.objects.exclude(balance=0).values_list('id', 'balance').iterator()
+    ]
+    BalanceLedger.objects.bulk_create(entries, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('offers', '0025_clickfilterstat'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('user', '0008_alter_user_previous_is_active'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceLedger',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entry_type', models.CharField(choices=[('opening_balance', 'Opening Balance'), ('conversion_credit', 'Conversion Credit'), ('referral_credit', 'Referral Credit'), ('reversal', 'Reversal'), ('invoice_debit', 'Invoice Debit'), ('adjustment', 'Adjustment')], max_length=20, verbose_name='Entry Type')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Amount (USD)')),
+                ('description', models.CharField(blank=True, max_length=255, verbose_name='Description')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('conversion', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='offers.conversion', verbose_name='Conversion')),
+                ('invoice', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='offers.invoice', verbose_name='Invoice')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Balance Ledger Entry',
+                'verbose_name_plural': 'Balance Ledger',
+                'ordering': ['-created_at', '-id'],
+                'indexes': [models.Index(fields=['user', 'created_at'], name='offers_bala_user_id_c94313_idx')],
+            },
+        ),
+        migrations.RunPython(record_opening_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:53
+
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count
+
+
+def remove_duplicate_conversions(apps, schema_editor):
+    """
+    Keep the first conversion of each click and undo the rest
+
+    Duplicates come from concurrent postback retries; each one credited the
+    affiliate (and referrer) again, so those credits are reversed through the
+    ledger before the extra rows are deleted.
+    """
+    Conversion = apps.get_model('offers', 'Conversion')
+    ReferralEarning = apps.get_model('offers', 'ReferralEarning')
+    BalanceLedger = apps.get_model('offers', 'BalanceLedger')
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+
+    def reverse(user_id, amount, description):
+        balance = User.objects.values_list('balance', flat=True).get(pk=user_id)
+        applied = min(amount, balance)
+        if applied > 0:
+            User.objects.filter(pk=user_id).update(balance=balance - applied)
+            BalanceLedger.objects.create(user_id=user_id, entry_type='reversal', amount=-applied, description=description)
+
+    duplicated = (
+        Conversion.objects.order_by().values('click_tracking_id')
+        .annotate(total=Count('id')).filter(total__gt=1)
+        .values_list('click_tracking_id', flat=True)
+    )
+    for click_tracking_id in list(duplicated):
+        extras = list(
+            Conversion.objects.filter(click_tracking_id=click_tracking_id)
+            .select_related('click_tracking').order_by('id')[1:]
+        )
+        for conversion in extras:
+            if conversion.status == 'approved':
+                reverse(conversion.click_tracking.user_id, conversion.payout, f'Duplicate conversion {conversion.id} removed')
+            for earning in ReferralEarning.objects.filter(conversion=conversion).select_related('referral'):
+                reverse(earning.referral.referrer_id, earning.amount, f'Duplicate conversion {conversion.id} removed')
+            conversion.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('offers', '0026_balanceledger'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_conversions, migrations.RunPython.noop),
+    ]
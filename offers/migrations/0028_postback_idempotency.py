@@ -0,0 +1,42 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('offers', '0027_remove_duplicate_conversions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostbackReceipt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True, verbose_name='Idempotency Key')),
+                ('network_key', models.CharField(max_length=100, verbose_name='Network Key')),
+                ('click_id', models.CharField(max_length=100, verbose_name='Click ID')),
+                ('response', models.JSONField(blank=True, null=True, verbose_name='Response')),
+                ('status_code', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Status Code')),
+                ('hits', models.PositiveIntegerField(default=1, verbose_name='Times Received')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='First Received')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Last Received')),
+            ],
+            options={
+                'verbose_name': 'Postback Receipt',
+                'verbose_name_plural': 'Postback Receipts',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='conversion',
+            constraint=models.UniqueConstraint(fields=('click_tracking',), name='unique_conversion_per_click'),
+        ),
+        migrations.AddField(
+            model_name='postbackreceipt',
+            name='conversion',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='postback_receipts', to='offers.conversion', verbose_name='Conversion'),
+        ),
+    ]
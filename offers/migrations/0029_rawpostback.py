@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:56
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('offers', '0028_postback_idempotency'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RawPostback',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('params', models.JSONField(verbose_name='Parameters')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=20, verbose_name='Status')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Attempts')),
+                ('status_code', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Status Code')),
+                ('response', models.JSONField(blank=True, null=True, verbose_name='Response')),
+                ('last_error', models.TextField(blank=True, null=True, verbose_name='Last Error')),
+                ('received_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Received At')),
+                ('claimed_at', models.DateTimeField(blank=True, null=True, verbose_name='Claimed At')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='Processed At')),
+            ],
+            options={
+                'verbose_name': 'Raw Postback',
+                'verbose_name_plural': 'Raw Postbacks',
+                'ordering': ['received_at'],
+                'indexes': [models.Index(fields=['status', 'received_at'], name='offers_rawp_status_0cec93_idx')],
+            },
+        ),
+    ]
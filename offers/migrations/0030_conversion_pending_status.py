@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('offers', '0029_rawpostback'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='conversion',
+            name='status',
+            field=models.CharField(choices=[('approved', 'Approved'), ('pending', 'Pending'), ('rejected', 'Rejected')], default='approved', max_length=20, verbose_name='Status'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:03
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('offers', '0030_conversion_pending_status'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversionStatusJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('new_status', models.CharField(choices=[('approved', 'Approved'), ('pending', 'Pending'), ('rejected', 'Rejected')], max_length=20, verbose_name='New Conversion Status')),
+                ('conversion_ids', models.JSONField(verbose_name='Conversion IDs')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=20, verbose_name='Status')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='Selected')),
+                ('processed', models.PositiveIntegerField(default=0, verbose_name='Processed')),
+                ('changed', models.PositiveIntegerField(default=0, verbose_name='Changed')),
+                ('last_error', models.TextField(blank=True, null=True, verbose_name='Last Error')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Created At')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Started At')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Finished At')),
+                ('requested_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='conversion_status_jobs', to=settings.AUTH_USER_MODEL, verbose_name='Requested By')),
+            ],
+            options={
+                'verbose_name': 'Conversion Status Job',
+                'verbose_name_plural': 'Conversion Status Jobs',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:07
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_default_rule(apps, schema_editor):
+    """Keep filtering every third conversion, continuing each affiliate's count"""
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    SamplingRule = apps.get_model('offers', 'SamplingRule')
+    SamplingCounter = apps.get_model('offers', 'SamplingCounter')
+    rule = SamplingRule.objects.create(method='counter', skip_count=1, window=3)
+    counters = [
+        SamplingCounter(rule=rule, user_id=user_id, value=counter)
+        for user_id, counter in User.objects.exclude(conversion_counter=0).values_list('id', 'conversion_counter').iterator()
+    ]
+    SamplingCounter.objects.bulk_create(counters, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('offers', '0031_conversionstatusjob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SamplingRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('method', models.CharField(choices=[('counter', 'Counter (exact ratio per affiliate)'), ('hash', 'Click ID hash (no shared state)')], default='counter', max_length=20, verbose_name='Method')),
+                ('skip_count', models.PositiveSmallIntegerField(default=1, help_text='Conversions filtered out per window', verbose_name='Skipped')),
+                ('window', models.PositiveSmallIntegerField(default=3, help_text='Conversions per window (1 skipped of 3 = every third conversion)', verbose_name='Window')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Is Active')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+                ('cpa_network', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sampling_rules', to='offers.cpanetwork', verbose_name='CPA Network')),
+                ('offer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sampling_rules', to='offers.offer', verbose_name='Offer')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sampling_rules', to=settings.AUTH_USER_MODEL, verbose_name='Affiliate User')),
+            ],
+            options={
+                'verbose_name': 'Sampling Rule',
+                'verbose_name_plural': 'Sampling Rules',
+                'ordering': ['-is_active', 'id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SamplingDecision',
+            fields=[
+                ('click_tracking', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='sampling_decision', serialize=False, to='offers.clicktracking', verbose_name='Click Tracking')),
+                ('sequence', models.PositiveIntegerField(blank=True, null=True, verbose_name='Counter Value')),
+                ('kept', models.BooleanField(verbose_name='Kept')),
+                ('decided_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Decided At')),
+                ('rule', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='decisions', to='offers.samplingrule', verbose_name='Sampling Rule')),
+            ],
+            options={
+                'verbose_name': 'Sampling Decision',
+                'verbose_name_plural': 'Sampling Decisions',
+                'ordering': ['-decided_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SamplingCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.PositiveIntegerField(default=0, verbose_name='Postbacks Counted')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sampling_counters', to=settings.AUTH_USER_MODEL, verbose_name='Affiliate User')),
+                ('rule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='counters', to='offers.samplingrule', verbose_name='Sampling Rule')),
+            ],
+            options={
+                'verbose_name': 'Sampling Counter',
+                'verbose_name_plural': 'Sampling Counters',
+                'constraints': [models.UniqueConstraint(fields=('rule', 'user'), name='unique_sampling_counter')],
+            },
+        ),
+        migrations.RunPython(create_default_rule, migrations.RunPython.noop),
+    ]
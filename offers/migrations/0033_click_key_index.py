@@ -0,0 +1,25 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:14
+
+import offers.click_ids
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('offers', '0032_sampling_rules'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='conversion',
+            name='network_click_id',
+            field=models.CharField(blank=True, db_index=True, max_length=100, null=True, verbose_name='Network Click ID'),
+        ),
+        migrations.AddIndex(
+            model_name='clicktracking',
+            index=models.Index(offers.click_ids.ClickKey('click_id'), name='offers_click_key_idx'),
+        ),
+    ]
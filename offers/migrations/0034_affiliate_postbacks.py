@@ -0,0 +1,91 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:17
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('offers', '0033_click_key_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AffiliatePostback',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.CharField(help_text='Macros: {click_id}, {subid1}, {subid2}, {subid3}, {payout}, {offer_id}, {conversion_id}, {status}', max_length=1000, verbose_name='Postback URL')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Is Active')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+                ('offer', models.ForeignKey(blank=True, help_text='Leave empty for all offers', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='affiliate_postbacks', to='offers.offer', verbose_name='Offer')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='affiliate_postbacks', to=settings.AUTH_USER_MODEL, verbose_name='Affiliate User')),
+            ],
+            options={
+                'verbose_name': 'Affiliate Postback',
+                'verbose_name_plural': 'Affiliate Postbacks',
+                'ordering': ['user', 'offer'],
+            },
+        ),
+        migrations.CreateModel(
+            name='OutboundPostback',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.CharField(max_length=2000, verbose_name='URL')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent')], default='pending', max_length=20, verbose_name='Status')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Attempts')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Next Attempt At')),
+                ('claimed_at', models.DateTimeField(blank=True, null=True, verbose_name='Claimed At')),
+                ('status_code', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Last Status Code')),
+                ('last_error', models.TextField(blank=True, null=True, verbose_name='Last Error')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Created At')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Sent At')),
+                ('affiliate_postback', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='deliveries', to='offers.affiliatepostback', verbose_name='Affiliate Postback')),
+                ('conversion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='outbound_postbacks', to='offers.conversion', verbose_name='Conversion')),
+            ],
+            options={
+                'verbose_name': 'Outbound Postback',
+                'verbose_name_plural': 'Outbound Postbacks',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='OutboundPostbackDeadLetter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.CharField(max_length=2000, verbose_name='URL')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Attempts')),
+                ('status_code', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Last Status Code')),
+                ('last_error', models.TextField(blank=True, null=True, verbose_name='Last Error')),
+                ('created_at', models.DateTimeField(verbose_name='Created At')),
+                ('failed_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Failed At')),
+                ('affiliate_postback', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='dead_letters', to='offers.affiliatepostback', verbose_name='Affiliate Postback')),
+                ('conversion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='outbound_dead_letters', to='offers.conversion', verbose_name='Conversion')),
+            ],
+            options={
+                'verbose_name': 'Outbound Postback Dead Letter',
+                'verbose_name_plural': 'Outbound Postback Dead Letters',
+                'ordering': ['-failed_at'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='affiliatepostback',
+            constraint=models.UniqueConstraint(fields=('user', 'offer'), name='unique_affiliate_postback_per_offer'),
+        ),
+        migrations.AddConstraint(
+            model_name='affiliatepostback',
+            constraint=models.UniqueConstraint(condition=models.Q(('offer__isnull', True)), fields=('user',), name='unique_affiliate_postback_default'),
+        ),
+        migrations.AddIndex(
+            model_name='outboundpostback',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='offers_outb_status_562fbe_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='outboundpostback',
+            constraint=models.UniqueConstraint(fields=('affiliate_postback', 'conversion'), name='unique_outbound_postback'),
+        ),
+    ]
@@ -0,0 +1,123 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:20
+
+import datetime
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+# Days rolled up per pair of grouped queries
+CHUNK_DAYS = 30
+
+
+def backfill_daily_stats(apps, schema_editor):
+    """Roll up the clicks and conversions recorded before DailyStat existed"""
+    ClickTracking = apps.get_model('offers', 'ClickTracking')
+    Conversion = apps.get_model('offers', 'Conversion')
+    DailyStat = apps.get_model('offers', 'DailyStat')
+
+    firsts = [
+        value for value in (
+            ClickTracking.objects.aggregate(first=Min('click_date'))['first'],
+            Conversion.objects.aggregate(first=Min('conversion_date'))['first'],
+        )
+        if value is not None
+    ]
+    if not firsts:
+        return
+    first = min(firsts)
+    day = timezone.localdate(first) if timezone.is_aware(first) else first.date()
+    tz = timezone.get_current_timezone()
+    today = timezone.localdate()
+
+    while day <= today:
+        chunk_end = day + datetime.timedelta(days=CHUNK_DAYS)
+        start = timezone.make_aware(datetime.datetime.combine(day, datetime.time.min), tz)
+        end = timezone.make_aware(datetime.datetime.combine(chunk_end, datetime.time.min), tz)
+        rows = {}
+
+        def row(date, user_id, offer_id, subid1, subid2, subid3):
+            key = (date, user_id, offer_id, subid1 or '', subid2 or '', subid3 or '')
+            return rows.setdefault(key, {'clicks': 0, 'conversions': 0, 'rejected': 0, 'earnings': Decimal('0.00')})
+
+        clicks = (
+            ClickTracking.objects.filter(click_date__gte=start, click_date__lt=end)
+            .annotate(day=TruncDate('click_date'))
+            .order_by()
+            .values_list('day', 'user_id', 'offer_id', 'subid1', 'subid2', 'subid3')
+            .annotate(total=Count('id'))
+        )
+        for date, user_id, offer_id, subid1, subid2, subid3, total in clicks:
+            row(date, user_id, offer_id, subid1, subid2, subid3)['clicks'] = total
+
+        conversions = (
+            Conversion.objects.filter(conversion_date__gte=start, conversion_date__lt=end)
+            .annotate(day=TruncDate('conversion_date'))
+            .order_by()
+            .values_list(
+                'day', 'click_tracking__user_id', 'click_tracking__offer_id',
+                'click_tracking__subid1', 'click_tracking__subid2', 'click_tracking__subid3',
+            )
+            .annotate(
+                approved=Count('id', filter=Q(status='approved')),
+                rejected=Count('id', filter=Q(status='rejected')),
+                earnings=Sum('payout', filter=Q(status='approved')),
+            )
+        )
+        for date, user_id, offer_id, subid1, subid2, subid3, approved, rejected, earnings in conversions:
+            measures = row(date, user_id, offer_id, subid1, subid2, subid3)
+            measures['conversions'] = approved
+            measures['rejected'] = rejected
+            measures['earnings'] = earnings or Decimal('0.00')
+
+        DailyStat.objects.bulk_create(
+            [
+                DailyStat(
+                    date=date, user_id=user_id, offer_id=offer_id,
+                    subid1=subid1, subid2=subid2, subid3=subid3,
+                    **measures
+                )
+                for (date, user_id, offer_id, subid1, subid2, subid3), measures in rows.items()
+                if any(measures.values())
+            ],
+            batch_size=1000,
+        )
+        day = chunk_end
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('offers', '0034_affiliate_postbacks'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Date')),
+                ('subid1', models.CharField(blank=True, default='', max_length=100, verbose_name='Subid 1')),
+                ('subid2', models.CharField(blank=True, default='', max_length=100, verbose_name='Subid 2')),
+                ('subid3', models.CharField(blank=True, default='', max_length=100, verbose_name='Subid 3')),
+                ('clicks', models.IntegerField(default=0, verbose_name='Clicks')),
+                ('conversions', models.IntegerField(default=0, verbose_name='Approved Conversions')),
+                ('rejected', models.IntegerField(default=0, verbose_name='Rejected Conversions')),
+                ('earnings', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Earnings (USD)')),
+                ('offer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='offers.offer', verbose_name='Offer')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to=settings.AUTH_USER_MODEL, verbose_name='Affiliate User')),
+            ],
+            options={
+                'verbose_name': 'Daily Stat',
+                'verbose_name_plural': 'Daily Stats',
+                'ordering': ['-date'],
+                'constraints': [models.UniqueConstraint(fields=('user', 'date', 'offer', 'subid1', 'subid2', 'subid3'), name='unique_daily_stat')],
+            },
+        ),
+        migrations.RunPython(backfill_daily_stats, migrations.RunPython.noop),
+    ]
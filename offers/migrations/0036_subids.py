@@ -0,0 +1,89 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:29
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max, Min, OuterRef, Subquery
+from django.utils import timezone
+
+
+def link_existing_subids(apps, schema_editor):
+    """Create the SubId rows of the clicks recorded so far and point the clicks at them"""
+    ClickTracking = apps.get_model('offers', 'ClickTracking')
+    SubId = apps.get_model('offers', 'SubId')
+    for slot in (1, 2, 3):
+        field = f'subid{slot}'
+        used = (
+            ClickTracking.objects.filter(**{f'{field}__gt': ''})
+            .order_by()
+            .values_list('user_id', field)
+            .annotate(first=Min('click_date'), last=Max('click_date'))
+        )
+        SubId.objects.bulk_create(
+            [
+                SubId(
+                    user_id=user_id, slot=slot, value=value,
+                    first_seen=first or timezone.now(), last_seen=last or timezone.now(),
+                )
+                for user_id, value, first, last in used.iterator()
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+        ClickTracking.objects.filter(**{f'{field}__gt': ''}).update(**{
+            f'{field}_ref': Subquery(
+                SubId.objects.filter(user_id=OuterRef('user_id'), slot=slot, value=OuterRef(field)).values('id')[:1]
+            ),
+        })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('offers', '0035_daily_stats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubId',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.PositiveSmallIntegerField(choices=[(1, 'Subid 1'), (2, 'Subid 2'), (3, 'Subid 3')], verbose_name='Slot')),
+                ('value', models.CharField(max_length=100, verbose_name='Value')),
+                ('first_seen', models.DateTimeField(default=django.utils.timezone.now, verbose_name='First Seen')),
+                ('last_seen', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Last Seen')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='subids', to=settings.AUTH_USER_MODEL, verbose_name='Affiliate User')),
+            ],
+            options={
+                'verbose_name': 'Sub ID',
+                'verbose_name_plural': 'Sub IDs',
+                'ordering': ['value', 'slot'],
+            },
+        ),
+        migrations.AddField(
+            model_name='clicktracking',
+            name='subid1_ref',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='offers.subid', verbose_name='Subid 1 Ref'),
+        ),
+        migrations.AddField(
+            model_name='clicktracking',
+            name='subid2_ref',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='offers.subid', verbose_name='Subid 2 Ref'),
+        ),
+        migrations.AddField(
+            model_name='clicktracking',
+            name='subid3_ref',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='offers.subid', verbose_name='Subid 3 Ref'),
+        ),
+        migrations.AddIndex(
+            model_name='subid',
+            index=models.Index(fields=['user', 'value'], name='offers_subi_user_id_a3c83c_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='subid',
+            constraint=models.UniqueConstraint(fields=('user', 'slot', 'value'), name='unique_subid'),
+        ),
+        migrations.RunPython(link_existing_subids, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('offers', '0036_subids'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clickenrichmentjob',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Claimed At'),
+        ),
+        migrations.AlterField(
+            model_name='clickenrichmentjob',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('failed', 'Failed')], default='pending', max_length=20, verbose_name='Status'),
+        ),
+    ]
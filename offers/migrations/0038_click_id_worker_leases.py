@@ -0,0 +1,25 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('offers', '0037_enrichment_job_claims'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClickIdWorkerLease',
+            fields=[
+                ('worker_id', models.PositiveSmallIntegerField(primary_key=True, serialize=False, verbose_name='Worker ID')),
+                ('owner', models.CharField(max_length=255, verbose_name='Owner')),
+                ('expires_at', models.DateTimeField(verbose_name='Expires At')),
+            ],
+            options={
+                'verbose_name': 'Click ID Worker Lease',
+                'verbose_name_plural': 'Click ID Worker Leases',
+            },
+        ),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 from django import forms
 from user.models import User
@@ -7,16 +7,16 @@ import datetime
 import requests
 import json
 import logging
+from .click_ids import ClickKey
+from .redirect_templates import compile_redirect_template, format_click_id_macro, render_redirect_url
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
 def generate_click_id(user_id, offer_id):
-    """Generate unique click ID"""
-    now = timezone.now()
-    date_str = now.strftime('%Y%m%d')
-    time_str = now.strftime('%H%M%S')
-    return f"{user_id}-{offer_id}-{time_str}-{date_str}"
+    """Generate unique click ID (see offers.click_ids for the format)"""
+    from .click_ids import get_click_id_generator
+    return get_click_id_generator().next_id(user_id, offer_id)
 
 class SiteSettings(models.Model):
     """Site configuration settings"""
@@ -110,25 +110,31 @@ class CPANetwork(models.Model):
     def __str__(self):
         return f"{self.name} ({self.network_key})"
     
-    def get_postback_url(self, site_settings):
-        """Generate postback URL with prefilled parameters"""
+    def save(self, *args, **kwargs):
+        """Override save to recompile the redirect templates of this network's offers"""
+        is_new = self.pk is None
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if not is_new:
+                offers = list(self.offer_set.only('id', 'offer_url'))
+                for offer in offers:
+                    offer.redirect_template = compile_redirect_template(
+                        offer.offer_url, self.click_id_parameter, self.click_id_wrapper
+                    )
+                Offer.objects.bulk_update(offers, ['redirect_template'], batch_size=500)
+    
+    def get_postback_url(self, site_settings=None):
+        """Generate postback URL with prefilled parameters (site settings default to the active ones)"""
+        if site_settings is None:
+            from .network_registry import get_site_settings
+            site_settings = get_site_settings()
         if not site_settings:
             return ""
         
         base_url = f"{site_settings.site_url}/offers/postback/?network={self.network_key}"
         
         # Use the wrapper to format the click ID parameter
-        if len(self.click_id_wrapper) == 2:
-            # Two-character wrapper like {} or # or []
-            start_wrapper = self.click_id_wrapper[0]
-            end_wrapper = self.click_id_wrapper[1]
-            formatted_click_id = f"{start_wrapper}{self.click_id_parameter}{end_wrapper}"
-        elif len(self.click_id_wrapper) == 1:
-            # Single character wrapper like # or *
-            formatted_click_id = f"{self.click_id_wrapper}{self.click_id_parameter}{self.click_id_wrapper}"
-        else:
-            # Default to {} if wrapper is invalid
-            formatted_click_id = f"{{{self.click_id_parameter}}}"
+        formatted_click_id = format_click_id_macro(self.click_id_parameter, self.click_id_wrapper)
         
         postback_url = f"{base_url}&{self.postback_click_id_parameter}={formatted_click_id}"
         return postback_url
@@ -177,6 +183,13 @@ class Offer(models.Model):
         help_text="URL from the third-party CPA network",
         default="https://www.demourl.com"
     )
+    redirect_template = models.TextField(
+        blank=True,
+        default='',
+        editable=False,
+        verbose_name="Redirect Template",
+        help_text="Offer URL with the click ID position marked; rebuilt on save"
+    )
     need_approval = models.BooleanField(default=True, verbose_name="Needs Approval")
     is_active = models.BooleanField(default=True, verbose_name="Is Active")
     
@@ -226,7 +239,7 @@ class Offer(models.Model):
         ordering = ['-created_at']
     
     def __str__(self):
-        return f"{self.offer_name} ({self.cpa_network.name})"
+        return f"{self.offer_name} ({self.get_network().name})"
     
     def get_countries_display(self):
         """Return human-readable country names"""
@@ -288,34 +301,32 @@ class Offer(models.Model):
         domains = getattr(settings, 'TRACKING_DOMAINS', ['http://localhost:8000'])
         return [f"{domain}/offer/?userid={user_id}&offerid={self.id}" for domain in domains]
     
+    def get_network(self):
+        """Return the offer's CPA network, from the network registry unless already loaded"""
+        if Offer.cpa_network.is_cached(self):
+            return self.cpa_network
+        from .network_registry import get_network
+        return get_network(self.cpa_network_id) or self.cpa_network
+    
+    def compile_redirect_template(self):
+        """Compile this offer's redirect template from its URL and network"""
+        network = self.get_network()
+        return compile_redirect_template(self.offer_url, network.click_id_parameter, network.click_id_wrapper)
+    
+    def save(self, *args, **kwargs):
+        """Override save to rebuild the redirect template"""
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'offer_url', 'cpa_network'} & set(update_fields):
+            self.redirect_template = self.compile_redirect_template()
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'redirect_template'}
+        
+        super().save(*args, **kwargs)
+    
     def build_redirect_url(self, click_id):
         """Build redirect URL with click ID for the specific CPA network"""
-        from urllib.parse import urlencode, urlparse, parse_qs
-        
-        # Debug info
-        print(f"Building redirect URL for offer: {self.offer_name}")
-        print(f"CPA Network: {self.cpa_network.name if self.cpa_network else 'None'}")
-        print(f"Click ID Parameter: '{self.cpa_network.click_id_parameter if self.cpa_network else 'None'}'")
-        print(f"Original URL: {self.offer_url}")
-        
-        # Determine the click ID parameter to use
-        if not self.cpa_network or not self.cpa_network.click_id_parameter:
-            click_param_name = 'subid'
-            print(f"Using fallback parameter: {click_param_name}")
-        else:
-            click_param_name = self.cpa_network.click_id_parameter
-            print(f"Using network parameter: {click_param_name}")
-        
-        # Simple approach: just append the parameter
-        separator = '&' if '?' in self.offer_url else '?'
-        final_url = f"{self.offer_url}{separator}{click_param_name}={click_id}"
-        
-        print(f"Final URL: {final_url}")
-        print(f"URL length: {len(final_url)}")
-        print(f"Contains click ID: {'click_id' in final_url}")
-        print(f"Contains parameter: '{click_param_name}' in final_url: {'{click_param_name}' in final_url}")
-        
-        return final_url
+        template = self.redirect_template or self.compile_redirect_template()
+        return render_redirect_url(template, click_id)
 
 
 class UserOfferRequest(models.Model):
@@ -356,6 +367,43 @@ class UserOfferRequest(models.Model):
             return "bg-danger"
 
 
+class SubId(models.Model):
+    """
+    A subid value an affiliate has sent in one of the three subid slots
+
+    Clicks point at their subids through subid1_ref/subid2_ref/subid3_ref,
+    so the report filters are index lookups on those foreign keys and the
+    subid dropdowns read this table instead of scanning clicks. Rows are
+    created at click time by offers.subids; last_seen is kept to the day.
+    """
+    SLOT_CHOICES = [
+        (1, 'Subid 1'),
+        (2, 'Subid 2'),
+        (3, 'Subid 3'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='subids', verbose_name="Affiliate User")
+    slot = models.PositiveSmallIntegerField(choices=SLOT_CHOICES, verbose_name="Slot")
+    value = models.CharField(max_length=100, verbose_name="Value")
+    first_seen = models.DateTimeField(default=timezone.now, verbose_name="First Seen")
+    last_seen = models.DateTimeField(default=timezone.now, verbose_name="Last Seen")
+
+    class Meta:
+        verbose_name = "Sub ID"
+        verbose_name_plural = "Sub IDs"
+        ordering = ['value', 'slot']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'slot', 'value'], name='unique_subid'),
+        ]
+        indexes = [
+            # The dropdowns and filters look values up across slots
+            models.Index(fields=['user', 'value']),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}: {self.value} (slot {self.slot})"
+
+
 class ClickTracking(models.Model):
     """Track offer clicks for analytics and commission tracking"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="Affiliate User")
@@ -378,6 +426,10 @@ class ClickTracking(models.Model):
     subid1 = models.CharField(max_length=100, verbose_name="Subid 1", blank=True, null=True, help_text="Optional subid parameter 1")
     subid2 = models.CharField(max_length=100, verbose_name="Subid 2", blank=True, null=True, help_text="Optional subid parameter 2")
     subid3 = models.CharField(max_length=100, verbose_name="Subid 3", blank=True, null=True, help_text="Optional subid parameter 3")
+    # The same subids as SubId rows, set by offers.subids when the click is written
+    subid1_ref = models.ForeignKey(SubId, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="Subid 1 Ref")
+    subid2_ref = models.ForeignKey(SubId, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="Subid 2 Ref")
+    subid3_ref = models.ForeignKey(SubId, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="Subid 3 Ref")
     
     class Meta:
         verbose_name = "Click Tracking"
@@ -388,6 +440,9 @@ class ClickTracking(models.Model):
             models.Index(fields=['click_date']),
             models.Index(fields=['ip_address']),
             models.Index(fields=['click_id']),
+            # Case-insensitive prefix key for postbacks whose click ID was
+            # truncated or re-cased by the network (see offers.click_lookup)
+            models.Index(ClickKey('click_id'), name='offers_click_key_idx'),
         ]
     
     def __str__(self):
@@ -406,6 +461,97 @@ class ClickTracking(models.Model):
         super().save(*args, **kwargs)
 
 
+class ClickEnrichmentJob(models.Model):
+    """
+    Pending geo lookup for a click
+
+    track_click only queues one of these so the redirect never waits on the
+    geo provider. The process_click_enrichment command drains the queue,
+    fills in the location fields on ClickTracking and deletes the job.
+    Jobs that keep failing are kept with status 'failed' for inspection.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('failed', 'Failed'),
+    ]
+
+    click_tracking = models.OneToOneField(
+        ClickTracking,
+        on_delete=models.CASCADE,
+        related_name='enrichment_job',
+        verbose_name="Click Tracking"
+    )
+    ip_address = models.GenericIPAddressField(verbose_name="Visitor IP Address")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name="Status")
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name="Attempts")
+    last_error = models.TextField(blank=True, null=True, verbose_name="Last Error")
+    created_at = models.DateTimeField(default=timezone.now, verbose_name="Created At")
+    claimed_at = models.DateTimeField(null=True, blank=True, verbose_name="Claimed At")
+
+    class Meta:
+        verbose_name = "Click Enrichment Job"
+        verbose_name_plural = "Click Enrichment Jobs"
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.click_tracking_id} - {self.ip_address} ({self.status})"
+
+
+class ClickIdWorkerLease(models.Model):
+    """
+    Click ID worker id held by a running process
+
+    Each process issuing click IDs claims a free worker id here at first use
+    and keeps extending expires_at while it runs (see offers.click_ids); a
+    row past expires_at belongs to a process that died and may be taken over.
+    """
+    worker_id = models.PositiveSmallIntegerField(primary_key=True, verbose_name="Worker ID")
+    owner = models.CharField(max_length=255, verbose_name="Owner")
+    expires_at = models.DateTimeField(verbose_name="Expires At")
+
+    class Meta:
+        verbose_name = "Click ID Worker Lease"
+        verbose_name_plural = "Click ID Worker Leases"
+
+    def __str__(self):
+        return f"{self.worker_id} - {self.owner}"
+
+
+class ClickFilterStat(models.Model):
+    """
+    Daily count of tracking-link hits that did not become a ClickTracking row
+
+    Filtered hits (crawlers, blocked networks, repeat clicks and click floods)
+    are only counted; track_click keeps the counters in memory and adds them
+    to these rows periodically (see offers.click_filters).
+    """
+    REASON_CHOICES = [
+        ('bot', 'Bot User Agent'),
+        ('blocked_asn', 'Blocked ASN'),
+        ('duplicate', 'Duplicate Click'),
+        ('flood', 'Click Flood'),
+    ]
+
+    date = models.DateField(verbose_name="Date")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="User")
+    offer = models.ForeignKey('Offer', on_delete=models.CASCADE, verbose_name="Offer")
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES, verbose_name="Reason")
+    count = models.PositiveIntegerField(default=0, verbose_name="Count")
+
+    class Meta:
+        verbose_name = "Click Filter Stat"
+        verbose_name_plural = "Click Filter Stats"
+        ordering = ['-date', 'reason']
+        unique_together = ['date', 'user', 'offer', 'reason']
+
+    def __str__(self):
+        return f"{self.date} - {self.user_id}/{self.offer_id} - {self.reason}: {self.count}"
+
+
 class Conversion(models.Model):
     """
     Track conversions from CPA networks
@@ -413,15 +559,17 @@ class Conversion(models.Model):
     This model automatically updates the user's balance when:
     - A new conversion is created with 'approved' status (adds the offer's payout amount)
     - An existing conversion's status changes to 'approved' (adds the offer's payout amount)
-    - An existing conversion's status changes from 'approved' to 'rejected' (subtracts the offer's payout amount)
-    - An existing conversion's status changes from 'rejected' to 'approved' (adds the offer's payout amount)
+    - An existing conversion's status changes from 'approved' to 'rejected' or 'pending'
+      (subtracts the offer's payout amount)
     
     The balance updates use the offer's payout amount (set in admin panel) NOT the network payout.
-    The balance updates are handled in the save() method and use the User.add_to_balance() method
-    for safe balance updates with proper logging.
+    They are made by save() through offers.accounting, which applies the balance, referral
+    earning and notification changes of a status transition with a fixed number of queries;
+    each balance change is recorded in the BalanceLedger.
     """
     STATUS_CHOICES = [
         ('approved', 'Approved'),
+        ('pending', 'Pending'),
         ('rejected', 'Rejected'),
     ]
     
@@ -429,152 +577,387 @@ class Conversion(models.Model):
     conversion_date = models.DateTimeField(default=timezone.now, verbose_name="Conversion Date")
     payout = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Payout (USD)")
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='approved', verbose_name="Status")
-    network_click_id = models.CharField(max_length=100, blank=True, null=True, verbose_name="Network Click ID")
+    network_click_id = models.CharField(max_length=100, blank=True, null=True, db_index=True, verbose_name="Network Click ID")
     network_payout = models.CharField(max_length=100, blank=True, null=True, verbose_name="Network Payout")
     
     class Meta:
         verbose_name = "Conversion"
         verbose_name_plural = "Conversions"
         ordering = ['-conversion_date']
+        constraints = [
+            # A click converts at most once, however often the network retries
+            models.UniqueConstraint(fields=['click_tracking'], name='unique_conversion_per_click'),
+        ]
     
     def __str__(self):
         return f"{self.click_tracking.offer.offer_name} - ${self.payout} - {self.status.upper()} - {self.conversion_date.strftime('%Y-%m-%d')}"
     
     def save(self, *args, **kwargs):
-        """Override save method to handle balance updates and referral earnings"""
-        # Get the offer's payout amount (the amount set in admin panel)
-        offer_payout = self.click_tracking.offer.payout
-        
-        # Check if this is a new conversion or an update
-        if self.pk:
-            # This is an update - check if status changed
-            try:
-                old_conversion = Conversion.objects.get(pk=self.pk)
-                old_status = old_conversion.status
-                
-                # Handle status changes
-                if old_status != self.status:
-                    if old_status == 'approved' and self.status == 'rejected':
-                        # Status changed from approved to rejected - deduct balance
-                        user = self.click_tracking.user
-                        user.add_to_balance(-offer_payout)
-                        logger.info(f"Conversion rejected: User {user.id} balance decreased by {offer_payout} (offer payout)")
-                        
-                        # Handle referral earnings reversal
-                        self._handle_referral_earnings_reversal()
-                        
-                        # Create notification for lead rejection
-                        Notification.create_notification(
-                            user=user,
-                            notification_type='lead_rejected',
-                            title='Lead Rejected ❌',
-                            message=f'Your conversion for "{self.click_tracking.offer.offer_name}" has been rejected. The payout of ${offer_payout} has been deducted from your balance. Please ensure you follow the offer requirements to avoid rejections.',
-                            related_object=self
-                        )
-                        
-                    elif old_status == 'rejected' and self.status == 'approved':
-                        # Status changed from rejected to approved - add balance
-                        user = self.click_tracking.user
-                        user.add_to_balance(offer_payout)
-                        logger.info(f"Conversion approved: User {user.id} balance increased by {offer_payout} (offer payout)")
-                        
-                    else:
-                        user = self.click_tracking.user
-                        logger.info(f"Conversion updated: User {user.id} balance unchanged (status: {old_status} -> {self.status})")
-            except Conversion.DoesNotExist:
-                # This shouldn't happen, but handle it gracefully
-                pass
-        else:
-            # This is a new conversion - add the offer payout if status is approved
-            if self.status == 'approved' and offer_payout > 0:
-                user = self.click_tracking.user
-                user.add_to_balance(offer_payout)
-                logger.info(f"New conversion approved: User {user.id} balance increased by {offer_payout} (offer payout)")
-                
-            else:
-                user = self.click_tracking.user
-                logger.info(f"New conversion created: User {user.id} balance unchanged (status: {self.status}, offer payout: {offer_payout})")
-        
-        # Call the parent save method first
-        super().save(*args, **kwargs)
-        
-        # Handle referral earnings after the conversion is saved (so it has an ID)
-        if self.status == 'approved':
-            self._handle_referral_earnings()
-    
-    def _handle_referral_earnings(self):
-        """Handle referral earnings for this conversion"""
-        try:
-            # Check if the user was referred by someone
-            referral = Referral.objects.filter(referred_user=self.click_tracking.user, is_active=True).first()
-            
-            if referral:
-                logger.info(f"Found referral for user {self.click_tracking.user.id}: {referral.id}")
-                
-                # Get site settings for referral percentage
-                site_settings = SiteSettings.get_settings()
-                if site_settings and site_settings.referral_percentage > 0:
-                    # Calculate referral earning
-                    referral_amount = (self.click_tracking.offer.payout * site_settings.referral_percentage) / 100
-                    
-                    logger.info(f"Calculated referral amount: ${referral_amount} (offer payout: ${self.click_tracking.offer.payout}, percentage: {site_settings.referral_percentage}%)")
-                    
-                    # Check if referral earning already exists for this conversion
-                    existing_earning = ReferralEarning.objects.filter(
-                        referral=referral,
-                        conversion=self
-                    ).first()
-                    
-                    if existing_earning:
-                        logger.info(f"Referral earning already exists for conversion {self.id}: ${existing_earning.amount}")
-                        return
-                    
-                    # Create referral earning record
-                    referral_earning = ReferralEarning.objects.create(
-                        referral=referral,
-                        conversion=self,
-                        amount=referral_amount,
-                        percentage_used=site_settings.referral_percentage
-                    )
-                    
-                    logger.info(f"Created referral earning record: {referral_earning.id}")
-                    
-                    # Add to referrer's balance
-                    referrer = referral.referrer
-                    old_balance = referrer.balance
-                    referrer.add_to_balance(referral_amount)
-                    new_balance = referrer.balance
-                    
-                    logger.info(f"Referral earning: User {referrer.id} balance updated from ${old_balance} to ${new_balance} (+${referral_amount}) from referral {referral.id}")
-                    
-                else:
-                    logger.warning(f"No site settings found or referral percentage is 0 for conversion {self.id}")
-            else:
-                logger.info(f"No active referral found for user {self.click_tracking.user.id}")
-                
-        except Exception as e:
-            logger.error(f"Error handling referral earnings for conversion {self.id}: {str(e)}")
-            import traceback
-            logger.error(f"Traceback: {traceback.format_exc()}")
-    
-    def _handle_referral_earnings_reversal(self):
-        """Handle referral earnings reversal when conversion is rejected"""
-        try:
-            # Find existing referral earnings for this conversion
-            referral_earnings = ReferralEarning.objects.filter(conversion=self)
-            
-            for earning in referral_earnings:
-                # Deduct from referrer's balance
-                referrer = earning.referral.referrer
-                referrer.add_to_balance(-earning.amount)
-                
-                # Delete the referral earning record
-                earning.delete()
-                
-                logger.info(f"Referral earning reversed: User {referrer.id} lost ${earning.amount} from referral {earning.referral.id}")
-                
-        except Exception as e:
-            logger.error(f"Error handling referral earnings reversal for conversion {self.id}: {str(e)}")
+        """Save the conversion and apply its balance and referral effects in one transaction"""
+        from .accounting import prepare_transition, apply_transition
+
+        with transaction.atomic(savepoint=False):
+            transition = prepare_transition(self)
+            super().save(*args, **kwargs)
+            apply_transition(self, transition)
+
+
+class PostbackReceipt(models.Model):
+    """
+    Idempotency record for an inbound postback
+
+    The key is a hash of what process_postback reads from the request
+    (network, click ID and payout), so a network retrying the same postback
+    gets the stored response back instead of a second conversion attempt.
+    """
+    key = models.CharField(max_length=64, unique=True, verbose_name="Idempotency Key")
+    network_key = models.CharField(max_length=100, verbose_name="Network Key")
+    click_id = models.CharField(max_length=100, verbose_name="Click ID")
+    conversion = models.ForeignKey(Conversion, on_delete=models.SET_NULL, null=True, blank=True, related_name='postback_receipts', verbose_name="Conversion")
+    response = models.JSONField(null=True, blank=True, verbose_name="Response")
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name="Status Code")
+    hits = models.PositiveIntegerField(default=1, verbose_name="Times Received")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="First Received")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Last Received")
+
+    class Meta:
+        verbose_name = "Postback Receipt"
+        verbose_name_plural = "Postback Receipts"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.network_key} - {self.click_id} (x{self.hits})"
+
+
+class RawPostback(models.Model):
+    """
+    Inbound postback waiting to be processed
+
+    With POSTBACK_INGEST_MODE = 'queue' the postback endpoint stores the
+    request parameters here in a single insert and answers the network at
+    once; the process_postback_queue command turns them into conversions
+    (see offers.postback_queue). Processed rows are kept as a log for
+    POSTBACK_QUEUE_RETENTION_DAYS.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    params = models.JSONField(verbose_name="Parameters")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name="Status")
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name="Attempts")
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name="Status Code")
+    response = models.JSONField(null=True, blank=True, verbose_name="Response")
+    last_error = models.TextField(blank=True, null=True, verbose_name="Last Error")
+    received_at = models.DateTimeField(default=timezone.now, verbose_name="Received At")
+    claimed_at = models.DateTimeField(null=True, blank=True, verbose_name="Claimed At")
+    processed_at = models.DateTimeField(null=True, blank=True, verbose_name="Processed At")
+
+    class Meta:
+        verbose_name = "Raw Postback"
+        verbose_name_plural = "Raw Postbacks"
+        ordering = ['received_at']
+        indexes = [
+            models.Index(fields=['status', 'received_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.params.get('network', '?')} - {self.received_at:%Y-%m-%d %H:%M:%S} ({self.status})"
+
+
+class ConversionStatusJob(models.Model):
+    """
+    Bulk approval or rejection of conversions from the admin
+
+    Small selections are changed straight away; larger ones are stored here
+    and worked through in chunks by the process_conversion_status_jobs
+    command (see offers.accounting.run_status_job). processed is saved with
+    each chunk, so the admin can follow the progress and an interrupted job
+    carries on where it stopped.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    new_status = models.CharField(max_length=20, choices=Conversion.STATUS_CHOICES, verbose_name="New Conversion Status")
+    conversion_ids = models.JSONField(verbose_name="Conversion IDs")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name="Status")
+    total = models.PositiveIntegerField(default=0, verbose_name="Selected")
+    processed = models.PositiveIntegerField(default=0, verbose_name="Processed")
+    changed = models.PositiveIntegerField(default=0, verbose_name="Changed")
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='conversion_status_jobs', verbose_name="Requested By")
+    last_error = models.TextField(blank=True, null=True, verbose_name="Last Error")
+    created_at = models.DateTimeField(default=timezone.now, verbose_name="Created At")
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name="Started At")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="Finished At")
+
+    class Meta:
+        verbose_name = "Conversion Status Job"
+        verbose_name_plural = "Conversion Status Jobs"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Mark {self.total} conversion(s) {self.new_status} ({self.status})"
+
+    @property
+    def progress(self):
+        """Percentage of the selection processed so far"""
+        if not self.total:
+            return 100
+        return int(self.processed * 100 / self.total)
+
+
+class SamplingRule(models.Model):
+    """
+    Share of an affiliate's conversions that postbacks filter out
+
+    skip_count out of every window conversions are dropped. A rule applies
+    to the conversions matching all of its user, offer and network fields
+    (empty fields match anything); when several match, the most specific
+    wins: user and offer, then user, offer, network and finally a rule with
+    no scope at all. Conversions no rule matches are all kept.
+
+    'counter' drops exactly skip_count of every window postbacks per
+    affiliate, counted separately for each rule; 'hash' drops the clicks
+    whose ID hashes into the skipped share, which needs no counter and
+    always gives the same answer for a click. See offers.sampling.
+    """
+    METHOD_CHOICES = [
+        ('counter', 'Counter (exact ratio per affiliate)'),
+        ('hash', 'Click ID hash (no shared state)'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='sampling_rules', verbose_name="Affiliate User")
+    offer = models.ForeignKey(Offer, on_delete=models.CASCADE, null=True, blank=True, related_name='sampling_rules', verbose_name="Offer")
+    cpa_network = models.ForeignKey(CPANetwork, on_delete=models.CASCADE, null=True, blank=True, related_name='sampling_rules', verbose_name="CPA Network")
+    method = models.CharField(max_length=20, choices=METHOD_CHOICES, default='counter', verbose_name="Method")
+    skip_count = models.PositiveSmallIntegerField(default=1, verbose_name="Skipped", help_text="Conversions filtered out per window")
+    window = models.PositiveSmallIntegerField(default=3, verbose_name="Window", help_text="Conversions per window (1 skipped of 3 = every third conversion)")
+    is_active = models.BooleanField(default=True, verbose_name="Is Active")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created At")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Updated At")
+
+    class Meta:
+        verbose_name = "Sampling Rule"
+        verbose_name_plural = "Sampling Rules"
+        ordering = ['-is_active', 'id']
+
+    def __str__(self):
+        scope = ', '.join(filter(None, [
+            f'user {self.user_id}' if self.user_id else '',
+            f'offer {self.offer_id}' if self.offer_id else '',
+            f'network {self.cpa_network_id}' if self.cpa_network_id else '',
+        ])) or 'everyone'
+        return f"Skip {self.skip_count} of {self.window} by {self.method} ({scope})"
+
+    def clean(self):
+        from django.core.exceptions import ValidationError
+        if not self.window:
+            raise ValidationError({'window': 'The window must hold at least one conversion.'})
+        if self.skip_count > self.window:
+            raise ValidationError({'skip_count': 'Cannot skip more conversions than the window holds.'})
+
+    @property
+    def specificity(self):
+        """Rank used to pick between matching rules (higher wins)"""
+        return (4 if self.user_id else 0) + (2 if self.offer_id else 0) + (1 if self.cpa_network_id else 0)
+
+    def matches(self, user_id, offer_id, network_id):
+        return (
+            (self.user_id is None or self.user_id == user_id)
+            and (self.offer_id is None or self.offer_id == offer_id)
+            and (self.cpa_network_id is None or self.cpa_network_id == network_id)
+        )
+
+
+class SamplingCounter(models.Model):
+    """Postbacks counted by a 'counter' SamplingRule for one affiliate"""
+    rule = models.ForeignKey(SamplingRule, on_delete=models.CASCADE, related_name='counters', verbose_name="Sampling Rule")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sampling_counters', verbose_name="Affiliate User")
+    value = models.PositiveIntegerField(default=0, verbose_name="Postbacks Counted")
+
+    class Meta:
+        verbose_name = "Sampling Counter"
+        verbose_name_plural = "Sampling Counters"
+        constraints = [
+            models.UniqueConstraint(fields=['rule', 'user'], name='unique_sampling_counter'),
+        ]
+
+    def __str__(self):
+        return f"Rule {self.rule_id} / user {self.user_id}: {self.value}"
+
+
+class SamplingDecision(models.Model):
+    """
+    Whether the conversion for a click was kept or filtered out
+
+    One narrow row per click that reached the sampling step; a postback for
+    a click that already has a decision reuses it.
+    """
+    click_tracking = models.OneToOneField(ClickTracking, on_delete=models.CASCADE, primary_key=True, related_name='sampling_decision', verbose_name="Click Tracking")
+    rule = models.ForeignKey(SamplingRule, on_delete=models.SET_NULL, null=True, blank=True, related_name='decisions', verbose_name="Sampling Rule")
+    sequence = models.PositiveIntegerField(null=True, blank=True, verbose_name="Counter Value")
+    kept = models.BooleanField(verbose_name="Kept")
+    decided_at = models.DateTimeField(default=timezone.now, verbose_name="Decided At")
+
+    class Meta:
+        verbose_name = "Sampling Decision"
+        verbose_name_plural = "Sampling Decisions"
+        ordering = ['-decided_at']
+
+    def __str__(self):
+        return f"{self.click_tracking_id}: {'kept' if self.kept else 'filtered'}"
+
+
+class DailyStat(models.Model):
+    """
+    Per-day report totals for one affiliate, offer and subid combination
+
+    The affiliate reports and dashboard read these instead of counting
+    ClickTracking and Conversion rows. Clicks count on the day they were
+    made, conversions on their conversion date; conversions and earnings
+    cover approved conversions only. The rows are kept current by
+    offers.daily_stats (buffered counts from click tracking and conversion
+    status changes) and can be rebuilt from history with the
+    rebuild_daily_stats command. Empty subids are stored as ''.
+    """
+    date = models.DateField(verbose_name="Date")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_stats', verbose_name="Affiliate User")
+    offer = models.ForeignKey(Offer, on_delete=models.CASCADE, related_name='daily_stats', verbose_name="Offer")
+    subid1 = models.CharField(max_length=100, blank=True, default='', verbose_name="Subid 1")
+    subid2 = models.CharField(max_length=100, blank=True, default='', verbose_name="Subid 2")
+    subid3 = models.CharField(max_length=100, blank=True, default='', verbose_name="Subid 3")
+    # Signed: buffered counts from different processes may land out of order
+    clicks = models.IntegerField(default=0, verbose_name="Clicks")
+    conversions = models.IntegerField(default=0, verbose_name="Approved Conversions")
+    rejected = models.IntegerField(default=0, verbose_name="Rejected Conversions")
+    earnings = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Earnings (USD)")
+
+    class Meta:
+        verbose_name = "Daily Stat"
+        verbose_name_plural = "Daily Stats"
+        ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'date', 'offer', 'subid1', 'subid2', 'subid3'], name='unique_daily_stat'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.date} - {self.user_id}/{self.offer_id}: {self.clicks} clicks, {self.conversions} conversions"
+
+
+class AffiliatePostback(models.Model):
+    """
+    URL an affiliate wants called when one of their conversions is approved
+
+    A postback without an offer covers all of the affiliate's offers; one
+    with an offer replaces it for that offer. The URL may contain macros,
+    replaced (URL-encoded) when the conversion is approved - see
+    offers.outbound_postbacks.MACROS.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='affiliate_postbacks', verbose_name="Affiliate User")
+    offer = models.ForeignKey(Offer, on_delete=models.CASCADE, null=True, blank=True, related_name='affiliate_postbacks', verbose_name="Offer", help_text="Leave empty for all offers")
+    url = models.CharField(
+        max_length=1000,
+        verbose_name="Postback URL",
+        help_text="Macros: {click_id}, {subid1}, {subid2}, {subid3}, {payout}, {offer_id}, {conversion_id}, {status}"
+    )
+    is_active = models.BooleanField(default=True, verbose_name="Is Active")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created At")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Updated At")
+
+    class Meta:
+        verbose_name = "Affiliate Postback"
+        verbose_name_plural = "Affiliate Postbacks"
+        ordering = ['user', 'offer']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'offer'], name='unique_affiliate_postback_per_offer'),
+            models.UniqueConstraint(fields=['user'], condition=models.Q(offer__isnull=True), name='unique_affiliate_postback_default'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.offer_id or 'all offers'}: {self.url}"
+
+    def clean(self):
+        from django.core.exceptions import ValidationError
+        from urllib.parse import urlsplit
+        if urlsplit(self.url or '').scheme not in ('http', 'https'):
+            raise ValidationError({'url': 'The postback URL must start with http:// or https://.'})
+
+
+class OutboundPostback(models.Model):
+    """
+    One call of an affiliate's postback URL for an approved conversion
+
+    Created (with the macros already filled in) in the transaction that
+    approves the conversion and sent by the deliver_outbound_postbacks
+    command. Failed calls are retried with exponential backoff; after
+    OUTBOUND_POSTBACK_MAX_ATTEMPTS, or on an answer that will not change,
+    the row is moved to OutboundPostbackDeadLetter.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+    ]
+
+    affiliate_postback = models.ForeignKey(AffiliatePostback, on_delete=models.SET_NULL, null=True, blank=True, related_name='deliveries', verbose_name="Affiliate Postback")
+    conversion = models.ForeignKey(Conversion, on_delete=models.CASCADE, related_name='outbound_postbacks', verbose_name="Conversion")
+    url = models.CharField(max_length=2000, verbose_name="URL")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name="Status")
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name="Attempts")
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name="Next Attempt At")
+    claimed_at = models.DateTimeField(null=True, blank=True, verbose_name="Claimed At")
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name="Last Status Code")
+    last_error = models.TextField(blank=True, null=True, verbose_name="Last Error")
+    created_at = models.DateTimeField(default=timezone.now, verbose_name="Created At")
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name="Sent At")
+
+    class Meta:
+        verbose_name = "Outbound Postback"
+        verbose_name_plural = "Outbound Postbacks"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['affiliate_postback', 'conversion'], name='unique_outbound_postback'),
+        ]
+
+    def __str__(self):
+        return f"Conversion {self.conversion_id} -> {self.url} ({self.status})"
+
+
+class OutboundPostbackDeadLetter(models.Model):
+    """
+    Outbound postback given up on
+
+    Kept for inspection; the admin can send them again, which moves them
+    back to OutboundPostback with a fresh attempt count.
+    """
+    affiliate_postback = models.ForeignKey(AffiliatePostback, on_delete=models.SET_NULL, null=True, blank=True, related_name='dead_letters', verbose_name="Affiliate Postback")
+    conversion = models.ForeignKey(Conversion, on_delete=models.CASCADE, related_name='outbound_dead_letters', verbose_name="Conversion")
+    url = models.CharField(max_length=2000, verbose_name="URL")
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name="Attempts")
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name="Last Status Code")
+    last_error = models.TextField(blank=True, null=True, verbose_name="Last Error")
+    created_at = models.DateTimeField(verbose_name="Created At")
+    failed_at = models.DateTimeField(default=timezone.now, verbose_name="Failed At")
+
+    class Meta:
+        verbose_name = "Outbound Postback Dead Letter"
+        verbose_name_plural = "Outbound Postback Dead Letters"
+        ordering = ['-failed_at']
+
+    def __str__(self):
+        return f"Conversion {self.conversion_id} -> {self.url} ({self.attempts} attempts)"
 
 
 # Custom form for admin
@@ -843,6 +1226,52 @@ class Invoice(models.Model):
         self.save()
 
 
+class BalanceLedger(models.Model):
+    """
+    Append-only record of every change to a user's balance
+
+    User.add_to_balance() writes one entry per change in the same transaction
+    as the balance UPDATE, so a user's balance always equals the sum of their
+    entries. reconcile_balances checks that periodically (see offers.ledger).
+    """
+    ENTRY_TYPE_CHOICES = [
+        ('opening_balance', 'Opening Balance'),
+        ('conversion_credit', 'Conversion Credit'),
+        ('referral_credit', 'Referral Credit'),
+        ('reversal', 'Reversal'),
+        ('invoice_debit', 'Invoice Debit'),
+        ('adjustment', 'Adjustment'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='ledger_entries', verbose_name="User")
+    entry_type = models.CharField(max_length=20, choices=ENTRY_TYPE_CHOICES, verbose_name="Entry Type")
+    amount = models.DecimalField(max_digits=12, decimal_places=2, verbose_name="Amount (USD)")
+    conversion = models.ForeignKey(Conversion, on_delete=models.SET_NULL, null=True, blank=True, related_name='ledger_entries', verbose_name="Conversion")
+    invoice = models.ForeignKey(Invoice, on_delete=models.SET_NULL, null=True, blank=True, related_name='ledger_entries', verbose_name="Invoice")
+    description = models.CharField(max_length=255, blank=True, verbose_name="Description")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created At")
+
+    class Meta:
+        verbose_name = "Balance Ledger Entry"
+        verbose_name_plural = "Balance Ledger"
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['user', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.get_entry_type_display()} - ${self.amount}"
+
+    def save(self, *args, **kwargs):
+        """Entries are never edited; corrections are new entries"""
+        if not self._state.adding:
+            raise ValueError("Balance ledger entries are append-only")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError("Balance ledger entries are append-only")
+
+
 class ReferralLink(models.Model):
     """Referral link for users to share"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='referral_links', verbose_name="Referrer")
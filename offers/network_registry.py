@@ -0,0 +1,120 @@
+"""
+Process-wide registry of CPA networks
+
+There are only a handful of CPANetwork rows and they rarely change, yet
+postbacks, redirect URL building and the admin all look them up. The
+registry loads every network (and the active SiteSettings, which postback
+URLs are built from, and the active SamplingRules postbacks are filtered
+by) in three queries and serves them from memory, keyed by network_key and
+by id.
+
+Invalidation works like the redirect plans (see offers.redirect_plans):
+saving or deleting a CPANetwork, SiteSettings or SamplingRule bumps a version stamp in
+the shared OFFERS_CACHE_ALIAS cache once the transaction commits (see
+offers.signals). Every lookup compares the stamp with the one the registry
+was loaded under and reloads on a mismatch, so all worker processes pick up
+a change on their next lookup.
+
+The returned objects are shared between threads and must be treated as
+read-only; fetch a fresh row from the database to modify it.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import CPANetwork, SamplingRule, SiteSettings
+
+VERSION_KEY = 'offers:network_registry:version'
+
+
+def _cache():
+    return caches[getattr(settings, 'OFFERS_CACHE_ALIAS', 'default')]
+
+
+def get_network_version():
+    """Return the current registry version stamp, creating it if missing"""
+    cache = _cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_network_version():
+    """Make every process reload its registry on the next lookup"""
+    _cache().set(VERSION_KEY, time.time_ns(), None)
+    reset_network_registry()
+
+
+class NetworkRegistry:
+    """Snapshot of all CPA networks, the active site settings and sampling rules"""
+
+    def __init__(self, version, networks, site_settings, sampling_rules=()):
+        self.version = version
+        self.by_id = {network.id: network for network in networks}
+        self.by_key = {network.network_key: network for network in networks}
+        self.site_settings = site_settings
+        # Most specific first, so the first match is the one that applies
+        self.sampling_rules = sorted(sampling_rules, key=lambda rule: (-rule.specificity, rule.id))
+
+    @classmethod
+    def load(cls, version):
+        return cls(
+            version,
+            list(CPANetwork.objects.all()),
+            SiteSettings.get_settings(),
+            list(SamplingRule.objects.filter(is_active=True)),
+        )
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_network_registry():
+    """Return the registry, reloading it when the version stamp has moved"""
+    global _registry
+    version = get_network_version()
+    registry = _registry
+    if registry is None or registry.version != version:
+        with _registry_lock:
+            registry = _registry
+            if registry is None or registry.version != version:
+                registry = _registry = NetworkRegistry.load(version)
+    return registry
+
+
+def reset_network_registry():
+    """Drop this process's registry"""
+    global _registry
+    with _registry_lock:
+        _registry = None
+
+
+def get_network_by_key(network_key, active_only=True):
+    """Return the CPANetwork with this key, or None (also when inactive and active_only)"""
+    network = get_network_registry().by_key.get(network_key)
+    if network is None or (active_only and not network.is_active):
+        return None
+    return network
+
+
+def get_network(network_id):
+    """Return the CPANetwork with this id, or None"""
+    return get_network_registry().by_id.get(network_id)
+
+
+def get_site_settings():
+    """Return the active SiteSettings (as SiteSettings.get_settings() would), or None"""
+    return get_network_registry().site_settings
+
+
+def get_sampling_rule(user_id, offer_id, network_id):
+    """Return the active SamplingRule that applies to a conversion, or None"""
+    for rule in get_network_registry().sampling_rules:
+        if rule.matches(user_id, offer_id, network_id):
+            return rule
+    return None
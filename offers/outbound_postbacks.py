@@ -0,0 +1,330 @@
+"""
+Outbound postbacks to affiliates
+
+An affiliate can register postback URLs (AffiliatePostback) that we call
+when one of their conversions is approved, so their own tracker learns
+about it. The call is never made while the conversion is saved:
+
+1. Approving a conversion (Conversion.save through offers.accounting, or a
+   bulk approval) runs queue_outbound_postbacks() in the same transaction.
+   It fills the macros of the matching URL - the offer's own postback, or
+   else the affiliate's default - and inserts an OutboundPostback.
+2. The deliver_outbound_postbacks command claims due rows in batches and
+   sends them with OutboundPostbackSender: an asyncio loop with at most
+   OUTBOUND_POSTBACK_CONCURRENCY requests in flight and at most
+   OUTBOUND_POSTBACK_HOST_RATE requests per second to any one host. The
+   HTTP calls go through one pooled requests.Session (run in the loop's
+   thread pool), so connections to an affiliate's tracker are kept alive
+   between postbacks and batches.
+3. A 2xx answer marks the row sent. Timeouts, connection errors, 408, 429
+   and 5xx answers are retried with exponential backoff (429 honours
+   Retry-After); other answers will not change on a retry. A row that
+   cannot be sent is moved to OutboundPostbackDeadLetter, from which the
+   admin can requeue it.
+
+Sent rows stay in the table as a log for OUTBOUND_POSTBACK_RETENTION_DAYS.
+"""
+import asyncio
+import logging
+import random
+import re
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import quote, urlsplit
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+
+from .models import AffiliatePostback, Conversion, OutboundPostback, OutboundPostbackDeadLetter
+
+logger = logging.getLogger(__name__)
+
+# Macro name -> Conversion.values() lookup that fills it
+MACROS = {
+    'click_id': 'click_tracking__click_id',
+    'subid1': 'click_tracking__subid1',
+    'subid2': 'click_tracking__subid2',
+    'subid3': 'click_tracking__subid3',
+    'payout': 'click_tracking__offer__payout',
+    'offer_id': 'click_tracking__offer_id',
+    'conversion_id': 'id',
+    'status': 'status',
+}
+
+_MACRO_PATTERN = re.compile(r'\{(\w+)\}')
+
+# Answers worth trying again; any other non-2xx answer is final
+RETRY_STATUS_CODES = {408, 425, 429}
+
+Outcome = namedtuple('Outcome', ['delivery', 'status_code', 'error', 'retry_after'])
+
+
+def _setting(name, default):
+    return getattr(settings, f'OUTBOUND_POSTBACK_{name}', default)
+
+
+def render_postback_url(template, values):
+    """Replace {macro} placeholders with URL-encoded values; unknown macros are left alone"""
+    def replace(match):
+        name = match.group(1)
+        if name not in values:
+            return match.group(0)
+        value = values[name]
+        return quote('' if value is None else str(value), safe='')
+    return _MACRO_PATTERN.sub(replace, template)
+
+
+def queue_outbound_postbacks(conversion_ids):
+    """
+    Queue the affiliate postbacks of conversions that were just approved
+
+    Two queries (conversions, postback URLs) and one insert whatever the
+    number of conversions. A conversion approved again while its earlier
+    postback is still on record is not queued twice. Returns the number of
+    conversions that have a postback URL.
+    """
+    rows = list(
+        Conversion.objects.filter(pk__in=list(conversion_ids))
+        .values('click_tracking__user_id', *MACROS.values())
+    )
+    if not rows:
+        return 0
+
+    postbacks = {}
+    for postback in AffiliatePostback.objects.filter(
+        user_id__in={row['click_tracking__user_id'] for row in rows}, is_active=True
+    ):
+        postbacks[(postback.user_id, postback.offer_id)] = postback
+
+    deliveries = []
+    for row in rows:
+        user_id = row['click_tracking__user_id']
+        postback = postbacks.get((user_id, row['click_tracking__offer_id'])) or postbacks.get((user_id, None))
+        if postback is None:
+            continue
+        values = {name: row[lookup] for name, lookup in MACROS.items()}
+        deliveries.append(OutboundPostback(
+            affiliate_postback=postback,
+            conversion_id=row['id'],
+            url=render_postback_url(postback.url, values),
+        ))
+    OutboundPostback.objects.bulk_create(deliveries, ignore_conflicts=True)
+    return len(deliveries)
+
+
+class HostRateLimiter:
+    """Spaces the requests to each host at least 1/rate seconds apart (one event loop only)"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next_slot = {}
+
+    async def wait(self, host):
+        if not self.interval:
+            return
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self._next_slot.get(host, now))
+        self._next_slot[host] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class OutboundPostbackSender:
+    """Sends batches of outbound postbacks over a shared connection pool"""
+
+    def __init__(self, concurrency=None, host_rate=None, timeout=None):
+        self.concurrency = concurrency or _setting('CONCURRENCY', 20)
+        self.host_rate = _setting('HOST_RATE', 10) if host_rate is None else host_rate
+        self.timeout = timeout or _setting('TIMEOUT', 10)
+
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = 'CPA-Postback/1.0'
+        adapter = HTTPAdapter(pool_connections=self.concurrency, pool_maxsize=self.concurrency, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='outbound-postback')
+
+    def _get(self, url):
+        response = self.session.get(url, timeout=self.timeout)
+        return response.status_code, response.headers.get('Retry-After')
+
+    async def _send(self, delivery, semaphore, limiter):
+        await limiter.wait(urlsplit(delivery.url).netloc.lower())
+        async with semaphore:
+            try:
+                status_code, retry_after = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, self._get, delivery.url
+                )
+            except requests.RequestException as e:
+                return Outcome(delivery, None, str(e), None)
+        if 200 <= status_code < 300:
+            return Outcome(delivery, status_code, None, None)
+        return Outcome(delivery, status_code, f'HTTP {status_code}', retry_after)
+
+    async def send_all(self, deliveries):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        limiter = HostRateLimiter(self.host_rate)
+        return await asyncio.gather(*(self._send(delivery, semaphore, limiter) for delivery in deliveries))
+
+    def send(self, deliveries):
+        """Send the deliveries and return one Outcome each, in order"""
+        if not deliveries:
+            return []
+        return asyncio.run(self.send_all(deliveries))
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+
+_sender = None
+_sender_lock = threading.Lock()
+
+
+def get_outbound_sender():
+    """Return the process-wide sender, keeping its connections across batches"""
+    global _sender
+    if _sender is None:
+        with _sender_lock:
+            if _sender is None:
+                _sender = OutboundPostbackSender()
+    return _sender
+
+
+def reset_outbound_sender():
+    """Close this process's sender (settings changed, tests)"""
+    global _sender
+    with _sender_lock:
+        if _sender is not None:
+            _sender.close()
+        _sender = None
+
+
+def retry_delay(attempts, retry_after=None):
+    """Seconds to wait before the next attempt after attempts failed ones"""
+    base = _setting('BACKOFF_SECONDS', 30)
+    delay = min(base * 2 ** (attempts - 1), _setting('BACKOFF_MAX_SECONDS', 3600))
+    if retry_after and str(retry_after).isdigit():
+        delay = max(delay, min(int(retry_after), _setting('BACKOFF_MAX_SECONDS', 3600)))
+    # Spread retries out so a recovering tracker is not hit all at once
+    return delay * random.uniform(1.0, 1.2)
+
+
+def is_retryable(outcome):
+    return outcome.status_code is None or outcome.status_code >= 500 or outcome.status_code in RETRY_STATUS_CODES
+
+
+def claim_outbound_postbacks(batch_size):
+    """Mark up to batch_size due postbacks as being sent and return them"""
+    now = timezone.now()
+    stale = now - timedelta(seconds=_setting('CLAIM_TIMEOUT', 300))
+    with transaction.atomic():
+        ids = list(
+            OutboundPostback.objects
+            .filter(Q(status='pending', next_attempt_at__lte=now) | Q(status='sending', claimed_at__lt=stale))
+            .order_by('next_attempt_at')
+            .select_for_update(skip_locked=True)
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return []
+        OutboundPostback.objects.filter(pk__in=ids).update(status='sending', claimed_at=now)
+    return list(OutboundPostback.objects.filter(pk__in=ids).order_by('next_attempt_at'))
+
+
+def deliver_outbound_batch(batch_size=None, sender=None):
+    """
+    Claim and send one batch of outbound postbacks
+
+    Returns a dict with the sent, retried and dead counts.
+    """
+    batch_size = batch_size or _setting('BATCH_SIZE', 200)
+    sender = sender or get_outbound_sender()
+    max_attempts = _setting('MAX_ATTEMPTS', 6)
+
+    result = {'sent': 0, 'retried': 0, 'dead': 0}
+    deliveries = claim_outbound_postbacks(batch_size)
+    if not deliveries:
+        return result
+
+    outcomes = sender.send(deliveries)
+
+    now = timezone.now()
+    updated, dead = [], []
+    for outcome in outcomes:
+        delivery = outcome.delivery
+        delivery.attempts += 1
+        delivery.status_code = outcome.status_code
+        if outcome.error is None:
+            delivery.status = 'sent'
+            delivery.sent_at = now
+            delivery.last_error = None
+            updated.append(delivery)
+            result['sent'] += 1
+            continue
+
+        delivery.last_error = outcome.error
+        if is_retryable(outcome) and delivery.attempts < max_attempts:
+            delivery.status = 'pending'
+            delivery.next_attempt_at = now + timedelta(seconds=retry_delay(delivery.attempts, outcome.retry_after))
+            updated.append(delivery)
+            result['retried'] += 1
+        else:
+            dead.append(delivery)
+            result['dead'] += 1
+            logger.warning(
+                f"Giving up on outbound postback {delivery.id} for conversion {delivery.conversion_id} "
+                f"after {delivery.attempts} attempt(s): {outcome.error}"
+            )
+
+    with transaction.atomic():
+        OutboundPostback.objects.bulk_update(
+            updated, ['status', 'attempts', 'status_code', 'last_error', 'next_attempt_at', 'sent_at'], batch_size=500,
+        )
+        if dead:
+            OutboundPostbackDeadLetter.objects.bulk_create([
+                OutboundPostbackDeadLetter(
+                    affiliate_postback_id=delivery.affiliate_postback_id,
+                    conversion_id=delivery.conversion_id,
+                    url=delivery.url,
+                    attempts=delivery.attempts,
+                    status_code=delivery.status_code,
+                    last_error=delivery.last_error,
+                    created_at=delivery.created_at,
+                )
+                for delivery in dead
+            ])
+            OutboundPostback.objects.filter(pk__in=[delivery.pk for delivery in dead]).delete()
+    return result
+
+
+def requeue_dead_letters(dead_letters):
+    """Move dead letters back to the outbound queue; returns the number requeued"""
+    dead_letters = list(dead_letters)
+    with transaction.atomic():
+        OutboundPostback.objects.bulk_create([
+            OutboundPostback(
+                affiliate_postback_id=dead_letter.affiliate_postback_id,
+                conversion_id=dead_letter.conversion_id,
+                url=dead_letter.url,
+                created_at=dead_letter.created_at,
+            )
+            for dead_letter in dead_letters
+        ], ignore_conflicts=True)
+        OutboundPostbackDeadLetter.objects.filter(pk__in=[dead_letter.pk for dead_letter in dead_letters]).delete()
+    return len(dead_letters)
+
+
+def purge_sent_postbacks(retention_days=None):
+    """Delete sent postbacks older than the retention period; returns the count"""
+    if retention_days is None:
+        retention_days = _setting('RETENTION_DAYS', 14)
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    deleted, _ = OutboundPostback.objects.filter(status='sent', sent_at__lt=cutoff).delete()
+    return deleted
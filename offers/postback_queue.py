@@ -0,0 +1,231 @@
+"""
+Postback ingestion queue
+
+Networks retry postbacks that are slow to answer, and processing one
+(network and click lookups, counter update, conversion insert, balance and
+referral credits, notification) takes a dozen queries. With
+POSTBACK_INGEST_MODE = 'queue' the endpoint only stores the request
+parameters as a RawPostback - a single insert - and answers 200 straight
+away. The process_postback_queue command drains the table in batches:
+
+- Rows are claimed by switching them to 'processing' (with SKIP LOCKED
+  where the database has it), so several workers can run side by side.
+  A claim older than POSTBACK_QUEUE_CLAIM_TIMEOUT seconds is taken over,
+  which covers a worker that died mid-batch.
+- The batch is grouped by affiliate, read from the click ID itself (see
+  offers.click_ids), and each group is handled in order by one thread. Two
+  threads never credit the same user at once, so they do not wait on each
+  other's row locks.
+- Each postback goes through process_postback, which is idempotent, so a
+  row processed twice (after a crash, or a network retry queued twice) is
+  harmless. Rows that fail with a server error are retried up to
+  POSTBACK_QUEUE_MAX_ATTEMPTS times.
+
+Processed rows stay in the table as a log for POSTBACK_QUEUE_RETENTION_DAYS.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .click_ids import decode_click_id
+from .click_lookup import unwrap_click_id
+from .models import RawPostback
+from .network_registry import get_network_by_key
+from .postbacks import process_postback
+
+logger = logging.getLogger(__name__)
+
+_metrics_lock = threading.Lock()
+_metrics = {
+    'accepted': 0,
+    'processed': 0,
+    'retried': 0,
+    'failed': 0,
+    'last_batch_mean_lag_seconds': 0.0,
+    'last_batch_max_lag_seconds': 0.0,
+}
+
+
+def _increment(name, amount=1):
+    with _metrics_lock:
+        _metrics[name] += amount
+
+
+def get_ingest_mode():
+    return getattr(settings, 'POSTBACK_INGEST_MODE', 'sync')
+
+
+def get_max_attempts():
+    return getattr(settings, 'POSTBACK_QUEUE_MAX_ATTEMPTS', 5)
+
+
+def accept_postback(params):
+    """
+    Store a postback for the queue
+
+    Returns (data, status_code) like process_postback. Requests without a
+    network are answered directly since there is nothing to process.
+    """
+    if not params.get('network'):
+        return process_postback(params)
+
+    raw = RawPostback.objects.create(params=dict(params))
+    _increment('accepted')
+    return ({
+        'success': True,
+        'message': 'Postback accepted',
+        'postback_id': raw.id
+    }, 200)
+
+
+def receive_postback(params):
+    """Queue or process a postback according to POSTBACK_INGEST_MODE"""
+    if get_ingest_mode() == 'queue':
+        return accept_postback(params)
+    return process_postback(params)
+
+
+def claim_postbacks(batch_size):
+    """Mark up to batch_size waiting postbacks as being processed and return them"""
+    now = timezone.now()
+    stale = now - timedelta(seconds=getattr(settings, 'POSTBACK_QUEUE_CLAIM_TIMEOUT', 300))
+    with transaction.atomic():
+        ids = list(
+            RawPostback.objects
+            .filter(Q(status='pending') | Q(status='processing', claimed_at__lt=stale))
+            .order_by('received_at')
+            .select_for_update(skip_locked=True)
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return []
+        RawPostback.objects.filter(pk__in=ids).update(status='processing', claimed_at=now)
+    return list(RawPostback.objects.filter(pk__in=ids).order_by('received_at'))
+
+
+def group_by_user(raws):
+    """
+    Split postbacks into per-affiliate lists, keeping their order
+
+    The affiliate comes from the click ID; postbacks whose click ID cannot
+    be decoded (older formats, unknown networks) are grouped by click ID.
+    """
+    groups = {}
+    for raw in raws:
+        network = get_network_by_key(raw.params.get('network'))
+        click_id = raw.params.get(network.postback_click_id_parameter) if network else None
+        info = decode_click_id(unwrap_click_id(click_id, network.click_id_wrapper)) if click_id else None
+        if info is not None:
+            key = ('user', info.user_id)
+        else:
+            key = ('click', click_id or raw.pk)
+        groups.setdefault(key, []).append(raw)
+    return list(groups.values())
+
+
+def _process_group(raws):
+    """Run one affiliate's postbacks in order; runs in a worker thread"""
+    try:
+        results = []
+        for raw in raws:
+            data, status_code = process_postback(raw.params)
+            results.append((raw, data, status_code))
+        return results
+    finally:
+        connections.close_all()
+
+
+def process_postback_batch(batch_size=None, workers=None):
+    """
+    Claim and process one batch of queued postbacks
+
+    Returns a dict with the processed, retried and failed counts.
+    """
+    if batch_size is None:
+        batch_size = getattr(settings, 'POSTBACK_QUEUE_BATCH_SIZE', 200)
+    if workers is None:
+        workers = getattr(settings, 'POSTBACK_QUEUE_WORKERS', 4)
+
+    result = {'processed': 0, 'retried': 0, 'failed': 0}
+    raws = claim_postbacks(batch_size)
+    if not raws:
+        return result
+
+    # Largest groups first so one long group does not finish the batch alone
+    groups = sorted(group_by_user(raws), key=len, reverse=True)
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(groups)))) as executor:
+        outcomes = [item for group in executor.map(_process_group, groups) for item in group]
+
+    now = timezone.now()
+    lags = []
+    for raw, data, status_code in outcomes:
+        raw.attempts += 1
+        raw.status_code = status_code
+        raw.response = data
+        if status_code >= 500:
+            raw.last_error = data.get('message')
+            if raw.attempts >= get_max_attempts():
+                raw.status = 'failed'
+                result['failed'] += 1
+                logger.error(f"Giving up on queued postback {raw.id} after {raw.attempts} attempts")
+            else:
+                raw.status = 'pending'
+                result['retried'] += 1
+            continue
+        raw.status = 'done'
+        raw.processed_at = now
+        lags.append((now - raw.received_at).total_seconds())
+        result['processed'] += 1
+
+    RawPostback.objects.bulk_update(
+        [raw for raw, _, _ in outcomes],
+        ['status', 'attempts', 'status_code', 'response', 'last_error', 'processed_at'],
+        batch_size=500,
+    )
+
+    with _metrics_lock:
+        for name, value in result.items():
+            _metrics[name] += value
+        if lags:
+            _metrics['last_batch_mean_lag_seconds'] = sum(lags) / len(lags)
+            _metrics['last_batch_max_lag_seconds'] = max(lags)
+    return result
+
+
+def purge_processed_postbacks(retention_days=None):
+    """Delete processed postbacks older than the retention period; returns the count"""
+    if retention_days is None:
+        retention_days = getattr(settings, 'POSTBACK_QUEUE_RETENTION_DAYS', 7)
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    deleted, _ = RawPostback.objects.filter(status='done', processed_at__lt=cutoff).delete()
+    return deleted
+
+
+def get_postback_queue_metrics():
+    """
+    Return queue depth and lag for the postback queue
+
+    pending, processing, failed_postbacks and oldest_pending_seconds (the
+    current lag) describe the shared table; the other counters are local to
+    this process.
+    """
+    waiting = RawPostback.objects.filter(status='pending')
+    oldest = waiting.order_by('received_at').values_list('received_at', flat=True).first()
+
+    with _metrics_lock:
+        metrics = dict(_metrics)
+
+    metrics.update({
+        'mode': get_ingest_mode(),
+        'pending': waiting.count(),
+        'processing': RawPostback.objects.filter(status='processing').count(),
+        'failed_postbacks': RawPostback.objects.filter(status='failed').count(),
+        'oldest_pending_seconds': (timezone.now() - oldest).total_seconds() if oldest else 0.0,
+    })
+    return metrics
@@ -0,0 +1,210 @@
+"""
+Postback processing core
+
+process_postback() turns a CPA network's conversion callback into a
+Conversion. It is shared by the Django handle_postback view and the
+lightweight ASGI endpoint in offers.asgi; both pass the request parameters
+as one mapping (see merge_params) and render the returned data as JSON.
+
+Postbacks are idempotent. A click converts at most once (a unique
+constraint on Conversion.click_tracking), the click row is locked while a
+postback for it is processed, and the response to each distinct postback
+is stored in a PostbackReceipt so that network retries get the same answer
+without touching counters or balances again.
+"""
+import hashlib
+import logging
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .click_ids import normalize_click_id
+from .click_lookup import resolve_click_id
+from .models import ClickTracking, Conversion, PostbackReceipt
+from .network_registry import get_network_by_key
+from .sampling import sample_conversion
+
+logger = logging.getLogger(__name__)
+
+
+def merge_params(query, form):
+    """
+    Combine query string and form values the way postbacks are read
+
+    A non-empty query string value wins; otherwise the form value is used.
+    """
+    merged = dict(form)
+    for key, value in query.items():
+        if value or key not in merged:
+            merged[key] = value
+    return merged
+
+
+def process_postback(params):
+    """
+    Record the conversion reported by a postback
+
+    Returns (data, status_code); data is the JSON body for the network.
+    """
+    try:
+        # Get the CPA network from the request
+        network_key = params.get('network')
+        
+        if not network_key:
+            logger.warning("Postback received without network parameter")
+            return ({
+                'success': False, 
+                'message': 'Network parameter required',
+                'error_code': 'MISSING_NETWORK'
+            }, 400)
+
+        # Get the CPA network (served from the in-process network registry)
+        cpa_network = get_network_by_key(network_key)
+        if cpa_network is None:
+            logger.warning(f"Postback received for unknown network: {network_key}")
+            return ({
+                'success': False, 
+                'message': f'Unknown network: {network_key}',
+                'error_code': 'UNKNOWN_NETWORK'
+            }, 200)
+
+        # Get click ID and payout from the postback
+        click_id_param = cpa_network.postback_click_id_parameter
+        payout_param = "payout"
+
+        network_click_id = params.get(click_id_param)
+        network_payout = params.get(payout_param)
+
+        logger.info(f"Postback data: network={network_key}, click_id_param={click_id_param}, click_id={network_click_id}, payout={network_payout}")
+
+        if not network_click_id:
+            logger.warning(f"Postback missing click ID parameter: {click_id_param}")
+            return ({
+                'success': False, 
+                'message': f'Missing {click_id_param} parameter',
+                'error_code': 'MISSING_CLICK_ID'
+            }, 200)
+
+        # Everything from here runs under a lock on the click row, so retries
+        # of one postback arriving together are handled one after the other:
+        # the first records the conversion, the rest find its receipt
+        key = postback_key(network_key, network_click_id, network_payout)
+        with transaction.atomic():
+            # Find the click tracking record (networks sometimes change the
+            # case of the ID they echo back, so look up its canonical form)
+            clicks = ClickTracking.objects.select_for_update(of=('self',)).select_related('offer')
+            click_tracking = clicks.filter(click_id=normalize_click_id(network_click_id)).first()
+            if click_tracking is None:
+                # Wrapped, truncated or re-cased IDs (see offers.click_lookup)
+                resolved = resolve_click_id(network_click_id, cpa_network)
+                if resolved is not None:
+                    click_tracking = clicks.filter(click_id=resolved).first()
+            if click_tracking is None:
+                logger.warning(f"Click tracking record not found for click_id: {network_click_id}")
+                return ({
+                    'success': False, 
+                    'message': 'Click tracking record not found',
+                    'error_code': 'CLICK_NOT_FOUND'
+                }, 200)
+
+            receipt, created = PostbackReceipt.objects.get_or_create(
+                key=key,
+                defaults={'network_key': network_key, 'click_id': click_tracking.click_id},
+            )
+            if not created and receipt.status_code is not None:
+                PostbackReceipt.objects.filter(pk=receipt.pk).update(hits=F('hits') + 1, updated_at=timezone.now())
+                logger.info(f"Duplicate postback for click_id {network_click_id} answered from receipt {receipt.id}")
+                return receipt.response, receipt.status_code
+
+            data, status_code, conversion = _record_conversion(click_tracking, network_click_id, network_payout)
+
+            receipt.response = data
+            receipt.status_code = status_code
+            receipt.conversion = conversion
+            receipt.save(update_fields=['response', 'status_code', 'conversion', 'updated_at'])
+            return data, status_code
+
+    except Exception as e:
+        logger.error(f"Postback processing error: {str(e)}", exc_info=True)
+        return ({
+            'success': False, 
+            'message': 'Internal server error',
+            'error_code': 'SERVER_ERROR'
+        }, 500)
+
+
+def postback_key(network_key, click_id, payout):
+    """Idempotency key over everything process_postback reads from a postback"""
+    raw = '\x1f'.join([network_key, normalize_click_id(click_id), payout or ''])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _record_conversion(click_tracking, network_click_id, network_payout):
+    """
+    Create or update the conversion for a locked click
+
+    Returns (data, status_code, conversion); conversion is None when the
+    postback was filtered out.
+    """
+    # Use the offer's payout amount (set in admin panel) instead of network payout
+    offer_payout = click_tracking.offer.payout
+    user_id = click_tracking.user_id
+
+    # First, check if a conversion already exists for this click tracking record
+    existing_conversion = Conversion.objects.filter(click_tracking=click_tracking).first()
+    if existing_conversion:
+        # Conversion already exists, just update it (this prevents double counting)
+        existing_conversion.payout = offer_payout
+        existing_conversion.network_click_id = network_click_id
+        existing_conversion.network_payout = network_payout
+        existing_conversion.save()
+
+        logger.info(f"Updated existing conversion for user {user_id}, click_id: {network_click_id}")
+        return ({
+            'success': True, 
+            'message': 'Existing conversion updated',
+            'conversion_id': existing_conversion.id
+        }, 200, existing_conversion)
+
+    # Drop the share of conversions the applicable SamplingRule filters out
+    # (see offers.sampling); the decision is stored, so a retry reuses it
+    decision = sample_conversion(click_tracking, click_tracking.offer.cpa_network_id)
+    if not decision.kept:
+        logger.info(f"Conversion filtered out for user {user_id} by sampling rule {decision.rule_id} (counter {decision.sequence})")
+
+        return ({
+            'success': True, 
+            'message': 'Conversion filtered out (sampling rule)',
+            'filtered': True,
+            'conversion_counter': decision.sequence
+        }, 200, None)
+
+    # Create new conversion record; the unique constraint on click_tracking
+    # backs up the row lock on databases without SELECT ... FOR UPDATE
+    try:
+        with transaction.atomic():
+            conversion = Conversion.objects.create(
+                click_tracking=click_tracking,
+                payout=offer_payout,
+                status='approved',
+                network_click_id=network_click_id,
+                network_payout=network_payout
+            )
+    except IntegrityError:
+        conversion = Conversion.objects.get(click_tracking=click_tracking)
+        logger.warning(f"Conversion for click_id {network_click_id} was created concurrently: conversion ID {conversion.id}")
+        return ({
+            'success': True, 
+            'message': 'Existing conversion updated',
+            'conversion_id': conversion.id
+        }, 200, conversion)
+
+    logger.info(f"New conversion created for user {user_id}: conversion ID {conversion.id}, sampling counter {decision.sequence}")
+
+    return ({
+        'success': True, 
+        'message': 'Conversion created successfully',
+        'conversion_id': conversion.id,
+        'conversion_counter': decision.sequence
+    }, 200, conversion)
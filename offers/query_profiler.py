@@ -0,0 +1,210 @@
+"""
+Per-view database query profiling
+
+QueryProfilerMiddleware (offers.middleware) wraps every database cursor
+for the duration of a request with a QueryRecorder, which counts queries,
+sums their time and fingerprints their SQL. At the end of the request the
+numbers are added to the process-wide QueryProfile under the view's name.
+
+QueryProfile keeps a rolling window of one-minute buckets per view
+(QUERY_PROFILER_WINDOW_MINUTES), each with a wall-time and a query-count
+histogram and the fingerprints that repeated within a request - the usual
+sign of an N+1 loop. The staff page home.views.query_profile renders it.
+
+Everything is in memory and per process: with several workers, each one
+reports the traffic it served.
+"""
+import re
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+# Histogram bucket upper bounds; the last bucket is open-ended
+LATENCY_BOUNDS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+QUERY_COUNT_BOUNDS = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500]
+
+# Repeated fingerprints kept per view and bucket
+MAX_FINGERPRINTS = 20
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN\s*\((?:\s*(?:%s|\?|\d+|\'[^\']*\')\s*,?)+\)', re.IGNORECASE)
+_WHITESPACE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """Collapse literals, IN lists and whitespace so repeats of a query match"""
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _IN_LIST.sub('IN (...)', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+def _bucket_index(bounds, value):
+    for index, bound in enumerate(bounds):
+        if value <= bound:
+            return index
+    return len(bounds)
+
+
+class QueryRecorder:
+    """execute_wrapper that records the queries of one request"""
+
+    def __init__(self):
+        self.count = 0
+        self.sql_seconds = 0.0
+        self.fingerprints = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_seconds += time.perf_counter() - started
+            self.count += 1
+            key = fingerprint(sql)
+            self.fingerprints[key] = self.fingerprints.get(key, 0) + 1
+
+    def repeated(self):
+        """Return {fingerprint: executions} for queries run more than once"""
+        return {key: count for key, count in self.fingerprints.items() if count > 1}
+
+
+class _Bucket:
+    __slots__ = ('minute', 'requests', 'queries', 'sql_ms', 'wall_ms', 'max_queries',
+                 'latency_histogram', 'query_histogram', 'repeated')
+
+    def __init__(self, minute):
+        self.minute = minute
+        self.requests = 0
+        self.queries = 0
+        self.sql_ms = 0.0
+        self.wall_ms = 0.0
+        self.max_queries = 0
+        self.latency_histogram = [0] * (len(LATENCY_BOUNDS_MS) + 1)
+        self.query_histogram = [0] * (len(QUERY_COUNT_BOUNDS) + 1)
+        # fingerprint -> [requests it repeated in, most executions in one request]
+        self.repeated = {}
+
+
+def _percentile_bound(histogram, bounds, pct):
+    """Upper bound of the histogram bucket holding the pct-th percentile"""
+    total = sum(histogram)
+    if not total:
+        return None
+    threshold = total * pct / 100.0
+    running = 0
+    for index, count in enumerate(histogram):
+        running += count
+        if running >= threshold:
+            return bounds[index] if index < len(bounds) else None
+    return None
+
+
+class QueryProfile:
+    """Rolling per-view aggregates of QueryRecorder results"""
+
+    def __init__(self, window_minutes=60):
+        self.window_minutes = window_minutes
+        self._views = {}
+        self._lock = threading.Lock()
+
+    def record(self, view_name, recorder, wall_seconds):
+        minute = int(time.time() // 60)
+        wall_ms = wall_seconds * 1000
+        with self._lock:
+            buckets = self._views.setdefault(view_name, deque())
+            if not buckets or buckets[-1].minute != minute:
+                buckets.append(_Bucket(minute))
+            while buckets and buckets[0].minute <= minute - self.window_minutes:
+                buckets.popleft()
+
+            bucket = buckets[-1]
+            bucket.requests += 1
+            bucket.queries += recorder.count
+            bucket.sql_ms += recorder.sql_seconds * 1000
+            bucket.wall_ms += wall_ms
+            bucket.max_queries = max(bucket.max_queries, recorder.count)
+            bucket.latency_histogram[_bucket_index(LATENCY_BOUNDS_MS, wall_ms)] += 1
+            bucket.query_histogram[_bucket_index(QUERY_COUNT_BOUNDS, recorder.count)] += 1
+
+            for key, executions in recorder.repeated().items():
+                entry = bucket.repeated.get(key)
+                if entry is None:
+                    if len(bucket.repeated) >= MAX_FINGERPRINTS:
+                        continue
+                    entry = bucket.repeated[key] = [0, 0]
+                entry[0] += 1
+                entry[1] = max(entry[1], executions)
+
+    def report(self):
+        """
+        Summarise the window per view, busiest SQL time first
+
+        Percentiles are histogram bucket upper bounds (None = above the
+        largest bound).
+        """
+        oldest = int(time.time() // 60) - self.window_minutes
+        rows = []
+        with self._lock:
+            for view_name, buckets in self._views.items():
+                live = [bucket for bucket in buckets if bucket.minute > oldest]
+                if not live:
+                    continue
+
+                requests = sum(bucket.requests for bucket in live)
+                latency = [sum(counts) for counts in zip(*(bucket.latency_histogram for bucket in live))]
+                query_counts = [sum(counts) for counts in zip(*(bucket.query_histogram for bucket in live))]
+
+                repeated = {}
+                for bucket in live:
+                    for key, (hits, executions) in bucket.repeated.items():
+                        entry = repeated.setdefault(key, [0, 0])
+                        entry[0] += hits
+                        entry[1] = max(entry[1], executions)
+
+                total_queries = sum(bucket.queries for bucket in live)
+                total_sql_ms = sum(bucket.sql_ms for bucket in live)
+                rows.append({
+                    'view': view_name,
+                    'requests': requests,
+                    'avg_queries': total_queries / requests,
+                    'max_queries': max(bucket.max_queries for bucket in live),
+                    'p95_queries': _percentile_bound(query_counts, QUERY_COUNT_BOUNDS, 95),
+                    'avg_sql_ms': total_sql_ms / requests,
+                    'total_sql_ms': total_sql_ms,
+                    'avg_wall_ms': sum(bucket.wall_ms for bucket in live) / requests,
+                    'p50_wall_ms': _percentile_bound(latency, LATENCY_BOUNDS_MS, 50),
+                    'p95_wall_ms': _percentile_bound(latency, LATENCY_BOUNDS_MS, 95),
+                    'latency_histogram': latency,
+                    'repeated': sorted(
+                        (
+                            {'fingerprint': key, 'requests': hits, 'max_executions': executions}
+                            for key, (hits, executions) in repeated.items()
+                        ),
+                        key=lambda item: (-item['max_executions'], -item['requests']),
+                    )[:5],
+                })
+
+        rows.sort(key=lambda row: -row['total_sql_ms'])
+        return rows
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+
+_profile = None
+_profile_lock = threading.Lock()
+
+
+def get_query_profile():
+    """Return the process-wide QueryProfile"""
+    global _profile
+    if _profile is None:
+        with _profile_lock:
+            if _profile is None:
+                _profile = QueryProfile(getattr(settings, 'QUERY_PROFILER_WINDOW_MINUTES', 60))
+    return _profile
@@ -0,0 +1,130 @@
+"""
+Cached redirect plans for track_click
+
+A redirect plan is everything track_click needs to answer a click for a
+(user, offer) pair: whether the affiliate may send traffic, and the offer
+URL plus the network's click ID parameter. Building one costs a single
+query (the network comes from offers.network_registry); after that it is served from a small in-process dict backed
+by the shared OFFERS_CACHE_ALIAS cache, so a warm click only costs the
+ClickTracking INSERT and the redirect URL is the offer's precompiled
+template with the click ID substituted (see offers.redirect_templates).
+
+Plans are versioned rather than deleted one by one: saving or deleting an
+Offer, CPANetwork, UserOfferRequest or User bumps a version stamp in the
+shared cache (see offers.signals), which every worker process checks on
+each lookup.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Exists, OuterRef, Subquery
+
+from user.models import User
+from .models import Offer, UserOfferRequest
+from .redirect_templates import render_redirect_url
+
+VERSION_KEY = 'offers:redirect_plan:version'
+
+# Part of the cache key so plans cached in an older shape are never read
+PLAN_FORMAT = 2
+
+# Upper bound for the in-process layer; it is simply emptied when full
+LOCAL_MAX_ENTRIES = 10000
+
+_local_plans = {}
+_local_lock = threading.Lock()
+
+
+def _cache():
+    return caches[getattr(settings, 'OFFERS_CACHE_ALIAS', 'default')]
+
+
+def get_plan_version():
+    """Return the current plan version stamp, creating it if missing"""
+    cache = _cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_plan_version():
+    """Invalidate every cached plan in every process"""
+    # A fresh timestamp instead of incr() so a cache restart can never bring
+    # an old version number (and the plans stored under it) back to life
+    _cache().set(VERSION_KEY, time.time_ns(), None)
+    with _local_lock:
+        _local_plans.clear()
+
+
+def build_redirect_plan(user_id, offer_id):
+    """
+    Build the plan for a (user, offer) pair straight from the database
+
+    status is 404 for an unknown user or inactive/unknown offer, 403 when the
+    affiliate is not approved for the offer and 200 otherwise.
+    """
+    offer = Offer.objects.filter(
+        id=offer_id,
+        is_active=True,
+    ).annotate(
+        request_status=Subquery(
+            UserOfferRequest.objects.filter(
+                user_id=user_id,
+                offer=OuterRef('pk'),
+            ).values('status')[:1]
+        ),
+        user_exists=Exists(User.objects.filter(id=user_id)),
+    ).first()
+
+    if offer is None or not offer.user_exists:
+        return {'status': 404}
+
+    if offer.request_status:
+        allowed = offer.request_status == 'approved'
+    else:
+        # No request on file - only offers without approval are open
+        allowed = not offer.need_approval
+
+    if not allowed:
+        return {'status': 403}
+
+    return {
+        'status': 200,
+        'user_id': int(user_id),
+        'offer_id': offer.id,
+        'offer_url': offer.offer_url,
+        'click_id_parameter': offer.get_network().click_id_parameter or 'subid',
+        'redirect_template': offer.redirect_template or offer.compile_redirect_template(),
+    }
+
+
+def get_redirect_plan(user_id, offer_id):
+    """Return the redirect plan for a (user, offer) pair, building it on a miss"""
+    version = get_plan_version()
+    local_key = (user_id, offer_id)
+
+    entry = _local_plans.get(local_key)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+
+    cache = _cache()
+    cache_key = f'offers:redirect_plan:{PLAN_FORMAT}:{version}:{user_id}:{offer_id}'
+    plan = cache.get(cache_key)
+    if plan is None:
+        plan = build_redirect_plan(user_id, offer_id)
+        cache.set(cache_key, plan, getattr(settings, 'REDIRECT_PLAN_TIMEOUT', 300))
+
+    with _local_lock:
+        if len(_local_plans) >= LOCAL_MAX_ENTRIES:
+            _local_plans.clear()
+        _local_plans[local_key] = (version, plan)
+    return plan
+
+
+def build_plan_redirect_url(plan, click_id):
+    """Fill the click ID into the plan's precompiled redirect template"""
+    return render_redirect_url(plan['redirect_template'], click_id)
@@ -0,0 +1,60 @@
+"""
+Precompiled offer redirect URLs
+
+An offer's redirect template is its offer URL with the click ID position
+marked by CLICK_ID_TOKEN. It is compiled when the offer (or its network) is
+saved, so answering a click is one str.replace().
+
+Compiling handles:
+- macros already in the offer URL: the network's wrapped click ID
+  parameter (e.g. {s2}, #s2#, [s2] depending on click_id_wrapper) and the
+  generic {clickid} / {click_id} are replaced in place;
+- otherwise the parameter is appended to the query string, reusing an
+  existing one (including a trailing ? or &) and keeping any #fragment at
+  the end of the URL where it belongs.
+"""
+import re
+from urllib.parse import quote
+
+CLICK_ID_TOKEN = '{click_id}'
+
+# Parameter used when the network does not define one
+DEFAULT_CLICK_ID_PARAMETER = 'subid'
+
+GENERIC_MACRO = re.compile(r'\{click_?id\}', re.IGNORECASE)
+
+
+def format_click_id_macro(parameter, wrapper):
+    """Wrap a parameter name the way the network writes its macros"""
+    if len(wrapper) == 2:
+        # Two-character wrapper like {} or []
+        return f"{wrapper[0]}{parameter}{wrapper[1]}"
+    elif len(wrapper) == 1:
+        # Single character wrapper like # or *
+        return f"{wrapper}{parameter}{wrapper}"
+    # Default to {} if wrapper is invalid
+    return f"{{{parameter}}}"
+
+
+def compile_redirect_template(offer_url, click_id_parameter, click_id_wrapper='{}'):
+    """Return the redirect template for an offer URL"""
+    parameter = click_id_parameter or DEFAULT_CLICK_ID_PARAMETER
+    url = (offer_url or '').strip()
+
+    macro = format_click_id_macro(parameter, click_id_wrapper or '')
+    if macro in url or GENERIC_MACRO.search(url):
+        return GENERIC_MACRO.sub(CLICK_ID_TOKEN, url.replace(macro, CLICK_ID_TOKEN))
+
+    base, hash_mark, fragment = url.partition('#')
+    if '?' not in base:
+        separator = '?'
+    elif base.endswith(('?', '&')):
+        separator = ''
+    else:
+        separator = '&'
+    return f"{base}{separator}{quote(parameter, safe='')}={CLICK_ID_TOKEN}{hash_mark}{fragment}"
+
+
+def render_redirect_url(template, click_id):
+    """Fill a click ID into a compiled template"""
+    return template.replace(CLICK_ID_TOKEN, click_id)
@@ -0,0 +1,170 @@
+"""
+Report queries for the affiliate report views
+
+Each report is one grouped query whose rows already carry the derived
+figures (conversion rate, EPC), computed in SQL, so the views hand the
+queryset to a Paginator and the database does the counting, ordering and
+LIMIT/OFFSET. A report page costs the same handful of queries whatever
+the affiliate's click volume.
+
+Reports read the DailyStat rollup (see offers.daily_stats). With
+DAILY_STATS_ENABLED = False the rollup is not maintained and the same
+reports are grouped straight from ClickTracking with TruncDate, joined
+(LEFT JOIN) to each click's conversion; that source attributes
+conversions to the day of their click rather than their conversion date,
+and filters subids through the SubId references (see offers.subids).
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import (
+    Case, Count, DecimalField, Exists, F, FloatField, IntegerField, OuterRef, Q, Subquery, Sum, Value, When,
+)
+from django.db.models.functions import Cast, Coalesce, TruncDate
+
+from .daily_stats import day_bounds, stats_for
+from .models import ClickTracking, Offer, UserOfferRequest
+from .subids import has_subid, subid_filter
+
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+
+APPROVED = Q(conversion__status='approved')
+
+
+def use_rollup():
+    return getattr(settings, 'DAILY_STATS_ENABLED', True)
+
+
+def clicks_for(user, start_date=None, end_date=None, offer_id=None, subid=None):
+    """ClickTracking rows of an affiliate, narrowed by the usual report filters"""
+    clicks = ClickTracking.objects.filter(user=user)
+    if start_date:
+        clicks = clicks.filter(click_date__gte=day_bounds(start_date, start_date)[0])
+    if end_date:
+        clicks = clicks.filter(click_date__lt=day_bounds(end_date, end_date)[1])
+    if offer_id:
+        clicks = clicks.filter(offer_id=offer_id)
+    if subid:
+        clicks = clicks.filter(subid_filter(user, subid))
+    return clicks.order_by()
+
+
+def _measures():
+    """Aggregates for clicks, conversions and earnings over the selected source"""
+    if use_rollup():
+        return {
+            'clicks': Sum('clicks'),
+            'conversions': Sum('conversions'),
+            'earnings': Coalesce(Sum('earnings'), Value(Decimal('0.00')), output_field=MONEY),
+        }
+    return {
+        'clicks': Count('id'),
+        'conversions': Count('conversion', filter=APPROVED),
+        'earnings': Coalesce(Sum('conversion__payout', filter=APPROVED), Value(Decimal('0.00')), output_field=MONEY),
+    }
+
+
+def _rates(prefix=''):
+    """Conversion rate (percent) and EPC from the aggregated measures (named with prefix)"""
+    clicks, conversions, earnings = f'{prefix}clicks', f'{prefix}conversions', f'{prefix}earnings'
+    return {
+        f'{prefix}conversion_rate': Case(
+            When(**{f'{clicks}__gt': 0}, then=Cast(conversions, FloatField()) * 100.0 / Cast(clicks, FloatField())),
+            default=Value(0.0),
+            output_field=FloatField(),
+        ),
+        f'{prefix}epc': Case(
+            When(**{f'{clicks}__gt': 0}, then=F(earnings) / F(clicks)),
+            default=Value(Decimal('0.00')),
+            output_field=MONEY,
+        ),
+    }
+
+
+def _rows(user, start_date, end_date, offer_id=None, subid=None):
+    if use_rollup():
+        return stats_for(user, start_date, end_date, offer_id, subid)
+    return clicks_for(user, start_date, end_date, offer_id, subid)
+
+
+def daily_report(user, start_date=None, end_date=None, offer_id=None, subid=None):
+    """
+    One row per day: date, clicks, conversions, earnings, conversion_rate, epc
+
+    Most recent day first; no dates means the whole history.
+    """
+    rows = _rows(user, start_date, end_date, offer_id, subid)
+    if not use_rollup():
+        rows = rows.annotate(date=TruncDate('click_date'))
+    return rows.values('date').annotate(**_measures()).annotate(**_rates()).order_by('-date')
+
+
+def offer_breakdown(user, start_date=None, end_date=None, offer_id=None, subid=None):
+    """One row per offer: offer_id, offer_name and the daily_report figures, best earners first"""
+    rows = _rows(user, start_date, end_date, offer_id, subid)
+    return (
+        rows.values('offer_id', offer_name=F('offer__offer_name'))
+        .annotate(**_measures()).annotate(**_rates())
+        .order_by('-earnings', 'offer_name')
+    )
+
+
+def offer_performance(user, start_date=None, end_date=None):
+    """
+    The affiliate's approved, active offers annotated with report_clicks,
+    report_conversions, report_earnings, report_conversion_rate and
+    report_epc, most clicked first
+
+    Each figure is a correlated subquery over the report source, so the
+    queryset pages in the database and totals can be aggregated over it;
+    offers without activity get zeros. (Offer already has an epc field,
+    hence the prefix.)
+    """
+    per_offer = (
+        _rows(user, start_date, end_date)
+        .filter(offer_id=OuterRef('pk'))
+        .values('offer_id')
+        .annotate(**_measures())
+    )
+    figures = {
+        f'report_{measure}': Coalesce(Subquery(per_offer.values(measure)), Value(zero), output_field=field)
+        for measure, field, zero in (
+            ('clicks', IntegerField(), 0),
+            ('conversions', IntegerField(), 0),
+            ('earnings', MONEY, Decimal('0.00')),
+        )
+    }
+    return (
+        Offer.objects.filter(is_active=True)
+        .filter(Exists(UserOfferRequest.objects.filter(user=user, offer=OuterRef('pk'), status='approved')))
+        .annotate(**figures)
+        .annotate(**_rates('report_'))
+        .order_by('-report_clicks', 'offer_name', 'pk')
+    )
+
+
+def report_totals(user, start_date=None, end_date=None, offer_id=None, subid=None):
+    """clicks, conversions, earnings, conversion_rate and epc over the whole selection"""
+    totals = _rows(user, start_date, end_date, offer_id, subid).aggregate(**_measures())
+    clicks = totals['clicks'] or 0
+    conversions = totals['conversions'] or 0
+    earnings = totals['earnings'] or Decimal('0.00')
+    return {
+        'clicks': clicks,
+        'conversions': conversions,
+        'earnings': earnings,
+        'conversion_rate': conversions * 100 / clicks if clicks else 0.0,
+        'epc': earnings / clicks if clicks else Decimal('0.00'),
+    }
+
+
+def subid_click_count(user, start_date=None, end_date=None, subid=None):
+    """Clicks carrying the given subid, or any subid at all"""
+    rows = _rows(user, start_date, end_date, subid=subid)
+    if not subid:
+        if use_rollup():
+            # '' and NULL both fail > ''
+            rows = rows.filter(Q(subid1__gt='') | Q(subid2__gt='') | Q(subid3__gt=''))
+        else:
+            rows = rows.filter(has_subid())
+    return rows.aggregate(**_measures())['clicks'] or 0
@@ -0,0 +1,133 @@
+"""
+Conversion sampling
+
+Postbacks drop a configured share of each affiliate's conversions. Which
+share is set by SamplingRule rows (served from the network registry, see
+offers.network_registry.get_sampling_rule) and decided by a sampler
+registered here under the rule's method:
+
+- 'counter' keeps one counter per rule and affiliate (SamplingCounter) and
+  drops skip_count of every window postbacks. The counter is advanced with
+  a single UPDATE ... SET value = value + 1 that returns the new value, so
+  parallel postbacks each get their own number and the ratio holds exactly.
+- 'hash' drops the clicks whose ID hashes into the skipped share. It needs
+  no shared state at all; the ratio holds on average.
+
+Every decision is stored as a SamplingDecision, and a click that already
+has one keeps it, so a postback retried after a failure is not sampled a
+second time.
+"""
+import hashlib
+import logging
+from collections import namedtuple
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+
+from .models import SamplingCounter, SamplingDecision
+from .network_registry import get_sampling_rule
+
+logger = logging.getLogger(__name__)
+
+# A sampler takes (rule, click_tracking) and returns (kept, sequence)
+_samplers = {}
+
+Decision = namedtuple('Decision', ['kept', 'rule_id', 'sequence'])
+
+
+def register_sampler(method):
+    """Register a sampler function for SamplingRule.method"""
+    def decorator(func):
+        _samplers[method] = func
+        return func
+    return decorator
+
+
+def _in_window(position, rule):
+    """Whether a 0-based position falls in the kept part of the rule's window"""
+    return position % rule.window < rule.window - rule.skip_count
+
+
+def _update_returning():
+    # UPDATE ... RETURNING is supported by PostgreSQL and SQLite 3.35+
+    if connection.vendor == 'postgresql':
+        return True
+    return connection.vendor == 'sqlite' and connection.features.can_return_columns_from_insert
+
+
+def next_counter_value(rule_id, user_id):
+    """Advance the rule's counter for an affiliate and return the new value"""
+    table = connection.ops.quote_name(SamplingCounter._meta.db_table)
+    for _ in range(2):
+        if _update_returning():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'UPDATE {table} SET value = value + 1 WHERE rule_id = %s AND user_id = %s RETURNING value',
+                    [rule_id, user_id],
+                )
+                row = cursor.fetchone()
+            if row is not None:
+                return row[0]
+        else:
+            # The UPDATE keeps the row locked until the transaction ends, so
+            # the read that follows sees this postback's own increment
+            with transaction.atomic():
+                counters = SamplingCounter.objects.filter(rule_id=rule_id, user_id=user_id)
+                if counters.update(value=F('value') + 1):
+                    return counters.values_list('value', flat=True).get()
+        # First postback for this affiliate under the rule
+        try:
+            with transaction.atomic():
+                SamplingCounter.objects.create(rule_id=rule_id, user_id=user_id)
+        except IntegrityError:
+            pass
+    raise RuntimeError(f'Could not advance sampling counter for rule {rule_id}, user {user_id}')
+
+
+@register_sampler('counter')
+def sample_by_counter(rule, click_tracking):
+    sequence = next_counter_value(rule.id, click_tracking.user_id)
+    return _in_window(sequence - 1, rule), sequence
+
+
+@register_sampler('hash')
+def sample_by_hash(rule, click_tracking):
+    digest = hashlib.sha256(click_tracking.click_id.encode('utf-8')).digest()
+    return _in_window(int.from_bytes(digest[:8], 'big'), rule), None
+
+
+def sample_conversion(click_tracking, network_id):
+    """
+    Decide whether the conversion for a click is kept
+
+    Returns a Decision(kept, rule_id, sequence); rule_id is None when no
+    rule applies, sequence is the counter value for 'counter' rules.
+    """
+    existing = SamplingDecision.objects.filter(click_tracking_id=click_tracking.pk).first()
+    if existing is not None:
+        return Decision(existing.kept, existing.rule_id, existing.sequence)
+
+    rule = get_sampling_rule(click_tracking.user_id, click_tracking.offer_id, network_id)
+    if rule is None or not rule.skip_count:
+        kept, sequence = True, None
+    else:
+        sampler = _samplers.get(rule.method)
+        if sampler is None:
+            logger.error(f"Sampling rule {rule.id} uses unknown method '{rule.method}'; keeping the conversion")
+            kept, sequence = True, None
+        else:
+            kept, sequence = sampler(rule, click_tracking)
+
+    try:
+        with transaction.atomic():
+            SamplingDecision.objects.create(
+                click_tracking_id=click_tracking.pk,
+                rule_id=rule.id if rule else None,
+                sequence=sequence,
+                kept=kept,
+            )
+    except IntegrityError:
+        # Decided concurrently (only possible without a lock on the click)
+        existing = SamplingDecision.objects.get(click_tracking_id=click_tracking.pk)
+        return Decision(existing.kept, existing.rule_id, existing.sequence)
+    return Decision(kept, rule.id if rule else None, sequence)
@@ -0,0 +1,39 @@
+from django.db.models.signals import post_save, post_delete
+from django.db import transaction
+from django.dispatch import receiver
+from user.models import User
+from .models import Offer, CPANetwork, SamplingRule, SiteSettings, UserOfferRequest
+from .network_registry import bump_network_version
+from .redirect_plans import bump_plan_version
+import logging
+
+logger = logging.getLogger(__name__)
+
+@receiver(post_save, sender=Offer)
+@receiver(post_delete, sender=Offer)
+@receiver(post_save, sender=CPANetwork)
+@receiver(post_delete, sender=CPANetwork)
+@receiver(post_save, sender=UserOfferRequest)
+@receiver(post_delete, sender=UserOfferRequest)
+@receiver(post_delete, sender=User)
+def invalidate_redirect_plans(sender, **kwargs):
+    """
+    Drop cached track_click redirect plans when anything they depend on changes
+
+    The bump waits for the surrounding transaction to commit; bumping earlier
+    would let a concurrent click re-cache a plan built from the old rows.
+    """
+    transaction.on_commit(bump_plan_version)
+    logger.debug(f"Redirect plans invalidated by {sender.__name__} change")
+
+
+@receiver(post_save, sender=CPANetwork)
+@receiver(post_delete, sender=CPANetwork)
+@receiver(post_save, sender=SiteSettings)
+@receiver(post_delete, sender=SiteSettings)
+@receiver(post_save, sender=SamplingRule)
+@receiver(post_delete, sender=SamplingRule)
+def invalidate_network_registry(sender, **kwargs):
+    """Reload the network registry in every process once the change is committed"""
+    transaction.on_commit(bump_network_version)
+    logger.debug(f"Network registry invalidated by {sender.__name__} change")
@@ -0,0 +1,135 @@
+"""
+Logging helpers for the offers app
+
+- JsonFormatter writes one JSON object per record. Context passed with
+  extra={...} (click_id, user_id, offer_id, latency_ms, ...) becomes
+  top-level keys.
+- SamplingFilter keeps a fraction of low-level records from hot paths such
+  as track_click; warnings and errors always pass.
+- QueueingHandler hands records to a background thread through a bounded
+  queue, so a slow terminal or disk never blocks a request. When the queue
+  is full records are dropped (and counted) rather than waited for.
+
+All three are wired up by LOGGING in cpa/settings.py.
+"""
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import weakref
+
+# Attributes every LogRecord has; anything else on a record came from extra
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as single-line JSON"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, tz=datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep roughly `rate` of the records at or below `max_level`
+
+    Sampling is by count (every 1/rate-th record) rather than random, which
+    is cheaper and spreads kept records evenly under steady traffic.
+    """
+
+    def __init__(self, rate=1.0, max_level='INFO', name=''):
+        super().__init__(name)
+        self.rate = float(rate)
+        self.max_level = max_level if isinstance(max_level, int) else logging.getLevelName(max_level)
+        self.every = max(1, round(1 / self.rate)) if self.rate > 0 else 0
+        self._seen = 0
+
+    def filter(self, record):
+        if record.levelno > self.max_level:
+            return True
+        if not self.every:
+            return False
+        # Unlocked increment: an occasional miscount only shifts the sample
+        self._seen += 1
+        return self._seen % self.every == 0
+
+
+class QueueingHandler(logging.handlers.QueueHandler):
+    """
+    Non-blocking handler that writes through a QueueListener thread
+
+    The actual output goes to a StreamHandler (stream, default stderr) or a
+    WatchedFileHandler (filename). The formatter configured on this handler
+    is applied by the target in the listener thread.
+    """
+
+    def __init__(self, stream=None, filename=None, queue_size=10000):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        if filename:
+            self.target = logging.handlers.WatchedFileHandler(filename)
+        else:
+            self.target = logging.StreamHandler(stream)
+        self.dropped = 0
+        self.listener = None
+        self._start_listener()
+        _handlers.add(self)
+        atexit.register(self.stop)
+
+    def _start_listener(self):
+        self.listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=True)
+        self.listener.start()
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # The record stays in this process, so formatting (the expensive
+        # part) is left to the listener thread instead of done here
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        """Flush queued records and stop the listener thread"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        self.target.flush()
+
+    def _after_fork(self):
+        # The listener thread does not survive fork(); give the child its own
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self.dropped = 0
+        self._start_listener()
+
+
+_handlers = weakref.WeakSet()
+
+
+def _restart_listeners():
+    for handler in list(_handlers):
+        if handler.listener is not None:
+            handler._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_listeners)
@@ -0,0 +1,160 @@
+"""
+SubId dimension
+
+Every distinct subid an affiliate sends is stored once per slot as a SubId
+row, and each click points at its subids through subid1_ref, subid2_ref
+and subid3_ref. The subid dropdowns then read SubId alone, and the report
+filters become lookups on the indexed foreign keys, where the old
+subid1 = x OR subid2 = x OR subid3 = x over the click rows could not use
+an index.
+
+resolve_subids() fills the references in before clicks are inserted
+(offers.click_ingest calls it for both ingest modes). Resolved IDs are
+kept in a per-process dict, so a warm subid costs no query; a new one
+costs an INSERT ... ON CONFLICT DO NOTHING and a SELECT per batch, and
+last_seen is moved forward at most once a day per subid and process.
+
+Migration 0036 links the clicks recorded before the dimension existed;
+the backfill_subids command does the same for any written afterwards
+without references (e.g. by processes still running the old code during
+a deploy).
+"""
+import threading
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .daily_stats import day_bounds
+from .models import SubId
+
+SLOTS = (1, 2, 3)
+
+# Upper bound for the in-process layer; it is simply emptied when full
+LOCAL_MAX_ENTRIES = 50000
+
+# (user_id, slot, value) -> (SubId id, date last_seen was last moved to)
+_local_ids = {}
+_local_lock = threading.Lock()
+
+
+def reset_subid_cache():
+    with _local_lock:
+        _local_ids.clear()
+
+
+def _date(value):
+    return timezone.localdate(value) if timezone.is_aware(value) else value.date()
+
+
+def resolve_subids(clicks, use_cache=True):
+    """
+    Set subid1_ref/subid2_ref/subid3_ref on clicks from their subid values
+
+    use_cache=False looks every subid up, which also moves first_seen back
+    for clicks older than the existing row (see the backfill_subids command).
+    """
+    # key -> [earliest, latest] click time in this batch
+    wanted = {}
+    for click in clicks:
+        seen = click.click_date or timezone.now()
+        for slot in SLOTS:
+            value = getattr(click, f'subid{slot}')
+            if not value:
+                setattr(click, f'subid{slot}_ref_id', None)
+                continue
+            key = (click.user_id, slot, value)
+            if key not in wanted:
+                wanted[key] = [seen, seen]
+            else:
+                wanted[key][0] = min(wanted[key][0], seen)
+                wanted[key][1] = max(wanted[key][1], seen)
+    if not wanted:
+        return
+
+    resolved = {key: _local_ids[key] for key in wanted if use_cache and key in _local_ids}
+    missing = [key for key in wanted if key not in resolved]
+    if missing:
+        SubId.objects.bulk_create(
+            [
+                SubId(user_id=user_id, slot=slot, value=value, first_seen=wanted[key][0], last_seen=wanted[key][1])
+                for key in missing
+                for user_id, slot, value in [key]
+            ],
+            ignore_conflicts=True,
+        )
+        rows = SubId.objects.filter(
+            user_id__in={user_id for user_id, _, _ in missing},
+            value__in={value for _, _, value in missing},
+        ).order_by().values_list('id', 'user_id', 'slot', 'value', 'first_seen', 'last_seen')
+        for subid_id, user_id, slot, value, first_seen, last_seen in rows:
+            key = (user_id, slot, value)
+            if key not in wanted:
+                continue
+            resolved[key] = (subid_id, _date(last_seen))
+            # A replayed or backfilled click older than the existing row
+            if wanted[key][0] < first_seen:
+                SubId.objects.filter(id=subid_id, first_seen__gt=wanted[key][0]).update(first_seen=wanted[key][0])
+
+    # Move last_seen forward for subids not yet marked seen on this day
+    stale = {
+        subid_id: key
+        for key, (subid_id, seen_date) in resolved.items()
+        if seen_date < _date(wanted[key][1])
+    }
+    # One UPDATE per day seen (a single one outside replays and backfills)
+    by_day = {}
+    for subid_id, key in stale.items():
+        by_day.setdefault(_date(wanted[key][1]), {})[subid_id] = key
+    for day, subids in by_day.items():
+        latest = max(wanted[key][1] for key in subids.values())
+        SubId.objects.filter(id__in=subids, last_seen__lt=latest).update(last_seen=latest)
+        for subid_id, key in subids.items():
+            resolved[key] = (subid_id, day)
+
+    if missing or stale:
+        with _local_lock:
+            if len(_local_ids) + len(missing) > LOCAL_MAX_ENTRIES:
+                _local_ids.clear()
+            _local_ids.update(resolved)
+
+    for click in clicks:
+        for slot in SLOTS:
+            value = getattr(click, f'subid{slot}')
+            if value:
+                entry = resolved.get((click.user_id, slot, value))
+                setattr(click, f'subid{slot}_ref_id', entry[0] if entry else None)
+
+
+def subid_filter(user, subid, prefix=''):
+    """Q matching clicks (or rows related to clicks through prefix) carrying subid in any slot"""
+    ids = SubId.objects.filter(user=user, value=subid).values('id')
+    return (
+        Q(**{f'{prefix}subid1_ref__in': ids})
+        | Q(**{f'{prefix}subid2_ref__in': ids})
+        | Q(**{f'{prefix}subid3_ref__in': ids})
+    )
+
+
+def has_subid(prefix=''):
+    """Q matching clicks (or rows related to clicks through prefix) carrying any subid"""
+    return (
+        Q(**{f'{prefix}subid1_ref__isnull': False})
+        | Q(**{f'{prefix}subid2_ref__isnull': False})
+        | Q(**{f'{prefix}subid3_ref__isnull': False})
+    )
+
+
+def subid_choices(user, start_date=None, end_date=None):
+    """
+    Sorted distinct subids of an affiliate, for the filter dropdowns
+
+    With dates, subids seen at some point between first_seen and last_seen
+    overlapping the range; a subid used before and after the range but not
+    during it is still offered.
+    """
+    subids = SubId.objects.filter(user=user)
+    if start_date:
+        subids = subids.filter(last_seen__gte=day_bounds(start_date, start_date)[0])
+    if end_date:
+        subids = subids.filter(first_seen__lt=day_bounds(end_date, end_date)[1])
+    return list(subids.order_by('value').values_list('value', flat=True).distinct())
@@ -1,3 +1,1173 @@
-from django.test import TestCase
+import hashlib
+from datetime import timedelta
+from decimal import Decimal
+from importlib import import_module
+from io import StringIO
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.contrib import admin
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from user.models import User
+
+from .accounting import BalanceChange, apply_balance_changes, change_conversion_statuses, run_status_job
+from .benchmarks import stub_http_server
+from .click_filters import DEFAULT_BOT_USER_AGENTS, compile_trie_pattern, get_click_filter, reset_click_filter
+from .click_ids import (
+    CLICK_KEY_LENGTH, ClickIdGenerator, decode_click_id, get_click_id_generator, normalize_click_id,
+    reset_click_id_generator,
+)
+from .click_lookup import resolve_click_id
+from .click_ingest import record_click, write_clicks
+from .daily_stats import count_clicks, flush_daily_stats, rebuild_daily_stats, reset_daily_stat_buffer
+from .dashboard_metrics import dashboard_metrics
+from .enrichment import claim_enrichment_jobs
+from .models import (
+    AffiliatePostback, BalanceLedger, ClickEnrichmentJob, ClickFilterStat, ClickIdWorkerLease, ClickTracking,
+    Conversion, ConversionStatusJob, CPANetwork, DailyStat, Notification, Offer, OutboundPostback,
+    OutboundPostbackDeadLetter, PostbackReceipt, RawPostback, Referral, ReferralEarning, ReferralLink, SamplingCounter,
+    SamplingRule, SiteSettings, SubId, UserOfferRequest,
+)
+from .network_registry import get_network_registry, reset_network_registry
+from .outbound_postbacks import OutboundPostbackSender, deliver_outbound_batch, requeue_dead_letters
+from .management.commands.bench_redirect_templates import legacy_redirect_url
+from .postback_queue import group_by_user, process_postback_batch, receive_postback
+from .postbacks import process_postback
+from .redirect_templates import compile_redirect_template, render_redirect_url
+from .reports import daily_report, offer_performance
+from .sampling import sample_conversion
+from .subids import reset_subid_cache, subid_choices, subid_filter
+from .tracking import process_click
+
+
+# Keep version stamps and cached plans out of the on-disk shared cache, and
+# click IDs from leasing a worker id inside the query counts
+offers_test_settings = override_settings(OFFERS_CACHE_ALIAS='default', CLICK_ID_WORKER_ID=1)
+
+
+class OffersFixture:
+    """Shared fixture: one network, one offer on it and one affiliate"""
+
+    def setUp(self):
+        super().setUp()
+        caches['default'].clear()
+        self.network = CPANetwork.objects.create(
+            network_key='TestNetwork',
+            name='Test Network',
+            click_id_parameter='subid',
+            postback_click_id_parameter='subid',
+        )
+        self.offer = self.make_offer()
+        self.user = User.objects.create_user(email='affiliate@example.com', password=None, full_name='Affiliate')
+        self.clicks = 0
+
+        # The registry is reloaded on commit, which never happens in a TestCase
+        reset_network_registry()
+        get_network_registry()
+        # Per-process state would otherwise refer to rows rolled back with an earlier test
+        reset_subid_cache()
+        reset_daily_stat_buffer()
+        reset_click_id_generator()
+
+    def tearDown(self):
+        reset_subid_cache()
+        reset_daily_stat_buffer()
+        reset_click_id_generator()
+        super().tearDown()
+
+    def make_offer(self, offer_name='Test Offer', **fields):
+        fields.setdefault('offer_url', 'https://offers.example.com/lp')
+        fields.setdefault('payout', Decimal('10.00'))
+        return Offer.objects.create(offer_name=offer_name, cpa_network=self.network, **fields)
+
+    def new_click(self, **fields):
+        """An unsaved click of the affiliate on the offer, with a fresh click ID"""
+        self.clicks += 1
+        fields.setdefault('user', self.user)
+        fields.setdefault('offer', self.offer)
+        fields.setdefault('click_id', f'test-click-{self.clicks}')
+        return ClickTracking(**fields)
+
+    def make_click(self, **fields):
+        click = self.new_click(**fields)
+        click.save(force_insert=True)
+        return click
+
+
+@offers_test_settings
+class OffersTestCase(OffersFixture, TestCase):
+    pass
+
+
+class ConversionAccountingTests(OffersTestCase):
+    """Conversion.save applies each status transition with a fixed number of queries"""
+
+    def setUp(self):
+        super().setUp()
+        SiteSettings.objects.create(referral_percentage=Decimal('10.00'))
+        # Reload the registry so it sees the referral percentage
+        reset_network_registry()
+        get_network_registry()
+        self.referrer = User.objects.create_user(email='referrer@example.com', password=None, full_name='Referrer')
+
+    def refer(self):
+        link = ReferralLink.objects.create(user=self.referrer, referral_code='TESTCODE')
+        return Referral.objects.create(referrer=self.referrer, referred_user=self.user, referral_link=link)
+
+    def convert(self, status='approved'):
+        return Conversion(click_tracking=self.make_click(), payout=Decimal('1.00'), status=status)
+
+    def balance(self, user):
+        return User.objects.values_list('balance', flat=True).get(pk=user.pk)
+
+    def test_new_approved_conversion(self):
+        conversion = self.convert()
+        # transition lookup, insert, balance update, ledger insert
+        with self.assertNumQueries(4):
+            conversion.save()
+        self.assertEqual(self.balance(self.user), Decimal('10.00'))
+        self.assertEqual(BalanceLedger.objects.filter(user=self.user, entry_type='conversion_credit').count(), 1)
+
+    def test_new_approved_conversion_with_referral(self):
+        self.refer()
+        conversion = self.convert()
+        # ... plus the referral earning insert; both credits share one UPDATE
+        with self.assertNumQueries(5):
+            conversion.save()
+        self.assertEqual(self.balance(self.user), Decimal('10.00'))
+        self.assertEqual(self.balance(self.referrer), Decimal('1.00'))
+        self.assertEqual(ReferralEarning.objects.get(conversion=conversion).amount, Decimal('1.00'))
+
+    def test_new_rejected_conversion(self):
+        conversion = self.convert(status='rejected')
+        with self.assertNumQueries(2):
+            conversion.save()
+        self.assertEqual(self.balance(self.user), Decimal('0.00'))
+
+    def test_approved_to_rejected(self):
+        self.refer()
+        conversion = self.convert()
+        conversion.save()
+
+        conversion.status = 'rejected'
+        # transition lookup, update, earnings select and delete, one guarded
+        # UPDATE per debited user, ledger insert, notification insert
+        with self.assertNumQueries(8):
+            conversion.save()
+        self.assertEqual(self.balance(self.user), Decimal('0.00'))
+        self.assertEqual(self.balance(self.referrer), Decimal('0.00'))
+        self.assertFalse(ReferralEarning.objects.filter(conversion=conversion).exists())
+        self.assertTrue(Notification.objects.filter(
+            user=self.user, notification_type='lead_rejected', related_object_id=conversion.id
+        ).exists())
+
+    def test_approved_to_pending(self):
+        conversion = self.convert()
+        conversion.save()
+
+        conversion.status = 'pending'
+        with self.assertNumQueries(4):
+            conversion.save()
+        self.assertEqual(self.balance(self.user), Decimal('0.00'))
+        self.assertFalse(Notification.objects.filter(notification_type='lead_rejected').exists())
+
+    def test_rejected_to_approved(self):
+        self.refer()
+        conversion = self.convert(status='rejected')
+        conversion.save()
+
+        conversion.status = 'approved'
+        with self.assertNumQueries(5):
+            conversion.save()
+        self.assertEqual(self.balance(self.user), Decimal('10.00'))
+        self.assertEqual(self.balance(self.referrer), Decimal('1.00'))
+
+    def test_unchanged_status(self):
+        conversion = self.convert()
+        conversion.save()
+
+        conversion.network_payout = '2.00'
+        with self.assertNumQueries(2):
+            conversion.save()
+        self.assertEqual(self.balance(self.user), Decimal('10.00'))
+
+    def test_debit_limited_to_balance(self):
+        conversion = self.convert()
+        conversion.save()
+        User.objects.filter(pk=self.user.pk).update(balance=Decimal('4.00'))
+
+        conversion.status = 'rejected'
+        conversion.save()
+        self.assertEqual(self.balance(self.user), Decimal('0.00'))
+        self.assertEqual(
+            BalanceLedger.objects.get(user=self.user, entry_type='adjustment').amount, Decimal('6.00')
+        )
+
+
+
+class BulkStatusChangeTests(OffersTestCase):
+    """change_conversion_statuses moves balances, ledger and referral earnings for a whole set at once"""
+
+    def setUp(self):
+        super().setUp()
+        SiteSettings.objects.create(referral_percentage=Decimal('10.00'))
+        reset_network_registry()
+        get_network_registry()
+        self.referrer = User.objects.create_user(email='referrer@example.com', password=None, full_name='Referrer')
+        link = ReferralLink.objects.create(user=self.referrer, referral_code='TESTCODE')
+        Referral.objects.create(referrer=self.referrer, referred_user=self.user, referral_link=link)
+        self.conversion_ids = [
+            Conversion.objects.create(click_tracking=self.make_click(), payout=Decimal('1.00'), status='pending').id
+            for _ in range(3)
+        ]
+
+    def balance(self, user):
+        return User.objects.values_list('balance', flat=True).get(pk=user.pk)
+
+    def ledger(self, user):
+        return list(BalanceLedger.objects.filter(user=user).order_by('id').values_list('entry_type', 'amount'))
+
+    def assertBalances(self, user_balance, referrer_balance):
+        for user, expected in ((self.user, user_balance), (self.referrer, referrer_balance)):
+            self.assertEqual(self.balance(user), expected)
+            self.assertEqual(sum(amount for _, amount in self.ledger(user)), expected)
+
+    def test_approve_reject_reapprove(self):
+        self.assertEqual(change_conversion_statuses(self.conversion_ids, 'approved'), 3)
+        self.assertBalances(Decimal('30.00'), Decimal('3.00'))
+        self.assertEqual(ReferralEarning.objects.count(), 3)
+        # Already approved: nothing changes
+        self.assertEqual(change_conversion_statuses(self.conversion_ids, 'approved'), 0)
+        self.assertBalances(Decimal('30.00'), Decimal('3.00'))
+
+        rejected = self.conversion_ids[:2]
+        self.assertEqual(change_conversion_statuses(rejected, 'rejected'), 2)
+        self.assertBalances(Decimal('10.00'), Decimal('1.00'))
+        self.assertEqual(
+            list(ReferralEarning.objects.values_list('conversion_id', flat=True)), self.conversion_ids[2:]
+        )
+        self.assertEqual(self.ledger(self.referrer)[-1], ('reversal', Decimal('-2.00')))
+        self.assertEqual(
+            set(Notification.objects.filter(notification_type='lead_rejected').values_list('related_object_id', flat=True)),
+            set(rejected),
+        )
+
+        self.assertEqual(change_conversion_statuses(rejected, 'approved'), 2)
+        self.assertBalances(Decimal('30.00'), Decimal('3.00'))
+        self.assertEqual(ReferralEarning.objects.count(), 3)
+        self.assertEqual(self.ledger(self.user), [
+            ('conversion_credit', Decimal('30.00')), ('reversal', Decimal('-20.00')), ('conversion_credit', Decimal('20.00')),
+        ])
+
+    def test_debit_limited_to_balance(self):
+        change_conversion_statuses(self.conversion_ids, 'approved')
+        self.user.add_to_balance(Decimal('-25.00'), entry_type='invoice_debit')
+
+        change_conversion_statuses(self.conversion_ids, 'rejected')
+        self.assertEqual(self.ledger(self.user)[2:], [('reversal', Decimal('-30.00')), ('adjustment', Decimal('25.00'))])
+        self.assertBalances(Decimal('0.00'), Decimal('0.00'))
+
+    def test_status_job_rerun(self):
+        job = ConversionStatusJob.objects.create(
+            new_status='approved', conversion_ids=self.conversion_ids, total=len(self.conversion_ids),
+        )
+        run_status_job(job, chunk_size=2)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed, job.changed), ('done', 3, 3))
+        self.assertBalances(Decimal('30.00'), Decimal('3.00'))
+
+        # The finished job has nothing left, and the same selection again changes nothing
+        run_status_job(job, chunk_size=2)
+        again = run_status_job(ConversionStatusJob.objects.create(
+            new_status='approved', conversion_ids=self.conversion_ids, total=len(self.conversion_ids),
+        ))
+        self.assertEqual((again.status, again.changed), ('done', 0))
+        job.refresh_from_db()
+        self.assertEqual(job.changed, 3)
+        self.assertBalances(Decimal('30.00'), Decimal('3.00'))
+        # One credit per chunk
+        self.assertEqual(len(self.ledger(self.user)), 2)
+
+
+class BalanceTests(OffersTestCase):
+    """Balances move through add_to_balance only; other saves leave the column alone"""
+
+    def balance(self):
+        return User.objects.values_list('balance', flat=True).get(pk=self.user.pk)
+
+    def test_admin_save_keeps_concurrent_credit(self):
+        admin_user = User.objects.create_superuser(email='admin@example.com', password='admin', full_name='Admin')
+        request = RequestFactory().post('/')
+        request.user = admin_user
+        model_admin = admin.site._registry[User]
+
+        # The change form is loaded, then a conversion credits the affiliate
+        stale = User.objects.get(pk=self.user.pk)
+        self.user.add_to_balance(Decimal('5.00'), entry_type='conversion_credit')
+
+        Form = model_admin.get_form(request, stale, change=True)
+        self.assertNotIn('balance', Form.base_fields)
+        data = {name: value for name, value in Form(instance=stale).initial.items() if value is not None}
+        data['full_name'] = 'Renamed Affiliate'
+        form = Form(data, instance=stale)
+        self.assertTrue(form.is_valid(), form.errors)
+        model_admin.save_model(request, form.save(commit=False), form, change=True)
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.full_name, 'Renamed Affiliate')
+        self.assertEqual(self.user.balance, Decimal('5.00'))
+
+    def test_admin_balance_adjustment(self):
+        admin_user = User.objects.create_superuser(email='admin@example.com', password='admin', full_name='Admin')
+        request = RequestFactory().post('/')
+        request.user = admin_user
+        request._messages = CookieStorage(request)
+        model_admin = admin.site._registry[User]
+        self.user.add_to_balance(Decimal('5.00'), entry_type='conversion_credit')
+
+        user = User.objects.get(pk=self.user.pk)
+        Form = model_admin.get_form(request, user, change=True)
+        data = {name: value for name, value in Form(instance=user).initial.items() if value is not None}
+        data.update(balance_adjustment='-2.00', adjustment_note='Chargeback')
+        form = Form(data, instance=user)
+        self.assertTrue(form.is_valid(), form.errors)
+        model_admin.save_model(request, form.save(commit=False), form, change=True)
+
+        self.assertEqual(self.balance(), Decimal('3.00'))
+        entry = BalanceLedger.objects.get(user=self.user, entry_type='adjustment')
+        self.assertEqual((entry.amount, entry.description), (Decimal('-2.00'), 'Chargeback'))
+
+    def test_activation_keeps_concurrent_credit(self):
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        stale = User.objects.get(pk=self.user.pk)
+        self.user.add_to_balance(Decimal('5.00'), entry_type='conversion_credit')
+        self.assertTrue(User.objects.activate_user(stale))
+        self.assertEqual(self.balance(), Decimal('5.00'))
+        self.assertIsNotNone(User.objects.get(pk=self.user.pk).last_activated)
+
+
+
+class BalanceLedgerTests(OffersTestCase):
+    """Every balance change leaves a ledger entry, so balance == SUM(ledger)"""
+
+    def balance(self):
+        return User.objects.values_list('balance', flat=True).get(pk=self.user.pk)
+
+    def ledger(self):
+        return list(BalanceLedger.objects.filter(user=self.user).order_by('id').values_list('entry_type', 'amount'))
+
+    def reconcile(self, *args):
+        out = StringIO()
+        call_command('reconcile_balances', *args, stdout=out)
+        return out.getvalue()
+
+    def test_one_entry_per_change(self):
+        self.user.add_to_balance(Decimal('10.00'), entry_type='conversion_credit')
+        self.user.add_to_balance(Decimal('2.504'), entry_type='referral_credit')
+        self.user.add_to_balance(Decimal('-4.00'), entry_type='reversal')
+        self.assertEqual(self.ledger(), [
+            ('conversion_credit', Decimal('10.00')),
+            ('referral_credit', Decimal('2.50')),
+            ('reversal', Decimal('-4.00')),
+        ])
+        self.assertEqual(self.balance(), Decimal('8.50'))
+        self.assertIn('All balances match', self.reconcile())
+
+    def test_capped_debit_records_amount_taken(self):
+        self.user.add_to_balance(Decimal('3.00'), entry_type='conversion_credit')
+        self.assertEqual(self.user.add_to_balance(Decimal('-10.00'), entry_type='reversal'), Decimal('0.00'))
+        self.assertEqual(self.ledger(), [('conversion_credit', Decimal('3.00')), ('reversal', Decimal('-3.00'))])
+        self.assertIn('All balances match', self.reconcile())
+
+    def test_capped_batch_debit_books_adjustment(self):
+        self.user.add_to_balance(Decimal('3.00'), entry_type='conversion_credit')
+        applied = apply_balance_changes([BalanceChange(self.user.pk, Decimal('-10.00'), 'reversal', None, '')])
+        self.assertEqual(applied, {self.user.pk: Decimal('-3.00')})
+        self.assertEqual(self.balance(), Decimal('0.00'))
+        self.assertEqual(self.ledger(), [
+            ('conversion_credit', Decimal('3.00')),
+            ('reversal', Decimal('-10.00')),
+            ('adjustment', Decimal('7.00')),
+        ])
+        self.assertIn('All balances match', self.reconcile())
+
+    def test_reconcile_flags_drift(self):
+        self.user.add_to_balance(Decimal('10.00'), entry_type='conversion_credit')
+        # A write that bypasses add_to_balance
+        User.objects.filter(pk=self.user.pk).update(balance=Decimal('12.50'))
+
+        output = self.reconcile()
+        self.assertIn('affiliate@example.com', output)
+        self.assertIn('difference $2.50', output)
+        self.assertEqual(len(self.ledger()), 1)
+
+        self.reconcile('--fix')
+        self.assertEqual(self.ledger()[-1], ('adjustment', Decimal('2.50')))
+        self.assertIn('All balances match', self.reconcile())
+
+
+
+@override_settings(POSTBACK_INGEST_MODE='sync')
+class PostbackIdempotencyTests(OffersTestCase):
+    """However often and in whatever spelling a postback arrives, it converts and credits once"""
+
+    def setUp(self):
+        super().setUp()
+        # A click ID in the current scheme with both a 0 and a 1 in it
+        self.click = self.make_click(click_id='01ARZ3NDEKTSV4RRFFQ69G5FAV')
+
+    def postback(self, click_id=None, payout='10'):
+        params = {'network': self.network.network_key, 'subid': click_id or self.click.click_id, 'payout': payout}
+        return process_postback(params)
+
+    def assert_counted_once(self):
+        self.assertEqual(Conversion.objects.filter(click_tracking=self.click).count(), 1)
+        self.assertEqual(PostbackReceipt.objects.count(), 1)
+        self.assertEqual(BalanceLedger.objects.filter(user=self.user, entry_type='conversion_credit').count(), 1)
+        self.assertEqual(User.objects.values_list('balance', flat=True).get(pk=self.user.pk), Decimal('10.00'))
+
+    def test_duplicate_postback(self):
+        first = self.postback()
+        self.assertEqual(first[0]['message'], 'Conversion created successfully')
+        self.assertEqual(self.postback(), first)
+        self.assert_counted_once()
+        self.assertEqual(PostbackReceipt.objects.get().hits, 2)
+
+    def test_retry_through_view(self):
+        # The network retries with the parameters in the body instead of the query string
+        url = reverse('handle_postback')
+        params = {'network': self.network.network_key, 'subid': self.click.click_id, 'payout': '10'}
+        first = self.client.get(url, params).json()
+        self.assertTrue(first['success'])
+        self.assertEqual(self.client.post(url, params).json(), first)
+        self.assert_counted_once()
+
+    def test_case_variant_postbacks(self):
+        first = self.postback()
+        self.assertEqual(self.postback(self.click.click_id.lower()), first)
+        # Crockford look-alikes (O for 0, I/L for 1) decode to the same ID
+        mangled = self.click.click_id.replace('0', 'o').replace('1', 'l')
+        self.assertEqual(self.postback(mangled), first)
+        self.assert_counted_once()
+        self.assertEqual(PostbackReceipt.objects.get().hits, 3)
+
+
+# The batch runs in worker threads, which only see committed rows
+@offers_test_settings
+@override_settings(POSTBACK_INGEST_MODE='queue')
+class PostbackQueueTests(OffersFixture, TransactionTestCase):
+    """Queued copies of a postback are processed in one group and convert once"""
+
+    def test_duplicate_postbacks_convert_once(self):
+        click = self.make_click(click_id=get_click_id_generator().next_id(self.user.pk, self.offer.pk))
+        params = {'network': self.network.network_key, 'subid': click.click_id, 'payout': '10'}
+        for received in (params, params, {**params, 'subid': click.click_id.lower()}):
+            data, status_code = receive_postback(received)
+            self.assertEqual((status_code, data['message']), (200, 'Postback accepted'))
+        self.assertEqual(len(group_by_user(RawPostback.objects.all())), 1)
+
+        self.assertEqual(process_postback_batch(), {'processed': 3, 'retried': 0, 'failed': 0})
+        self.assertEqual(process_postback_batch(), {'processed': 0, 'retried': 0, 'failed': 0})
+        self.assertEqual(set(RawPostback.objects.values_list('status', 'status_code')), {('done', 200)})
+        self.assertEqual(Conversion.objects.filter(click_tracking=click).count(), 1)
+        self.assertEqual(PostbackReceipt.objects.get().hits, 3)
+        self.assertEqual(BalanceLedger.objects.filter(user=self.user, entry_type='conversion_credit').count(), 1)
+        self.assertEqual(User.objects.values_list('balance', flat=True).get(pk=self.user.pk), Decimal('10.00'))
+
+
+
+class SamplingTests(OffersTestCase):
+    """Sampling rules drop the configured share of conversions, deterministically per click"""
+
+    def setUp(self):
+        super().setUp()
+        # Start without the default rule migration 0032 seeds
+        SamplingRule.objects.all().delete()
+        self.reload_rules()
+
+    def reload_rules(self):
+        reset_network_registry()
+        get_network_registry()
+
+    def use_rule(self, **fields):
+        rule = SamplingRule.objects.create(**fields)
+        self.reload_rules()
+        return rule
+
+    def decide(self, clicks):
+        return [sample_conversion(click, self.network.pk) for click in clicks]
+
+    def test_counter_drops_exact_share(self):
+        rule = self.use_rule(method='counter', skip_count=1, window=3)
+        clicks = [self.make_click() for _ in range(6)]
+        decisions = self.decide(clicks)
+        self.assertEqual([decision.kept for decision in decisions], [True, True, False, True, True, False])
+        self.assertEqual([decision.sequence for decision in decisions], [1, 2, 3, 4, 5, 6])
+        self.assertEqual({decision.rule_id for decision in decisions}, {rule.pk})
+
+        # A retried postback keeps its decision and does not move the counter
+        self.assertEqual(self.decide(clicks[2:3])[0], decisions[2])
+        self.assertEqual(SamplingCounter.objects.get(rule=rule, user=self.user).value, 6)
+
+    def test_hash_follows_click_id(self):
+        self.use_rule(method='hash', skip_count=1, window=4)
+        clicks = [self.make_click() for _ in range(40)]
+        expected = [
+            int.from_bytes(hashlib.sha256(click.click_id.encode('utf-8')).digest()[:8], 'big') % 4 < 3
+            for click in clicks
+        ]
+        decisions = self.decide(clicks)
+        self.assertEqual([decision.kept for decision in decisions], expected)
+        self.assertIn(False, expected)
+        self.assertTrue(all(decision.sequence is None for decision in decisions))
+        self.assertFalse(SamplingCounter.objects.exists())
+
+    def test_no_rule_keeps_everything(self):
+        self.assertEqual(self.decide([self.make_click()])[0], (True, None, None))
+
+    def test_default_rule_continues_every_third(self):
+        # Before the rules, every conversion_counter value divisible by 3 was dropped
+        User.objects.filter(pk=self.user.pk).update(conversion_counter=2)
+        import_module('offers.migrations.0032_sampling_rules').create_default_rule(django_apps, None)
+        self.reload_rules()
+
+        decisions = self.decide([self.make_click() for _ in range(6)])
+        self.assertEqual([decision.sequence for decision in decisions], [3, 4, 5, 6, 7, 8])
+        self.assertEqual([decision.kept for decision in decisions], [n % 3 != 0 for n in range(3, 9)])
+
+
+
+class RedirectTemplateTests(OffersTestCase):
+    """Compiled redirect templates give the URLs the old per-click builder did, and follow network edits"""
+
+    CLICK_ID = '01M53R7A11J600000000A00007'
+
+    # (click_id_parameter, click_id_wrapper) of every kind of network
+    NETWORKS = [('s2', '{}'), ('subid', '{}'), ('subid', '#'), ('aff_sub', '[]'), ('', '{}')]
+
+    def render(self, offer_url, parameter, wrapper):
+        return render_redirect_url(compile_redirect_template(offer_url, parameter, wrapper), self.CLICK_ID)
+
+    def test_matches_legacy_builder(self):
+        for parameter, wrapper in self.NETWORKS:
+            for offer_url in ('https://offers.example.com/lp/7', 'https://offers.example.com/lp?o=7&aff=3'):
+                with self.subTest(parameter=parameter, wrapper=wrapper, offer_url=offer_url):
+                    self.assertEqual(
+                        self.render(offer_url, parameter, wrapper),
+                        legacy_redirect_url(offer_url, parameter, self.CLICK_ID),
+                    )
+
+    def test_shapes_the_legacy_builder_broke(self):
+        cases = [
+            ('https://o.example.com/lp#signup', 's2', '{}', f'https://o.example.com/lp?s2={self.CLICK_ID}#signup'),
+            ('https://o.example.com/lp?', 's2', '{}', f'https://o.example.com/lp?s2={self.CLICK_ID}'),
+            ('https://o.example.com/lp?o=7&', 's2', '{}', f'https://o.example.com/lp?o=7&s2={self.CLICK_ID}'),
+            ('https://o.example.com/lp?s2={s2}', 's2', '{}', f'https://o.example.com/lp?s2={self.CLICK_ID}'),
+            ('https://o.example.com/lp?sub=#subid#', 'subid', '#', f'https://o.example.com/lp?sub={self.CLICK_ID}'),
+            ('https://o.example.com/lp?a=[aff_sub]', 'aff_sub', '[]', f'https://o.example.com/lp?a={self.CLICK_ID}'),
+            ('https://o.example.com/c/{clickid}/7', 's2', '{}', f'https://o.example.com/c/{self.CLICK_ID}/7'),
+        ]
+        for offer_url, parameter, wrapper, expected in cases:
+            with self.subTest(offer_url=offer_url):
+                self.assertEqual(self.render(offer_url, parameter, wrapper), expected)
+
+    def test_offer_save_compiles(self):
+        self.assertEqual(self.offer.build_redirect_url(self.CLICK_ID), f'https://offers.example.com/lp?subid={self.CLICK_ID}')
+        self.offer.offer_url = 'https://offers.example.com/new?o=1'
+        self.offer.save(update_fields=['offer_url'])
+        self.offer.refresh_from_db()
+        self.assertEqual(self.offer.redirect_template, 'https://offers.example.com/new?o=1&subid={click_id}')
+
+    def test_network_save_recompiles(self):
+        other = self.make_offer('Macro Offer', offer_url='https://offers.example.com/lp?x=#aff#')
+        self.network.click_id_parameter = 'aff'
+        self.network.click_id_wrapper = '#'
+        self.network.save()
+
+        self.offer.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.offer.build_redirect_url(self.CLICK_ID), f'https://offers.example.com/lp?aff={self.CLICK_ID}')
+        self.assertEqual(other.build_redirect_url(self.CLICK_ID), f'https://offers.example.com/lp?x={self.CLICK_ID}')
+
+
+
+class ClickLookupTests(OffersTestCase):
+    """Click IDs echoed back re-cased, wrapped or cut short still find their click"""
+
+    CLICK_ID = '01ARZ3NDEKTSV4RRFFQ69G5FAV'
+    # The user-offer-time-date format used before the Crockford scheme
+    LEGACY_ID = '12-345-101530-20250114'
+
+    def setUp(self):
+        super().setUp()
+        self.make_click(click_id=self.CLICK_ID)
+        self.make_click(click_id=self.LEGACY_ID)
+
+    def test_normalize_click_id(self):
+        self.assertEqual(normalize_click_id(self.CLICK_ID.lower()), self.CLICK_ID)
+        self.assertEqual(normalize_click_id(' 0lARZ3NDEKTSV4RRFFQ69G5FAV\n'), self.CLICK_ID)
+        self.assertEqual(normalize_click_id('OIARZ3NDEKTSV4RRFFQ69G5FAV'), self.CLICK_ID)
+        # Anything outside the scheme only loses surrounding whitespace
+        self.assertEqual(normalize_click_id(f' {self.LEGACY_ID} '), self.LEGACY_ID)
+        self.assertEqual(normalize_click_id(self.CLICK_ID[:20].lower()), self.CLICK_ID[:20].lower())
+        self.assertEqual(normalize_click_id(''), '')
+        self.assertIsNone(normalize_click_id(None))
+
+    def test_case_variants(self):
+        for received in (self.CLICK_ID.lower(), self.CLICK_ID.title(), 'oIarz3ndektsv4rrffq69g5fav'):
+            with self.subTest(received=received):
+                self.assertEqual(resolve_click_id(received, self.network), self.CLICK_ID)
+
+    def test_wrapped(self):
+        self.network.click_id_wrapper = '#'
+        for received in (f'#{self.CLICK_ID}#', f'{{{self.CLICK_ID.lower()}}}', f'"[{self.CLICK_ID}]"'):
+            with self.subTest(received=received):
+                self.assertEqual(resolve_click_id(received, self.network), self.CLICK_ID)
+
+    def test_legacy_ids(self):
+        self.assertEqual(resolve_click_id(self.LEGACY_ID, self.network), self.LEGACY_ID)
+        self.assertEqual(resolve_click_id(f'{{{self.LEGACY_ID}}}', self.network), self.LEGACY_ID)
+        self.assertIsNone(resolve_click_id('12-345-101530-20250115', self.network))
+
+    def test_truncated(self):
+        self.assertEqual(resolve_click_id(self.CLICK_ID[:CLICK_KEY_LENGTH].lower(), self.network), self.CLICK_ID)
+        self.assertEqual(resolve_click_id(self.CLICK_ID[:20], self.network), self.CLICK_ID)
+        self.assertEqual(resolve_click_id(self.LEGACY_ID[:18], self.network), self.LEGACY_ID)
+        # Too short to reach the index, or not a prefix of the stored ID
+        self.assertIsNone(resolve_click_id(self.CLICK_ID[:CLICK_KEY_LENGTH - 1], self.network))
+        self.assertIsNone(resolve_click_id(self.CLICK_ID[:20] + 'X', self.network))
+
+    def test_ambiguous_prefix_not_resolved(self):
+        self.make_click(click_id=self.CLICK_ID[:20] + '000000')
+        self.assertIsNone(resolve_click_id(self.CLICK_ID[:20], self.network))
+        self.assertEqual(resolve_click_id(self.CLICK_ID[:21], self.network), self.CLICK_ID)
+
+    def test_admin_search(self):
+        click = self.make_click(ip_address='192.168.100.200', organization='Examplecorp Hosting')
+        request = RequestFactory().get('/')
+        model_admin = admin.site._registry[ClickTracking]
+
+        def search(term):
+            queryset, _ = model_admin.get_search_results(request, ClickTracking.objects.all(), term)
+            return set(queryset.values_list('click_id', flat=True))
+
+        self.assertEqual(search(self.CLICK_ID.lower()), {self.CLICK_ID})
+        self.assertEqual(search(f'{{{self.CLICK_ID[:20]}}}'), {self.CLICK_ID})
+        # Long single-token terms that are not click IDs still use the normal search
+        self.assertEqual(search('192.168.100.200'), {click.click_id})
+        self.assertEqual(search('Examplecorp'), {click.click_id})
+
+
+@override_settings(OUTBOUND_POSTBACK_MAX_ATTEMPTS=3, OUTBOUND_POSTBACK_BACKOFF_SECONDS=60)
+class OutboundPostbackTests(OffersTestCase):
+    """Approved conversions are relayed to the affiliate's tracker, with retries and dead letters"""
+
+    def setUp(self):
+        super().setUp()
+        self.sender = OutboundPostbackSender(concurrency=4, host_rate=0, timeout=5)
+
+    def tearDown(self):
+        self.sender.close()
+        super().tearDown()
+
+    def approve(self, subid1='', status='approved'):
+        click = self.make_click(subid1=subid1)
+        conversion = Conversion(click_tracking=click, payout=Decimal('1.00'), status=status)
+        conversion.save()
+        return conversion
+
+    def deliver(self):
+        OutboundPostback.objects.update(next_attempt_at=timezone.now())
+        return deliver_outbound_batch(sender=self.sender)
+
+    def test_approval_queues_postback_with_macros(self):
+        AffiliatePostback.objects.create(user=self.user, url='https://t.example.com/pb?id={subid1}&p={payout}&c={click_id}')
+        offer_postback = AffiliatePostback.objects.create(
+            user=self.user, offer=self.offer, url='https://o.example.com/pb?id={subid1}&x={unknown}'
+        )
+        conversion = self.approve(subid1='a b&c')
+
+        delivery = OutboundPostback.objects.get(conversion=conversion)
+        self.assertEqual(delivery.affiliate_postback, offer_postback)
+        self.assertEqual(delivery.url, 'https://o.example.com/pb?id=a%20b%26c&x={unknown}')
+
+        # Approving it again does not queue a second postback
+        change_conversion_statuses([conversion.id], 'rejected')
+        change_conversion_statuses([conversion.id], 'approved')
+        self.assertEqual(OutboundPostback.objects.filter(conversion=conversion).count(), 1)
+
+    def test_rejected_conversion_queues_nothing(self):
+        AffiliatePostback.objects.create(user=self.user, url='https://t.example.com/pb')
+        self.approve(status='rejected')
+        self.assertFalse(OutboundPostback.objects.exists())
+
+    def test_delivery_to_tracker(self):
+        with stub_http_server() as tracker:
+            AffiliatePostback.objects.create(user=self.user, url=tracker.url + '/pb?sub={subid1}&amount={payout}')
+            self.approve(subid1='s1')
+            self.approve(subid1='s2')
+            self.assertEqual(self.deliver(), {'sent': 2, 'retried': 0, 'dead': 0})
+
+        self.assertCountEqual(tracker.paths(), ['/pb?sub=s1&amount=10.00', '/pb?sub=s2&amount=10.00'])
+        self.assertEqual(OutboundPostback.objects.filter(status='sent', status_code=200).count(), 2)
+
+    def test_server_errors_retried_then_dead_lettered(self):
+        with stub_http_server(respond=lambda path: 503) as tracker:
+            AffiliatePostback.objects.create(user=self.user, url=tracker.url + '/pb')
+            conversion = self.approve()
+
+            started = timezone.now()
+            self.assertEqual(self.deliver(), {'sent': 0, 'retried': 1, 'dead': 0})
+            delivery = OutboundPostback.objects.get(conversion=conversion)
+            self.assertEqual((delivery.status, delivery.attempts, delivery.status_code), ('pending', 1, 503))
+            self.assertGreaterEqual((delivery.next_attempt_at - started).total_seconds(), 60)
+            # Not due yet
+            self.assertEqual(deliver_outbound_batch(sender=self.sender), {'sent': 0, 'retried': 0, 'dead': 0})
+
+            self.deliver()
+            self.assertEqual(self.deliver(), {'sent': 0, 'retried': 0, 'dead': 1})
+
+        self.assertEqual(len(tracker.paths()), 3)
+        self.assertFalse(OutboundPostback.objects.exists())
+        dead_letter = OutboundPostbackDeadLetter.objects.get(conversion=conversion)
+        self.assertEqual((dead_letter.attempts, dead_letter.status_code), (3, 503))
+
+        requeue_dead_letters(OutboundPostbackDeadLetter.objects.all())
+        self.assertEqual(OutboundPostback.objects.get(conversion=conversion).attempts, 0)
+        self.assertFalse(OutboundPostbackDeadLetter.objects.exists())
+
+    def test_client_error_not_retried(self):
+        with stub_http_server(respond=lambda path: 404) as tracker:
+            AffiliatePostback.objects.create(user=self.user, url=tracker.url + '/missing')
+            self.approve()
+            self.assertEqual(self.deliver(), {'sent': 0, 'retried': 0, 'dead': 1})
+        self.assertEqual(OutboundPostbackDeadLetter.objects.get().status_code, 404)
+
+
+class ReportQueryTests(OffersTestCase):
+    """Report pages cost the same number of queries whatever the click volume"""
+
+    def setUp(self):
+        super().setUp()
+        self.offers = [self.offer, self.make_offer('Test Offer 1'), self.make_offer('Test Offer 2')]
+        self.client.force_login(self.user)
+
+    def add_clicks(self, count):
+        now = timezone.now()
+        clicks = ClickTracking.objects.bulk_create([
+            self.new_click(
+                offer=self.offers[i % len(self.offers)],
+                subid1=f'sub-{i % 4}',
+                click_date=now - timedelta(days=i % 10),
+            )
+            for i in range(count)
+        ])
+        Conversion.objects.bulk_create([
+            Conversion(click_tracking=click, payout=Decimal('10.00'), status='approved', conversion_date=click.click_date)
+            for click in clicks[::5]
+        ])
+        today = timezone.localdate()
+        rebuild_daily_stats(today - timedelta(days=10), today)
+
+    def queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def assert_constant_queries(self):
+        urls = [
+            reverse('daily_reports'),
+            reverse('get_daily_details') + f'?date={timezone.localdate()}',
+        ]
+        self.add_clicks(20)
+        before = [self.queries(url) for url in urls]
+        self.add_clicks(400)
+        self.assertEqual([self.queries(url) for url in urls], before)
+
+    def test_rollup_reports(self):
+        self.assert_constant_queries()
+
+    @override_settings(DAILY_STATS_ENABLED=False)
+    def test_raw_reports(self):
+        self.assert_constant_queries()
+
+    def test_sources_agree(self):
+        self.add_clicks(100)
+        rollup = list(daily_report(self.user))
+        with override_settings(DAILY_STATS_ENABLED=False):
+            raw = list(daily_report(self.user))
+        self.assertEqual(rollup, raw)
+        self.assertEqual(len(rollup), 10)
+        self.assertEqual(sum(row['clicks'] for row in rollup), 100)
+        self.assertEqual(sum(row['conversions'] for row in rollup), 20)
+
+    def test_rebuild_command_skips_unsettled_days(self):
+        self.add_clicks(20)
+        DailyStat.objects.all().delete()
+        today = timezone.localdate()
+        # Today may still have counts buffered in other processes
+        call_command('rebuild_daily_stats', start=str(today - timedelta(days=1)), end=str(today), stdout=StringIO())
+        self.assertEqual(set(DailyStat.objects.values_list('date', flat=True)), {today - timedelta(days=1)})
+
+
+class DashboardMetricsTests(OffersTestCase):
+    """Dashboard totals and series cost a fixed number of queries and are cached until new activity"""
+
+    def setUp(self):
+        super().setUp()
+        self.today = timezone.localdate()
+
+    def click(self, days_ago=0, status=None):
+        click = self.make_click(click_date=timezone.now() - timedelta(days=days_ago))
+        count_clicks([click])
+        if status:
+            # The conversion is counted once its transaction commits
+            with self.captureOnCommitCallbacks(execute=True):
+                Conversion.objects.create(
+                    click_tracking=click, payout=Decimal('10.00'), status=status, conversion_date=click.click_date,
+                )
+        return click
+
+    def check_series(self):
+        start = self.today - timedelta(days=364)
+        metrics = dashboard_metrics(self.user, start, self.today)
+        self.assertEqual(len(metrics['series']), 365)
+        self.assertEqual(metrics['series'][0]['date'], start)
+        self.assertEqual(metrics['series'][-1]['date'], self.today)
+        self.assertEqual(
+            [(day['clicks'], day['conversions']) for day in metrics['series'][-4:]],
+            [(1, 0), (0, 0), (0, 0), (2, 1)],
+        )
+        self.assertEqual((metrics['clicks'], metrics['conversions']), (3, 1))
+        self.assertEqual(metrics['earnings'], Decimal('10.00'))
+        self.assertEqual(metrics['epc'], Decimal('10.00') / 3)
+
+    def test_rollup_series_zero_filled(self):
+        self.click(days_ago=3)
+        self.click()
+        self.click(status='approved')
+        flush_daily_stats()
+        # one grouped DailyStat query
+        with self.assertNumQueries(1):
+            self.check_series()
+
+    @override_settings(DAILY_STATS_ENABLED=False)
+    def test_raw_series_zero_filled(self):
+        self.click(days_ago=3)
+        self.click()
+        self.click(status='approved')
+        # one grouped clicks query, one grouped conversions query
+        with self.assertNumQueries(2):
+            self.check_series()
+
+    def test_cached_until_new_activity(self):
+        self.click()
+        flush_daily_stats()
+        self.assertEqual(dashboard_metrics(self.user, self.today, self.today)['clicks'], 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(dashboard_metrics(self.user, self.today, self.today)['clicks'], 1)
+
+        # Buffered clicks are not in DailyStat yet, so the cached result stands
+        self.click()
+        with self.assertNumQueries(0):
+            dashboard_metrics(self.user, self.today, self.today)
+        flush_daily_stats()
+        self.assertEqual(dashboard_metrics(self.user, self.today, self.today)['clicks'], 2)
+
+        # Another affiliate's activity leaves the cached result alone
+        other = User.objects.create_user(email='other@example.com', password=None, full_name='Other')
+        count_clicks([ClickTracking.objects.create(user=other, offer=self.offer, click_id='other-click')])
+        flush_daily_stats()
+        with self.assertNumQueries(0):
+            dashboard_metrics(self.user, self.today, self.today)
+
+    @override_settings(DAILY_STATS_ENABLED=False)
+    def test_raw_cached_until_new_activity(self):
+        self.click()
+        self.assertEqual(dashboard_metrics(self.user, self.today, self.today)['clicks'], 1)
+        with self.assertNumQueries(0):
+            dashboard_metrics(self.user, self.today, self.today)
+        self.click()
+        self.assertEqual(dashboard_metrics(self.user, self.today, self.today)['clicks'], 2)
+
+
+class OfferReportQueryTests(OffersTestCase):
+    """The offer report costs the same number of queries whatever the number of approved offers"""
+
+    def setUp(self):
+        super().setUp()
+        # The shared offer is never requested, so it stays out of the report
+        self.client.force_login(self.user)
+        self.offers = []
+
+    def add_offers(self, count):
+        offers = [self.make_offer(f'Test Offer {len(self.offers) + i}') for i in range(count)]
+        UserOfferRequest.objects.bulk_create([
+            UserOfferRequest(user=self.user, offer=offer, status='approved') for offer in offers
+        ])
+        clicks = ClickTracking.objects.bulk_create([
+            self.new_click(offer=offer) for offer in offers for _ in range(offer.id % 3)
+        ])
+        Conversion.objects.bulk_create([
+            Conversion(click_tracking=click, payout=Decimal('10.00'), status='approved') for click in clicks[::2]
+        ])
+        self.offers += offers
+        rebuild_daily_stats(timezone.localdate(), timezone.localdate())
+
+    def queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('offer_reports'))
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response
+
+    def assert_constant_queries(self):
+        self.add_offers(3)
+        before, _ = self.queries()
+        self.add_offers(60)
+        after, response = self.queries()
+        self.assertEqual(after, before)
+
+        rows = list(response.context['offer_data'])
+        self.assertEqual(len(rows), 15)
+        self.assertEqual(response.context['total_offers'], 63)
+        self.assertEqual(response.context['total_clicks'], ClickTracking.objects.count())
+        self.assertEqual(response.context['total_conversions'], Conversion.objects.count())
+        clicks = [row['clicks'] for row in rows]
+        self.assertEqual(clicks, sorted(clicks, reverse=True))
+        for row in rows:
+            expected = row['earnings'] / row['clicks'] if row['clicks'] else Decimal('0.00')
+            self.assertEqual(row['epc'].quantize(Decimal('0.01')), expected.quantize(Decimal('0.01')))
+
+    def test_rollup_offer_report(self):
+        self.assert_constant_queries()
+
+    @override_settings(DAILY_STATS_ENABLED=False)
+    def test_raw_offer_report(self):
+        self.assert_constant_queries()
+
+    def test_unapproved_offers_left_out(self):
+        self.add_offers(2)
+        UserOfferRequest.objects.filter(offer=self.offers[0]).update(status='pending')
+        offers = offer_performance(self.user)
+        self.assertEqual([offer.pk for offer in offers], [self.offers[1].pk])
+
+
+@override_settings(CLICK_INGEST_MODE='direct', DAILY_STATS_ENABLED=False)
+class SubIdTests(OffersTestCase):
+    """Clicks are linked to SubId rows when written, and the subid filters and dropdowns read them"""
+
+    def click(self, subid1=None, subid2=None, subid3=None, days_ago=0):
+        return self.new_click(
+            subid1=subid1, subid2=subid2, subid3=subid3,
+            click_date=timezone.now() - timedelta(days=days_ago),
+        )
+
+    def test_click_linked_to_subids(self):
+        click = record_click(self.click(subid1='fb', subid3='ad-7'), queue_enrichment=False)
+        self.assertEqual(click.subid1_ref.value, 'fb')
+        self.assertEqual(click.subid1_ref.slot, 1)
+        self.assertIsNone(click.subid2_ref)
+        self.assertEqual(click.subid3_ref.slot, 3)
+
+        # Warm subids cost nothing beyond the click INSERT
+        with self.assertNumQueries(1):
+            again = record_click(self.click(subid1='fb', subid3='ad-7'), queue_enrichment=False)
+        self.assertEqual(
+            (again.subid1_ref_id, again.subid3_ref_id), (click.subid1_ref_id, click.subid3_ref_id)
+        )
+        # The same value in another slot is another row
+        other_slot = record_click(self.click(subid2='fb'), queue_enrichment=False)
+        self.assertNotEqual(other_slot.subid2_ref_id, click.subid1_ref_id)
+        self.assertEqual(SubId.objects.count(), 3)
+
+    def test_batch_and_last_seen(self):
+        write_clicks([self.click(subid1='fb', days_ago=3), self.click(subid1='tt', days_ago=2)])
+        fb = SubId.objects.get(value='fb')
+        self.assertEqual(fb.first_seen, fb.last_seen)
+
+        write_clicks([self.click(subid1='fb'), self.click(subid1='fb')])
+        fb.refresh_from_db()
+        self.assertEqual(timezone.localdate(fb.last_seen), timezone.localdate())
+        self.assertLess(fb.first_seen, fb.last_seen)
+        self.assertEqual(SubId.objects.count(), 2)
+
+    def test_choices_and_filter(self):
+        write_clicks([
+            self.click(subid1='fb', days_ago=10),
+            self.click(subid1='tt', subid2='fb'),
+            self.click(subid2='gg'),
+            self.click(),
+        ])
+        today = timezone.localdate()
+        with self.assertNumQueries(1):
+            self.assertEqual(subid_choices(self.user), ['fb', 'gg', 'tt'])
+        self.assertEqual(subid_choices(self.user, today - timedelta(days=1), today), ['fb', 'gg', 'tt'])
+        self.assertEqual(subid_choices(self.user, today - timedelta(days=12), today - timedelta(days=8)), ['fb'])
+
+        fb = ClickTracking.objects.filter(subid_filter(self.user, 'fb'))
+        self.assertEqual(sorted(fb.values_list('subid1', flat=True)), ['fb', 'tt'])
+        other = User.objects.create_user(email='other@example.com', password=None, full_name='Other')
+        self.assertFalse(ClickTracking.objects.filter(subid_filter(other, 'fb')).exists())
+
+    def test_backfill(self):
+        ClickTracking.objects.bulk_create([
+            self.click(subid1='fb', days_ago=5), self.click(subid1='fb', subid2='x'), self.click(),
+        ])
+        self.assertFalse(SubId.objects.exists())
+        call_command('backfill_subids', batch_size=2, stdout=StringIO())
+
+        fb = SubId.objects.get(value='fb')
+        self.assertEqual(timezone.localdate(fb.first_seen), timezone.localdate() - timedelta(days=5))
+        self.assertEqual(timezone.localdate(fb.last_seen), timezone.localdate())
+        self.assertEqual(ClickTracking.objects.filter(subid1_ref=fb).count(), 2)
+        self.assertEqual(ClickTracking.objects.filter(subid2_ref__value='x').count(), 1)
+
+    def test_backfill_moves_first_seen_back(self):
+        write_clicks([self.click(subid1='fb')])
+        ClickTracking.objects.bulk_create([self.click(subid1='fb', days_ago=30)])
+        call_command('backfill_subids', stdout=StringIO())
+        fb = SubId.objects.get()
+        self.assertEqual(timezone.localdate(fb.first_seen), timezone.localdate() - timedelta(days=30))
+        self.assertEqual(timezone.localdate(fb.last_seen), timezone.localdate())
+
+
+class EnrichmentClaimTests(OffersTestCase):
+    """Concurrent drainers never get the same enrichment job"""
+
+    def setUp(self):
+        super().setUp()
+        ClickEnrichmentJob.objects.bulk_create([
+            ClickEnrichmentJob(click_tracking=self.make_click(), ip_address='203.0.113.7') for _ in range(5)
+        ])
+
+    def test_claimed_jobs_not_handed_out_again(self):
+        first = claim_enrichment_jobs(3)
+        second = claim_enrichment_jobs(3)
+        self.assertEqual(len(first), 3)
+        self.assertEqual(len(second), 2)
+        self.assertFalse({job.pk for job in first} & {job.pk for job in second})
+        self.assertEqual(claim_enrichment_jobs(3), [])
+        self.assertEqual(ClickEnrichmentJob.objects.filter(status='running').count(), 5)
+
+    @override_settings(CLICK_ENRICHMENT_CLAIM_TIMEOUT=60)
+    def test_stale_claim_reclaimed(self):
+        jobs = claim_enrichment_jobs(5)
+        ClickEnrichmentJob.objects.filter(pk=jobs[0].pk).update(claimed_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual([job.pk for job in claim_enrichment_jobs(5)], [jobs[0].pk])
+
+
+class ClickIdLeaseTests(TestCase):
+    """Processes without CLICK_ID_WORKER_ID never share a worker id"""
+
+    def setUp(self):
+        self.generators = [ClickIdGenerator(), ClickIdGenerator()]
+
+    def tearDown(self):
+        for generator in self.generators:
+            generator.release()
+
+    def worker_id(self, generator):
+        return decode_click_id(generator.next_id(1, 1)).worker_id
+
+    def test_processes_lease_distinct_worker_ids(self):
+        first, second = (self.worker_id(generator) for generator in self.generators)
+        self.assertNotEqual(first, second)
+        self.assertEqual(ClickIdWorkerLease.objects.count(), 2)
+
+    def test_configured_worker_id_needs_no_lease(self):
+        self.assertEqual(self.worker_id(ClickIdGenerator(worker_id=7)), 7)
+        self.assertFalse(ClickIdWorkerLease.objects.exists())
+
+    def test_expired_lease_taken_over(self):
+        abandoned = self.worker_id(self.generators[0])
+        ClickIdWorkerLease.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        ClickIdWorkerLease.objects.exclude(worker_id=abandoned).delete()
+        # Every other worker id is in use, so the expired one is the only choice
+        ClickIdWorkerLease.objects.bulk_create([
+            ClickIdWorkerLease(worker_id=n, owner='other', expires_at=timezone.now() + timedelta(minutes=5))
+            for n in range(1024) if n != abandoned
+        ])
+        self.assertEqual(self.worker_id(self.generators[1]), abandoned)
+
+    def test_lost_lease_replaced_before_issuing(self):
+        generator = self.generators[0]
+        lost = self.worker_id(generator)
+        ClickIdWorkerLease.objects.filter(worker_id=lost).update(owner='other')
+        generator._lease.valid_until = 0.0
+        self.assertNotEqual(self.worker_id(generator), lost)
+
+    def test_released_worker_id_not_reused_at_once(self):
+        released = self.worker_id(self.generators[0])
+        self.generators[0].release()
+        self.assertNotEqual(self.worker_id(self.generators[1]), released)
+
+
+@override_settings(CLICK_INGEST_MODE='direct', CLICK_DEDUP_WINDOW=10)
+class ClickFilterTests(OffersTestCase):
+    """Bot words match on token boundaries; log-only mode still records every click"""
+
+    GOOGLEBOT = 'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)'
+
+    def setUp(self):
+        super().setUp()
+        UserOfferRequest.objects.create(user=self.user, offer=self.offer, status='approved')
+        reset_click_filter()
+
+    def tearDown(self):
+        reset_click_filter()
+        super().tearDown()
+
+    def hit(self, user_agent):
+        params = {'userid': str(self.user.pk), 'offerid': str(self.offer.pk)}
+        status, _ = process_click(params, {'REMOTE_ADDR': '203.0.113.7', 'HTTP_USER_AGENT': user_agent})
+        self.assertEqual(status, 302)
+
+    def test_bot_words_match_whole_tokens(self):
+        pattern = compile_trie_pattern(DEFAULT_BOT_USER_AGENTS)
+        for user_agent in (self.GOOGLEBOT, 'Mozilla/5.0 (compatible; bingbot/2.0)', 'curl/8.4.0', 'Yahoo! Slurp'):
+            self.assertTrue(pattern.search(user_agent), user_agent)
+        for user_agent in (
+            'Mozilla/5.0 (Linux; Android 10; CUBOT X30) AppleWebKit/537.36 Chrome/119.0 Mobile Safari/537.36',
+            'okhttp/4.12.0',
+            'Java/17.0.2',
+            'RobotVacuum/3.1 CFNetwork/1410',
+        ):
+            self.assertIsNone(pattern.search(user_agent), user_agent)
+
+    def test_longer_words_kept_beside_prefixes(self):
+        pattern = compile_trie_pattern(['bot', 'bots'])
+        self.assertEqual(pattern.search('all bots here').group(0), 'bots')
+
+    @override_settings(CLICK_FILTERS_LOG_ONLY=True)
+    def test_log_only_counts_and_records(self):
+        self.hit(self.GOOGLEBOT)
+        self.hit('Mozilla/5.0 (X11; Linux x86_64) Firefox/120.0')
+        self.hit('Mozilla/5.0 (X11; Linux x86_64) Firefox/120.0')
+        self.assertEqual(ClickTracking.objects.count(), 3)
+        self.assertEqual(
+            {reason for (_, _, _, reason) in get_click_filter().pending_counts()}, {'bot', 'duplicate'}
+        )
+
+    def test_counts_written_off_the_request_path(self):
+        self.hit(self.GOOGLEBOT)
+        self.hit(self.GOOGLEBOT)
+        self.assertFalse(ClickFilterStat.objects.exists())
+        reset_click_filter()
+        self.assertEqual(
+            list(ClickFilterStat.objects.values_list('reason', 'count')), [('bot', 2)]
+        )
+
+    @override_settings(CLICK_FILTERS_LOG_ONLY=False)
+    def test_enforcing_drops_filtered_hits(self):
+        self.hit(self.GOOGLEBOT)
+        self.hit('Mozilla/5.0 (X11; Linux x86_64) Firefox/120.0')
+        self.hit('Mozilla/5.0 (X11; Linux x86_64) Firefox/120.0')
+        self.assertEqual(ClickTracking.objects.count(), 1)
@@ -0,0 +1,158 @@
+"""
+Click tracking core
+
+process_click() does everything a tracking link hit needs and returns the
+status and redirect target, independent of how the request arrived. It is
+shared by the Django track_click view and the lightweight ASGI endpoint in
+offers.asgi, which hands over plain dicts instead of an HttpRequest.
+
+This module's logger is 'offers.tracking', whose INFO records are sampled
+(see LOGGING in cpa/settings.py).
+"""
+import logging
+import time
+
+from .click_filters import get_click_filter
+from .click_ingest import record_click
+from .enrichment import resolve_inline
+from .models import ClickTracking, generate_click_id
+from .redirect_plans import build_plan_redirect_url, get_redirect_plan
+
+logger = logging.getLogger(__name__)
+
+
+def client_ip_from_meta(meta):
+    """Get client IP address - improved version based on Stack Overflow best practices"""
+    # Try different headers in order of preference
+    ip = None
+
+    # 1. Try X-Forwarded-For (most common for proxies)
+    x_forwarded_for = meta.get('HTTP_X_FORWARDED_FOR')
+    if x_forwarded_for:
+        ip = x_forwarded_for.split(',')[0].strip()
+
+    # 2. Try X-Real-IP
+    if not ip or ip == '127.0.0.1':
+        ip = meta.get('HTTP_X_REAL_IP')
+
+    # 3. Try X-Forwarded
+    if not ip or ip == '127.0.0.1':
+        ip = meta.get('HTTP_X_FORWARDED')
+
+    # 4. Try X-Cluster-Client-IP
+    if not ip or ip == '127.0.0.1':
+        ip = meta.get('HTTP_X_CLUSTER_CLIENT_IP')
+
+    # 5. Fallback to REMOTE_ADDR
+    if not ip or ip == '127.0.0.1':
+        ip = meta.get('REMOTE_ADDR')
+
+    # 6. If still no valid IP, try HTTP_CLIENT_IP
+    if not ip or ip == '127.0.0.1':
+        ip = meta.get('HTTP_CLIENT_IP')
+
+    # 7. Last resort - if we're in development, use a default
+    if not ip:
+        ip = '127.0.0.1'  # Localhost for development
+
+    return ip
+
+
+def process_click(params, meta):
+    """
+    Record a click and work out where to send the visitor
+
+    params holds the query string values and meta the request headers in
+    Django's META form (HTTP_USER_AGENT, REMOTE_ADDR, ...). Returns
+    (status, value): (302, redirect URL) on success, otherwise the error
+    status and the text to show.
+    """
+    started = time.perf_counter()
+    userid = params.get('userid')
+    offerid = params.get('offerid')
+
+    # Get subid parameters
+    subid1 = params.get('subid1', '')
+    subid2 = params.get('subid2', '')
+    subid3 = params.get('subid3', '')
+
+    if not userid or not offerid or not userid.isdigit() or not offerid.isdigit():
+        return 400, "Invalid tracking link"
+
+    try:
+        # Approval status, offer URL and click ID parameter come from the
+        # cached redirect plan, so a warm click runs no lookup queries
+        plan = get_redirect_plan(int(userid), int(offerid))
+        if plan['status'] == 404:
+            return 404, "Invalid tracking link"
+        if plan['status'] != 200:
+            return 403, "Access denied"
+
+        # Get visitor information
+        ip_address = client_ip_from_meta(meta)
+        user_agent = meta.get('HTTP_USER_AGENT', '')
+        referrer = meta.get('HTTP_REFERER', '')
+
+        # Location data is resolved inline only when that needs no network;
+        # otherwise the enrichment queue fills it in after the redirect
+        geo_fields = resolve_inline(ip_address)
+
+        # Crawlers, blocked networks, repeat clicks and floods are redirected
+        # without creating a row; they only bump a ClickFilterStat counter
+        # (in log-only mode they are counted and still recorded)
+        click_filter = get_click_filter()
+        if click_filter is not None:
+            reason = click_filter.check_visitor(user_agent, geo_fields)
+            previous_click_id = None
+            if reason is None:
+                reason, previous_click_id = click_filter.check_repeat(ip_address, plan['user_id'], plan['offer_id'])
+            if reason is not None:
+                click_filter.count(plan['user_id'], plan['offer_id'], reason)
+                filter_context = {'user_id': plan['user_id'], 'offer_id': plan['offer_id'], 'reason': reason}
+                if click_filter.log_only:
+                    logger.info("Click would have been filtered", extra={**filter_context, 'user_agent': user_agent})
+                else:
+                    logger.debug("Click filtered", extra=filter_context)
+                    return 302, build_plan_redirect_url(plan, previous_click_id or '')
+
+        # Generate click ID
+        click_id = generate_click_id(plan['user_id'], plan['offer_id'])
+
+        # Create click tracking record with subid parameters; in batched
+        # ingest mode the INSERT happens later in a bulk_create
+        click_tracking = ClickTracking(
+            user_id=plan['user_id'],
+            offer_id=plan['offer_id'],
+            click_id=click_id,
+            ip_address=ip_address,
+            user_agent=user_agent,
+            referrer=referrer,
+            subid1=subid1 if subid1 else None,
+            subid2=subid2 if subid2 else None,
+            subid3=subid3 if subid3 else None,
+            **(geo_fields or {})
+        )
+        record_click(click_tracking, queue_enrichment=geo_fields is None)
+        if click_filter is not None:
+            click_filter.remember(ip_address, plan['user_id'], plan['offer_id'], click_id)
+
+        # Build redirect URL with click ID for the specific CPA network
+        redirect_url = build_plan_redirect_url(plan, click_id)
+
+        # Sampled (see OFFERS_TRACKING_LOG_SAMPLE_RATE); the redirect URL is
+        # only added when debug logging is on
+        log_context = {
+            'click_id': click_id,
+            'user_id': plan['user_id'],
+            'offer_id': plan['offer_id'],
+            'latency_ms': round((time.perf_counter() - started) * 1000, 3),
+        }
+        if logger.isEnabledFor(logging.DEBUG):
+            log_context['redirect_url'] = redirect_url
+        logger.info("Click tracked", extra=log_context)
+
+        return 302, redirect_url
+
+    except Exception as e:
+        logger.error(f"Click tracking error: {str(e)}", exc_info=True)
+        return 500, "An error occurred"
@@ -8,15 +8,17 @@ from django.utils import timezone
 from django.views.decorators.http import require_POST
 from django.conf import settings
 from django.db import models
-from django.db.models import Q
 from .models import Offer, UserOfferRequest, ClickTracking, Conversion, SiteSettings, CPANetwork
-from user.models import User
 import json
-import requests
 from datetime import datetime
 from django.db.models import Sum, Count
 from decimal import Decimal
 import logging
+from .tracking import client_ip_from_meta, process_click
+from .postbacks import merge_params
+from .postback_queue import receive_postback
+from .reports import daily_report, offer_breakdown, offer_performance, report_totals, subid_click_count
+from .subids import has_subid, subid_choices, subid_filter
 from .models import (
     Offer, UserOfferRequest, ClickTracking, Conversion, SiteSettings, 
     CPANetwork, Manager, PaymentMethod, Invoice, ReferralLink, Referral, ReferralEarning, Notification
@@ -26,39 +28,7 @@ logger = logging.getLogger(__name__)
 
 def get_client_ip(request):
     """Get client IP address - improved version based on Stack Overflow best practices"""
-    # Try different headers in order of preference
-    ip = None
-    
-    # 1. Try X-Forwarded-For (most common for proxies)
-    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-    if x_forwarded_for:
-        ip = x_forwarded_for.split(',')[0].strip()
-    
-    # 2. Try X-Real-IP
-    if not ip or ip == '127.0.0.1':
-        ip = request.META.get('HTTP_X_REAL_IP')
-    
-    # 3. Try X-Forwarded
-    if not ip or ip == '127.0.0.1':
-        ip = request.META.get('HTTP_X_FORWARDED')
-    
-    # 4. Try X-Cluster-Client-IP
-    if not ip or ip == '127.0.0.1':
-        ip = request.META.get('HTTP_X_CLUSTER_CLIENT_IP')
-    
-    # 5. Fallback to REMOTE_ADDR
-    if not ip or ip == '127.0.0.1':
-        ip = request.META.get('REMOTE_ADDR')
-    
-    # 6. If still no valid IP, try HTTP_CLIENT_IP
-    if not ip or ip == '127.0.0.1':
-        ip = request.META.get('HTTP_CLIENT_IP')
-    
-    # 7. Last resort - if we're in development, use a default
-    if not ip:
-        ip = '127.0.0.1'  # Localhost for development
-    
-    return ip
+    return client_ip_from_meta(request.META)
 
 @login_required
 def view_offer(request, offer_id):
@@ -284,124 +254,11 @@ def request_offer_access(request):
 
 def track_click(request):
     """Track offer clicks and redirect to original URL with click ID"""
-    userid = request.GET.get('userid')
-    offerid = request.GET.get('offerid')
-    
-    # Get subid parameters
-    subid1 = request.GET.get('subid1', '')
-    subid2 = request.GET.get('subid2', '')
-    subid3 = request.GET.get('subid3', '')
-
-    if not userid or not offerid:
-        return HttpResponse("Invalid tracking link", status=400)
-
-    try:
-        user = get_object_or_404(User, id=userid)
-        offer = get_object_or_404(Offer, id=offerid, is_active=True)
-
-        try:
-            user_request = UserOfferRequest.objects.get(user=user, offer=offer)
-            if user_request.status != 'approved':
-                return HttpResponse("Access denied", status=403)
-        except UserOfferRequest.DoesNotExist:
-            # Check if offer needs approval
-            if offer.need_approval:
-                return HttpResponse("Access denied", status=403)
-            # If no approval needed, allow access
-
-        # Generate click ID
-        from .models import generate_click_id
-        click_id = generate_click_id(user.id, offer.id)
-
-        # Get visitor information
-        ip_address = get_client_ip(request)
-        user_agent = request.META.get('HTTP_USER_AGENT', '')
-        referrer = request.META.get('HTTP_REFERER', '')
-
-        # Create click tracking record with subid parameters
-        click_tracking = ClickTracking.objects.create(
-            user=user,
-            offer=offer,
-            click_id=click_id,
-            ip_address=ip_address,
-            user_agent=user_agent,
-            referrer=referrer,
-            subid1=subid1 if subid1 else None,
-            subid2=subid2 if subid2 else None,
-            subid3=subid3 if subid3 else None
-        )
-        
-        # Fetch IP information from ipinfo.io and save it
-        if ip_address:
-            if ip_address == '127.0.0.1':
-                # For development environment, set some default values
-                click_tracking.country = 'Development'
-                click_tracking.city = 'Localhost'
-                click_tracking.region = 'Development Environment'
-                click_tracking.timezone = 'UTC'
-                click_tracking.organization = 'Development Server'
-                click_tracking.save()
-                print(f"Development environment detected, using default values for {ip_address}")
-            else:
-                try:
-                    # Fetch IP info from ipinfo.io
-                    response = requests.get(f'https://ipinfo.io/{ip_address}/json', timeout=5)
-                    if response.status_code == 200:
-                        data = response.json()
-                        
-                        # Update click tracking with IP info
-                        click_tracking.country = data.get('country', '')
-                        click_tracking.city = data.get('city', '')
-                        click_tracking.region = data.get('region', '')
-                        click_tracking.timezone = data.get('timezone', '')
-                        click_tracking.postal_code = data.get('postal', '')
-                        click_tracking.organization = data.get('org', '')
-                        
-                        # Parse location coordinates
-                        if 'loc' in data and data['loc']:
-                            try:
-                                lat, lon = data['loc'].split(',')
-                                click_tracking.latitude = float(lat.strip())
-                                click_tracking.longitude = float(lon.strip())
-                            except (ValueError, AttributeError):
-                                pass
-                        
-                        click_tracking.save()
-                        print(f"IP info fetched for {ip_address}: {data.get('city', 'Unknown')}, {data.get('country', 'Unknown')}")
-                    else:
-                        print(f"Failed to fetch IP info for {ip_address}: HTTP {response.status_code}")
-                except Exception as e:
-                    print(f"Error fetching IP info for {ip_address}: {str(e)}")
-        else:
-            print(f"No IP address captured")
-
-        # Build redirect URL with click ID for the specific CPA network
-        redirect_url = offer.build_redirect_url(click_id)
-        
-        # Enhanced debug logging (remove in production)
-        print("=" * 50)
-        print("CLICK TRACKING DEBUG INFO:")
-        print(f"User ID: {user.id}")
-        print(f"Offer ID: {offer.id}")
-        print(f"Offer Name: {offer.offer_name}")
-        print(f"Click ID: {click_id}")
-        print(f"CPA Network: {offer.cpa_network.name}")
-        print(f"CPA Network Key: {offer.cpa_network.network_key}")
-        print(f"Click ID Parameter: '{offer.cpa_network.click_id_parameter}'")
-        print(f"Original Offer URL: {offer.offer_url}")
-        print(f"Final Redirect URL: {redirect_url}")
-        print(f"Redirect URL type: {type(redirect_url)}")
-        print(f"Redirect URL length: {len(redirect_url)}")
-        print("=" * 50)
-
+    status, value = process_click(request.GET, request.META)
+    if status == 302:
         # Use HttpResponseRedirect instead of redirect() for better control
-        print(f"About to redirect to: {redirect_url}")
-        return HttpResponseRedirect(redirect_url)
-
-    except (User.DoesNotExist, Offer.DoesNotExist):
-        return HttpResponse("Invalid tracking link", status=404)
-    except Exception as e:
-        return HttpResponse("An error occurred", status=500)
+        return HttpResponseRedirect(value)
+    return HttpResponse(value, status=status)
 
 def get_tracking_domains(request):
     """Get available tracking domains"""
@@ -435,119 +292,8 @@ def handle_postback(request):
     # Log the incoming request for debugging
     logger.info(f"Postback received: Method={request.method}, GET={dict(request.GET)}, POST={dict(request.POST)}")
     
-    try:
-        # Get the CPA network from the request
-        network_key = request.GET.get('network') or request.POST.get('network')
-        
-        if not network_key:
-            logger.warning("Postback received without network parameter")
-            return create_postback_response({
-                'success': False, 
-                'message': 'Network parameter required',
-                'error_code': 'MISSING_NETWORK'
-            }, 400)
-
-        # Get the CPA network
-        try:
-            cpa_network = CPANetwork.objects.get(network_key=network_key, is_active=True)
-        except CPANetwork.DoesNotExist:
-            logger.warning(f"Postback received for unknown network: {network_key}")
-            return create_postback_response({
-                'success': False, 
-                'message': f'Unknown network: {network_key}',
-                'error_code': 'UNKNOWN_NETWORK'
-            }, 200)
-
-        # Get click ID and payout from the postback
-        click_id_param = cpa_network.postback_click_id_parameter
-        payout_param = "payout"
-
-        # Try to get values from both GET and POST
-        network_click_id = request.GET.get(click_id_param) or request.POST.get(click_id_param)
-        network_payout = request.GET.get(payout_param) or request.POST.get(payout_param)
-
-        logger.info(f"Postback data: network={network_key}, click_id_param={click_id_param}, click_id={network_click_id}, payout={network_payout}")
-
-        if not network_click_id:
-            logger.warning(f"Postback missing click ID parameter: {click_id_param}")
-            return create_postback_response({
-                'success': False, 
-                'message': f'Missing {click_id_param} parameter',
-                'error_code': 'MISSING_CLICK_ID'
-            }, 200)
-
-        # Find the click tracking record
-        try:
-            click_tracking = ClickTracking.objects.get(click_id=network_click_id)
-        except ClickTracking.DoesNotExist:
-            logger.warning(f"Click tracking record not found for click_id: {network_click_id}")
-            return create_postback_response({
-                'success': False, 
-                'message': 'Click tracking record not found',
-                'error_code': 'CLICK_NOT_FOUND'
-            }, 200)
-
-        # Use the offer's payout amount (set in admin panel) instead of network payout
-        offer_payout = click_tracking.offer.payout
-        user = click_tracking.user
-        
-        # First, check if a conversion already exists for this click tracking record
-        existing_conversion = Conversion.objects.filter(click_tracking=click_tracking).first()
-        if existing_conversion:
-            # Conversion already exists, just update it (this prevents double counting)
-            existing_conversion.payout = offer_payout
-            existing_conversion.network_click_id = network_click_id
-            existing_conversion.network_payout = network_payout
-            existing_conversion.save()
-            
-            logger.info(f"Updated existing conversion for user {user.id}, click_id: {network_click_id}")
-            return create_postback_response({
-                'success': True, 
-                'message': 'Existing conversion updated',
-                'conversion_id': existing_conversion.id
-            }, 200)
-        
-        # Increment the user's conversion counter (this happens regardless of filtering)
-        user.conversion_counter += 1
-        user.save()
-        
-        # Check if the conversion counter is divisible by 3
-        if user.conversion_counter % 3 == 0:
-            # Log that conversion was filtered out
-            logger.info(f"Conversion filtered out for user {user.id}: conversion counter {user.conversion_counter} (divisible by 3)")
-            
-            return create_postback_response({
-                'success': True, 
-                'message': 'Conversion filtered out (divisible by 3 rule)',
-                'filtered': True,
-                'conversion_counter': user.conversion_counter
-            }, 200)
-
-        # Create new conversion record
-        conversion = Conversion.objects.create(
-            click_tracking=click_tracking,
-            payout=offer_payout,
-            status='approved',
-            network_click_id=network_click_id,
-            network_payout=network_payout
-        )
-        
-        logger.info(f"New conversion created for user {user.id}: conversion ID {conversion.id}, conversion counter now {user.conversion_counter}")
-
-        return create_postback_response({
-            'success': True, 
-            'message': 'Conversion created successfully',
-            'conversion_id': conversion.id,
-            'conversion_counter': user.conversion_counter
-        }, 200)
-
-    except Exception as e:
-        logger.error(f"Postback processing error: {str(e)}", exc_info=True)
-        return create_postback_response({
-            'success': False, 
-            'message': 'Internal server error',
-            'error_code': 'SERVER_ERROR'
-        }, 500)
+    data, status_code = receive_postback(merge_params(request.GET.dict(), request.POST.dict()))
+    return create_postback_response(data, status_code)
 
 def test_cpa_networks(request):
     """Test view to check CPA network configurations"""
@@ -666,106 +412,46 @@ def daily_reports(request):
     page = request.GET.get('page', 1)
     page_size = request.GET.get('page_size', 15)
     
-    # Get user's click tracking data
-    user_click_data = ClickTracking.objects.filter(user=request.user)
-    
     # Apply date filters if provided
     if start_date and end_date:
         try:
             start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
             end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
-            user_click_data = user_click_data.filter(
-                click_date__date__range=[start_date, end_date]
-            )
         except ValueError:
-            pass
-    
-    # Apply offer filter if provided
-    if offer_id:
-        user_click_data = user_click_data.filter(offer_id=offer_id)
-    
-    # Apply subid filter if provided
-    if subid:
-        user_click_data = user_click_data.filter(
-            Q(subid1=subid) | Q(subid2=subid) | Q(subid3=subid)
-        )
-    
-    # Group by date and calculate daily metrics
-    daily_stats = {}
-    
-    for click in user_click_data:
-        date_key = click.click_date.date()
-        if date_key not in daily_stats:
-            daily_stats[date_key] = {
-                'clicks': 0,
-                'conversions': 0,
-                'earnings': 0,
-                'conversion_rate': 0.0,
-                'epc': 0.0
-            }
-        
-        daily_stats[date_key]['clicks'] += 1
-        
-        # Check if this click led to a conversion
-        conversion = Conversion.objects.filter(click_tracking=click).first()
-        if conversion:
-            daily_stats[date_key]['conversions'] += 1
-            # Earnings = offer payout × number of conversions
-            daily_stats[date_key]['earnings'] += float(click.offer.payout)
-    
-    # Calculate conversion rates and EPC
-    for date, stats in daily_stats.items():
-        if stats['clicks'] > 0:
-            stats['conversion_rate'] = (stats['conversions'] / stats['clicks']) * 100
-            # EPC = total earnings / total clicks
-            stats['epc'] = stats['earnings'] / stats['clicks']
-    
-    # Sort by date (most recent first)
-    sorted_dates = sorted(daily_stats.keys(), reverse=True)
-    
-    # Prepare data for template
-    daily_reports_data = []
-    for date in sorted_dates:
-        stats = daily_stats[date]
-        daily_reports_data.append({
-            'date': date,
-            'total_clicks': stats['clicks'],
-            'total_conversions': stats['conversions'],
-            'conversion_rate': round(stats['conversion_rate'], 2),
-            'earnings': round(stats['earnings'], 2),
-            'epc': round(stats['epc'], 2)
-        })
+            start_date = end_date = None
+    else:
+        start_date = end_date = None
     
-    # Pagination
-    paginator = Paginator(daily_reports_data, page_size)
+    # One row per day, grouped, ordered and paginated by the database
+    paginator = Paginator(daily_report(request.user, start_date, end_date, offer_id, subid), page_size)
     try:
         page_obj = paginator.page(page)
     except (PageNotAnInteger, EmptyPage):
         page_obj = paginator.page(1)
     
-    # Calculate summary statistics
-    total_clicks = sum(stats['clicks'] for stats in daily_stats.values())
-    total_conversions = sum(stats['conversions'] for stats in daily_stats.values())
-    total_earnings = sum(stats['earnings'] for stats in daily_stats.values())
-    avg_conversion_rate = (total_conversions / total_clicks * 100) if total_clicks > 0 else 0
+    # Template field names
+    page_obj.object_list = [
+        {
+            'date': row['date'],
+            'total_clicks': row['clicks'],
+            'total_conversions': row['conversions'],
+            'conversion_rate': row['conversion_rate'],
+            'earnings': row['earnings'],
+            'epc': row['epc'],
+        }
+        for row in page_obj.object_list
+    ]
     
     # Get available offers for filter (show all active offers)
     user_offers = Offer.objects.filter(is_active=True).order_by('offer_name')
     
     # Get available subids for filter
-    subids = set()
-    for click in user_click_data:
-        if click.subid1:
-            subids.add(click.subid1)
-        if click.subid2:
-            subids.add(click.subid2)
-        if click.subid3:
-            subids.add(click.subid3)
+    subids = subid_choices(request.user)
     
     context = {
         'daily_data': page_obj,
         'offers': user_offers,
-        'subids': sorted(list(subids)),
+        'subids': subids,
         'current_filters': {
             'start_date': start_date,
             'end_date': end_date,
@@ -780,13 +466,14 @@ def daily_reports(request):
 @login_required
 def get_daily_details(request):
     """Get detailed performance data for a specific date"""
-    print(f"DEBUG: get_daily_details called with params: {request.GET}")
-    
     date_str = request.GET.get('date')
     offer_id = request.GET.get('offer_id')
     subid = request.GET.get('subid')
     
-    print(f"DEBUG: date_str={date_str}, offer_id={offer_id}, subid={subid}")
+    logger.debug(
+        "Daily details requested",
+        extra={'user_id': request.user.id, 'date': date_str, 'offer_id': offer_id, 'subid': subid}
+    )
     
     if not date_str:
         return JsonResponse({'success': False, 'message': 'Date parameter required'})
@@ -795,78 +482,33 @@ def get_daily_details(request):
         # Parse the date
         selected_date = datetime.strptime(date_str, '%Y-%m-%d').date()
         
-        # Get user's click tracking data for the specific date
-        user_click_data = ClickTracking.objects.filter(
-            user=request.user,
-            click_date__date=selected_date
-        )
-        
-        # Apply filters if provided
-        if offer_id:
-            user_click_data = user_click_data.filter(offer_id=offer_id)
-        
-        if subid:
-            user_click_data = user_click_data.filter(
-                Q(subid1=subid) | Q(subid2=subid) | Q(subid3=subid)
-            )
-        
-        # Calculate daily metrics
-        total_clicks = user_click_data.count()
-        conversions = Conversion.objects.filter(click_tracking__in=user_click_data)
-        total_conversions = conversions.count()
-        
-        # Calculate earnings (offer payout × conversions)
-        total_earnings = 0
-        for conversion in conversions:
-            total_earnings += float(conversion.click_tracking.offer.payout)
-        
-        # Calculate conversion rate and EPC
-        conversion_rate = (total_conversions / total_clicks * 100) if total_clicks > 0 else 0
-        epc = (total_earnings / total_clicks) if total_clicks > 0 else 0
-        
-        # Get top performing offers for this date
-        offer_stats = {}
-        for click in user_click_data:
-            offer_name = click.offer.offer_name
-            if offer_name not in offer_stats:
-                offer_stats[offer_name] = {
-                    'clicks': 0,
-                    'conversions': 0,
-                    'earnings': 0
-                }
-            
-            offer_stats[offer_name]['clicks'] += 1
-            
-            # Check if this click led to a conversion
-            conversion = Conversion.objects.filter(click_tracking=click).first()
-            if conversion:
-                offer_stats[offer_name]['conversions'] += 1
-                offer_stats[offer_name]['earnings'] += float(click.offer.payout)
+        # Calculate daily metrics, conversion rate and EPC
+        totals = report_totals(request.user, selected_date, selected_date, offer_id, subid)
         
-        # Sort offers by earnings (descending)
-        top_offers = sorted(offer_stats.items(), key=lambda x: x[1]['earnings'], reverse=True)
+        # Get top performing offers for this date, by earnings (descending)
+        top_offers = offer_breakdown(request.user, selected_date, selected_date, offer_id, subid)[:5]
         
         # Prepare response data
         response_data = {
             'success': True,
             'date': selected_date.strftime('%B %d, %Y'),
             'summary': {
-                'total_clicks': total_clicks,
-                'total_conversions': total_conversions,
-                'conversion_rate': round(conversion_rate, 2),
-                'earnings': round(total_earnings, 2),
-                'epc': round(epc, 2)
+                'total_clicks': totals['clicks'],
+                'total_conversions': totals['conversions'],
+                'conversion_rate': round(totals['conversion_rate'], 2),
+                'earnings': round(float(totals['earnings']), 2),
+                'epc': round(float(totals['epc']), 2)
             },
             'top_offers': []
         }
         
         # Add top performing offers (limit to 5)
-        for offer_name, stats in top_offers[:5]:
+        for stats in top_offers:
             response_data['top_offers'].append({
-                'name': offer_name,
+                'name': stats['offer_name'],
                 'clicks': stats['clicks'],
                 'conversions': stats['conversions'],
-                'earnings': round(stats['earnings'], 2)
+                'earnings': round(float(stats['earnings']), 2)
             })
         
         return JsonResponse(response_data)
@@ -880,7 +522,6 @@ def get_daily_details(request):
 def click_reports(request):
     """Display click tracking reports with filtering and pagination"""
     from datetime import datetime, timedelta
-    from django.db.models import Q
     
     # Get filter parameters
     start_date = request.GET.get('start_date')
@@ -911,22 +552,11 @@ def click_reports(request):
         click_data = click_data.filter(offer_id=offer_id)
     
     if subid:
-        click_data = click_data.filter(
-            Q(subid1=subid) | Q(subid2=subid) | Q(subid3=subid)
-        )
+        click_data = click_data.filter(subid_filter(request.user, subid))
     
     # Get unique offers and subids for filter dropdowns
     offers = Offer.objects.filter(is_active=True).order_by('offer_name')
-    subids = ClickTracking.objects.filter(user=request.user).values_list(
-        'subid1', 'subid2', 'subid3'
-    ).distinct()
-    
-    # Flatten and filter subids
-    unique_subids = set()
-    for subid_tuple in subids:
-        for subid_val in subid_tuple:
-            if subid_val:
-                unique_subids.add(subid_val)
+    unique_subids = subid_choices(request.user)
     
     # Pagination
     paginator = Paginator(click_data, 20)  # Show 20 clicks per page
@@ -944,9 +574,10 @@ def click_reports(request):
     context = {
         'click_data': page_obj,
         'offers': offers,
-        'subids': sorted(unique_subids),
+        'subids': unique_subids,
         'current_filters': current_filters,
-        'total_clicks': click_data.count(),
+        # The paginator has counted the clicks already
+        'total_clicks': paginator.count,
     }
     
     return render(request, 'dashboard/click_report.html', context)
@@ -955,7 +586,7 @@ def click_reports(request):
 def offer_reports(request):
     """Display offer performance reports with filtering and pagination"""
     from datetime import datetime, timedelta
-    from django.db.models import Count, Sum, Q
+    from django.db.models import Sum
     from decimal import Decimal
     
     # Get filter parameters
@@ -974,65 +605,33 @@ def offer_reports(request):
             end_date = datetime.now().date()
             start_date = end_date - timedelta(days=6)
     
-    # Get user's approved offers
-    user_offers = Offer.objects.filter(
-        userofferrequest__user=request.user,
-        userofferrequest__status='approved',
-        is_active=True
-    ).distinct()
-    
-    # Get offer performance data
-    offer_data = []
-    total_clicks = 0
-    total_conversions = 0
-    total_earnings = Decimal('0.00')
-    
-    for offer in user_offers:
-        # Get clicks for this offer in date range
-        clicks = ClickTracking.objects.filter(
-            user=request.user,
-            offer=offer,
-            click_date__date__range=[start_date, end_date]
-        ).count()
-        
-        # Get conversions for this offer in date range
-        conversions = Conversion.objects.filter(
-            click_tracking__user=request.user,
-            click_tracking__offer=offer,
-            conversion_date__date__range=[start_date, end_date]
-        )
-        
-        conversion_count = conversions.count()
-        
-        # Calculate earnings (conversions * offer payout)
-        earnings = conversion_count * offer.payout
-        
-        # Calculate EPC (Earnings Per Click)
-        epc = earnings / clicks if clicks > 0 else Decimal('0.00')
-        
-        # Add to totals
-        total_clicks += clicks
-        total_conversions += conversion_count
-        total_earnings += earnings
-        
-        offer_data.append({
-            'offer': offer,
-            'clicks': clicks,
-            'conversions': conversion_count,
-            'epc': epc,
-            'payout': offer.payout,
-            'earnings': earnings
-        })
-    
-    # Sort by clicks (descending)
-    offer_data.sort(key=lambda x: x['clicks'], reverse=True)
+    # Approved offers with their figures for the date range, ordered and
+    # paged by the database
+    user_offers = offer_performance(request.user, start_date, end_date)
     
     # Pagination
-    paginator = Paginator(offer_data, 15)  # Show 15 offers per page
+    paginator = Paginator(user_offers, 15)  # Show 15 offers per page
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
+    page_obj.object_list = [
+        {
+            'offer': offer,
+            'clicks': offer.report_clicks,
+            'conversions': offer.report_conversions,
+            'epc': offer.report_epc,
+            'payout': offer.payout,
+            'earnings': offer.report_earnings,
+        }
+        for offer in page_obj.object_list
+    ]
     
-    # Calculate overall stats
+    # Calculate overall stats across every approved offer
+    totals = user_offers.aggregate(
+        clicks=Sum('report_clicks'), conversions=Sum('report_conversions'), earnings=Sum('report_earnings')
+    )
+    total_clicks = totals['clicks'] or 0
+    total_conversions = totals['conversions'] or 0
+    total_earnings = totals['earnings'] or Decimal('0.00')
     overall_epc = total_earnings / total_clicks if total_clicks > 0 else Decimal('0.00')
     
     # Prepare current filters for template
@@ -1044,7 +643,7 @@ def offer_reports(request):
     context = {
         'offer_data': page_obj,
         'current_filters': current_filters,
-        'total_offers': len(offer_data),
+        'total_offers': paginator.count,
         'total_clicks': total_clicks,
         'total_conversions': total_conversions,
         'total_earnings': total_earnings,
@@ -1057,7 +656,7 @@ def offer_reports(request):
 def conversion_reports(request):
     """Display conversion tracking reports with filtering and pagination"""
     from datetime import datetime, timedelta
-    from django.db.models import Count, Sum, Q
+    from django.db.models import Count, Sum
     from decimal import Decimal
     
     # Get filter parameters
@@ -1089,32 +688,13 @@ def conversion_reports(request):
         conversion_data = conversion_data.filter(click_tracking__offer_id=offer_id)
     
     if subid:
-        conversion_data = conversion_data.filter(
-            Q(click_tracking__subid1=subid) | 
-            Q(click_tracking__subid2=subid) | 
-            Q(click_tracking__subid3=subid)
-        )
+        conversion_data = conversion_data.filter(subid_filter(request.user, subid, 'click_tracking__'))
     
     # Get unique offers for filter dropdown (show all active offers)
     offers = Offer.objects.filter(is_active=True).order_by('offer_name')
     
     # Get unique subids for filter dropdown
-    subids = ClickTracking.objects.filter(
-        user=request.user,
-        click_date__date__range=[start_date, end_date]
-    ).values_list('subid1', flat=True).distinct().exclude(subid1__isnull=True).exclude(subid1='')
-    
-    subids = list(subids) + list(ClickTracking.objects.filter(
-        user=request.user,
-        click_date__date__range=[start_date, end_date]
-    ).values_list('subid2', flat=True).distinct().exclude(subid2__isnull=True).exclude(subid2=''))
-    
-    subids = list(subids) + list(ClickTracking.objects.filter(
-        user=request.user,
-        click_date__date__range=[start_date, end_date]
-    ).values_list('subid3', flat=True).distinct().exclude(subid3__isnull=True).exclude(subid3=''))
-    
-    subids = list(set(subids))  # Remove duplicates
+    subids = subid_choices(request.user, start_date, end_date)
     
     # Pagination
     paginator = Paginator(conversion_data, 20)  # Show 20 conversions per page
@@ -1133,10 +713,18 @@ def conversion_reports(request):
         
             # If payout sum is 0, calculate based on offer payouts
         if total_earnings == Decimal('0.00'):
-            # Debug: Print conversion data to see what's happening
-            print(f"Debug: Found {total_conversions} conversions but payout sum is 0")
-            for conv in conversion_data[:3]:  # Print first 3 conversions
-                print(f"Conversion ID: {conv.id}, Payout: {conv.payout}, Offer Payout: {conv.click_tracking.offer.payout}")
+            # The sample below costs extra queries, so only gather it for debug logging
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    f"Found {total_conversions} conversions but payout sum is 0",
+                    extra={
+                        'user_id': request.user.id,
+                        'sample': [
+                            {'conversion_id': conv.id, 'payout': conv.payout, 'offer_payout': conv.click_tracking.offer.payout}
+                            for conv in conversion_data[:3]
+                        ],
+                    }
+                )
             
             # Calculate earnings based on offer payouts
             total_earnings = sum(
@@ -1170,7 +758,7 @@ def conversion_reports(request):
 def subid_reports(request):
     """Display subid conversion tracking reports with filtering and pagination"""
     from datetime import datetime, timedelta
-    from django.db.models import Count, Sum, Q, Avg
+    from django.db.models import Count, Sum, Avg
     from decimal import Decimal
     
     # Get filter parameters
@@ -1194,37 +782,14 @@ def subid_reports(request):
     conversion_data = Conversion.objects.filter(
         click_tracking__user=request.user,
         conversion_date__date__range=[start_date, end_date]
-    ).select_related('click_tracking', 'click_tracking__offer').filter(
-        Q(click_tracking__subid1__isnull=False) & ~Q(click_tracking__subid1='') |
-        Q(click_tracking__subid2__isnull=False) & ~Q(click_tracking__subid2='') |
-        Q(click_tracking__subid3__isnull=False) & ~Q(click_tracking__subid3='')
-    )
+    ).select_related('click_tracking', 'click_tracking__offer').filter(has_subid('click_tracking__'))
     
     # Apply subid filter if specified
     if subid:
-        conversion_data = conversion_data.filter(
-            Q(click_tracking__subid1=subid) | 
-            Q(click_tracking__subid2=subid) | 
-            Q(click_tracking__subid3=subid)
-        )
+        conversion_data = conversion_data.filter(subid_filter(request.user, subid, 'click_tracking__'))
     
     # Get unique subids for filter dropdown
-    subids = ClickTracking.objects.filter(
-        user=request.user,
-        click_date__date__range=[start_date, end_date]
-    ).values_list('subid1', flat=True).distinct().exclude(subid1__isnull=True).exclude(subid1='')
-    
-    subids = list(subids) + list(ClickTracking.objects.filter(
-        user=request.user,
-        click_date__date__range=[start_date, end_date]
-    ).values_list('subid2', flat=True).distinct().exclude(subid2__isnull=True).exclude(subid2=''))
-    
-    subids = list(subids) + list(ClickTracking.objects.filter(
-        user=request.user,
-        click_date__date__range=[start_date, end_date]
-    ).values_list('subid3', flat=True).distinct().exclude(subid3__isnull=True).exclude(subid3=''))
-    
-    subids = list(set(subids))  # Remove duplicates
+    subids = subid_choices(request.user, start_date, end_date)
     
     # Pagination
     paginator = Paginator(conversion_data, 20)  # Show 20 conversions per page
@@ -1257,23 +822,8 @@ def subid_reports(request):
     else:
         total_earnings = Decimal('0.00')
     
-    # Calculate EPC (Earnings Per Click)
-    total_clicks = ClickTracking.objects.filter(
-        user=request.user,
-        click_date__date__range=[start_date, end_date]
-    ).filter(
-        Q(subid1__isnull=False) & ~Q(subid1='') |
-        Q(subid2__isnull=False) & ~Q(subid2='') |
-        Q(subid3__isnull=False) & ~Q(subid3='')
-    ).count()
-    
-    if subid:
-        total_clicks = ClickTracking.objects.filter(
-            user=request.user,
-            click_date__date__range=[start_date, end_date]
-        ).filter(
-            Q(subid1=subid) | Q(subid2=subid) | Q(subid3=subid)
-        ).count()
+    # Calculate EPC (Earnings Per Click) over the clicks with a subid
+    total_clicks = subid_click_count(request.user, start_date, end_date, subid)
     
     epc = total_earnings / total_clicks if total_clicks > 0 else Decimal('0.00')
     
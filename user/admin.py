@@ -1,27 +1,55 @@
+from django import forms
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.contrib.auth.forms import UserChangeForm
 from .models import User
+from offers.models import SamplingCounter
+
+
+# Change form with a manual balance correction, booked through the ledger
+class UserAdminChangeForm(UserChangeForm):
+    balance_adjustment = forms.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        required=False,
+        help_text="Amount to add to the balance (negative to deduct); recorded in the balance ledger as an adjustment"
+    )
+    
+    adjustment_note = forms.CharField(
+        max_length=255,
+        required=False,
+        help_text="Reason for the adjustment, stored on the ledger entry"
+    )
+
 
 @admin.register(User)
 class UserAdmin(BaseUserAdmin):
-    list_display = ['email', 'full_name', 'balance', 'conversion_counter', 'manager','is_verified', 'is_active', 'previous_is_active', 'last_activated', 'date_joined']
+    form = UserAdminChangeForm
+    list_display = ['email', 'full_name', 'balance', 'manager','is_verified', 'is_active', 'previous_is_active', 'last_activated', 'date_joined']
     list_filter = ['is_active', 'date_joined', 'manager']
     search_fields = ['email', 'full_name']
     ordering = ['-date_joined']
     list_editable = ['is_verified']  # Remove is_active from list_editable to prevent direct editing
-    actions = ['activate_users', 'deactivate_users', 'reset_conversion_counters', 'send_welcome_emails']
+    actions = ['activate_users', 'deactivate_users', 'reset_sampling_counters', 'send_welcome_emails']
     
     fieldsets = (
         (None, {'fields': ('email', 'password')}),
         ('Personal info', {'fields': ('full_name', 'phone_number', 'telegram_username', 'address', 'city', 'state', 'zip_code', 'country')}),
         ('Affiliate Info', {'fields': ('niches', 'promotion_description', 'heard_about_us')}),
-        ('Financial', {'fields': ('balance', 'conversion_counter')}),
+        ('Financial', {'fields': ('balance', 'balance_adjustment', 'adjustment_note')}),
+        ('Legacy', {
+            'fields': ('conversion_counter',),
+            'description': 'Postback count from before the sampling rules. Postbacks no longer update it and sampling does not read it.',
+            'classes': ('collapse',),
+        }),
         ('Manager Assignment', {'fields': ('manager',)}),
         ('Permissions', {'fields': ('is_active', 'is_staff', 'is_superuser', 'groups', 'user_permissions')}),
         ('Important dates', {'fields': ('last_login', 'last_activated', 'previous_is_active')}),
     )
     
-    readonly_fields = ['date_joined']
+    # The balance only moves through add_to_balance, which keeps the ledger;
+    # staff correct it with the balance adjustment field
+    readonly_fields = ['date_joined', 'balance', 'conversion_counter']
     
     add_fieldsets = (
         (None, {
@@ -30,6 +58,24 @@ class UserAdmin(BaseUserAdmin):
         }),
     )
     
+    def save_model(self, request, obj, form, change):
+        if not change:
+            super().save_model(request, obj, form, change)
+            return
+        # Write only the edited columns, so a balance credited while the
+        # form was open is not overwritten with the value it was loaded with
+        columns = {field.name for field in obj._meta.concrete_fields}
+        fields = [name for name in form.changed_data if name in columns]
+        if 'is_active' in fields:
+            fields.append('last_activated')
+        obj.save(update_fields=fields)
+        
+        amount = form.cleaned_data.get('balance_adjustment')
+        if amount:
+            note = form.cleaned_data.get('adjustment_note') or f'Manual adjustment by {request.user.email}'
+            balance = obj.add_to_balance(amount, entry_type='adjustment', description=note)
+            self.message_user(request, f'Balance of {obj.email} adjusted by {amount:+}; new balance ${balance}.')
+
     def activate_users(self, request, queryset):
         from offers.models import Notification
         
@@ -38,7 +84,7 @@ class UserAdmin(BaseUserAdmin):
         for user in queryset.filter(is_active=False):
             # Activate the user - this will trigger the post_save signal
             user.is_active = True
-            user.save()
+            user.save(update_fields=['is_active', 'last_activated'])
             updated_users.append(user)
             
             # Create notification for account approval
@@ -58,27 +104,20 @@ class UserAdmin(BaseUserAdmin):
         for user in queryset:
             if user.is_active:
                 user.is_active = False
-                user.save()
+                user.save(update_fields=['is_active'])
                 updated_count += 1
         
         self.message_user(request, f'{updated_count} user(s) have been deactivated.')
     deactivate_users.short_description = "Deactivate selected users"
     
-    def reset_conversion_counters(self, request, queryset):
-        """Reset conversion counters for selected users"""
-        updated_users = []
-        for user in queryset:
-            if user.conversion_counter > 0:
-                old_counter = user.conversion_counter
-                user.conversion_counter = 0
-                user.save()
-                updated_users.append(f"{user.email} ({old_counter} → 0)")
-        
-        if updated_users:
-            self.message_user(request, f'Conversion counters reset for {len(updated_users)} user(s): {", ".join(updated_users)}')
+    def reset_sampling_counters(self, request, queryset):
+        """Restart the counter sampling rules' windows for selected users"""
+        cleared, _ = SamplingCounter.objects.filter(user__in=queryset).delete()
+        if cleared:
+            self.message_user(request, f'{cleared} sampling counter(s) reset.')
         else:
-            self.message_user(request, 'No users had conversion counters to reset.')
-    reset_conversion_counters.short_description = "Reset conversion counters for selected users"
+            self.message_user(request, 'No users had sampling counters to reset.')
+    reset_sampling_counters.short_description = "Reset sampling counters for selected users"
     
     def activate_single_user(self, request, user_id):
         """Activate a single user and send welcome email"""
@@ -86,7 +125,7 @@ class UserAdmin(BaseUserAdmin):
             user = User.objects.get(id=user_id)
             if not user.is_active:
                 user.is_active = True
-                user.save()
+                user.save(update_fields=['is_active', 'last_activated'])
                 
                 # Send welcome email
                 from .signals import send_welcome_email
@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
 from decimal import Decimal
 import logging
@@ -36,7 +37,7 @@ class CustomUserManager(BaseUserManager):
         """
         if not user.is_active:
             user.is_active = True
-            user.save()
+            user.save(update_fields=['is_active', 'last_activated'])
             return True
         return False
     
@@ -147,17 +148,27 @@ class User(AbstractBaseUser, PermissionsMixin):
     def __str__(self):
         return self.email
     
-    def add_to_balance(self, amount):
+    def add_to_balance(self, amount, entry_type='adjustment', conversion=None, invoice=None, description=''):
         """
         Safely add amount to user's balance
         
+        The balance is changed with a single UPDATE ... SET balance = balance + amount
+        rather than a read-modify-save, so concurrent credits (parallel postbacks,
+        referral earnings) never overwrite each other. Each change is recorded as a
+        BalanceLedger entry in the same transaction.
+        
         This method ensures that:
-        - The amount is properly converted to Decimal for precision
-        - The balance never goes negative (sets to 0.00 if it would)
+        - The amount is properly converted to Decimal (rounded to cents) for precision
+        - The balance never goes negative (a larger debit only clears the balance,
+          and the ledger records the amount actually taken)
         - All balance updates are logged for audit purposes
         
         Args:
             amount (Decimal or float): Amount to add to balance (positive for credit, negative for debit)
+            entry_type (str): BalanceLedger entry type (conversion_credit, referral_credit, reversal, ...)
+            conversion (Conversion): Conversion the change belongs to, if any
+            invoice (Invoice): Invoice the change belongs to, if any
+            description (str): Free-form note stored on the ledger entry
             
         Returns:
             Decimal: New balance after the update
@@ -166,20 +177,38 @@ class User(AbstractBaseUser, PermissionsMixin):
             user.add_to_balance(25.50)  # Adds $25.50 to balance
             user.add_to_balance(-10.00) # Subtracts $10.00 from balance
         """
+        from offers.models import BalanceLedger
+        
         if not isinstance(amount, Decimal):
             amount = Decimal(str(amount))
+        amount = amount.quantize(Decimal('0.01'))
         
-        old_balance = self.balance
-        self.balance += amount
-        
-        # Ensure balance doesn't go negative
-        if self.balance < 0:
-            self.balance = Decimal('0.00')
-            logger.warning(f"User {self.id} balance would have gone negative. Set to 0.00")
-        
-        self.save()
+        with transaction.atomic():
+            users = User.objects.filter(pk=self.pk)
+            if amount >= 0:
+                users.update(balance=F('balance') + amount)
+                applied = amount
+            elif users.filter(balance__gte=-amount).update(balance=F('balance') + amount):
+                applied = amount
+            else:
+                # The debit is larger than the balance: lock the row and clear it
+                current = users.select_for_update().values_list('balance', flat=True).get()
+                users.update(balance=Decimal('0.00'))
+                applied = -current
+                logger.warning(f"User {self.id} balance would have gone negative. Set to 0.00")
+            
+            if applied:
+                BalanceLedger.objects.create(
+                    user_id=self.pk,
+                    entry_type=entry_type,
+                    amount=applied,
+                    conversion=conversion,
+                    invoice=invoice,
+                    description=description,
+                )
         
-        logger.info(f"User {self.id} balance updated: {old_balance} + {amount} = {self.balance}")
+        self.refresh_from_db(fields=['balance'])
+        logger.info(f"User {self.id} balance updated: {applied:+} ({entry_type}) = {self.balance}")
         return self.balance
     
     def get_balance_display(self):
@@ -190,8 +219,10 @@ class User(AbstractBaseUser, PermissionsMixin):
         """
         Custom save method to handle welcome email when user is approved
         """
-        # Check if this is an existing user being updated
-        if self.pk:
+        # Check if this is an existing user being updated; saves limited to
+        # other fields (update_fields without is_active) cannot activate anyone
+        update_fields = kwargs.get('update_fields')
+        if self.pk and (update_fields is None or 'is_active' in update_fields):
             try:
                 # Get the old instance from the database
                 old_instance = User.objects.get(pk=self.pk)
@@ -237,7 +268,7 @@ class User(AbstractBaseUser, PermissionsMixin):
             # Assign the manager with the least users
             if manager_counts.exists():
                 self.manager = manager_counts.first()
-                self.save()
+                self.save(update_fields=['manager'])
                 return self.manager
         
         return None
@@ -254,17 +285,5 @@ class User(AbstractBaseUser, PermissionsMixin):
             return "Verification Pending"
         else:
             return "Not Verified"
-    
-    def get_conversion_counter_display(self):
-        """Return formatted conversion counter for display"""
-        return f"{self.conversion_counter:,}"
-    
-    def reset_conversion_counter(self):
-        """Reset the conversion counter to 0"""
-        old_counter = self.conversion_counter
-        self.conversion_counter = 0
-        self.save()
-        logger.info(f"User {self.id} conversion counter reset from {old_counter} to 0")
-        return self.conversion_counter
 
 
@@ -12,7 +12,7 @@ from django.utils import timezone
 import requests
 import json
 
-from datetime import datetime, timedelta
+from datetime import datetime
 
 def verify_recaptcha(recaptcha_response):
     """
@@ -202,7 +202,7 @@ def verify_email(request, token):
         # Mark as verified
         user = verification.user
         user.is_verified = True
-        user.save()
+        user.save(update_fields=['is_verified'])
         logger.info(f"User {user.email} marked as verified")
         
         # Mark verification as used
@@ -270,7 +270,8 @@ def resend_verification(request):
 
 @login_required
 def dashboard(request):
-    from offers.models import Noticeboard, Invoice, ClickTracking, Conversion
+    from offers.models import Noticeboard, Invoice
+    from offers.dashboard_metrics import dashboard_metrics
     from django.utils import timezone
     from django.db import models
     
@@ -301,63 +302,16 @@ def dashboard(request):
         total=models.Sum('amount')
     )['total'] or 0.00
     
-    # Calculate metrics for the selected date range
-    # Clicks
-    total_clicks = ClickTracking.objects.filter(
-        user=request.user,
-        click_date__date__range=[start_date, end_date]
-    ).count()
-    
-    # Conversions
-    total_conversions = Conversion.objects.filter(
-        click_tracking__user=request.user,
-        conversion_date__date__range=[start_date, end_date],
-        status='approved'
-    ).count()
-    
-    # Earnings (from approved conversions)
-    total_earnings = Conversion.objects.filter(
-        click_tracking__user=request.user,
-        conversion_date__date__range=[start_date, end_date],
-        status='approved'
-    ).aggregate(
-        total=models.Sum('payout')
-    )['total'] or 0.00
-    
-    # Conversion Rate
-    conversion_rate = 0.00
-    if total_clicks > 0:
-        conversion_rate = (total_conversions / total_clicks) * 100
-    
-    # EPC (Earnings Per Click) calculation
-    epc = 0.00
-    if total_clicks > 0:
-        epc = total_earnings / total_clicks
-    
-    # Get datewise data for the chart
-    chart_data = []
-    current_date = start_date
-    while current_date <= end_date:
-        # Get clicks for this date
-        daily_clicks = ClickTracking.objects.filter(
-            user=request.user,
-            click_date__date=current_date
-        ).count()
-        
-        # Get conversions (leads) for this date
-        daily_conversions = Conversion.objects.filter(
-            click_tracking__user=request.user,
-            conversion_date__date=current_date,
-            status='approved'
-        ).count()
-        
-        chart_data.append({
-            'date': current_date.strftime('%Y-%m-%d'),
-            'clicks': daily_clicks,
-            'leads': daily_conversions
-        })
-        
-        current_date += timedelta(days=1)
+    # Totals and the per-day chart series for the selected date range
+    metrics = dashboard_metrics(request.user, start_date, end_date)
+    chart_data = [
+        {
+            'date': day['date'].strftime('%Y-%m-%d'),
+            'clicks': day['clicks'],
+            'leads': day['conversions'],
+        }
+        for day in metrics['series']
+    ]
     
     # Get latest 10 offers for the Latest Offers card
     from offers.models import Offer
@@ -370,11 +324,11 @@ def dashboard(request):
         'total_paid': total_paid,
         'start_date': start_date,
         'end_date': end_date,
-        'total_clicks': total_clicks,
-        'total_conversions': total_conversions,
-        'total_earnings': total_earnings,
-        'conversion_rate': conversion_rate,
-        'epc': epc,
+        'total_clicks': metrics['clicks'],
+        'total_conversions': metrics['conversions'],
+        'total_earnings': metrics['earnings'],
+        'conversion_rate': metrics['conversion_rate'],
+        'epc': metrics['epc'],
         'chart_data': chart_data,
         'latest_offers': latest_offers,
     }
@@ -422,7 +376,10 @@ def profile(request):
         user.zip_code = request.POST.get('zip_code', user.zip_code)
         user.country = request.POST.get('country', user.country)
         user.niches = request.POST.get('niches', user.niches)
-        user.save()
+        user.save(update_fields=[
+            'full_name', 'phone_number', 'telegram_username', 'address',
+            'city', 'state', 'zip_code', 'country', 'niches',
+        ])
         messages.success(request, 'Profile updated successfully!')
         return redirect('profile')
     return render(request, 'dashboard/profile.html', {'user': user})
@@ -452,7 +409,7 @@ def change_password(request):
         
         # Update password
         request.user.set_password(new_password)
-        request.user.save()
+        request.user.save(update_fields=['password'])
         
         messages.success(request, 'Password changed successfully! Please log in again.')
         return redirect('login')